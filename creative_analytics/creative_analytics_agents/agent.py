@@ -1,16 +1,34 @@
 import logging
+import os
+from typing import Any, Dict, List
 
-import vertexai
 from google.adk.agents import LlmAgent
-from google.adk.models.google_llm import Gemini
 from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.tools import ToolContext
 
 # CRITICAL: This validates the entire environment on startup.
 from .utils.settings import settings
 
-from .prompts import get_orchestrator_instructions_template
+from .prompts import (
+    get_non_interactive_instructions,
+    get_orchestrator_instructions_template,
+    get_parallel_subtasks_instructions,
+    get_speculative_execution_instructions,
+)
 from .sub_agents import performance_predictor_agent, statistical_analyst_agent
-from .utils.database_context import init_database_settings
+from .sub_agents.statistical_analysis.async_tools import start_speculative_analysis
+from .sub_agents.statistical_analysis.speculation import speculation_manager
+from .utils.cassette import record_user_message
+from .utils.database_context import init_database_settings, pin_schema_version
+from .utils.execution_mode import is_auto, log_plan_in_auto_mode
+from .utils.fanout import Subtask, fanout_scheduler
+from .utils.history import compact_history
+from .utils.intent_router import route_intent
+from .utils.metering import METERED_SESSION_STATE_KEY, fail_model_call, record_model_call, start_model_call
+from .utils.models import create_model
+from .utils.schema_refresher import schema_refresher
+from .utils.schema_registry import SCHEMA_VERSION_STATE_KEY, schema_registry
 
 logging.basicConfig(
     level=logging.INFO,
@@ -18,26 +36,88 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-vertexai.init(
-    project=settings.GOOGLE_CLOUD_PROJECT_ID,
-    location=settings.GOOGLE_CLOUD_LOCATION
-)
+# The Vertex AI clients read the project and location from the environment, so
+# the Vertex AI SDK (about two seconds to import) is not loaded at startup.
+os.environ.setdefault("GOOGLE_CLOUD_PROJECT", settings.GOOGLE_CLOUD_PROJECT_ID)
+os.environ.setdefault("GOOGLE_CLOUD_LOCATION", settings.GOOGLE_CLOUD_LOCATION)
 
 
 def load_database_settings_in_context(callback_context: CallbackContext):
-    """Load database settings into the callback context on first use."""
-    if "database_settings" not in callback_context.state:
-        callback_context.state["database_settings"] = _shared_context['database_settings']
+    """Record the current shared database settings version and the metered session in the session state."""
+    # Deployments without the server lifespan (e.g. Agent Engine) start polling on first use
+    schema_refresher.start()
+    pin_schema_version(callback_context)
+    if METERED_SESSION_STATE_KEY not in callback_context.state:
+        callback_context.state[METERED_SESSION_STATE_KEY] = callback_context.session.id
+
+
+def discard_unconfirmed_speculation(callback_context: CallbackContext):
+    """Cancel background analysis for a plan the user did not confirm this turn."""
+    speculation_manager.discard_stale(callback_context.state, callback_context.invocation_id)
+
+
+def isolated_specialist(agent: LlmAgent) -> LlmAgent:
+    """A copy of a specialist that answers a subtask on its own, without transfers or session recording."""
+    return agent.clone(update={
+        "disallow_transfer_to_parent": True,
+        "disallow_transfer_to_peers": True,
+        "before_agent_callback": [
+            callback for callback in agent.before_agent_callback if callback is not record_user_message
+        ],
+    })
+
+
+async def run_subtasks_in_parallel(subtasks: List[Subtask], tool_context: ToolContext) -> Dict[str, Any]:
+    """
+    Runs the independent parts of a compound request concurrently, each on its specialist.
+
+    Args:
+    subtasks: One entry per independent part of the confirmed plan: the specialist
+        (`analysis` or `prediction`), a self-contained request, and for
+        predictions the positions of the creatives it needs.
+    tool_context: The context of the orchestrator's session.
+
+    Returns:
+        Dict[str, Any]: A dictionary representing the outcome.
+        - On success: `{"status": "success", "results": [...], "wall_seconds": ...}` with the
+          `answer` and structured `result` of each subtask, in the given order.
+        - On failure: `{"status": "error", "error_message": "Details..."}`
+    """
+    return await fanout_scheduler.run(
+        _subtask_agents, [Subtask.model_validate(subtask) for subtask in subtasks], tool_context
+    )
+
+
+def orchestrator_instruction(context: ReadonlyContext) -> str:
+    """
+    The orchestrator instructions with the dataset definitions of the session's
+    schema version. Sessions in auto execution mode delegate without
+    confirmation, so nothing is prepared speculatively for them.
+    """
+    snapshot = schema_registry.resolve(context.state.get(SCHEMA_VERSION_STATE_KEY))
+    suffix = _non_interactive_suffix if is_auto(context.state) else _instructions_suffix
+    return _instructions_template + "\n" + snapshot.database_definitions_prompt + suffix
 
 
 def create_orchestrator_agent() -> LlmAgent:
+    tools = [run_subtasks_in_parallel]
+    speculative_options = {}
+    if _speculative_execution:
+        tools.append(start_speculative_analysis)
+        speculative_options = {"after_agent_callback": discard_unconfirmed_speculation}
+
     agent = LlmAgent(
         name="AdInsightsOrchestrator",
-        model=Gemini(model=settings.ROOT_AGENT_MODEL),
+        model=create_model(settings.ROOT_AGENT_MODEL),
         description="A top-level agent that delegates user questions about ad performance.",
-        instruction=_full_instructions,
-        before_agent_callback=load_database_settings_in_context,
-        sub_agents=[statistical_analyst_agent, performance_predictor_agent]
+        instruction=orchestrator_instruction,
+        before_agent_callback=[load_database_settings_in_context, record_user_message],
+        before_model_callback=[route_intent, compact_history, start_model_call],
+        after_model_callback=[record_model_call, log_plan_in_auto_mode],
+        on_model_error_callback=fail_model_call,
+        sub_agents=[statistical_analyst_agent, performance_predictor_agent],
+        tools=tools,
+        **speculative_options,
     )
     return agent
 
@@ -45,13 +125,25 @@ def create_orchestrator_agent() -> LlmAgent:
 # Database context
 _shared_context = init_database_settings()
 
-# Instructions for orchestrator
-_instructions_template = get_orchestrator_instructions_template()
-_full_instructions = (
-    _instructions_template + "\n" + _shared_context["database_definitions_prompt"]
-)
+# Instructions for orchestrator; the dataset definitions follow the session's schema version.
+_instructions_template = get_orchestrator_instructions_template() + get_parallel_subtasks_instructions()
+_instructions_suffix = ""
+_non_interactive_suffix = "\n" + get_non_interactive_instructions()
+
+# Speculation hands results to the analyst through the async tools only.
+_speculative_execution = settings.SPECULATIVE_EXECUTION and settings.USE_ASYNC_TOOLS
+if settings.SPECULATIVE_EXECUTION and not settings.USE_ASYNC_TOOLS:
+    logger.warning("SPECULATIVE_EXECUTION requires USE_ASYNC_TOOLS; speculative mode is disabled...")
+if _speculative_execution:
+    _instructions_suffix += "\n" + get_speculative_execution_instructions()
 
 print(_shared_context)
 
+# Specialists that run the subtasks of compound requests
+_subtask_agents = {
+    "analysis": isolated_specialist(statistical_analyst_agent),
+    "prediction": isolated_specialist(performance_predictor_agent),
+}
+
 # Define the root agent
 root_agent = create_orchestrator_agent()
@@ -36,6 +36,12 @@ def get_orchestrator_instructions_template() -> str:
             -   **Comparative Analysis**: Questions that compare the impact of two or more creative tags against each other.
                 - *Keywords*: "compare", "vs.", "versus", "which is better", "which performed best".
                 - *Example Queries*: "Which worked better, ads with animals or ads with humans?", "Compare the performance lift from ads with a 'logo' versus ads with a 'cta'."
+            -   **Multi-Metric Analysis**: Questions about the impact of creative tags on several performance metrics (e.g. video views, impressions, clicks, CTR, spend, conversions).
+                - *Keywords*: "across metrics", "CTR and spend", "every metric", "lift matrix".
+                - *Example Queries*: "How do our creative tags affect views, CTR and cost per click?", "Show the lift of every tag on every metric."
+            -   **Typical-Ad Analysis**: Questions about the median or typical ad rather than the average, or where a few viral ads skew the numbers.
+                - *Keywords*: "median", "typical ad", "p90", "outliers", "without viral ads".
+                - *Example Queries*: "Does the median ad with a human get more views?", "Is the animal lift real for most ads or just a few viral hits?"
 
     2.  **PerformancePredictorAgent**: (Internal Use Only) Forecasts performance to answer **"What will happen with a new ad?"**.
         - **Methodology**: Uses a vision model to extract features from a new creative asset (image/video) and feeds them into a pre-trained Logistic Regression model in BigQuery (`ML.PREDICT`) to predict a high/low outcome and a probability score.
@@ -65,3 +71,45 @@ def get_orchestrator_instructions_template() -> str:
     """
 
     return instruction_template
+
+
+def get_parallel_subtasks_instructions() -> str:
+    """Returns the orchestrator instructions for running the parts of compound requests concurrently."""
+
+    instruction_template = """
+    <PARALLEL_SUBTASKS>
+    Some requests combine independent parts, e.g. "compare logo vs. cta lift, and predict how these two new images will do".
+    - Plan such a request as usual, listing each part. Upon confirmation, do not delegate to one specialist at a time. Instead, call the `run_subtasks_in_parallel` tool once with one subtask per independent part: one per historical analysis and one per creative to predict.
+    - Each subtask `request` must be self-contained, because the specialist does not see the conversation. For predictions, give the 0-based `attachments` positions of the creatives in the order the user uploaded them in this conversation.
+    - Merge the returned answers into one response that covers every part, in the order the user asked. Report failed subtasks honestly. Never mention the tool or subtasks to the user.
+    - Requests with a single part are delegated as before.
+    </PARALLEL_SUBTASKS>
+    """
+
+    return instruction_template
+
+
+def get_speculative_execution_instructions() -> str:
+    """Returns the extra orchestrator instructions for speculative pre-execution."""
+
+    instruction_template = """
+    <SPECULATIVE_EXECUTION>
+    When your plan delegates a historical analysis, call the `start_speculative_analysis` tool with the exact analytical question you will delegate, immediately before presenting the plan to the user. This only prepares the answer in the background; you MUST still present the plan and wait for confirmation. Never mention this tool to the user. Do not call it for predictions.
+    </SPECULATIVE_EXECUTION>
+    """
+
+    return instruction_template
+
+
+def get_non_interactive_instructions() -> str:
+    """Returns the orchestrator instructions that replace plan confirmation for non-interactive callers."""
+
+    instruction_template = """
+    <NON_INTERACTIVE_MODE>
+    This session is used by a program that cannot confirm plans. These rules override **Always Plan First** and **Delegate Upon Confirmation**:
+    - State your user-facing plan in one or two sentences, then delegate to the specialist (or run the subtasks of a compound request) in the same response. Never ask for confirmation.
+    - Validate tags against the schema as usual. If the request is out of scope, names an unknown tag, is too ambiguous to act on, or asks for a prediction without a creative asset, reply with the reason and do not delegate.
+    </NON_INTERACTIVE_MODE>
+    """
+
+    return instruction_template
@@ -0,0 +1,383 @@
+"""
+Self-hosted HTTP server for `root_agent`.
+
+Each worker process builds the agents and the shared schema context once at
+startup, before it accepts traffic; schema changes are picked up in the
+background afterwards (`SCHEMA_REFRESH_SECONDS`). Agent events are streamed to the client as
+Server-Sent Events, or `POST /run` returns the final answer as JSON. Sessions in
+`auto` execution mode answer in one turn without plan confirmation, and their
+structured result is returned next to the answer. At most `SERVER_MAX_CONCURRENT_RUNS` runs execute per
+worker. Up to `SERVER_MAX_QUEUED_REQUESTS` more wait for a slot, for at most
+`SERVER_QUEUE_TIMEOUT_SECONDS`. Anything beyond that is rejected with 503 and a
+Retry-After header.
+
+Run from the `creative_analytics` directory:
+
+    python -m creative_analytics_agents.server --workers 4 --port 8080
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Callable, Dict, List, Literal, Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from google.adk.agents import BaseAgent
+from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.adk.models.google_llm import Gemini
+from google.adk.runners import Runner
+from google.adk.sessions import BaseSessionService, InMemorySessionService
+from google.genai import types
+from pydantic import BaseModel, Field
+from starlette.types import Receive, Scope, Send
+
+from .agent import root_agent
+from .sub_agents.statistical_analysis.speculation import speculation_manager
+from .utils.aggregate_router import aggregate_router
+from .utils.answer_cache import answer_cache
+from .utils.approximate import approximate_planner
+from .utils.cassette import CassetteLlm, cassette
+from .utils.database_context import get_bigquery_client, init_database_settings
+from .utils.example_index import example_index
+from .utils.execution_mode import (
+    AUTO, EXECUTION_MODE_STATE_KEY, INTERACTIVE, STRUCTURED_RESULT_STATE_KEY, structured_result,
+)
+from .utils.fanout import fanout_scheduler
+from .utils.history import history_compactor
+from .utils.intent_router import intent_router
+from .utils.metering import meter
+from .utils.schema_refresher import schema_refresher
+from .utils.settings import settings
+from .utils.sql_guard import sql_guard
+
+logger = logging.getLogger(__name__)
+
+APP_NAME = "creative_analytics_agents"
+RETRY_AFTER_SECONDS = 1
+
+
+class Attachment(BaseModel):
+    """A base64 encoded file sent with a message."""
+    mime_type: str = Field(..., description="MIME type, e.g. image/png")
+    data: str = Field(..., description="Base64 encoded file content")
+
+
+class RunRequest(BaseModel):
+    """One user message for a session."""
+    user_id: str
+    session_id: Optional[str] = Field(None, description="Existing session; a new one is created if omitted")
+    message: str
+    attachments: List[Attachment] = Field(default_factory=list)
+    execution_mode: Optional[Literal["interactive", "auto"]] = Field(
+        None, description="Sets the session's execution mode from this message on"
+    )
+
+
+class CreateSessionRequest(BaseModel):
+    user_id: str
+    execution_mode: Literal["interactive", "auto"] = Field(
+        INTERACTIVE, description="`auto` executes plans without confirmation and returns structured results"
+    )
+
+
+class AdmissionController:
+    """Bounds concurrent runs and the number of requests waiting for one."""
+
+    def __init__(self, max_concurrent: int, max_queued: int, queue_timeout: float):
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._waiting = 0
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.stats = {"admitted": 0, "rejected": 0, "completed": 0}
+
+    async def acquire(self) -> None:
+        """Waits for a run slot, or raises a 503 when the queue is full or the wait times out."""
+        if self.in_flight + self._waiting >= self.max_concurrent + self.max_queued:
+            self.stats["rejected"] += 1
+            raise _overloaded("Server queue is full")
+
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats["rejected"] += 1
+            raise _overloaded("Timed out waiting for a free run slot")
+        finally:
+            self._waiting -= 1
+
+        self.in_flight += 1
+        self.stats["admitted"] += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self.stats["completed"] += 1
+        self._slots.release()
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "in_flight": self.in_flight, "queued": self._waiting}
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    A streaming response that releases its run slot when the response ends,
+    including when the client disconnects before the stream is iterated, in
+    which case neither the generator's `finally` nor a background task runs.
+    """
+
+    def __init__(self, *args, release: Callable[[], None], **kwargs):
+        super().__init__(*args, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                # Stops the agent run of a stream the client abandoned.
+                await self.body_iterator.aclose()
+            finally:
+                self._release()
+
+
+def _overloaded(detail: str) -> HTTPException:
+    return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+
+def _create_session_service() -> BaseSessionService:
+    """Sessions live in a shared database when configured, otherwise in this worker's memory."""
+    if settings.SERVER_SESSION_DB_URL:
+        # Optional dependency (sqlalchemy[asyncio]), only needed for shared sessions.
+        from google.adk.sessions import DatabaseSessionService
+        return DatabaseSessionService(db_url=settings.SERVER_SESSION_DB_URL)
+    return InMemorySessionService()
+
+
+def _prewarm(agent: BaseAgent) -> None:
+    """Loads the schema context and opens model and BigQuery clients before serving."""
+    init_database_settings()
+    if not cassette.replaying:
+        get_bigquery_client()
+    _prewarm_model(agent)
+
+
+def _prewarm_model(agent: BaseAgent) -> None:
+    model = getattr(agent, "model", None)
+    if isinstance(model, CassetteLlm):
+        # Recording calls the wrapped model; replay calls no model at all.
+        model = None if cassette.replaying else model.inner
+    if isinstance(model, Gemini):
+        # Cached on the model, so the first request does not pay for client setup.
+        _ = model.api_client
+    for tool in getattr(agent, "tools", []):
+        # AgentTool wraps agents whose models are otherwise first built on demand.
+        if hasattr(tool, "agent"):
+            _prewarm_model(tool.agent)
+    for sub_agent in agent.sub_agents:
+        _prewarm_model(sub_agent)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start = time.perf_counter()
+    _prewarm(root_agent)
+    # Pick up schema changes without a restart
+    schema_refresher.start()
+    app.state.runner = Runner(
+        app_name=APP_NAME,
+        agent=root_agent,
+        session_service=_create_session_service(),
+    )
+    app.state.admission = AdmissionController(
+        max_concurrent=settings.SERVER_MAX_CONCURRENT_RUNS,
+        max_queued=settings.SERVER_MAX_QUEUED_REQUESTS,
+        queue_timeout=settings.SERVER_QUEUE_TIMEOUT_SECONDS,
+    )
+    logger.info(f"Worker ready in {time.perf_counter() - start:.2f}s...")
+    yield
+    schema_refresher.stop()
+    await app.state.runner.close()
+    cassette.close()
+
+
+app = FastAPI(title="Creative Analytics Agents", lifespan=lifespan)
+
+
+@app.get("/healthz")
+async def healthz() -> dict:
+    return {"status": "ok", **app.state.admission.snapshot()}
+
+
+@app.get("/stats")
+async def stats() -> dict:
+    """Counters of this worker's caches, SQL guard, rollup and intent routing, parallel subtasks, history compaction, few-shot index, schema refresher and cassette."""
+    return {
+        "aggregate_routing": aggregate_router.snapshot(),
+        "answer_cache": answer_cache.snapshot(),
+        "approximate": approximate_planner.snapshot(),
+        "cassette": cassette.snapshot(),
+        "fanout": fanout_scheduler.snapshot(),
+        "few_shot": example_index.snapshot(),
+        "history": history_compactor.snapshot(),
+        "intent_routing": intent_router.snapshot(),
+        "metering": meter.snapshot(),
+        "schema": schema_refresher.snapshot(),
+        "sql_guard": sql_guard.snapshot(),
+        "speculation": speculation_manager.snapshot(),
+    }
+
+
+@app.post("/sessions")
+async def create_session(req: CreateSessionRequest) -> dict:
+    session = await app.state.runner.session_service.create_session(
+        app_name=APP_NAME, user_id=req.user_id, state={EXECUTION_MODE_STATE_KEY: req.execution_mode},
+    )
+    return {"session_id": session.id}
+
+
+def _message_parts(req: RunRequest) -> List[types.Part]:
+    try:
+        return [types.Part(text=req.message)] + [
+            types.Part(inline_data=types.Blob(mime_type=a.mime_type, data=base64.b64decode(a.data)))
+            for a in req.attachments
+        ]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid attachment: {e}")
+
+
+async def _start_run(req: RunRequest) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    Acquires a run slot and resolves the session, returning its id, the
+    execution mode of this run and the state changes to apply with the message.
+    The caller must release the slot.
+    """
+    runner: Runner = app.state.runner
+    await app.state.admission.acquire()
+    try:
+        if req.session_id is None:
+            session = await runner.session_service.create_session(app_name=APP_NAME, user_id=req.user_id)
+        else:
+            session = await runner.session_service.get_session(
+                app_name=APP_NAME, user_id=req.user_id, session_id=req.session_id
+            )
+            if session is None:
+                raise HTTPException(status_code=404, detail=f"Session not found: {req.session_id}")
+    except BaseException:
+        app.state.admission.release()
+        raise
+
+    # The structured result is cleared so a turn never returns the previous turn's result.
+    state_delta: Dict[str, Any] = {STRUCTURED_RESULT_STATE_KEY: None}
+    if req.execution_mode:
+        state_delta[EXECUTION_MODE_STATE_KEY] = req.execution_mode
+    mode = req.execution_mode or session.state.get(EXECUTION_MODE_STATE_KEY) or INTERACTIVE
+    return session.id, mode, state_delta
+
+
+async def _run_result(user_id: str, session_id: str, answer: str) -> dict:
+    """The final answer of a run with the structured result the specialists stored."""
+    session = await app.state.runner.session_service.get_session(
+        app_name=APP_NAME, user_id=user_id, session_id=session_id
+    )
+    return {"session_id": session_id, "answer": answer, "result": structured_result(session.state) if session else None}
+
+
+def _final_text(event: Any) -> Optional[str]:
+    """The text of a complete model response, or None for partial, tool and user events."""
+    if event.partial or event.author == "user" or event.content is None or not event.content.parts:
+        return None
+    if any(part.function_call or part.function_response for part in event.content.parts):
+        return None
+    text = "".join(part.text for part in event.content.parts if part.text and not part.thought)
+    return text or None
+
+
+@app.post("/run")
+async def run(req: RunRequest) -> dict:
+    """Runs the agent on one message and returns its final answer and structured result."""
+    runner: Runner = app.state.runner
+    parts = _message_parts(req)
+    session_id, _, state_delta = await _start_run(req)
+    answer = ""
+    try:
+        async for event in runner.run_async(
+            user_id=req.user_id,
+            session_id=session_id,
+            new_message=types.Content(role="user", parts=parts),
+            state_delta=state_delta,
+        ):
+            answer = _final_text(event) or answer
+    except Exception as e:
+        logger.exception(f"Agent run failed for session {session_id}...")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        app.state.admission.release()
+    return await _run_result(req.user_id, session_id, answer)
+
+
+@app.post("/run_sse")
+async def run_sse(req: RunRequest) -> StreamingResponse:
+    """
+    Runs the agent on one message and streams its events as Server-Sent Events.
+    In auto execution mode, a final `result` event carries the answer and the
+    structured result.
+    """
+    runner: Runner = app.state.runner
+    parts = _message_parts(req)
+    session_id, mode, state_delta = await _start_run(req)
+
+    async def event_stream() -> AsyncGenerator[str, None]:
+        answer = ""
+        try:
+            async for event in runner.run_async(
+                user_id=req.user_id,
+                session_id=session_id,
+                new_message=types.Content(role="user", parts=parts),
+                state_delta=state_delta,
+                run_config=RunConfig(streaming_mode=StreamingMode.SSE),
+            ):
+                answer = _final_text(event) or answer
+                yield f"data: {event.model_dump_json(exclude_none=True, by_alias=True)}\n\n"
+            if mode == AUTO:
+                result = await _run_result(req.user_id, session_id, answer)
+                yield f"event: result\ndata: {json.dumps(result, default=str)}\n\n"
+        except Exception as e:
+            logger.exception(f"Agent run failed for session {session_id}...")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    # The run slot is held until the response ends, however it ends.
+    return SlotStreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"X-Session-Id": session_id, "Cache-Control": "no-cache"},
+        release=app.state.admission.release,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the creative analytics agents over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes, each with its own warmed agents")
+    args = parser.parse_args()
+
+    if args.workers > 1 and not settings.SERVER_SESSION_DB_URL:
+        logger.warning("Sessions are kept per worker; set SERVER_SESSION_DB_URL to share them across workers...")
+
+    uvicorn.run(
+        "creative_analytics_agents.server:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        log_level="info",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,152 @@
+import json
 import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
 
 from google.adk.agents import LlmAgent
-from google.adk.tools import AgentTool
-from google.adk.models.google_llm import Gemini
+from google.adk.tools import AgentTool, BaseTool, ToolContext
 from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
 from google.genai.types import HttpRetryOptions
 
 from .tools import (
+    CreativeFeatures,
     generate_prediction_sql,
-    validate_features_json
+    parse_features
 )
-from ..statistical_analysis.tools import bq_executor_tool
+from ..statistical_analysis.async_tools import execute_sql as async_execute_sql
+from ..statistical_analysis.tools import get_bq_executor_tool
 
 from .prompts import (
     get_instructions_features_extractor_agent,
     get_instructions_sql_prediction_agent,
     get_instructions_performance_predictor_agent
 )
-from ...utils.database_context import init_database_settings
+from ...utils.cassette import record_tool_call, record_user_message, replay_tool_call
+from ...utils.database_context import pin_schema_version
+from ...utils.execution_mode import store_structured_result
+from ...utils.feature_cache import feature_cache
+from ...utils.history import compact_history
+from ...utils.metering import fail_model_call, record_model_call, start_model_call
+from ...utils.models import create_model
 from ...utils.settings import settings
 
 logger = logging.getLogger(__name__)
 
+# Feature cache key of the media being analyzed, set before the extractor's model call
+FEATURE_CACHE_KEY_STATE = "feature_cache_key"
+# Feature cache key of the latest creative given to the coordinator. AgentTool
+# forwards only the request text to the extractor, but copies the session state.
+CREATIVE_MEDIA_KEY_STATE = "creative_media_key"
+# Media parts of the creatives recently given to the coordinator, by feature cache key
+MAX_TRACKED_CREATIVES = 64
+_creative_parts: "OrderedDict[str, List[types.Part]]" = OrderedDict()
+
+
+def _inline_media(content: types.Content) -> List[bytes]:
+    return [part.inline_data.data for part in content.parts or [] if part.inline_data and part.inline_data.data]
+
 
 def setup_before_agent_call(callback_context: CallbackContext):
-    """Ensures the shared database settings are loaded into the agent's state."""
-    if "database_settings" not in callback_context.state:
-        shared_context = init_database_settings()
-        callback_context.state["database_settings"] = shared_context['database_settings']
+    """Ensures the session references the current version of the shared database settings."""
+    pin_schema_version(callback_context)
+
+
+def track_creative_media(callback_context: CallbackContext, llm_request: LlmRequest) -> None:
+    """
+    Remembers the latest user message carrying media in the coordinator's
+    request: its feature cache key in the session state and its media parts
+    in this worker, for `attach_creative_media`.
+    """
+    for content in reversed(llm_request.contents):
+        media = _inline_media(content) if content.role == "user" else []
+        if media:
+            key = feature_cache.make_key(media, settings.PREDICTOR_AGENT_MODEL)
+            if callback_context.state.get(CREATIVE_MEDIA_KEY_STATE) != key:
+                callback_context.state[CREATIVE_MEDIA_KEY_STATE] = key
+            _creative_parts[key] = [part for part in content.parts if part.inline_data and part.inline_data.data]
+            _creative_parts.move_to_end(key)
+            while len(_creative_parts) > MAX_TRACKED_CREATIVES:
+                _creative_parts.popitem(last=False)
+            return
+
+
+def attach_creative_media(callback_context: CallbackContext, llm_request: LlmRequest) -> None:
+    """Adds the coordinator's creative to an extractor request that AgentTool sent as text only."""
+    if not llm_request.contents or any(_inline_media(content) for content in llm_request.contents):
+        return
+    parts = _creative_parts.get(callback_context.state.get(CREATIVE_MEDIA_KEY_STATE) or "")
+    if parts is None:
+        return
+    content = llm_request.contents[-1]
+    if content.role == "user":
+        content.parts = [*(content.parts or []), *parts]
+
+
+def serve_cached_features(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+    """
+    Answers from the feature cache when the same media was analyzed before.
+
+    The key comes from the media in the extractor's own request (batch scoring)
+    or, when called through AgentTool with text only, from the creative the
+    coordinator was given (`CREATIVE_MEDIA_KEY_STATE`).
+    """
+    media = [data for content in llm_request.contents for data in _inline_media(content)]
+    if media:
+        key = feature_cache.make_key(media, settings.PREDICTOR_AGENT_MODEL)
+    else:
+        key = callback_context.state.get(CREATIVE_MEDIA_KEY_STATE)
+    if not key:
+        callback_context.state[FEATURE_CACHE_KEY_STATE] = None
+        return None
+    features = feature_cache.get(key)
+    if features is None:
+        callback_context.state[FEATURE_CACHE_KEY_STATE] = key
+        return None
+    callback_context.state[FEATURE_CACHE_KEY_STATE] = None
+    return LlmResponse(content=types.Content(role="model", parts=[types.Part(text=json.dumps(features))]))
+
+
+def validate_extracted_features(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+    """
+    Checks the extractor's final JSON against `CreativeFeatures`, turning a
+    violation into an error response, and caches valid features.
+    """
+    content = llm_response.content
+    if llm_response.partial or content is None or not content.parts:
+        return None
+    text = "".join(part.text for part in content.parts if part.text and not part.thought)
+    try:
+        features = parse_features(text)
+    except ValueError as e:
+        logger.warning(f"Rejected feature extraction output: {e}")
+        return LlmResponse(error_code="INVALID_FEATURES", error_message=str(e))
+
+    cache_key = callback_context.state.get(FEATURE_CACHE_KEY_STATE)
+    if cache_key:
+        feature_cache.put(cache_key, features.model_dump())
+    return None
+
+
+def store_prediction_result(
+    tool: BaseTool,
+    args: Dict[str, Any],
+    tool_context: ToolContext,
+    tool_response: Dict,
+) -> Optional[Dict]:
+    """Stores the predicted class and confidence with the features they were predicted from as the structured result."""
+    if tool.name != 'execute_sql' or tool_response.get("status") != "SUCCESS" or not tool_response.get("rows"):
+        return None
+    prediction = tool_response["rows"][0]
+    store_structured_result(
+        tool_context.state,
+        "prediction",
+        features=tool_context.state.get("features"),
+        predicted_class=prediction.get("predicted_class"),
+        confidence_score=prediction.get("confidence_score"),
+    )
+    return None
 
 
 retry_config = HttpRetryOptions(
@@ -39,30 +158,44 @@ retry_config = HttpRetryOptions(
 
 features_extraction_agent = LlmAgent(
     name="FeaturesExtractionAgent",
-    model=Gemini(model=settings.PREDICTOR_AGENT_MODEL, retry_options=retry_config),
+    model=create_model(settings.PREDICTOR_AGENT_MODEL, retry_options=retry_config),
     description="An agent tool to extract visual features from the input image or video",
     instruction=get_instructions_features_extractor_agent(),
-    tools=[validate_features_json],
-    output_key="features"
+    output_schema=CreativeFeatures,
+    output_key="features",
+    before_model_callback=[serve_cached_features, attach_creative_media, start_model_call],
+    after_model_callback=[record_model_call, validate_extracted_features],
+    on_model_error_callback=fail_model_call,
 )
 
 sql_prediction_agent = LlmAgent(
     name="SQLPredictionAgent",
-    model=Gemini(model=settings.PREDICTOR_AGENT_MODEL, retry_options=retry_config),
+    model=create_model(settings.PREDICTOR_AGENT_MODEL, retry_options=retry_config),
     description="A agent tool to get prediction of visual features via BigQuery ML model",
     instruction=get_instructions_sql_prediction_agent(),
-    tools=[generate_prediction_sql, bq_executor_tool],
-    output_key='predictions'
+    tools=[
+        generate_prediction_sql,
+        async_execute_sql if settings.USE_ASYNC_TOOLS else get_bq_executor_tool()
+    ],
+    output_key='predictions',
+    before_model_callback=start_model_call,
+    after_model_callback=record_model_call,
+    on_model_error_callback=fail_model_call,
+    before_tool_callback=replay_tool_call,
+    after_tool_callback=[record_tool_call, store_prediction_result],
 )
 
 performance_predictor_agent = LlmAgent(
     name="PerformancePredictorCoordinator",
-    model=Gemini(model=settings.PREDICTOR_AGENT_MODEL, retry_options=retry_config),
+    model=create_model(settings.PREDICTOR_AGENT_MODEL, retry_options=retry_config),
     description="Orchestrates a workflow to predict creative performance.",
     instruction=get_instructions_performance_predictor_agent(),
     tools=[
         AgentTool(features_extraction_agent),
         AgentTool(sql_prediction_agent)
     ],
-    before_agent_callback=setup_before_agent_call,
+    before_agent_callback=[setup_before_agent_call, record_user_message],
+    before_model_callback=[track_creative_media, compact_history, start_model_call],
+    after_model_callback=record_model_call,
+    on_model_error_callback=fail_model_call,
 )
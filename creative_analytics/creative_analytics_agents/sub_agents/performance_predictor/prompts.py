@@ -1,29 +1,21 @@
 """
 This module contains the focused instructions for the Performance Predictor agent and its sub agents.
 """
+from ...utils.tag_registry import tag_registry
 
 
 def get_instructions_features_extractor_agent() -> str:
-    """ Instruction for the feature extraction agent."""
+    """ Instruction for the feature extraction agent, listing the tags of the registry."""
 
-    instruction_prompt = """
+    instruction_prompt = f"""
     You are a specialist **Creative Feature Extraction Agent**. Your entire purpose is to analyze a creative asset (Image or Video) and produce a structured dictionary of its visual features.
 
     <YOUR_WORKFLOW>
-    1. First, analyze the provided image or video. For each of the following visual feature tags — "animal", "human", "logo", "product", "cta" — detect whether the element appears **anywhere** in the creative.  
-        - If the element is present in any part of the image or video: set its value to true.  
-        - If the element does not appear anywhere: set its value to false.
-
-        You must output a raw JSON string containing exactly these five boolean keys.  
-        Example: '{"animal": false, "human": true, "logo": true, "product": false, "cta": true}'
-
-    2.  Next, call the `validate_features_json` tool with this string. This tool confirms your output is valid and returns the data in a structured way.
-
-    3.  Finally, your task is complete. Your final output for the entire job **MUST be ONLY the dictionary of features** that you receive from the `validate_features_json` tool.
+    {tag_registry.extraction_instructions()}
 
     <CONSTRAINTS>
     - Do not add any conversational text, summaries, or explanations.
-    - Your only output is the final, clean feature dictionary.
+    - Your only output is the feature JSON object.
     """
 
     return instruction_prompt
@@ -103,6 +95,7 @@ def get_instructions_performance_predictor_agent() -> str:
 
     <CONSTRAINTS>
     - You MUST follow the workflow in order.
+    - If `FeaturesExtractionAgent` returns no features, stop and tell the user that the creative could not be analyzed.
     - Your final answer MUST be a natural language sentence and not the raw data dictionary.
     """
 
@@ -1,80 +1,60 @@
-import json
 import logging
-from typing import Dict, Any
+from typing import Any, Dict, List
+
+from pydantic import ValidationError
 
 from ...utils.settings import settings
+from ...utils.tag_registry import tag_registry
 
 logger = logging.getLogger(__name__)
 
+# The visual features of a creative asset, as detected by the
+# `FeaturesExtractionAgent`: a boolean per registered tag, or the list of tags
+# present when tags are packed. It is the agent's response schema, so the model
+# can only produce registered tags, and it is validated strictly in code:
+# missing keys, unknown keys or tags and values of the wrong type are rejected.
+CreativeFeatures = tag_registry.features_model()
 
-def validate_features_json(json_string: str) -> Dict[str, Any]:
-    """
-    Acts as a mandatory quality check for a JSON string of visual features.
-
-    An agent MUST call this tool immediately after it generates a JSON string
-    of creative features. This tool verifies that the agent's output is
-    syntactically correct and well-formed before it can be used in subsequent
-    steps of a workflow.
 
-    Args:
-        json_string: The raw JSON string generated by the agent during the
-            feature extraction step.
-            Example: '{"animal": false, "human": true, "logo": true}'
+def parse_features(text: str) -> CreativeFeatures:
+    """
+    Parses the extractor's JSON output into `CreativeFeatures`.
 
-    Returns:
-        A dictionary detailing the outcome of the validation.
-        - On success, the dictionary will have a 'status' of 'success' and a
-          'features' key. This 'features' key contains the parsed, validated
-          feature dictionary, which is the clean data intended for the next
-          step in the workflow.
-          Example Success Return:
-          {
-            "status": "success",
-            "features": {"animal": false, "human": true, "logo": true}
-          }
-        - On failure, the dictionary will have a 'status' of 'error' and an
-          'error_message' key with details about the parsing failure. The
-          agent should stop the workflow and report this error.
+    Raises:
+        ValueError: If the output does not match `CreativeFeatures`.
     """
     try:
-        if not isinstance(json_string, str):
-            raise TypeError("Input must be a string.")
-
-        data = json.loads(json_string)
-        return {
-            "status": "success",
-            "features": data
-        }
-    except (json.JSONDecodeError, TypeError) as e:
-        error_message = f"Validation failed: The provided input is not a valid JSON string. Details: {str(e)}"
-        logger.warning(error_message)
-        return {
-            "status": "error",
-            "error_message": error_message
-        }
-
-
-def generate_prediction_sql(features: Dict[str, bool]) -> Dict[str, Any]:
+        return CreativeFeatures.model_validate_json(text)
+    except ValidationError as e:
+        raise ValueError(f"Invalid creative features: {e}") from e
+
+
+def generate_prediction_sql(features: Dict[str, Any]) -> Dict[str, Any]:
     """
     Generates the BigQuery ML SQL query for performance prediction.
 
     Args:
-        features: A dictionary of boolean features from the features_extraction_agent.
+        features: The feature dictionary from the features_extraction_agent.
 
     Returns:
         Dict[str, Any]: A dictionary representing the outcome.
         - On success: `{"status": "success", "sql_query": "SELECT ..."}`
         - On failure: `{"status": "error", "error_message": "Details..."}`
     """
+    try:
+        features = CreativeFeatures.model_validate(features).model_dump()
+    except ValidationError as e:
+        error_msg = f"Invalid creative features: {e}"
+        logger.warning(error_msg)
+        return {"status": "error", "error_message": error_msg}
+
     try:
         project_id = settings.GOOGLE_CLOUD_PROJECT_ID
         dataset_name = settings.BQ_DATASET_NAME
         model_name = settings.BQ_MODEL_NAME
 
         full_model_id = f"`{project_id}.{dataset_name}.{model_name}`"
-        feature_selects = ", ".join(
-            f"{str(val).lower()} AS {key}" for key, val in features.items()
-        )
+        feature_selects = tag_registry.prediction_input_sql(tag_registry.present_tags(features))
 
         query = f"""
         SELECT
@@ -89,3 +69,34 @@ def generate_prediction_sql(features: Dict[str, bool]) -> Dict[str, Any]:
         error_msg = "Failed to construct the BigQuery ML prediction SQL query."
         logger.error(f"{error_msg} Details: {e}", exc_info=True)
         return {"status": "error", "error_message": error_msg}
+
+
+def build_batch_prediction_query(features: List[Dict[str, Any]]) -> str:
+    """
+    Builds one ML.PREDICT query that scores many feature sets at once.
+
+    Each input row carries its position in `features` as `row_index`, which
+    ML.PREDICT passes through, so results can be matched back to their assets.
+
+    Args:
+        features: Validated feature dictionaries, one per asset.
+
+    Returns:
+        str: A query returning `row_index`, `predicted_class` and `confidence_score`.
+    """
+    full_model_id = f"`{settings.GOOGLE_CLOUD_PROJECT_ID}.{settings.BQ_DATASET_NAME}.{settings.BQ_MODEL_NAME}`"
+    rows = ",\n".join(
+        "STRUCT({index} AS row_index, {values})".format(
+            index=index,
+            values=tag_registry.prediction_input_sql(tag_registry.present_tags(row)),
+        )
+        for index, row in enumerate(features)
+    )
+    return f"""
+    SELECT
+      row_index,
+      predicted_is_high_performing AS predicted_class,
+      predicted_is_high_performing_probs[OFFSET(1)].prob AS confidence_score
+    FROM
+      ML.PREDICT(MODEL {full_model_id}, (SELECT * FROM UNNEST([{rows}])))
+    """
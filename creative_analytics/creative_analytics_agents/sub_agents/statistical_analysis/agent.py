@@ -2,24 +2,80 @@ import logging
 from typing import Any, Dict, Optional
 
 from google.adk.agents import LlmAgent
-from google.adk.models.google_llm import Gemini
 from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
 from google.adk.tools import BaseTool, ToolContext
+from google.genai import types
 from google.genai.types import HttpRetryOptions
 
-from .tools import generate_sql_for_analysis, bq_executor_tool
+from . import async_tools
+from .tools import (
+    ANSWER_CACHE_KEY_STATE,
+    CACHED_ANSWER_STATE,
+    generate_sql_for_analysis,
+    compute_lift_matrix,
+    compute_lift_significance,
+    compute_robust_lift,
+    get_bq_executor_tool
+)
 from .prompts import get_instructions_statistical_analyst_agent
-from ...utils.database_context import init_database_settings
+from ...utils.answer_cache import answer_cache
+from ...utils.cassette import record_tool_call, record_user_message, replay_tool_call
+from ...utils.database_context import get_database_settings, pin_schema_version
+from ...utils.example_index import example_index, is_same_query
+from ...utils.execution_mode import store_structured_result
+from ...utils.history import compact_history
+from ...utils.metering import meter, metered_session_id, fail_model_call, record_model_call, start_model_call
+from ...utils.models import create_model
 from ...utils.settings import settings
+from ...utils.sql_guard import sql_guard
 
 logger = logging.getLogger(__name__)
 
+# Cache key whose result rows are awaiting a synthesized answer
+PENDING_ANSWER_KEY_STATE = "answer_cache_pending_key"
+
+# Question of the generated SQL that has not been executed yet
+GENERATED_QUESTION_STATE = "last_generated_question"
+
 
 def setup_before_agent_call(callback_context: CallbackContext):
-    """Ensures the shared database settings are loaded into the agent's state."""
-    if "database_settings" not in callback_context.state:
-        shared_context = init_database_settings()
-        callback_context.state["database_settings"] = shared_context['database_settings']
+    """Ensures the session references the current version of the shared database settings."""
+    pin_schema_version(callback_context)
+
+
+def validate_sql_before_execution(
+    tool: BaseTool,
+    args: Dict[str, Any],
+    tool_context: ToolContext,
+) -> Optional[Dict]:
+    """Rejects queries that fail local validation against the cached schema without running them."""
+    if tool.name != 'execute_sql':
+        return None
+    try:
+        sql_guard.check(
+            args.get("query", ""),
+            get_database_settings(tool_context.state),
+            settings.GOOGLE_CLOUD_PROJECT_ID,
+        )
+    except ValueError as e:
+        return {"status": "ERROR", "error_details": f"Query rejected before execution: {e}"}
+    return None
+
+
+def record_first_execution(query: str, tool_context: ToolContext, succeeded: bool) -> None:
+    """
+    Counts the first execution of freshly generated SQL for the first-shot
+    success rate, and records it as a few-shot example when it succeeded.
+    """
+    question = tool_context.state.get(GENERATED_QUESTION_STATE)
+    generated_sql = tool_context.state.get("last_generated_sql")
+    if not question or not generated_sql or not is_same_query(query, generated_sql):
+        return
+    tool_context.state[GENERATED_QUESTION_STATE] = None
+    example_index.record_execution(succeeded)
+    if succeeded and settings.FEW_SHOT_RETRIEVAL:
+        example_index.add(question, query)
 
 
 def store_results_in_context(
@@ -28,13 +84,118 @@ def store_results_in_context(
     tool_context: ToolContext,
     tool_response: Dict,
 ) -> Optional[Dict]:
-    """Stores intermediate tool output into the agent's state."""
+    """Stores intermediate tool output, and the structured result of the analysis, into the agent's state and the answer cache."""
+    cache_key = tool_context.state.get(ANSWER_CACHE_KEY_STATE)
     if tool.name == 'execute_sql':
+        record_first_execution(args.get("query", ""), tool_context, tool_response.get("status") == "SUCCESS")
         if tool_response.get("status") == "SUCCESS":
             tool_context.state["last_query_result"] = tool_response.get("rows")
+            store_structured_result(tool_context.state, "rows", sql_query=args.get("query"), rows=tool_response.get("rows"))
+            if cache_key and settings.ANSWER_CACHE_ENABLED:
+                answer_cache.put(cache_key, sql_query=args.get("query"), rows=tool_response.get("rows"))
+                tool_context.state[PENDING_ANSWER_KEY_STATE] = cache_key
     elif tool.name == 'generate_sql_for_analysis':
-        if tool_response.get("status") == "SUCCESS":
+        if tool_response.get("status") == "success":
             tool_context.state["last_generated_sql"] = tool_response.get("sql_query")
+            is_cached = "cached_rows" in tool_response or tool_response.get("cached_answer")
+            tool_context.state[GENERATED_QUESTION_STATE] = None if is_cached else args.get("question")
+            if "cached_rows" in tool_response:
+                tool_context.state["last_query_result"] = tool_response["cached_rows"]
+                store_structured_result(tool_context.state, "rows", sql_query=tool_response.get("sql_query"),
+                                        rows=tool_response["cached_rows"])
+                tool_context.state[PENDING_ANSWER_KEY_STATE] = cache_key
+    elif tool.name == 'compute_lift_significance':
+        if tool_response.get("status") == "success":
+            tool_context.state["last_significance_result"] = tool_response.get("results")
+            store_structured_result(tool_context.state, "lift_significance", results=tool_response.get("results"))
+    elif tool.name == 'compute_lift_matrix':
+        if tool_response.get("status") == "success":
+            tool_context.state["last_lift_matrix"] = [
+                {"tag": result["tag"], "segment_size": result["segment_size"], **result["percentage_lift"]}
+                for result in tool_response.get("results", [])
+            ]
+            store_structured_result(tool_context.state, "lift_matrix", results=tool_response.get("results"))
+    elif tool.name == 'compute_robust_lift':
+        if tool_response.get("status") == "success":
+            tool_context.state["last_robust_lift"] = [
+                {"tag": result["tag"], "segment_size": result["segment_size"],
+                 **{f"{name}_lift": lift for name, lift in result["percentage_lift"].items()}}
+                for result in tool_response.get("results", [])
+            ]
+            tool_context.state["last_robust_lift_stale_reason"] = tool_response.get("stale_reason")
+            store_structured_result(tool_context.state, "robust_lift", results=tool_response.get("results"),
+                                    stale=tool_response.get("stale", False))
+    return None
+
+
+def serve_cached_answer(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+    """Returns a cached final answer staged by `generate_sql_for_analysis` instead of calling the model."""
+    answer = callback_context.state.get(CACHED_ANSWER_STATE)
+    if not answer:
+        return None
+    callback_context.state[CACHED_ANSWER_STATE] = None
+    return LlmResponse(content=types.Content(role="model", parts=[types.Part(text=answer)]))
+
+
+def _format_rows(rows: Any, max_rows: int = 20) -> str:
+    """Renders result rows as a markdown table."""
+    if not rows or not isinstance(rows, list) or not isinstance(rows[0], dict):
+        return "No rows were returned."
+    columns = list(rows[0].keys())
+    lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+    for row in rows[:max_rows]:
+        lines.append("| " + " | ".join(str(row.get(column, "")) for column in columns) + " |")
+    if len(rows) > max_rows:
+        lines.append(f"\n({len(rows) - max_rows} more rows not shown)")
+    return "\n".join(lines)
+
+
+def report_results_when_over_budget(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+    """
+    Once the session or its brand is over its token budget, reports fresh
+    analysis results as a table instead of calling the model to synthesize them.
+    """
+    if not llm_request.contents or not llm_request.contents[-1].parts:
+        return None
+    responded = {
+        part.function_response.name
+        for part in llm_request.contents[-1].parts if part.function_response
+    }
+    if not responded & {'execute_sql', 'compute_lift_significance', 'compute_lift_matrix', 'compute_robust_lift'}:
+        return None
+    reason = meter.budget_exceeded(metered_session_id(callback_context), callback_context.state)
+    if not reason:
+        return None
+
+    sections = [f"Results are reported without a written summary because the {reason}."]
+    if 'compute_lift_matrix' in responded:
+        sections.append(_format_rows(callback_context.state.get("last_lift_matrix")))
+    elif 'compute_lift_significance' in responded:
+        sections.append(_format_rows(callback_context.state.get("last_significance_result")))
+    elif 'compute_robust_lift' in responded:
+        sections.append(_format_rows(callback_context.state.get("last_robust_lift")))
+        if callback_context.state.get("last_robust_lift_stale_reason"):
+            sections.append(f"These quantiles may be out of date. {callback_context.state['last_robust_lift_stale_reason']}")
+    else:
+        sections.append(_format_rows(callback_context.state.get("last_query_result")))
+    meter.record_degradation("skipped_synthesis")
+    logger.info(f"Skipped answer synthesis: {reason}")
+    return LlmResponse(content=types.Content(role="model", parts=[types.Part(text="\n\n".join(sections))]))
+
+
+def cache_synthesized_answer(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+    """Stores the analyst's final answer against the cache entry of the rows it was based on."""
+    cache_key = callback_context.state.get(PENDING_ANSWER_KEY_STATE)
+    content = llm_response.content
+    if not cache_key or content is None or not content.parts or llm_response.partial:
+        return None
+    if any(part.function_call for part in content.parts):
+        return None
+
+    answer = "".join(part.text for part in content.parts if part.text)
+    if answer:
+        answer_cache.put(cache_key, answer=answer)
+        callback_context.state[PENDING_ANSWER_KEY_STATE] = None
     return None
 
 
@@ -45,13 +206,30 @@ retry_config = HttpRetryOptions(
     http_status_codes=[429, 500, 503, 504]
 )
 
+if settings.USE_ASYNC_TOOLS:
+    analysis_tools = [
+        async_tools.generate_sql_for_analysis,
+        async_tools.execute_sql,
+        async_tools.compute_lift_significance,
+        async_tools.compute_lift_matrix,
+        compute_robust_lift,
+    ]
+else:
+    analysis_tools = [
+        generate_sql_for_analysis, get_bq_executor_tool(), compute_lift_significance, compute_lift_matrix, compute_robust_lift,
+    ]
+
 
 statistical_analyst_agent = LlmAgent(
     name="StatisticalAnalystAgent",
-    model=Gemini(model=settings.STATS_AGENT_MODEL, retry_options=retry_config),
+    model=create_model(settings.STATS_AGENT_MODEL, retry_options=retry_config),
     description="A specialist agent that analyzes historical ad data by generating and executing SQL.",
     instruction=get_instructions_statistical_analyst_agent(),
-    tools=[generate_sql_for_analysis, bq_executor_tool],
-    before_agent_callback=setup_before_agent_call,
-    after_tool_callback=store_results_in_context,
+    tools=analysis_tools,
+    before_agent_callback=[setup_before_agent_call, record_user_message],
+    before_model_callback=[serve_cached_answer, report_results_when_over_budget, compact_history, start_model_call],
+    after_model_callback=[record_model_call, cache_synthesized_answer],
+    on_model_error_callback=fail_model_call,
+    before_tool_callback=[validate_sql_before_execution, replay_tool_call],
+    after_tool_callback=[record_tool_call, store_results_in_context],
 )
@@ -0,0 +1,343 @@
+"""
+Non-blocking variants of the statistical analysis tools.
+
+The functions here keep the names and response shapes of their synchronous
+counterparts (`generate_sql_for_analysis`, `compute_lift_significance`,
+`compute_lift_matrix` and the BigQuery toolset's `execute_sql`), so prompts and callbacks work unchanged.
+They are enabled with `USE_ASYNC_TOOLS=1`. Model calls go through the async
+GenAI client and BigQuery jobs are polled with `asyncio.sleep` between status
+checks, so concurrent sessions in one worker do not serialize on the event loop.
+`compute_robust_lift` only reads in-memory sketches and is shared by both modes.
+"""
+import asyncio
+import datetime
+import decimal
+import logging
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Mapping, Optional
+
+from google import genai
+from google.adk.tools import ToolContext
+from google.api_core.exceptions import GoogleAPICallError
+from google.cloud import bigquery
+from google.genai import types
+
+from .speculation import SPECULATION_STATE_KEY, speculation_manager
+from .tools import (
+    DEFAULT_METRIC,
+    build_lift_matrix_query,
+    build_significance_query,
+    build_sql_generation_prompt,
+    get_bigquery_client,
+    lift_matrix_response,
+    lookup_cached_analysis,
+    prepare_generated_sql,
+    record_sql_generation_usage,
+    route_to_rollup,
+    significance_response,
+    table_context,
+)
+from ...utils.answer_cache import BRAND_STATE_KEY
+from ...utils.approximate import approximate_planner
+from ...utils.cassette import cassette
+from ...utils.metering import metered_session_id
+from ...utils.schema_registry import SCHEMA_VERSION_STATE_KEY
+from ...utils.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def _get_async_genai_client():
+    """Returns the async surface of a process-wide GenAI client."""
+    return genai.Client(vertexai=True).aio
+
+
+def _serialize_value(value: Any) -> Any:
+    """Converts BigQuery row values into JSON-friendly types."""
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, list):
+        return [_serialize_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _serialize_value(item) for key, item in value.items()}
+    return value
+
+
+async def _wait_for_job(job: bigquery.QueryJob) -> None:
+    """Polls a BigQuery job with capped exponential backoff without blocking the loop."""
+    delay = settings.BQ_POLL_INITIAL_DELAY
+    while not await asyncio.to_thread(job.done):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, settings.BQ_POLL_MAX_DELAY)
+
+
+async def run_query_async(
+    query: str,
+    project_id: Optional[str] = None,
+    max_results: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """Submits a query, awaits completion and returns its rows as dictionaries."""
+    client = get_bigquery_client()
+    job = await asyncio.to_thread(
+        client.query, query, project=project_id or settings.GOOGLE_CLOUD_PROJECT_ID
+    )
+    await _wait_for_job(job)
+    rows = await asyncio.to_thread(lambda: list(job.result(max_results=max_results)))
+    return [{key: _serialize_value(value) for key, value in row.items()} for row in rows]
+
+
+async def generate_sql(
+    question: str,
+    state: Mapping[str, Any],
+    session_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """Generates SQL for `question` using the schema referenced by `state`, metered to `session_id`."""
+    result = None
+    for _ in range(max(1, settings.SQL_GENERATION_ATTEMPTS)):
+        try:
+            prompt = build_sql_generation_prompt(question, state, rejection=result)
+        except (KeyError, TypeError) as e:
+            error_msg = f"Could not find required schema info to generate SQL. Error: {e}"
+            logger.error(error_msg)
+            return {"status": "error", "error_message": error_msg}
+
+        try:
+            start = time.perf_counter()
+            response = await cassette.exchange_async(
+                "sql_generation", {"model": settings.STATS_AGENT_MODEL, "contents": prompt},
+                lambda: _get_async_genai_client().models.generate_content(
+                    model=settings.STATS_AGENT_MODEL,
+                    contents=prompt,
+                ),
+                response_type=types.GenerateContentResponse,
+                label=settings.STATS_AGENT_MODEL,
+            )
+        except Exception as e:
+            error_msg = f"LLM failed to generate SQL. Error: {e}"
+            logger.error(error_msg, exc_info=True)
+            return {"status": "error", "error_message": error_msg}
+
+        record_sql_generation_usage(response, state, session_id, time.perf_counter() - start)
+        # Parsing is cheap and local; a rejected query is regenerated with the error as feedback.
+        result = prepare_generated_sql(response.text, state)
+        if result["status"] == "success":
+            break
+    # Routing dry-runs the query, so it runs off the event loop.
+    return await asyncio.to_thread(route_to_rollup, result, state)
+
+
+async def run_read_only_query(project_id: str, query: str) -> Dict[str, Any]:
+    """Executes `query` after a dry-run check, in the `execute_sql` response format."""
+    max_rows = settings.BQ_MAX_RESULT_ROWS
+    try:
+        client = get_bigquery_client()
+
+        # Mirror the built-in tool's read-only guard with a free dry run.
+        dry_run_job = await asyncio.to_thread(
+            client.query,
+            query,
+            project=project_id or settings.GOOGLE_CLOUD_PROJECT_ID,
+            job_config=bigquery.QueryJobConfig(dry_run=True),
+        )
+        if dry_run_job.statement_type != "SELECT":
+            return {
+                "status": "ERROR",
+                "error_details": "Read-only mode only supports SELECT statements.",
+            }
+
+        rows = await run_query_async(query, project_id=project_id, max_results=max_rows)
+        result = {"status": "SUCCESS", "rows": rows}
+        if max_rows and len(rows) == max_rows:
+            result["result_is_likely_truncated"] = True
+        return result
+    except Exception as e:
+        logger.error(f"BigQuery query failed. Error: {e}", exc_info=True)
+        return {"status": "ERROR", "error_details": str(e)}
+
+
+async def generate_sql_for_analysis(question: str, tool_context: ToolContext) -> Dict[str, Any]:
+    """
+    Generates a Google Standard SQL query from a natural language question.
+
+    This tool takes a user's question about ad performance and uses a powerful LLM
+    to construct an optimized BigQuery SQL query based on the available schema.
+
+    Args:
+    question: The user's natural language question.
+    tool_context: The context containing shared data like database schemas.
+
+    Returns:
+        Dict[str, Any]: A dictionary representing the outcome.
+        - On success: `{"status": "success", "sql_query": "SELECT ..."}`. If the
+          question was answered before on the same data, the response also holds
+          `cached_rows` (the query result) or `cached_answer`. A query answered
+          from a smaller pre-aggregated table holds `routing` with the bytes saved.
+        - On failure: `{"status": "error", "error_message": "Details of the error."}`
+    """
+    session_id = metered_session_id(tool_context)
+    # The cache key needs the data version, which may be read from BigQuery metadata.
+    cached = await asyncio.to_thread(lookup_cached_analysis, question, tool_context.state, session_id)
+    if cached is not None:
+        return cached
+    speculative = await speculation_manager.claim_generated_sql(tool_context.state, question)
+    if speculative is not None:
+        return speculative
+    return await generate_sql(question, tool_context.state, session_id)
+
+
+async def execute_sql(project_id: str, query: str, tool_context: ToolContext) -> Dict[str, Any]:
+    """
+    Runs a read-only BigQuery GoogleSQL query and returns the result rows.
+
+    Args:
+    project_id: The Google Cloud project ID in which the query job runs.
+    query: The SQL SELECT query to execute.
+    tool_context: The context of the current session.
+
+    Returns:
+        Dict[str, Any]: A dictionary representing the outcome.
+        - On success: `{"status": "SUCCESS", "rows": [{...}, ...]}`, with
+          `"result_is_likely_truncated": True` when the row limit was reached.
+        - On failure: `{"status": "ERROR", "error_details": "Details of the error."}`
+    """
+    speculative = await speculation_manager.claim_query_result(tool_context.state, query)
+    if speculative is not None:
+        return speculative
+    return await run_read_only_query(project_id, query)
+
+
+async def compute_lift_significance(
+    tags: List[str],
+    tool_context: ToolContext,
+    metric: str = DEFAULT_METRIC
+) -> Dict[str, Any]:
+    """
+    Computes the lift of each creative tag together with a bootstrap confidence
+    interval and a Welch t-test against ads without the tag.
+
+    Args:
+    tags: The boolean tag columns to analyze, e.g. ["animal", "human"].
+    tool_context: The context containing shared data like database schemas.
+    metric: The per-ad average metric to test, e.g. "video_views" or "spend".
+
+    Returns:
+        Dict[str, Any]: A dictionary representing the outcome.
+        - On success: `{"status": "success", "metric": "video_views", "confidence": 0.95, "results": [...]}`
+        - On failure: `{"status": "error", "error_message": "Details of the error."}`
+    """
+    try:
+        query = build_significance_query(tags, tool_context.state, metric)
+    except (KeyError, TypeError) as e:
+        error_msg = f"Could not find required schema info to compute significance. Error: {e}"
+        logger.error(error_msg)
+        return {"status": "error", "error_message": error_msg}
+    except ValueError as e:
+        return {"status": "error", "error_message": str(e)}
+
+    try:
+        rows = await run_query_async(query)
+        # The bootstrap is CPU-bound; keep it off the event loop.
+        return await asyncio.to_thread(significance_response, rows, tags, metric)
+    except GoogleAPICallError as e:
+        error_msg = f"BigQuery failed to aggregate data for significance testing. Error: {e}"
+        logger.error(error_msg, exc_info=True)
+        return {"status": "error", "error_message": error_msg}
+
+
+async def compute_lift_matrix(
+    tool_context: ToolContext,
+    tags: Optional[List[str]] = None,
+    metrics: Optional[List[str]] = None,
+    approximate: bool = False
+) -> Dict[str, Any]:
+    """
+    Computes the lift of every creative tag on every performance metric in a
+    single table scan.
+
+    Lift is the metric over ads with the tag relative to the metric over all
+    ads, in percent. Use it for questions about several metrics (e.g. views,
+    CTR and spend) or about which tags work best across metrics.
+
+    Args:
+    tool_context: The context containing shared data like database schemas.
+    tags: The boolean tag columns to analyze, e.g. ["animal", "human"]. All tags when omitted.
+    metrics: The metrics to analyze, e.g. ["video_views", "ctr"]. All available metrics when omitted.
+    approximate: Estimate from a sample of the table for exploratory questions
+        that do not need exact numbers, e.g. "what's working overall?".
+
+    Returns:
+        Dict[str, Any]: A dictionary representing the outcome.
+        - On success: `{"status": "success", "metrics": [...], "overall": {"ctr": 0.021, ...}, "results": [...]}`
+          where each result holds `tag`, `segment_size` and `percentage_lift`,
+          a mapping of metric name to lift. Sampled results have `"approximate": True`,
+          `sample_percent`, and `ci_lower` and `ci_upper` mappings per result.
+          Exact results read from a pre-aggregated table hold `routing` with the bytes saved.
+        - On failure: `{"status": "error", "error_message": "Details of the error."}`
+    """
+    try:
+        query, tags, metrics = build_lift_matrix_query(tags, metrics, tool_context.state)
+    except (KeyError, TypeError) as e:
+        error_msg = f"Could not find required schema info to compute the lift matrix. Error: {e}"
+        logger.error(error_msg)
+        return {"status": "error", "error_message": error_msg}
+    except ValueError as e:
+        return {"status": "error", "error_message": str(e)}
+
+    try:
+        if approximate and settings.APPROXIMATE_MODE:
+            _, full_table_id = table_context(tool_context.state)
+            result = await asyncio.to_thread(
+                approximate_planner.lift_matrix, get_bigquery_client(), full_table_id, tags, metrics
+            )
+            return {"status": "success", **result}
+        routed = await asyncio.to_thread(route_to_rollup, {"status": "success", "sql_query": query}, tool_context.state)
+        rows = await run_query_async(routed["sql_query"])
+        response = lift_matrix_response(rows, tags, metrics)
+        return {**response, "routing": routed["routing"]} if "routing" in routed else response
+    except GoogleAPICallError as e:
+        error_msg = f"BigQuery failed to aggregate data for the lift matrix. Error: {e}"
+        logger.error(error_msg, exc_info=True)
+        return {"status": "error", "error_message": error_msg}
+
+
+async def start_speculative_analysis(question: str, tool_context: ToolContext) -> Dict[str, Any]:
+    """
+    Starts preparing the answer to a planned historical analysis in the background
+    while the user reviews the plan.
+
+    Call this right before presenting a historical analysis plan to the user.
+    Nothing is shown to the user and the plan still requires confirmation; if the
+    user confirms, the analysis completes immediately, otherwise it is discarded.
+
+    Args:
+    question: The exact analytical question the plan will delegate for analysis.
+    tool_context: The context of the current session.
+
+    Returns:
+        Dict[str, Any]: `{"status": "success", "speculation_id": "..."}`
+    """
+    # The background work only needs the schema version, not the live session state.
+    state_snapshot = {
+        SCHEMA_VERSION_STATE_KEY: tool_context.state.get(SCHEMA_VERSION_STATE_KEY),
+        BRAND_STATE_KEY: tool_context.state.get(BRAND_STATE_KEY),
+    }
+    session_id = metered_session_id(tool_context)
+    speculation = speculation_manager.start(
+        tool_context.state,
+        question,
+        tool_context.invocation_id,
+        generate=lambda: generate_sql(question, state_snapshot, session_id),
+        # Recorded in the cassette, since the background query also runs when execute_sql is replayed.
+        execute=lambda query: cassette.exchange_async(
+            "bigquery", {"speculative_query": query},
+            lambda: run_read_only_query(settings.GOOGLE_CLOUD_PROJECT_ID, query),
+            label="speculation",
+        ),
+    )
+    return {"status": "success", SPECULATION_STATE_KEY: speculation.speculation_id}
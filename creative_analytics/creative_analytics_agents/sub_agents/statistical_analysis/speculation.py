@@ -0,0 +1,221 @@
+"""
+Speculative pre-execution of statistical analyses.
+
+While the orchestrator waits for the user to confirm a plan, the SQL for that
+plan can already be generated and executed in the background. The outcome is
+held against the session; when the analyst later asks for the same SQL and
+query result, they are served from the speculation instead of being recomputed.
+Speculations that are not claimed by the turn after they were started are
+cancelled and counted as wasted work.
+
+Speculation only pays off when the confirming turn is handled by the same
+worker process, since results live in process memory.
+"""
+import asyncio
+import logging
+import re
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, MutableMapping, Optional
+
+from ...utils.settings import settings
+
+logger = logging.getLogger(__name__)
+
+SPECULATION_STATE_KEY = "speculation_id"
+
+# Minimum token overlap between the planned and the delegated question.
+QUESTION_SIMILARITY_THRESHOLD = 0.5
+
+
+def _tokens(text: str) -> set:
+    """Lower-cased word tokens of a question."""
+    return set(re.findall(r"[a-z0-9_]+", text.lower()))
+
+
+def _question_similarity(left: str, right: str) -> float:
+    """Jaccard similarity of the word sets of two questions."""
+    left_tokens, right_tokens = _tokens(left), _tokens(right)
+    if not left_tokens or not right_tokens:
+        return 0.0
+    return len(left_tokens & right_tokens) / len(left_tokens | right_tokens)
+
+
+def _normalize_sql(query: str) -> str:
+    """Collapses whitespace and a trailing semicolon so equivalent SQL compares equal."""
+    return " ".join(query.split()).rstrip(";").strip()
+
+
+class Speculation:
+    """Background generate-and-execute work for one planned question."""
+
+    def __init__(self, question: str, invocation_id: str):
+        self.speculation_id = uuid.uuid4().hex
+        self.question = question
+        self.invocation_id = invocation_id
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.claimed_at: Optional[float] = None
+        self.generated: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task: Optional[asyncio.Task] = None
+
+    def elapsed_work(self) -> float:
+        """Seconds of background work performed so far."""
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+
+class SpeculationManager:
+    """Process-wide store of speculations, keyed by an id kept in session state."""
+
+    def __init__(self):
+        self._speculations: Dict[str, Speculation] = {}
+        self.stats = {
+            "started": 0,
+            "sql_hits": 0,
+            "result_hits": 0,
+            "misses": 0,
+            "cancelled": 0,
+            "saved_seconds": 0.0,
+            "wasted_seconds": 0.0,
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns the counters together with the derived hit rate."""
+        started = self.stats["started"]
+        return {
+            **self.stats,
+            "in_flight": len(self._speculations),
+            "hit_rate": self.stats["result_hits"] / started if started else 0.0,
+        }
+
+    async def _run(
+        self,
+        speculation: Speculation,
+        generate: Callable[[], Awaitable[Dict[str, Any]]],
+        execute: Callable[[str], Awaitable[Dict[str, Any]]],
+    ) -> Optional[Dict[str, Any]]:
+        """Generates SQL, publishes it, then executes it."""
+        try:
+            try:
+                generated = await generate()
+            except asyncio.CancelledError:
+                speculation.generated.cancel()
+                raise
+            except Exception as e:
+                speculation.generated.set_exception(e)
+                raise
+            speculation.generated.set_result(generated)
+
+            if generated.get("status") != "success":
+                return None
+            return await execute(generated["sql_query"])
+        finally:
+            speculation.finished_at = time.monotonic()
+
+    def start(
+        self,
+        state: MutableMapping[str, Any],
+        question: str,
+        invocation_id: str,
+        generate: Callable[[], Awaitable[Dict[str, Any]]],
+        execute: Callable[[str], Awaitable[Dict[str, Any]]],
+    ) -> Speculation:
+        """Starts background work for `question` and records it in the session state."""
+        self._expire()
+        previous = self._speculations.pop(state.get(SPECULATION_STATE_KEY) or "", None)
+        if previous is not None:
+            self._discard(previous, reason="replaced by a new plan")
+
+        speculation = Speculation(question, invocation_id)
+        speculation.task = asyncio.create_task(self._run(speculation, generate, execute))
+        # Retrieve exceptions so cancelled or failed work is never logged as unhandled.
+        speculation.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        self._speculations[speculation.speculation_id] = speculation
+        state[SPECULATION_STATE_KEY] = speculation.speculation_id
+        self.stats["started"] += 1
+        return speculation
+
+    async def claim_generated_sql(self, state: MutableMapping[str, Any], question: str) -> Optional[Dict[str, Any]]:
+        """Returns the speculatively generated SQL if it was planned for `question`."""
+        speculation = self._speculations.get(state.get(SPECULATION_STATE_KEY) or "")
+        if speculation is None or speculation.claimed_at is not None:
+            return None
+
+        if _question_similarity(speculation.question, question) < QUESTION_SIMILARITY_THRESHOLD:
+            self.stats["misses"] += 1
+            self._forget(state, speculation, reason="question changed after the plan")
+            return None
+
+        speculation.claimed_at = time.monotonic()
+        try:
+            generated = await speculation.generated
+        except (asyncio.CancelledError, Exception):
+            self._forget(state, speculation, reason="speculative SQL generation failed")
+            return None
+
+        self.stats["sql_hits"] += 1
+        return generated
+
+    async def claim_query_result(self, state: MutableMapping[str, Any], query: str) -> Optional[Dict[str, Any]]:
+        """Returns the speculative query result if `query` is the SQL that was speculated."""
+        speculation = self._speculations.get(state.get(SPECULATION_STATE_KEY) or "")
+        if speculation is None or speculation.claimed_at is None or not speculation.generated.done():
+            return None
+        if speculation.generated.cancelled() or speculation.generated.exception() is not None:
+            return None
+
+        generated = speculation.generated.result()
+        if _normalize_sql(generated.get("sql_query", "")) != _normalize_sql(query):
+            self.stats["misses"] += 1
+            self._forget(state, speculation, reason="executed SQL differs from the speculation")
+            return None
+
+        try:
+            result = await speculation.task
+        except (asyncio.CancelledError, Exception):
+            result = None
+        self._speculations.pop(speculation.speculation_id, None)
+        state[SPECULATION_STATE_KEY] = None
+        if result is None:
+            return None
+
+        # Work that completed before the user confirmed is latency saved.
+        finished = min(speculation.finished_at or speculation.claimed_at, speculation.claimed_at)
+        self.stats["result_hits"] += 1
+        self.stats["saved_seconds"] += max(finished - speculation.started_at, 0.0)
+        logger.info(f"Speculative analysis served: {self.snapshot()}")
+        return result
+
+    def discard_stale(self, state: MutableMapping[str, Any], invocation_id: str) -> None:
+        """Cancels a speculation from an earlier turn that this turn did not claim."""
+        speculation = self._speculations.get(state.get(SPECULATION_STATE_KEY) or "")
+        if speculation is None or speculation.invocation_id == invocation_id:
+            return
+        self._forget(state, speculation, reason="plan was not confirmed")
+
+    def _forget(self, state: MutableMapping[str, Any], speculation: Speculation, reason: str) -> None:
+        """Removes a speculation from the session and the store, discarding its work."""
+        self._speculations.pop(speculation.speculation_id, None)
+        state[SPECULATION_STATE_KEY] = None
+        self._discard(speculation, reason)
+
+    def _discard(self, speculation: Speculation, reason: str) -> None:
+        """Cancels the background work and accounts for it as waste."""
+        if speculation.task is not None and not speculation.task.done():
+            speculation.task.cancel()
+        if not speculation.generated.done():
+            speculation.generated.cancel()
+        self.stats["cancelled"] += 1
+        self.stats["wasted_seconds"] += speculation.elapsed_work()
+        logger.info(f"Discarded speculative analysis ({reason}): {self.snapshot()}")
+
+    def _expire(self) -> None:
+        """Drops speculations older than the configured time-to-live."""
+        deadline = time.monotonic() - settings.SPECULATION_TTL_SECONDS
+        for speculation in [s for s in self._speculations.values() if s.started_at < deadline]:
+            self._speculations.pop(speculation.speculation_id, None)
+            self._discard(speculation, reason="expired")
+
+
+# Process-wide manager shared by the orchestrator and the async analysis tools
+speculation_manager = SpeculationManager()
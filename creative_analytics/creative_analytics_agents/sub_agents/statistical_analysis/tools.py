@@ -1,14 +1,36 @@
 import logging
-from typing import Dict, Any
+import time
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Mapping, MutableMapping, Optional, Tuple
 
 from google import genai
 from google.adk.tools import ToolContext
-from google.adk.tools.bigquery import BigQueryToolset
+from google.adk.tools.base_toolset import BaseToolset
+from google.api_core.exceptions import GoogleAPICallError
+from google.genai import types
 
+from ...utils import stats_engine
+from ...utils.aggregate_router import Rollup, aggregate_router, rollup_is_current
+from ...utils.answer_cache import answer_cache, answer_cache_key, get_table_modified
+from ...utils.approximate import approximate_planner
+from ...utils.cassette import cassette
+from ...utils.database_context import get_bigquery_client, get_database_settings
+from ...utils.example_index import example_index
+from ...utils.execution_mode import store_structured_result
+from ...utils.metering import brand_of, meter, metered_session_id
+from ...utils.quantile_sketch import get_sketch_store
 from ...utils.settings import settings
+from ...utils.sql_guard import sql_guard
+from ...utils.tag_registry import tag_registry
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_METRIC = "video_views"
+
+# Session state keys used by the answer cache
+ANSWER_CACHE_KEY_STATE = "answer_cache_key"
+CACHED_ANSWER_STATE = "cached_answer"
+
 
 TOOL_PROMPT = """
     You are an expert-level BigQuery data analyst. Your sole purpose is to write a single, highly-optimized, and syntactically correct Google Standard SQL query to answer the user's analytical question. You must use the provided schema.
@@ -17,8 +39,11 @@ TOOL_PROMPT = """
 
     -   **Table Referencing:** You have access to one table: {FULL_TABLE_ID}. ALWAYS use this full, backticked name in your queries.
     -   **Column Usage:** Use ONLY the column names mentioned in the provided Table Schema below. Do not invent or assume any other columns exist.
-    -   **Aggregations:** To calculate "lift" or "boost," you MUST compare the `AVG(video_views)` of a specific segment against the overall `AVG(video_views)` for the entire table. Use Common Table Expressions (CTEs) to make this efficient.
-    -   **Efficiency:** Write a single query to answer the entire question. If asked to compare multiple tags, use techniques like `UNION ALL` or conditional aggregation in a `GROUP BY` to get all results in one database call.
+    -   **Metrics:** Measure performance with the metrics below, computed exactly as shown. Use `video_views` when the question does not name a metric.
+{METRICS}
+{TAGS}
+    -   **Aggregations:** To calculate "lift" or "boost," you MUST compare a metric over a specific segment against the same metric over the entire table, e.g. `AVG(video_views)` of ads with the tag against the overall `AVG(video_views)`. Use Common Table Expressions (CTEs) to make this efficient.
+    -   **Efficiency:** Write a single query that scans the table once. To compare multiple tags or metrics, compute every segment value with conditional aggregation (`AVG(IF(tag, video_views, NULL))`, `SAFE_DIVIDE(SUM(IF(tag, clicks, 0)), SUM(IF(tag, impressions, 0)))`) in one pass instead of one `UNION ALL` branch or one query per tag or metric.
     -   **Output Format:** Your final output MUST be a raw SQL string only. Do not include any explanations, comments, or markdown formatting like ```sql.
 
     ---
@@ -30,17 +55,35 @@ TOOL_PROMPT = """
     ---
     **Example Tasks:**
 
+    {EXAMPLES}
+    ---
+
+    **User's Natural Language Question:**
+    {QUESTION}
+    {REJECTION}
+
+    **Your Generated SQL Query:**
+    """
+
+
+# Used until verified examples can be retrieved for a question; filled for the table's tags by `build_default_examples`
+DEFAULT_EXAMPLES = """
     **1. Comparative Analysis Question:**
-    "Compare the performance lift from ads with 'animals' vs. ads with 'humans'."
+    "Compare the performance lift from ads with '{FIRST_TAG}s' vs. ads with '{SECOND_TAG}s'."
 
     **Correct SQL Query:**
     ```sql
-    WITH OverallAvg AS (SELECT AVG(video_views) as avg_all FROM {FULL_TABLE_ID})
-    SELECT 'animal' as tag, (AVG(t.video_views) - o.avg_all) / o.avg_all * 100 as percentage_lift
-    FROM {FULL_TABLE_ID} t, OverallAvg o WHERE t.animal = TRUE GROUP BY o.avg_all
-    UNION ALL
-    SELECT 'human' as tag, (AVG(t.video_views) - o.avg_all) / o.avg_all * 100 as percentage_lift
-    FROM {FULL_TABLE_ID} t, OverallAvg o WHERE t.human = TRUE GROUP BY o.avg_all
+    WITH TagAverages AS (
+      SELECT
+        AVG(video_views) AS avg_all,
+{PAIR_AVERAGES}
+      FROM {FULL_TABLE_ID}
+    )
+    SELECT s.tag, (s.avg_tag - a.avg_all) / a.avg_all * 100 AS percentage_lift
+    FROM TagAverages AS a
+    CROSS JOIN UNNEST([
+{PAIR_STRUCTS}
+    ]) AS s
     ```
 
     **2. Comprehensive Analysis Question:**
@@ -48,26 +91,341 @@ TOOL_PROMPT = """
 
     **Correct SQL Query:**
     ```sql
-    WITH OverallAvg AS (SELECT AVG(video_views) as avg_all FROM {FULL_TABLE_ID})
-    SELECT tag_name, (AVG(t.video_views) - o.avg_all) / o.avg_all * 100 as percentage_lift
-    FROM {FULL_TABLE_ID} t, OverallAvg o
-    CROSS JOIN UNNEST(['animal', 'human', 'logo', 'product', 'cta']) as tag_name
-    WHERE
-      (tag_name = 'animal' AND t.animal = TRUE) OR
-      (tag_name = 'human' AND t.human = TRUE) OR
-      (tag_name = 'logo' AND t.logo = TRUE) OR
-      (tag_name = 'product' AND t.product = TRUE) OR
-      (tag_name = 'cta' AND t.cta = TRUE)
-    GROUP BY tag_name, o.avg_all
+    WITH TagAverages AS (
+      SELECT
+        AVG(video_views) AS avg_all,
+{ALL_AVERAGES}
+      FROM {FULL_TABLE_ID}
+    )
+    SELECT s.tag_name, (s.avg_tag - a.avg_all) / a.avg_all * 100 AS percentage_lift
+    FROM TagAverages AS a
+    CROSS JOIN UNNEST([
+{ALL_STRUCTS}
+    ]) AS s
     ORDER BY percentage_lift DESC
     ```
-    ---
+    """
 
-    **User's Natural Language Question:**
-    {QUESTION}
+RETRIEVED_EXAMPLE = """
+    **{NUMBER}. Question:**
+    "{QUESTION}"
 
-    **Your Generated SQL Query:**
+    **Correct SQL Query:**
+    ```sql
+    {SQL}
+    ```
+    """
+
+REJECTION_PROMPT = """
+    **Your previous query was rejected before execution. Fix this problem:**
+    {ERROR}
+
+    **Previous query:**
+    {SQL}
+    """
+
+
+# Tags shown in the comprehensive default example
+DEFAULT_EXAMPLE_TAGS = 5
+
+
+def build_default_examples(full_table_id: str, tags: List[str]) -> str:
+    """The default examples, written for the first tags of the table."""
+    if len(tags) < 2:
+        return ""
+
+    def averages(names: List[str]) -> str:
+        return ",\n".join(
+            f"        AVG(IF({tag_registry.predicate(tag)}, video_views, NULL)) AS avg_{tag}" for tag in names
+        )
+
+    def structs(names: List[str], alias: str) -> str:
+        return ",\n".join(f"      STRUCT('{tag}' AS {alias}, a.avg_{tag} AS avg_tag)" for tag in names)
+
+    pair, shown = tags[:2], tags[:DEFAULT_EXAMPLE_TAGS]
+    return DEFAULT_EXAMPLES.format(
+        FULL_TABLE_ID=full_table_id,
+        FIRST_TAG=pair[0],
+        SECOND_TAG=pair[1],
+        PAIR_AVERAGES=averages(pair),
+        PAIR_STRUCTS=structs(pair, "tag"),
+        ALL_AVERAGES=averages(shown),
+        ALL_STRUCTS=structs(shown, "tag_name"),
+    ).strip()
+
+
+def build_examples_prompt(question: str, full_table_id: str, tags: List[str]) -> str:
+    """Most similar verified examples for `question`, or the default examples if there are none."""
+    examples = []
+    if settings.FEW_SHOT_RETRIEVAL:
+        examples = example_index.search(
+            question, k=settings.FEW_SHOT_TOP_K, min_similarity=settings.FEW_SHOT_MIN_SIMILARITY
+        )
+    if not examples:
+        return build_default_examples(full_table_id, tags)
+    return "\n".join(
+        RETRIEVED_EXAMPLE.format(NUMBER=i, QUESTION=example["question"], SQL=example["sql_query"])
+        for i, example in enumerate(examples, start=1)
+    ).strip()
+
+
+def build_metrics_prompt(schema_list: Iterable[Any]) -> str:
+    """Lists the metrics the table supports with their GoogleSQL definitions."""
+    metrics = stats_engine.available_metrics(name for name, _ in schema_list)
+    return "\n".join(
+        f"        -   `{metric.name}` ({metric.description}): `{metric.sql}`"
+        for metric in metrics
+    )
+
+
+def build_sql_generation_prompt(
+    question: str,
+    state: Mapping[str, Any],
+    rejection: Optional[Dict[str, str]] = None
+) -> str:
+    """
+    Fills `TOOL_PROMPT` for the configured table; raises KeyError if the schema is missing.
+
+    `rejection` holds the `sql_query` and `error_message` of a previous attempt
+    that failed validation, so the model can correct it.
+    """
+    database_settings = get_database_settings(state)
+    project_id = settings.GOOGLE_CLOUD_PROJECT_ID
+    dataset_name = settings.BQ_DATASET_NAME
+    table_name = settings.BQ_TABLE_NAME
+
+    table_info = database_settings[dataset_name]["tables"][table_name]
+    full_table_id = f"`{project_id}.{dataset_name}.{table_name}`"
+    tags = tag_registry.schema_tags(table_info["schema_list"])
+
+    return TOOL_PROMPT.format(
+        FULL_TABLE_ID=full_table_id,
+        METRICS=build_metrics_prompt(table_info["schema_list"]),
+        TAGS=tag_registry.sql_guidelines(question, tags),
+        SCHEMA=table_info["schema_prompt"],
+        EXAMPLES=build_examples_prompt(question, full_table_id, tags),
+        QUESTION=question,
+        REJECTION=REJECTION_PROMPT.format(ERROR=rejection["error_message"], SQL=rejection["sql_query"]) if rejection else "",
+    )
+
+
+def clean_generated_sql(text: str) -> str:
+    """Strips markdown fences from the raw model output."""
+    return text.strip().replace("```sql", "").replace("```", "")
+
+
+def record_sql_generation_usage(
+    response: Any,
+    state: Mapping[str, Any],
+    session_id: Optional[str],
+    latency_seconds: float
+) -> None:
+    """Meters the raw SQL generation call, which does not pass through agent callbacks."""
+    meter.record(
+        agent="generate_sql_for_analysis",
+        session_id=session_id or "",
+        brand=brand_of(state),
+        model=settings.STATS_AGENT_MODEL,
+        usage_metadata=response.usage_metadata,
+        latency_seconds=latency_seconds,
+    )
+    example_index.record_generation(getattr(response.usage_metadata, "prompt_token_count", None))
+
+
+def prepare_generated_sql(text: str, state: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Cleans raw model output, validates it against the cached schema and applies
+    the single-scan rewrite of per-tag lift queries.
+
+    Returns a tool response: `{"status": "success", "sql_query": ...}` (with
+    `"optimization"` when rewritten) or `{"status": "error", "sql_query": ...,
+    "error_message": ...}` when the query was rejected.
+    """
+    sql_query = clean_generated_sql(text)
+    try:
+        prepared = sql_guard.prepare(sql_query, get_database_settings(state), settings.GOOGLE_CLOUD_PROJECT_ID)
+    except ValueError as e:
+        return {"status": "error", "sql_query": sql_query, "error_message": f"Generated SQL was rejected: {e}"}
+    return {"status": "success", **prepared}
+
+
+def route_to_rollup(result: Dict[str, Any], state: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Moves the query of a successful tool response to the smallest current
+    rollup table that answers it exactly, adding `"routing"` with the tables
+    used and the bytes scanned and saved. Other responses are returned
+    unchanged, and so are queries whose rollups lag their raw table.
     """
+    if result.get("status") != "success" or "sql_query" not in result or not settings.AGGREGATE_ROUTING:
+        return result
+    project_id = settings.GOOGLE_CLOUD_PROJECT_ID
+
+    def is_current(rollup: Rollup) -> bool:
+        return cassette.exchange(
+            "bigquery", {"rollup_current": rollup.table_id},
+            lambda: rollup_is_current(get_bigquery_client(), rollup),
+            label="rollup freshness",
+        )
+
+    route = aggregate_router.route(result["sql_query"], get_database_settings(state), project_id, is_current)
+    if route is None:
+        return result
+    routing = cassette.exchange(
+        "bigquery", {"dry_run": route.original_sql},
+        lambda: aggregate_router.measure(get_bigquery_client(), route, project_id),
+        label="routing dry run",
+    )
+    return {**result, "sql_query": route.sql, "routing": routing}
+
+
+def table_context(state: Mapping[str, Any]) -> Tuple[List[Any], str]:
+    """The schema list and full table id of the performance table; raises KeyError if the schema is missing."""
+    database_settings = get_database_settings(state)
+    project_id = settings.GOOGLE_CLOUD_PROJECT_ID
+    dataset_name = settings.BQ_DATASET_NAME
+    table_name = settings.BQ_TABLE_NAME
+
+    schema_list = database_settings[dataset_name]["tables"][table_name]["schema_list"]
+    return schema_list, f"`{project_id}.{dataset_name}.{table_name}`"
+
+
+def _resolve_tags(tags: Optional[List[str]], schema_list: List[Any]) -> List[str]:
+    """Validates `tags` against the tags the table stores; all of them when `tags` is empty."""
+    # Only known tags are interpolated into the query, as columns or registry predicates.
+    available_tags = tag_registry.schema_tags(schema_list)
+    if not tags:
+        return available_tags
+    unknown_tags = [tag for tag in tags if tag not in available_tags]
+    if unknown_tags:
+        raise ValueError(
+            f"Unknown creative tags: {unknown_tags}. "
+            f"Available tags: {sorted(available_tags)}"
+        )
+    return list(tags)
+
+
+def _resolve_metrics(metrics: Optional[List[str]], schema_list: List[Any]) -> List[stats_engine.Metric]:
+    """Validates `metrics` against the metrics the table supports; all of them when `metrics` is empty."""
+    available = {metric.name: metric for metric in stats_engine.available_metrics(name for name, _ in schema_list)}
+    if not metrics:
+        return list(available.values())
+    unknown_metrics = [name for name in metrics if name not in available]
+    if unknown_metrics:
+        raise ValueError(
+            f"Unknown metrics: {unknown_metrics}. "
+            f"Available metrics: {sorted(available)}"
+        )
+    return [available[name] for name in metrics]
+
+
+def build_significance_query(tags: List[str], state: Mapping[str, Any], metric: str = DEFAULT_METRIC) -> str:
+    """
+    Builds the bucket statistics query for `tags` on a per-ad average `metric`.
+
+    Raises KeyError if the schema is missing and ValueError if a tag is not a
+    boolean column of the table or the metric is not a per-ad average.
+    """
+    schema_list, full_table_id = table_context(state)
+    if not tags:
+        raise ValueError("At least one creative tag is required.")
+    tags = _resolve_tags(tags, schema_list)
+    (resolved_metric,) = _resolve_metrics([metric], schema_list)
+    if resolved_metric.denominator is not None:
+        raise ValueError(
+            f"Significance tests support per-ad averages only, not the rate '{metric}'. "
+            "Use compute_lift_matrix for its lift."
+        )
+
+    return stats_engine.build_bucket_statistics_sql(
+        full_table_id, tags, metric=resolved_metric.numerator, tag_sql=tag_registry.predicates(tags)
+    )
+
+
+def significance_response(
+    rows: Iterable[Mapping[str, Any]],
+    tags: List[str],
+    metric: str = DEFAULT_METRIC
+) -> Dict[str, Any]:
+    """Runs the bootstrap and Welch tests on bucket rows and wraps them in a tool response."""
+    bucket_stats = stats_engine.buckets_from_rows(rows, tags)
+    results = stats_engine.lift_significance_from_buckets(bucket_stats, tags)
+    return {
+        "status": "success",
+        "metric": metric,
+        "confidence": stats_engine.DEFAULT_CONFIDENCE,
+        "results": results,
+    }
+
+
+def build_lift_matrix_query(
+    tags: Optional[List[str]],
+    metrics: Optional[List[str]],
+    state: Mapping[str, Any]
+) -> Tuple[str, List[str], List[stats_engine.Metric]]:
+    """
+    Builds the single-scan lift matrix query and returns it with the resolved
+    tags and metrics.
+
+    Raises KeyError if the schema is missing and ValueError for unknown tags or metrics.
+    """
+    schema_list, full_table_id = table_context(state)
+    resolved_tags = _resolve_tags(tags, schema_list)
+    resolved_metrics = _resolve_metrics(metrics, schema_list)
+    if not resolved_tags or not resolved_metrics:
+        raise ValueError("The table has no creative tags or no supported metrics.")
+    query = stats_engine.build_lift_matrix_sql(
+        full_table_id, resolved_tags, resolved_metrics, tag_sql=tag_registry.predicates(resolved_tags)
+    )
+    return query, resolved_tags, resolved_metrics
+
+
+def lift_matrix_response(
+    rows: Iterable[Mapping[str, Any]],
+    tags: List[str],
+    metrics: List[stats_engine.Metric]
+) -> Dict[str, Any]:
+    """Computes the lift matrix from the query result and wraps it in a tool response."""
+    (row,) = list(rows)
+    return {"status": "success", **stats_engine.lift_matrix_from_row(row, tags, metrics)}
+
+
+def lookup_cached_analysis(
+    question: str,
+    state: MutableMapping[str, Any],
+    session_id: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Serves `question` from the answer cache when possible.
+
+    Records the cache key in `state` so the result rows and the final answer
+    can be stored later. On a full hit the synthesized answer is staged in
+    `state` for the analyst to return without another model call; on a partial
+    hit the cached rows are returned for re-synthesis. Once the session or its
+    brand is over its token budget, entries of any age are served. The cache
+    key may block on a BigQuery metadata read (see `get_data_version`), so
+    async callers run this in a thread.
+    """
+    if not settings.ANSWER_CACHE_ENABLED:
+        return None
+
+    key = answer_cache_key(question, state)
+    state[ANSWER_CACHE_KEY_STATE] = key
+    entry = answer_cache.get(key)
+    if entry is None and meter.budget_exceeded(session_id, state):
+        entry = answer_cache.get(key, max_staleness_seconds=float("inf"))
+        if entry is not None:
+            meter.record_degradation("stale_cache_answers")
+    if entry is None or "sql_query" not in entry:
+        return None
+
+    if entry.get("answer"):
+        state[CACHED_ANSWER_STATE] = entry["answer"]
+        # The staged answer skips the tools, so the rows it was based on are the structured result.
+        store_structured_result(state, "rows", sql_query=entry["sql_query"], rows=entry.get("rows"))
+        return {"status": "success", "sql_query": entry["sql_query"], "cached_answer": True}
+    if "rows" in entry:
+        return {"status": "success", "sql_query": entry["sql_query"], "cached_rows": entry["rows"]}
+    return None
 
 
 def generate_sql_for_analysis(question: str, tool_context: ToolContext) -> Dict[str, Any]:
@@ -83,45 +441,208 @@ def generate_sql_for_analysis(question: str, tool_context: ToolContext) -> Dict[
 
     Returns:
         Dict[str, Any]: A dictionary representing the outcome.
-        - On success: `{"status": "success", "sql_query": "SELECT ..."}`
-        - On failure: `{"status": "error", "error_message": "Details of the error."}`
+        - On success: `{"status": "success", "sql_query": "SELECT ..."}`. If the
+          question was answered before on the same data, the response also holds
+          `cached_rows` (the query result) or `cached_answer`. A query answered
+          from a smaller pre-aggregated table holds `routing` with the bytes saved.
+        - On failure: `{"status": "error", "error_message": "Details of the error."}`,
+          with the rejected `sql_query` when it failed validation against the schema.
     """
 
-    try:
-        database_settings = tool_context.state["database_settings"]
-        project_id = settings.GOOGLE_CLOUD_PROJECT_ID
-        dataset_name = settings.BQ_DATASET_NAME
-        table_name = settings.BQ_TABLE_NAME
+    session_id = metered_session_id(tool_context)
+    cached = lookup_cached_analysis(question, tool_context.state, session_id)
+    if cached is not None:
+        return cached
+
+    result = None
+    for _ in range(max(1, settings.SQL_GENERATION_ATTEMPTS)):
+        try:
+            prompt = build_sql_generation_prompt(question, tool_context.state, rejection=result)
+        except (KeyError, TypeError) as e:
+            error_msg = f"Could not find required schema info to generate SQL. Error: {e}"
+            logger.error(error_msg)
+            return {"status": "error", "error_message": error_msg}
+
+        try:
+            start = time.perf_counter()
+            response = cassette.exchange(
+                "sql_generation", {"model": settings.STATS_AGENT_MODEL, "contents": prompt},
+                lambda: genai.Client(vertexai=True).models.generate_content(
+                    model=settings.STATS_AGENT_MODEL,
+                    contents=prompt,
+                ),
+                response_type=types.GenerateContentResponse,
+                label=settings.STATS_AGENT_MODEL,
+            )
+        except Exception as e:
+            error_msg = f"LLM failed to generate SQL. Error: {e}"
+            logger.error(error_msg, exc_info=True)
+            return {"status": "error", "error_message": error_msg}
+
+        record_sql_generation_usage(response, tool_context.state, session_id, time.perf_counter() - start)
+        result = prepare_generated_sql(response.text, tool_context.state)
+        if result["status"] == "success":
+            break
+    return route_to_rollup(result, tool_context.state)
+
+
+def compute_lift_significance(
+    tags: List[str],
+    tool_context: ToolContext,
+    metric: str = DEFAULT_METRIC
+) -> Dict[str, Any]:
+    """
+    Computes the lift of each creative tag together with a bootstrap confidence
+    interval and a Welch t-test against ads without the tag.
+
+    BigQuery reduces the table to a few hundred bucket-level sums in a single
+    scan; the bootstrap and the significance tests then run locally in one
+    vectorized pass over all tags.
 
-        schema_prompt = database_settings[dataset_name]["tables"][table_name]["schema_prompt"]
-        full_table_id = f"`{project_id}.{dataset_name}.{table_name}`"
+    Args:
+    tags: The boolean tag columns to analyze, e.g. ["animal", "human"].
+    tool_context: The context containing shared data like database schemas.
+    metric: The per-ad average metric to test, e.g. "video_views" or "spend".
+
+    Returns:
+        Dict[str, Any]: A dictionary representing the outcome.
+        - On success: `{"status": "success", "metric": "video_views", "confidence": 0.95, "results": [...]}`
+          where each result holds `tag`, `segment_size`, `percentage_lift`,
+          `ci_lower`, `ci_upper`, `t_statistic`, `degrees_of_freedom` and `p_value`.
+        - On failure: `{"status": "error", "error_message": "Details of the error."}`
+    """
+    try:
+        query = build_significance_query(tags, tool_context.state, metric)
     except (KeyError, TypeError) as e:
-        error_msg = f"Could not find required schema info to generate SQL. Error: {e}"
+        error_msg = f"Could not find required schema info to compute significance. Error: {e}"
         logger.error(error_msg)
         return {"status": "error", "error_message": error_msg}
+    except ValueError as e:
+        return {"status": "error", "error_message": str(e)}
 
-    prompt = TOOL_PROMPT.format(
-        FULL_TABLE_ID=full_table_id,
-        SCHEMA=schema_prompt,
-        QUESTION=question
-    )
+    try:
+        rows = get_bigquery_client().query(query).result()
+        return significance_response(rows, tags, metric)
+    except GoogleAPICallError as e:
+        error_msg = f"BigQuery failed to aggregate data for significance testing. Error: {e}"
+        logger.error(error_msg, exc_info=True)
+        return {"status": "error", "error_message": error_msg}
+
+
+def compute_lift_matrix(
+    tool_context: ToolContext,
+    tags: Optional[List[str]] = None,
+    metrics: Optional[List[str]] = None,
+    approximate: bool = False
+) -> Dict[str, Any]:
+    """
+    Computes the lift of every creative tag on every performance metric in a
+    single table scan.
+
+    Lift is the metric over ads with the tag relative to the metric over all
+    ads, in percent. Use it for questions about several metrics (e.g. views,
+    CTR and spend) or about which tags work best across metrics.
+
+    Args:
+    tool_context: The context containing shared data like database schemas.
+    tags: The boolean tag columns to analyze, e.g. ["animal", "human"]. All tags when omitted.
+    metrics: The metrics to analyze, e.g. ["video_views", "ctr"]. All available metrics when omitted.
+    approximate: Estimate from a sample of the table for exploratory questions
+        that do not need exact numbers, e.g. "what's working overall?".
 
+    Returns:
+        Dict[str, Any]: A dictionary representing the outcome.
+        - On success: `{"status": "success", "metrics": [...], "overall": {"ctr": 0.021, ...}, "results": [...]}`
+          where each result holds `tag`, `segment_size` and `percentage_lift`,
+          a mapping of metric name to lift. Sampled results have `"approximate": True`,
+          `sample_percent`, and `ci_lower` and `ci_upper` mappings per result.
+          Exact results read from a pre-aggregated table hold `routing` with the bytes saved.
+        - On failure: `{"status": "error", "error_message": "Details of the error."}`
+    """
     try:
-        client = genai.Client(vertexai=True)
-        response = client.models.generate_content(
-            model=settings.STATS_AGENT_MODEL,
-            contents=prompt,
-        )
+        query, tags, metrics = build_lift_matrix_query(tags, metrics, tool_context.state)
+    except (KeyError, TypeError) as e:
+        error_msg = f"Could not find required schema info to compute the lift matrix. Error: {e}"
+        logger.error(error_msg)
+        return {"status": "error", "error_message": error_msg}
+    except ValueError as e:
+        return {"status": "error", "error_message": str(e)}
 
-        sql_query = response.text.strip().replace("```sql", "").replace("```", "")
-        return {"status": "success", "sql_query": sql_query}
-    except Exception as e:
-        error_msg = f"LLM failed to generate SQL. Error: {e}"
+    try:
+        if approximate and settings.APPROXIMATE_MODE:
+            _, full_table_id = table_context(tool_context.state)
+            return {"status": "success", **approximate_planner.lift_matrix(get_bigquery_client(), full_table_id, tags, metrics)}
+        routed = route_to_rollup({"status": "success", "sql_query": query}, tool_context.state)
+        rows = get_bigquery_client().query(routed["sql_query"]).result()
+        response = lift_matrix_response(rows, tags, metrics)
+        return {**response, "routing": routed["routing"]} if "routing" in routed else response
+    except GoogleAPICallError as e:
+        error_msg = f"BigQuery failed to aggregate data for the lift matrix. Error: {e}"
         logger.error(error_msg, exc_info=True)
         return {"status": "error", "error_message": error_msg}
 
 
-# BigQuery built in tool
-bq_executor_tool = BigQueryToolset(
-    tool_filter=['execute_sql'],
-)
+def compute_robust_lift(
+    tags: List[str],
+    tool_context: ToolContext,
+    metric: str = DEFAULT_METRIC
+) -> Dict[str, Any]:
+    """
+    Computes the median (p50) and p90 lift of each creative tag from
+    pre-merged quantile sketches, without scanning the table.
+
+    Unlike average lift, quantile lift is not dominated by a few viral ads:
+    it compares the typical ad with the tag to the typical ad overall.
+
+    Args:
+    tags: The boolean tag columns to analyze, e.g. ["animal", "human"].
+    tool_context: The context containing shared data like database schemas.
+    metric: The per-ad metric, e.g. "video_views" or "spend".
+
+    Returns:
+        Dict[str, Any]: A dictionary representing the outcome.
+        - On success: `{"status": "success", "metric": "video_views", "overall_quantiles": {"p50": ..., "p90": ...}, "results": [...], "stale": false}`
+          where each result holds `tag`, `segment_size`, `segment_quantiles` and
+          `percentage_lift`, a mapping of quantile name to lift. `stale` is true,
+          with a `stale_reason`, when the table changed since the sketches were built.
+        - On failure: `{"status": "error", "error_message": "Details of the error."}`
+    """
+    store = get_sketch_store()
+    if store is None:
+        return {
+            "status": "error",
+            "error_message": "Quantile sketches are not available. Build them with scripts/build_quantile_sketches.py "
+                             "and set QUANTILE_SKETCH_FILE.",
+        }
+    try:
+        _, full_table_id = table_context(tool_context.state)
+    except (KeyError, TypeError) as e:
+        error_msg = f"Could not find required schema info to compute robust lift. Error: {e}"
+        logger.error(error_msg)
+        return {"status": "error", "error_message": error_msg}
+    if store.table and store.table != full_table_id.strip("`"):
+        return {"status": "error", "error_message": f"Quantile sketches were built for {store.table}, not {full_table_id}."}
+
+    try:
+        result = {"status": "success", **store.robust_lift(tags, metric), "stale": False}
+    except ValueError as e:
+        return {"status": "error", "error_message": str(e)}
+    # Sketches of a local CSV export name no table, so there is nothing to compare them with.
+    table_modified = get_table_modified() if store.table else store.source_modified
+    if table_modified != store.source_modified:
+        result.update(stale=True, stale_reason=(
+            f"The table was last modified at {table_modified}, but the sketches were built from it as of "
+            f"{store.source_modified or 'an unrecorded time'}; rebuild them with "
+            f"`python scripts/build_quantile_sketches.py --rebuild`."
+        ))
+    return result
+
+
+@lru_cache(maxsize=1)
+def get_bq_executor_tool() -> BaseToolset:
+    """The BigQuery built-in `execute_sql` tool, imported and built on first use (sync tools only)."""
+    from google.adk.tools.bigquery import BigQueryToolset
+
+    return BigQueryToolset(
+        tool_filter=['execute_sql'],
+    )
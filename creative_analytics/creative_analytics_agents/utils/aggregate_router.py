@@ -0,0 +1,464 @@
+"""
+Aggregate-aware routing of queries to pre-aggregated rollup tables.
+
+A rollup is declared in the dataset config next to the raw table it
+aggregates: its grain (the columns it is grouped by), the column holding the
+number of raw rows per group and, per measure, the column holding its sum
+(and its non-NULL count when the measure can be NULL). Each aggregating
+`SELECT` over a raw table is moved to the smallest of its rollups that answers
+it exactly, i.e. when every column read outside aggregates is in the grain and
+every aggregate can be re-expressed over the rollup's sums and counts:
+
+- `COUNT(*)`, `COUNTIF(c)` and `COUNT(x)` become sums of row or non-NULL counts,
+- `SUM(e)` of an expression linear in the measures becomes a sum over the rollup's sums,
+- `AVG(e)` becomes the ratio of those two sums,
+- `MIN`, `MAX` and `COUNT(DISTINCT ...)` over grain columns are kept as they are.
+
+Anything else (quantiles, standard deviations, products of measures, per-ad
+keys such as `media_id`, sampling, volatile functions such as `RAND()`) keeps
+the `SELECT` on the raw table.
+
+A rollup is only used while it is current: whoever builds or refreshes it
+labels it with the modification time its raw table had at that point, and a
+raw table modified since (by an ingestion batch whose rollup refresh has not
+run or failed, or by any other write) keeps its queries on the raw table.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+import sqlglot
+from google.api_core.exceptions import GoogleAPICallError
+from google.cloud import bigquery
+from sqlglot import exp
+from sqlglot.errors import ParseError, TokenError
+
+from .database_context import table_row_count
+from .sql_guard import DIALECT, _cte_names, _table_id
+
+logger = logging.getLogger(__name__)
+
+# Casts that commute with summation
+_LINEAR_CASTS = (exp.DataType.Type.DOUBLE, exp.DataType.Type.DECIMAL, exp.DataType.Type.BIGDECIMAL)
+# Aggregates whose result over the grain columns does not depend on row multiplicity
+_GRAIN_AGGREGATES = (exp.Min, exp.Max, exp.AnyValue, exp.LogicalOr, exp.LogicalAnd)
+# Functions whose value is not fixed by the grain columns; functions sqlglot does not know are treated alike
+_VOLATILE_FUNCTIONS = (
+    exp.Rand, exp.Randn, exp.Uuid, exp.CurrentTimestamp, exp.CurrentDate, exp.CurrentDatetime,
+    exp.CurrentTime, exp.CurrentUser, exp.SessionUser, exp.Anonymous,
+)
+# Rollup table label holding the modification time of the raw table it was built or refreshed from
+SOURCE_MODIFIED_LABEL = "source_modified"
+
+
+@dataclass(frozen=True)
+class Rollup:
+    """A rollup table with lower-cased column names, as declared in the dataset config."""
+    table_id: str
+    base_table_id: str
+    grain: frozenset
+    count_column: str
+    sums: Mapping[str, str]
+    # Non-NULL count column per measure; None when the measure is never NULL
+    counts: Mapping[str, Optional[str]]
+    row_count: Optional[int] = None
+
+
+@dataclass
+class Route:
+    """A query with some of its raw table scans moved to rollups."""
+    original_sql: str
+    sql: str
+    # (raw table id, rollup table id) per routed SELECT
+    tables: List[Tuple[str, str]] = field(default_factory=list)
+
+
+def find_rollups(database_settings: Mapping[str, Any]) -> List[Rollup]:
+    """
+    The declared rollups whose table was inspected and has every declared
+    column, smallest first by their table metadata (or declared) row count.
+    """
+    rollups = []
+    for dataset in database_settings.values():
+        for table_name, table_info in dataset.get("tables", {}).items():
+            declared = table_info.get("rollup")
+            if not declared or table_info.get("error"):
+                continue
+            table_id = f"{dataset['project_id']}.{dataset['dataset_id']}.{table_name}".lower()
+            base_parts = declared["base_table"].split(".")
+            base_parts = [dataset["project_id"], dataset["dataset_id"]][:3 - len(base_parts)] + base_parts
+            measures = declared["measures"]
+            rollup = Rollup(
+                table_id=table_id,
+                base_table_id=".".join(base_parts).lower(),
+                grain=frozenset(column.lower() for column in declared["grain"]),
+                count_column=declared["count_column"].lower(),
+                sums={name.lower(): measure["sum"].lower() for name, measure in measures.items()},
+                counts={
+                    name.lower(): measure["count"].lower() if measure.get("count") else None
+                    for name, measure in measures.items()
+                },
+                row_count=table_row_count(table_id) or declared.get("row_count"),
+            )
+            columns = {name.lower() for name, _ in table_info.get("schema_list", [])}
+            required = rollup.grain | {rollup.count_column} | set(rollup.sums.values()) \
+                | {column for column in rollup.counts.values() if column}
+            if not required <= columns:
+                logger.warning(f"Rollup `{table_id}` lacks declared columns {sorted(required - columns)}; not routing to it.")
+                continue
+            rollups.append(rollup)
+    return sorted(rollups, key=lambda r: (r.row_count is None, r.row_count or 0))
+
+
+def source_stamp(table: bigquery.Table) -> str:
+    """The label value identifying the contents of `table`: its modification time in milliseconds."""
+    return str(int(table.modified.timestamp() * 1000))
+
+
+def stamp_rollup(client: bigquery.Client, rollup_table_id: str, source: bigquery.Table) -> None:
+    """
+    Labels a rollup as built from `source`, the raw table's metadata read
+    before the rollup read it, so a write in between leaves the rollup stale.
+    """
+    table = client.get_table(rollup_table_id)
+    table.labels = {**table.labels, SOURCE_MODIFIED_LABEL: source_stamp(source)}
+    client.update_table(table, ["labels"])
+
+
+def rollup_is_current(client: bigquery.Client, rollup: Rollup) -> bool:
+    """True if the rollup was last built or refreshed from the raw table as it is now."""
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            base, table = pool.map(client.get_table, (rollup.base_table_id, rollup.table_id))
+    except GoogleAPICallError as e:
+        logger.warning(f"Could not read the metadata of rollup `{rollup.table_id}`; not routing to it. Error: {e}")
+        return False
+    return table.labels.get(SOURCE_MODIFIED_LABEL) == source_stamp(base)
+
+
+def _zero() -> exp.Expression:
+    return exp.Literal.number(0)
+
+
+class _ScopeRewriter:
+    """Re-expresses the aggregates of one SELECT over a rollup's sums and counts."""
+
+    def __init__(self, rollup: Rollup):
+        self.rollup = rollup
+
+    def _rows(self) -> exp.Expression:
+        return exp.column(self.rollup.count_column)
+
+    def _is_grain(self, expression: exp.Expression) -> bool:
+        """True if `expression` only reads grain columns, so it is constant within a rollup row."""
+        if any(isinstance(node, (exp.AggFunc, exp.Window, exp.Select, exp.Star)) for node in expression.walk()):
+            return False
+        return all(column.name.lower() in self.rollup.grain for column in expression.find_all(exp.Column))
+
+    def _measure(self, expression: exp.Expression) -> Optional[str]:
+        if isinstance(expression, exp.Column) and expression.name.lower() in self.rollup.sums:
+            return expression.name.lower()
+        return None
+
+    def _never_null(self, expression: exp.Expression) -> bool:
+        """True if every column in `expression` is a grain column or a measure declared never NULL."""
+        for column in expression.find_all(exp.Column):
+            name = column.name.lower()
+            if name not in self.rollup.grain and not (name in self.rollup.counts and self.rollup.counts[name] is None):
+                return False
+        return not any(isinstance(node, exp.Null) for node in expression.walk())
+
+    def _branches(self, expression: exp.Expression) -> Optional[List[Tuple[Optional[exp.Expression], exp.Expression]]]:
+        """(condition, value) pairs of an IF or searched CASE with grain conditions; a None condition is the default."""
+        if isinstance(expression, exp.If):
+            pairs = [(expression.this, expression.args["true"]), (None, expression.args.get("false") or exp.Null())]
+        elif isinstance(expression, exp.Case) and expression.this is None:
+            pairs = [(branch.this, branch.args["true"]) for branch in expression.args.get("ifs", [])]
+            pairs.append((None, expression.args.get("default") or exp.Null()))
+        else:
+            return None
+        if not all(condition is None or self._is_grain(condition) for condition, _ in pairs):
+            return None
+        return pairs
+
+    def _rebuild_branches(self, pairs, values: List[exp.Expression]) -> exp.Expression:
+        conditions = [condition for condition, _ in pairs]
+        if len(pairs) == 2:
+            return exp.If(this=conditions[0].copy(), true=values[0], false=values[1])
+        ifs = [exp.If(this=condition.copy(), true=value) for condition, value in zip(conditions[:-1], values[:-1])]
+        return exp.Case(ifs=ifs, default=values[-1])
+
+    def sum_of(self, expression: exp.Expression) -> Optional[exp.Expression]:
+        """Per rollup row, the sum of `expression` over its raw rows; None if that is not expressible."""
+        if isinstance(expression, exp.Null) or (isinstance(expression, exp.Literal) and expression.this == "0"):
+            return expression.copy()
+        if self._is_grain(expression):
+            return exp.Mul(this=exp.Paren(this=expression.copy()), expression=self._rows())
+        if isinstance(expression, exp.Paren):
+            inner = self.sum_of(expression.this)
+            return None if inner is None else exp.Paren(this=inner)
+        measure = self._measure(expression)
+        if measure is not None:
+            return exp.column(self.rollup.sums[measure])
+        if isinstance(expression, exp.Cast) and expression.to.this in _LINEAR_CASTS:
+            inner = self.sum_of(expression.this)
+            return None if inner is None else exp.Cast(this=inner, to=expression.to.copy())
+        pairs = self._branches(expression)
+        if pairs is not None:
+            values = [self.sum_of(value) for _, value in pairs]
+            return None if any(value is None for value in values) else self._rebuild_branches(pairs, values)
+        if isinstance(expression, (exp.Mul, exp.Div)):
+            # Scaling by a value that is constant within a rollup row commutes with the sum.
+            factor, scaled = expression.expression, expression.this
+            if isinstance(expression, exp.Mul) and not self._is_grain(factor):
+                factor, scaled = scaled, factor
+            inner = self.sum_of(scaled) if self._is_grain(factor) else None
+            if inner is None:
+                return None
+            return expression.__class__(this=inner, expression=factor.copy())
+        if isinstance(expression, (exp.Add, exp.Sub, exp.Neg)) and self._never_null(expression):
+            # Without NULLs, every raw row contributes to every term.
+            if isinstance(expression, exp.Neg):
+                inner = self.sum_of(expression.this)
+                return None if inner is None else exp.Neg(this=inner)
+            left, right = self.sum_of(expression.this), self.sum_of(expression.expression)
+            if left is None or right is None:
+                return None
+            return expression.__class__(this=left, expression=right)
+        return None
+
+    def count_of(self, expression: exp.Expression) -> Optional[exp.Expression]:
+        """Per rollup row, the number of its raw rows where `expression` is not NULL; None if not expressible."""
+        if isinstance(expression, exp.Null):
+            return _zero()
+        if isinstance(expression, exp.Literal):
+            return self._rows()
+        if self._is_grain(expression):
+            return exp.If(this=exp.Is(this=expression.copy(), expression=exp.Null()), true=_zero(), false=self._rows())
+        if isinstance(expression, exp.Paren):
+            return self.count_of(expression.this)
+        measure = self._measure(expression)
+        if measure is not None:
+            count_column = self.rollup.counts[measure]
+            return exp.column(count_column) if count_column else self._rows()
+        if isinstance(expression, exp.Cast):
+            return self.count_of(expression.this)
+        pairs = self._branches(expression)
+        if pairs is not None:
+            values = [self.count_of(value) for _, value in pairs]
+            return None if any(value is None for value in values) else self._rebuild_branches(pairs, values)
+        if isinstance(expression, (exp.Add, exp.Sub, exp.Mul, exp.Div, exp.Neg)) and self._never_null(expression):
+            return self._rows()
+        return None
+
+    def aggregate(self, node: exp.AggFunc) -> Optional[exp.Expression]:
+        """The rollup form of an aggregate over raw rows; None if it cannot be answered exactly."""
+        if isinstance(node, exp.Count):
+            argument = node.this
+            if isinstance(argument, exp.Star):
+                count = self._rows()
+            elif isinstance(argument, exp.Distinct):
+                return node.copy() if all(self._is_grain(e) for e in argument.expressions) else None
+            else:
+                count = self.count_of(argument)
+            return None if count is None else exp.Coalesce(this=exp.Sum(this=count), expressions=[_zero()])
+        if isinstance(node, exp.CountIf):
+            if not self._is_grain(node.this):
+                return None
+            count = exp.If(this=node.this.copy(), true=self._rows(), false=_zero())
+            return exp.Coalesce(this=exp.Sum(this=count), expressions=[_zero()])
+        if isinstance(node, exp.Sum):
+            total = self.sum_of(node.this)
+            return None if total is None else exp.Sum(this=total)
+        if isinstance(node, exp.Avg):
+            total, count = self.sum_of(node.this), self.count_of(node.this)
+            if total is None or count is None:
+                return None
+            return exp.SafeDivide(this=exp.Sum(this=total), expression=exp.Sum(this=count))
+        if isinstance(node, _GRAIN_AGGREGATES) and self._is_grain(node.this):
+            return node.copy()
+        return None
+
+    def substitute_null_checks(self, node: exp.Expression) -> exp.Expression:
+        """Replaces `m IS NULL` with FALSE for measures declared never NULL."""
+        if isinstance(node, exp.Is) and isinstance(node.expression, exp.Null):
+            measure = self._measure(node.this)
+            if measure is not None and self.rollup.counts[measure] is None:
+                return exp.false()
+        return node
+
+
+def _route_select(select: exp.Select, table: exp.Table, rollup: Rollup) -> Optional[exp.Select]:
+    """A copy of `select` reading `rollup` instead of `table`, or None if it would not be exact."""
+    if select.args.get("joins") or select.args.get("distinct") or any(
+        table.args.get(key) for key in table.args if key not in ("this", "db", "catalog", "alias")
+    ):
+        return None
+    if any(isinstance(node, (exp.Select, exp.Subquery, exp.SetOperation)) and node is not select
+           for node in select.walk()):
+        return None
+    if select.find(*_VOLATILE_FUNCTIONS):
+        return None
+    rewriter = _ScopeRewriter(rollup)
+    routed = select.copy().transform(rewriter.substitute_null_checks)
+
+    # Innermost aggregates read raw rows; an aggregate over them (e.g. a window total) reads their results.
+    aggregates = [
+        node for node in routed.find_all(exp.AggFunc)
+        if not any(inner is not node for inner in node.find_all(exp.AggFunc))
+    ]
+    if not aggregates and not routed.args.get("group"):
+        return None
+    replacements = []
+    for node in aggregates:
+        if isinstance(node.parent, exp.Window):
+            return None
+        replacement = rewriter.aggregate(node)
+        if replacement is None:
+            return None
+        replacements.append((node, replacement))
+
+    aggregate_ids = {id(node) for node, _ in replacements}
+    aliases = {alias.alias.lower() for alias in routed.expressions if isinstance(alias, exp.Alias)}
+    for column in routed.find_all(exp.Column):
+        if any(id(ancestor) in aggregate_ids for ancestor in _ancestors(column)):
+            continue
+        if column.name.lower() not in rollup.grain and column.name.lower() not in aliases:
+            return None
+
+    for node, replacement in replacements:
+        node.replace(replacement)
+    source = routed.args["from_"].this
+    alias = source.args.get("alias")
+    if alias is None and any(column.table.lower() == source.name.lower() for column in routed.find_all(exp.Column)):
+        alias = exp.TableAlias(this=exp.to_identifier(source.name))
+    project, dataset, name = rollup.table_id.split(".")
+    source.replace(exp.Table(
+        this=exp.to_identifier(name, quoted=True),
+        db=exp.to_identifier(dataset, quoted=True),
+        catalog=exp.to_identifier(project, quoted=True),
+        alias=alias,
+    ))
+    return routed
+
+
+def _ancestors(node: exp.Expression):
+    parent = node.parent
+    while parent is not None:
+        yield parent
+        parent = parent.parent
+
+
+class AggregateRouter:
+    """Routes queries to rollup tables, keeping counts of routed queries and bytes saved."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {"routed": 0, "not_routable": 0, "stale_rollups": 0, "bytes_scanned": 0, "bytes_saved": 0}
+
+    def _count(self, **increments: int) -> None:
+        with self._lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def route(
+        self,
+        sql: str,
+        database_settings: Mapping[str, Any],
+        default_project: str,
+        is_current: Optional[Callable[[Rollup], bool]] = None,
+    ) -> Optional[Route]:
+        """
+        Moves every SELECT over a raw table with declared rollups to the
+        smallest rollup that answers it exactly.
+
+        `is_current` tells whether a rollup reflects its raw table as it is
+        now (see `rollup_is_current`); it is asked at most once per rollup and
+        only for rollups that would answer a SELECT. Stale rollups are skipped.
+
+        Returns None when no rollup is declared for the tables the query reads
+        or none of its SELECTs can be answered from a current one.
+        """
+        rollups = find_rollups(database_settings)
+        if not rollups:
+            return None
+        try:
+            tree = sqlglot.parse_one(sql, read=DIALECT)
+        except (ParseError, TokenError):
+            return None
+
+        ctes = _cte_names(tree)
+        route = Route(original_sql=sql, sql=sql)
+        reads_base = False
+        current: Dict[str, bool] = {}
+        for table in list(tree.find_all(exp.Table)):
+            if not table.db and table.name.lower() in ctes:
+                continue
+            table_id = _table_id(table, default_project)
+            candidates = [rollup for rollup in rollups if rollup.base_table_id == table_id]
+            if not candidates:
+                continue
+            reads_base = True
+            select = table.parent.parent if isinstance(table.parent, exp.From) else None
+            if not isinstance(select, exp.Select):
+                continue
+            base_rows = table_row_count(table_id)
+            for rollup in candidates:
+                if base_rows is not None and rollup.row_count is not None and rollup.row_count >= base_rows:
+                    continue
+                routed = _route_select(select, table, rollup)
+                if routed is None:
+                    continue
+                if is_current is not None and rollup.table_id not in current:
+                    current[rollup.table_id] = is_current(rollup)
+                    if not current[rollup.table_id]:
+                        self._count(stale_rollups=1)
+                        logger.warning(f"Rollup `{rollup.table_id}` lags `{table_id}`; keeping the query on the raw table.")
+                if not current.get(rollup.table_id, True):
+                    continue
+                if select is tree:
+                    tree = routed
+                else:
+                    select.replace(routed)
+                route.tables.append((table_id, rollup.table_id))
+                break
+
+        if not route.tables:
+            if reads_base:
+                self._count(not_routable=1)
+            return None
+        route.sql = tree.sql(dialect=DIALECT)
+        self._count(routed=1)
+        logger.info(f"Routed query to rollup tables: {route.tables}")
+        return route
+
+    def measure(self, client: bigquery.Client, route: Route, project: str) -> Dict[str, Any]:
+        """
+        Dry-runs the original and the routed query (free, and concurrently) and
+        returns the routing summary for a tool response, with the bytes
+        scanned and saved when the dry runs succeed.
+        """
+        summary: Dict[str, Any] = {"tables": [{"table": base, "routed_to": rollup} for base, rollup in route.tables]}
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        try:
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                original, routed = pool.map(
+                    lambda sql: client.query(sql, project=project, job_config=job_config).total_bytes_processed,
+                    (route.original_sql, route.sql),
+                )
+        except Exception as e:
+            logger.warning(f"Could not dry-run the routed query to measure savings. Error: {e}")
+            return summary
+        saved = max(0, (original or 0) - (routed or 0))
+        self._count(bytes_scanned=routed or 0, bytes_saved=saved)
+        return {**summary, "bytes_scanned": routed, "bytes_saved": saved}
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats)
+
+
+# Process-wide router shared by all sessions of this worker
+aggregate_router = AggregateRouter()
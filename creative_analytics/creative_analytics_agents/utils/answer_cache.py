@@ -0,0 +1,169 @@
+"""
+Cross-user memoization of statistical analysis answers.
+
+Entries are keyed on the normalized question, the brand scope of the session
+and the data version (last modification of the performance table and the
+prediction model). Each entry holds the generated SQL and result rows and, once
+the analyst has answered, the final synthesized answer. A data load or a
+retrain changes the data version, so older entries become unreachable and are
+purged the next time the new version is observed.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional
+
+from google.api_core.exceptions import GoogleAPICallError
+
+from .cassette import cassette
+from .database_context import get_bigquery_client
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+BRAND_STATE_KEY = "brand_id"
+DEFAULT_BRAND = "default"
+
+
+def normalize_question(question: str) -> str:
+    """Lower-cases a question and strips punctuation and repeated whitespace."""
+    return " ".join(re.findall(r"[a-z0-9_']+", question.lower()))
+
+
+class AnswerCache:
+    """A thread-safe LRU cache bounded by entry count and serialized size."""
+
+    def __init__(self, max_entries: int, max_bytes: int, max_staleness_seconds: float):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._data_version: Optional[str] = None
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_staleness_seconds = max_staleness_seconds
+        self.stats = {"answer_hits": 0, "row_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def make_key(question: str, brand: str, data_version: str) -> str:
+        """Builds the cache key for a question within a brand scope and data version."""
+        raw = "\x1f".join([normalize_question(question), brand, data_version])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def observe_data_version(self, data_version: str) -> None:
+        """Purges every entry when a new data version is first observed."""
+        with self._lock:
+            if self._data_version is not None and self._data_version != data_version:
+                self.stats["invalidations"] += 1
+                self._entries.clear()
+                self._bytes = 0
+                logger.info(f"Answer cache invalidated for data version {data_version}...")
+            self._data_version = data_version
+
+    def get(self, key: str, max_staleness_seconds: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Returns a fresh entry for `key`, or None."""
+        staleness = self.max_staleness_seconds if max_staleness_seconds is None else max_staleness_seconds
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry["stored_at"] > staleness:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["answer_hits" if entry.get("answer") else "row_hits"] += 1
+            return dict(entry)
+
+    def put(
+        self,
+        key: str,
+        sql_query: Optional[str] = None,
+        rows: Optional[List[Dict[str, Any]]] = None,
+        answer: Optional[str] = None,
+    ) -> None:
+        """Stores or updates the entry for `key`, evicting least recently used entries."""
+        with self._lock:
+            entry = dict(self._entries.pop(key, None) or {"stored_at": time.time()})
+            self._bytes -= entry.get("size", 0)
+            if sql_query is not None:
+                entry["sql_query"] = sql_query
+            if rows is not None:
+                entry["rows"] = rows
+                entry["stored_at"] = time.time()
+            if answer is not None:
+                entry["answer"] = answer
+
+            entry["size"] = len(json.dumps(
+                {k: v for k, v in entry.items() if k != "size"}, default=str
+            ).encode("utf-8"))
+            if entry["size"] > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._bytes += entry["size"]
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted["size"]
+                self.stats["evictions"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns counters together with the current size of the cache."""
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries), "bytes": self._bytes}
+
+
+_version_lock = threading.Lock()
+_version_cache: Dict[str, Any] = {"value": None, "checked_at": 0.0}
+
+
+def _read_data_version(prefix: str) -> str:
+    client = get_bigquery_client()
+    table = client.get_table(f"{prefix}.{settings.BQ_TABLE_NAME}")
+    model = client.get_model(f"{prefix}.{settings.BQ_MODEL_NAME}")
+    return f"{table.modified.isoformat()}|{model.modified.isoformat()}"
+
+
+def get_data_version() -> str:
+    """
+    Returns a version string for the performance table and the prediction model,
+    re-read from BigQuery metadata at most every `ANSWER_CACHE_VERSION_CHECK_SECONDS`.
+    """
+    with _version_lock:
+        now = time.monotonic()
+        if _version_cache["value"] and now - _version_cache["checked_at"] < settings.ANSWER_CACHE_VERSION_CHECK_SECONDS:
+            return _version_cache["value"]
+
+        prefix = f"{settings.GOOGLE_CLOUD_PROJECT_ID}.{settings.BQ_DATASET_NAME}"
+        try:
+            # Recorded in the cassette, so replayed sessions build the same cache keys offline.
+            version = cassette.exchange(
+                "bigquery", {"data_version": prefix}, lambda: _read_data_version(prefix), label="data_version"
+            )
+        except GoogleAPICallError as e:
+            logger.warning(f"Could not read data version, keeping the previous one. Error: {e}")
+            version = _version_cache["value"] or "unknown"
+
+        _version_cache.update(value=version, checked_at=now)
+
+    answer_cache.observe_data_version(version)
+    return version
+
+
+def get_table_modified() -> str:
+    """The performance table's part of the data version: its modification time, or "unknown"."""
+    return get_data_version().split("|", 1)[0]
+
+
+def answer_cache_key(question: str, state: Mapping[str, Any]) -> str:
+    """Cache key for `question` in the brand scope of the session."""
+    brand = state.get(BRAND_STATE_KEY) or DEFAULT_BRAND
+    return AnswerCache.make_key(question, str(brand), get_data_version())
+
+
+# Process-wide cache shared by all sessions of this worker
+answer_cache = AnswerCache(
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    max_bytes=settings.ANSWER_CACHE_MAX_BYTES,
+    max_staleness_seconds=settings.ANSWER_CACHE_MAX_STALENESS_SECONDS,
+)
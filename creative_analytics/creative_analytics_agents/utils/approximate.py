@@ -0,0 +1,144 @@
+"""
+Approximate lift matrices for exploratory questions on large tables.
+
+An approximate run reads the table twice, cheaply:
+
+1. Exact row counts per tag combination (stratum). This scans only the
+   boolean tag columns and is cached until the table is modified.
+2. Per-stratum sufficient statistics of the metric columns over a
+   `TABLESAMPLE SYSTEM` block sample.
+
+The sampling rate is the largest that fits `APPROX_TARGET_BYTES` (measured
+with a dry run of the exact query) and, once the scan throughput has been
+observed, `APPROX_TARGET_SECONDS`. It is never lower than the rate needed
+for `APPROX_MIN_SAMPLE_ROWS`. If the full table fits the targets, or the
+sample comes back empty (small tables are a single block), the exact lift
+matrix is computed instead.
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.cloud import bigquery
+
+from . import stats_engine
+from .tag_registry import tag_registry
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Weight of the latest observation in the scan throughput average
+THROUGHPUT_SMOOTHING = 0.3
+
+
+class ApproximateQueryPlanner:
+    """Chooses sampling rates and runs approximate lift matrices; thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._strata: Dict[Tuple[str, Tuple[str, ...]], Tuple[Any, List[Dict[str, Any]]]] = {}
+        self.bytes_per_second: Optional[float] = None
+        self.stats = {"approximate_runs": 0, "exact_fallbacks": 0, "bytes_scanned": 0, "bytes_avoided": 0}
+
+    def _stratum_counts(
+        self,
+        client: bigquery.Client,
+        full_table_id: str,
+        tags: List[str]
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """Row counts per tag combination, re-read only when the table has been modified."""
+        table = client.get_table(full_table_id.strip("`"))
+        key = (full_table_id, tuple(tags))
+        with self._lock:
+            cached = self._strata.get(key)
+        if cached is not None and cached[0] == table.modified:
+            return table.num_rows or 0, cached[1]
+
+        query = stats_engine.build_stratum_counts_sql(full_table_id, tags, tag_sql=tag_registry.predicates(tags))
+        rows = [dict(row.items()) for row in client.query(query).result()]
+        with self._lock:
+            self._strata[key] = (table.modified, rows)
+        return table.num_rows or 0, rows
+
+    def choose_sample_percent(self, full_scan_bytes: int, total_rows: int) -> float:
+        """The sampling rate, in percent, that meets the bytes and latency targets."""
+        budget = float(settings.APPROX_TARGET_BYTES)
+        with self._lock:
+            bytes_per_second = self.bytes_per_second
+        if settings.APPROX_TARGET_SECONDS and bytes_per_second:
+            budget = min(budget, settings.APPROX_TARGET_SECONDS * bytes_per_second)
+
+        percent = 100.0 * budget / full_scan_bytes if full_scan_bytes else 100.0
+        if total_rows:
+            percent = max(percent, 100.0 * settings.APPROX_MIN_SAMPLE_ROWS / total_rows)
+        return min(percent, 100.0)
+
+    def _observe_scan(self, bytes_processed: int, seconds: float) -> None:
+        if not bytes_processed or seconds <= 0:
+            return
+        observed = bytes_processed / seconds
+        with self._lock:
+            self.bytes_per_second = (
+                observed if self.bytes_per_second is None
+                else THROUGHPUT_SMOOTHING * observed + (1 - THROUGHPUT_SMOOTHING) * self.bytes_per_second
+            )
+
+    def lift_matrix(
+        self,
+        client: bigquery.Client,
+        full_table_id: str,
+        tags: List[str],
+        metrics: List[stats_engine.Metric],
+    ) -> Dict[str, Any]:
+        """
+        Computes the lift matrix approximately when that saves enough of the
+        scan, and exactly otherwise.
+
+        Returns:
+            The `stats_engine.approximate_lift_matrix` result with `sample_percent`,
+            or the exact `stats_engine.lift_matrix_from_row` result with
+            `"approximate": False`.
+        """
+        tag_sql = tag_registry.predicates(tags)
+        exact_sql = stats_engine.build_lift_matrix_sql(full_table_id, tags, metrics, tag_sql=tag_sql)
+        dry_run = client.query(exact_sql, job_config=bigquery.QueryJobConfig(dry_run=True))
+        full_scan_bytes = dry_run.total_bytes_processed or 0
+
+        sample_percent = 100.0
+        if len(tags) <= settings.APPROX_MAX_STRATIFIED_TAGS:
+            total_rows, strata = self._stratum_counts(client, full_table_id, tags)
+            sample_percent = self.choose_sample_percent(full_scan_bytes, total_rows)
+
+        if sample_percent < 100.0:
+            start = time.perf_counter()
+            job = client.query(stats_engine.build_stratified_sample_sql(
+                full_table_id, tags, metrics, sample_percent, tag_sql=tag_sql
+            ))
+            sample = [dict(row.items()) for row in job.result()]
+            self._observe_scan(job.total_bytes_processed or 0, time.perf_counter() - start)
+            if sample:
+                result = stats_engine.approximate_lift_matrix(strata, sample, tags, metrics)
+                with self._lock:
+                    self.stats["approximate_runs"] += 1
+                    self.stats["bytes_scanned"] += job.total_bytes_processed or 0
+                    self.stats["bytes_avoided"] += max(full_scan_bytes - (job.total_bytes_processed or 0), 0)
+                return {**result, "sample_percent": sample_percent}
+            logger.info(f"Empty {sample_percent:.4g}% sample of {full_table_id}; computing the exact lift matrix...")
+
+        start = time.perf_counter()
+        job = client.query(exact_sql)
+        (row,) = list(job.result())
+        self._observe_scan(job.total_bytes_processed or 0, time.perf_counter() - start)
+        with self._lock:
+            self.stats["exact_fallbacks"] += 1
+            self.stats["bytes_scanned"] += job.total_bytes_processed or 0
+        return {**stats_engine.lift_matrix_from_row(dict(row.items()), tags, metrics), "approximate": False}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "observed_bytes_per_second": self.bytes_per_second}
+
+
+# Process-wide planner shared by all sessions of this worker
+approximate_planner = ApproximateQueryPlanner()
@@ -0,0 +1,299 @@
+"""
+Record and replay of model and BigQuery exchanges.
+
+With `CASSETTE_MODE=record`, every agent model call, SQL generation call,
+BigQuery-backed tool call, routing dry run, speculative query and data version
+read is appended to `CASSETTE_FILE`, a gzip-compressed JSON-lines file,
+together with the user messages of each session and the schema snapshot the
+agents ran against. The approximate planner's dry runs, stratum counts and
+table metadata reads happen inside `compute_lift_matrix`, which is replayed as
+a whole, and schema inspection is replaced by the recorded snapshot. With
+`CASSETTE_MODE=replay`, the same calls are answered from the cassette without
+network access, after the recorded latency or none
+(`CASSETTE_REPLAY_LATENCY`), so recorded sessions can be replayed offline
+(see `scripts/replay_cassette.py`). A call that is not in the cassette fails
+with `CassetteMissError`.
+
+Exchanges are keyed by a hash of the request with generated call ids
+removed; identical requests are replayed in the order they were recorded.
+"""
+import asyncio
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, AsyncGenerator, Awaitable, Callable, Deque, Dict, List, Mapping, Optional, Tuple, Type, TypeVar
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.adk.tools import BaseTool, ToolContext
+from pydantic import BaseModel
+
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Tools whose responses come from BigQuery; other tools are local and run on replay.
+CASSETTE_TOOLS = ("execute_sql", "compute_lift_significance", "compute_lift_matrix")
+MAX_TRACKED_INVOCATIONS = 10000
+
+
+class CassetteMissError(LookupError):
+    """Raised on replay when a call was not recorded in the cassette."""
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json", exclude_none=True)
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    return value
+
+
+def request_key(request: Any) -> str:
+    """Stable hash of a JSON-serializable request."""
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:24]
+
+
+def model_request(llm_request: LlmRequest) -> Dict[str, Any]:
+    """The parts of a model request that determine its response, without generated function call ids."""
+    contents = _jsonable(llm_request.contents)
+    for content in contents:
+        for part in content.get("parts", []):
+            for call in (part.get("function_call"), part.get("function_response")):
+                if call:
+                    call.pop("id", None)
+    config = llm_request.config
+    return {
+        "model": llm_request.model,
+        "system_instruction": _jsonable(config.system_instruction) if config else None,
+        "tools": sorted(llm_request.tools_dict),
+        "contents": contents,
+    }
+
+
+class Cassette:
+    """A thread-safe cassette file, written in record mode and read lazily in replay mode."""
+
+    def __init__(self, path: str, mode: str = "off", replay_latency: str = "zero"):
+        self._lock = threading.Lock()
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self._writer = None
+        self._entries: Optional[Dict[Tuple[str, str], Deque[Dict[str, Any]]]] = None
+        self._recorded_invocations: Deque[str] = deque(maxlen=MAX_TRACKED_INVOCATIONS)
+        self.stats = {"recorded": 0, "replayed": 0, "misses": 0}
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def record(self, kind: str, key: str, response: Any, latency: float = 0.0, label: str = "") -> None:
+        """Appends one exchange; the file is flushed so a crash loses at most the entry being written."""
+        line = json.dumps(
+            {"kind": kind, "key": key, "label": label, "latency": round(latency, 4), "response": response},
+            separators=(",", ":"), default=str,
+        )
+        with self._lock:
+            if self._writer is None:
+                self._writer = gzip.open(self.path, "at", encoding="utf-8")
+                atexit.register(self.close)
+            self._writer.write(line + "\n")
+            self._writer.flush()
+            self.stats["recorded"] += 1
+
+    def _load(self) -> Dict[Tuple[str, str], Deque[Dict[str, Any]]]:
+        entries: Dict[Tuple[str, str], Deque[Dict[str, Any]]] = defaultdict(deque)
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    entries[(entry["kind"], entry["key"])].append(entry)
+        except EOFError:
+            # Written by a process that did not exit cleanly; complete entries are kept.
+            logger.warning(f"Cassette {self.path} is truncated; replaying its complete entries...")
+        logger.info(f"Loaded {sum(len(queue) for queue in entries.values())} exchanges from cassette {self.path}...")
+        return entries
+
+    def entries(self, kind: str) -> List[Dict[str, Any]]:
+        """All recorded entries of `kind`, in recording order per key."""
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            return [entry for (entry_kind, _), queue in self._entries.items() if entry_kind == kind for entry in queue]
+
+    def take(self, kind: str, key: str, label: str = "") -> Dict[str, Any]:
+        """The next recorded entry for a request; the last one is reused once the recordings run out."""
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            queue = self._entries.get((kind, key))
+            if not queue:
+                self.stats["misses"] += 1
+                raise CassetteMissError(f"No recorded {kind} exchange {label} with key {key} in {self.path}")
+            entry = queue.popleft() if len(queue) > 1 else queue[0]
+            self.stats["replayed"] += 1
+            return entry
+
+    def delay(self, recorded_seconds: float) -> float:
+        return recorded_seconds if self.replay_latency == "recorded" else 0.0
+
+    def exchange(
+        self,
+        kind: str,
+        request: Any,
+        call: Callable[[], T],
+        response_type: Optional[Type[BaseModel]] = None,
+        label: str = "",
+    ) -> T:
+        """Runs `call` (recording its result) or replays it; `response_type` (de)serializes pydantic results."""
+        if self.mode == "off":
+            return call()
+        key = request_key(request)
+        if self.replaying:
+            entry = self.take(kind, key, label)
+            time.sleep(self.delay(entry["latency"]))
+            return response_type.model_validate(entry["response"]) if response_type else entry["response"]
+        start = time.perf_counter()
+        result = call()
+        self.record(kind, key, _jsonable(result), time.perf_counter() - start, label)
+        return result
+
+    async def exchange_async(
+        self,
+        kind: str,
+        request: Any,
+        call: Callable[[], Awaitable[T]],
+        response_type: Optional[Type[BaseModel]] = None,
+        label: str = "",
+    ) -> T:
+        """Async form of `exchange`."""
+        if self.mode == "off":
+            return await call()
+        key = request_key(request)
+        if self.replaying:
+            entry = self.take(kind, key, label)
+            await asyncio.sleep(self.delay(entry["latency"]))
+            return response_type.model_validate(entry["response"]) if response_type else entry["response"]
+        start = time.perf_counter()
+        result = await call()
+        self.record(kind, key, _jsonable(result), time.perf_counter() - start, label)
+        return result
+
+    def first_in_invocation(self, invocation_id: str) -> bool:
+        """True the first time an invocation id is seen."""
+        with self._lock:
+            if invocation_id in self._recorded_invocations:
+                return False
+            self._recorded_invocations.append(invocation_id)
+            return True
+
+    def record_schema(self, database_settings: Mapping[str, Any], database_definitions_prompt: str) -> None:
+        """Records a published schema snapshot so replay does not inspect BigQuery."""
+        if self.recording:
+            self.record("schema", "", {"database_settings": database_settings, "prompt": database_definitions_prompt})
+
+    def recorded_schema(self) -> Tuple[Dict[str, Any], str]:
+        """The most recently recorded schema snapshot; raises CassetteMissError if there is none."""
+        schemas = self.entries("schema")
+        if not schemas:
+            raise CassetteMissError(f"No schema snapshot recorded in {self.path}")
+        return schemas[-1]["response"]["database_settings"], schemas[-1]["response"]["prompt"]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"mode": self.mode, **self.stats}
+
+
+# Process-wide cassette shared by all sessions of this worker
+cassette = Cassette(settings.CASSETTE_FILE, settings.CASSETTE_MODE, settings.CASSETTE_REPLAY_LATENCY)
+
+
+class CassetteLlm(BaseLlm):
+    """Records the responses of `inner` model calls to the cassette, or replays them."""
+
+    inner: BaseLlm
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        key = request_key(model_request(llm_request))
+        if cassette.replaying:
+            entry = cassette.take("model", key, self.model)
+            start = time.perf_counter()
+            for offset, data in entry["response"]:
+                response = LlmResponse.model_validate(data)
+                if response.partial and not stream:
+                    continue
+                await asyncio.sleep(max(0.0, cassette.delay(offset) - (time.perf_counter() - start)))
+                yield response
+            return
+
+        start = time.perf_counter()
+        chunks = []
+        async for response in self.inner.generate_content_async(llm_request, stream):
+            # Serialized before yielding: the flow assigns function call ids to the response afterwards.
+            chunks.append([round(time.perf_counter() - start, 4), _jsonable(response)])
+            yield response
+        cassette.record("model", key, chunks, time.perf_counter() - start, self.model)
+
+
+# Start of each recorded tool call by function call id
+_tool_starts: Dict[str, float] = {}
+
+
+async def replay_tool_call(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext) -> Optional[Dict]:
+    """before_tool_callback: serves BigQuery-backed tools from the cassette on replay and times them when recording."""
+    if tool.name not in CASSETTE_TOOLS or cassette.mode == "off":
+        return None
+    if cassette.recording:
+        _tool_starts[tool_context.function_call_id or ""] = time.perf_counter()
+        return None
+    entry = cassette.take("tool", request_key({"tool": tool.name, "args": args}), tool.name)
+    await asyncio.sleep(cassette.delay(entry["latency"]))
+    return entry["response"]
+
+
+def record_tool_call(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext, tool_response: Any) -> Optional[Dict]:
+    """after_tool_callback: records the response of a BigQuery-backed tool."""
+    if tool.name not in CASSETTE_TOOLS or not cassette.recording:
+        return None
+    start = _tool_starts.pop(tool_context.function_call_id or "", None)
+    latency = time.perf_counter() - start if start is not None else 0.0
+    cassette.record("tool", request_key({"tool": tool.name, "args": args}), _jsonable(tool_response), latency, tool.name)
+    return None
+
+
+def record_user_message(callback_context: CallbackContext) -> None:
+    """before_agent_callback: records the user message of each invocation, so sessions can be replayed."""
+    if not cassette.recording or callback_context.user_content is None:
+        return None
+    # Every agent of an invocation sees the same user message; it is recorded once.
+    if cassette.first_in_invocation(callback_context.invocation_id):
+        cassette.record("session", callback_context.invocation_id, {
+            "session_id": callback_context.session.id,
+            "user_id": callback_context.user_id,
+            "message": _jsonable(callback_context.user_content),
+        })
+    return None
@@ -1,18 +1,50 @@
 import json
 import logging
+import threading
 from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Literal, Tuple
+from typing import Any, Dict, List, Literal, Mapping, Optional, Tuple
 
-import pandas as pd
+from google.adk.agents.callback_context import CallbackContext
 from google.api_core.exceptions import GoogleAPICallError, NotFound
 from google.cloud import bigquery
 from pydantic import BaseModel, Field, ValidationError
 
+from .cassette import cassette
+from .schema_registry import SCHEMA_VERSION_STATE_KEY, SchemaSnapshot, schema_registry, thaw
 from .settings import settings
+from .tag_registry import tag_registry
 
 logger = logging.getLogger(__name__)
 
+# Invocation in which the session's schema version was last pinned
+SCHEMA_INVOCATION_STATE_KEY = "schema_version_invocation"
+
+# Serializes table inspection between first use and background refreshes
+_inspection_lock = threading.Lock()
+
+# Etag of every inspected table, so a refresh skips unchanged tables
+_table_etags: Dict[str, Optional[str]] = {}
+
+# Row count of every inspected table from its metadata, kept current on every refresh
+_table_rows: Dict[str, Optional[int]] = {}
+
+
+class RollupMeasureConfig(BaseModel):
+    """Columns of a rollup table that aggregate one measure of the raw table."""
+    sum: str = Field(..., description="Column holding the sum of the measure per group")
+    count: Optional[str] = Field(None, description="Column holding the non-NULL count per group; omit when the measure is never NULL")
+
+
+class RollupConfig(BaseModel):
+    """A pre-aggregated table that answers some queries on a raw table exactly."""
+    table: str = Field(..., description="The rollup table name in this dataset")
+    base_table: str = Field(..., description="The raw table it aggregates, as 'table' in this dataset or 'dataset.table'")
+    grain: List[str] = Field(..., description="The raw table columns the rollup is grouped by")
+    count_column: str = Field(..., description="Column holding the number of raw rows per group")
+    measures: Dict[str, RollupMeasureConfig] = Field(..., description="Raw table measure columns -> their rollup columns")
+    row_count: Optional[int] = Field(None, description="Approximate rows, used until the table metadata is read")
+
 
 class DatasetConfig(BaseModel):
     """Schema for a single data source entry in the JSON config."""
@@ -20,6 +52,7 @@ class DatasetConfig(BaseModel):
     name: str = Field(..., description="The BigQuery Dataset ID")
     tables: List[str] = Field(..., description="List of table names in the dataset")
     description: str = Field(..., description="A description for the LLM")
+    rollups: List[RollupConfig] = Field(default_factory=list, description="Pre-aggregated tables queries are routed to")
 
 
 class RootConfig(BaseModel):
@@ -27,6 +60,12 @@ class RootConfig(BaseModel):
     datasets: List[DatasetConfig]
 
 
+@lru_cache(maxsize=1)
+def get_bigquery_client() -> bigquery.Client:
+    """Returns a process-wide BigQuery client."""
+    return bigquery.Client(project=settings.GOOGLE_CLOUD_PROJECT_ID)
+
+
 def _load_and_validate_dataset_config(config_path: Path) -> RootConfig:
     """Loads and validates the dataset configuration file."""
     if not config_path.is_file():
@@ -36,25 +75,41 @@ def _load_and_validate_dataset_config(config_path: Path) -> RootConfig:
     return RootConfig.model_validate(data)
 
 
+def _format_sample_rows(columns: List[str], rows: List[Tuple[Any, ...]]) -> str:
+    """Renders rows as a right-aligned text table with a header line."""
+    cells = [columns] + [["NULL" if value is None else str(value) for value in row] for row in rows]
+    widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+    return "\n".join(
+        "  ".join(cell.rjust(width) for cell, width in zip(line, widths))
+        for line in cells
+    )
+
+
 def _format_schema_for_prompt(
     project_id: str,
     dataset_id: str,
     table_name: str,
     schema: List[Tuple[str, str]],
-    sample_df: pd.DataFrame
+    sample_rows: List[Tuple[Any, ...]]
 ) -> str:
     """Formats schema and sample rows into a single, clean text block for the LLM."""
     full_table_id = f"`{project_id}.{dataset_id}.{table_name}`"
     schema_str = ", ".join(f"{col} ({dtype})" for col, dtype in schema)
+    tags_str = tag_registry.schema_prompt(schema)
 
     samples_str = "This table is empty."
-    if not sample_df.empty:
-        samples_str = sample_df.to_string(index=False)
+    if sample_rows:
+        columns = [col for col, _ in schema]
+        if tags_str:
+            # Raw bitmask values mean nothing to the model; samples list the tags they encode.
+            columns, sample_rows = tag_registry.unpack_rows(columns, sample_rows)
+        samples_str = _format_sample_rows(columns, sample_rows)
 
     return (
         f"Table {full_table_id}:\n"
         f"  - Schema: {schema_str}\n"
-        f"  - Sample Rows:\n{samples_str}"
+        + (f"{tags_str}\n" if tags_str else "")
+        + f"  - Sample Rows:\n{samples_str}"
     )
 
 
@@ -62,21 +117,34 @@ def _get_table_details(
     client: bigquery.Client,
     project_id: str,
     dataset_id: str,
-    table_name: str
+    table_name: str,
+    previous: Optional[Dict[str, Any]] = None
 ) -> Dict[str, Any]:
     """
     Fetch schema and sample rows for a single BigQuery table.
+
+    With the `previous` details of the table, the sample rows are only
+    re-read when the table's etag and its schema have both changed.
     """
     full_table_id = f"{project_id}.{dataset_id}.{table_name}"
 
     try:
         table_obj = client.get_table(full_table_id)
+        _table_rows[full_table_id.lower()] = table_obj.num_rows
+        inspected = previous is not None and not previous.get("error")
+        if inspected and _table_etags.get(full_table_id) == table_obj.etag:
+            return previous
+
         schema = [(col.name, col.field_type) for col in table_obj.schema]
+        _table_etags[full_table_id] = table_obj.etag
+        if inspected and [tuple(column) for column in previous["schema_list"]] == schema:
+            # New data, same columns: keep the prompt and avoid a new schema version.
+            return previous
 
         query = f"SELECT * FROM `{full_table_id}` LIMIT 3"
-        sample_df = client.query(query).to_dataframe()
+        sample_rows = [tuple(row.values()) for row in client.query(query).result()]
         formatted_schema = _format_schema_for_prompt(
-            project_id, dataset_id, table_name, schema, sample_df
+            project_id, dataset_id, table_name, schema, sample_rows
         )
 
         return {
@@ -104,7 +172,8 @@ def _build_dataset_definitions_prompt(db_settings: Dict[str, Dict[str, Any]]) ->
         prompt_parts.append(f"<DESCRIPTION>{dataset_info['description']}</DESCRIPTION>")
         prompt_parts.append("<SCHEMAS>")
         for table_name, table_info in dataset_info.get("tables", {}).items():
-            if "schema_prompt" in table_info:
+            # Queries are written against the raw tables and routed to rollups afterwards.
+            if "schema_prompt" in table_info and not table_info.get("rollup"):
                 prompt_parts.append(table_info["schema_prompt"])
         prompt_parts.append("</SCHEMAS>")
         prompt_parts.append("</DATA_SOURCE>")
@@ -113,42 +182,129 @@ def _build_dataset_definitions_prompt(db_settings: Dict[str, Dict[str, Any]]) ->
     return "\n".join(prompt_parts)
 
 
-@lru_cache(maxsize=1)
+def _build_database_settings(previous: Optional[Mapping[str, Any]] = None) -> Dict[str, Dict[str, Any]]:
+    """Inspects the configured tables, reusing the unchanged tables of `previous` database settings."""
+    project_id = settings.GOOGLE_CLOUD_PROJECT_ID
+    config_path_str = Path(__file__).parent.parent / "config" / settings.DATASET_CONFIG_FILE
+
+    dataset_config = _load_and_validate_dataset_config(Path(config_path_str))
+
+    client = get_bigquery_client()
+
+    db_settings: Dict[str, Dict[str, Any]] = {}
+    for dataset in dataset_config.datasets:
+        if dataset.type == "bigquery":
+            previous_tables = (previous or {}).get(dataset.name, {}).get("tables", {})
+            table_details = {
+                name: _get_table_details(client, project_id, dataset.name, name, previous_tables.get(name))
+                for name in dataset.tables
+            }
+            for rollup in dataset.rollups:
+                details = _get_table_details(client, project_id, dataset.name, rollup.table, previous_tables.get(rollup.table))
+                table_details[rollup.table] = {**details, "rollup": rollup.model_dump()}
+            db_settings[dataset.name] = {
+                "project_id": project_id,
+                "dataset_id": dataset.name,
+                "description": dataset.description,
+                "tables": table_details,
+            }
+    return db_settings
+
+
+def _shared_context(snapshot: SchemaSnapshot) -> Dict[str, Any]:
+    return {
+        "database_settings": snapshot.database_settings,
+        "database_definitions_prompt": snapshot.database_definitions_prompt,
+        "schema_version": snapshot.version,
+    }
+
+
 def init_database_settings() -> Dict[str, Any]:
-    """Initializes the database settings for the configured datasets"""
-    try:
-        project_id = settings.GOOGLE_CLOUD_PROJECT_ID
-        config_path_str = Path(__file__).parent.parent / "config" / settings.DATASET_CONFIG_FILE
-
-        dataset_config = _load_and_validate_dataset_config(Path(config_path_str))
-
-        client = bigquery.Client(project=project_id)
-
-        db_settings: Dict[str, Dict[str, Any]] = {}
-        for dataset in dataset_config.datasets:
-            if dataset.type == "bigquery":
-                table_details = {
-                    name: _get_table_details(client, project_id, dataset.name, name)
-                    for name in dataset.tables
-                }
-                db_settings[dataset.name] = {
-                    "project_id": project_id,
-                    "dataset_id": dataset.name,
-                    "description": dataset.description,
-                    "tables": table_details,
-                }
+    """Returns the current shared database settings, inspecting the configured datasets on first use."""
+    snapshot = schema_registry.current()
+    if snapshot is not None:
+        return _shared_context(snapshot)
+
+    with _inspection_lock:
+        snapshot = schema_registry.current()
+        if snapshot is not None:
+            return _shared_context(snapshot)
+        try:
+            if cassette.replaying:
+                db_settings, db_definitions_prompt = cassette.recorded_schema()
+            else:
+                db_settings = _build_database_settings()
+                db_definitions_prompt = _build_dataset_definitions_prompt(db_settings)
+                cassette.record_schema(db_settings, db_definitions_prompt)
+            snapshot = schema_registry.publish(db_settings, db_definitions_prompt)
+            logger.info("Shared agent context initialization complete...")
+            return _shared_context(snapshot)
+
+        except (ValueError, FileNotFoundError, json.JSONDecodeError, ValidationError) as e:
+            logger.critical(f"Configuration failed. Application cannot start. Reason: {e}...")
+            raise
+        except Exception as e:
+            logger.critical(f"An unexpected error occurred during initialization. Reason: {e}...")
+            raise
 
+
+def refresh_database_settings() -> Optional[SchemaSnapshot]:
+    """
+    Re-inspects the tables whose metadata changed since they were last
+    inspected, plus tables added to the dataset config, and publishes a new
+    schema version if any table's schema prompt changed.
+
+    Sessions keep the version they are using until their next invocation
+    (see `pin_schema_version`), so in-flight requests are not affected.
+
+    Returns:
+        The newly published snapshot, or None if nothing changed.
+    """
+    current = schema_registry.current()
+    if current is None:
+        init_database_settings()
+        return None
+    if cassette.replaying:
+        # Replay keeps the recorded schema.
+        return None
+
+    with _inspection_lock:
+        db_settings = _build_database_settings(thaw(current.database_settings))
         db_definitions_prompt = _build_dataset_definitions_prompt(db_settings)
-        logger.info("Shared agent context initialization complete...")
+        if schema_registry.compute_version(db_settings, db_definitions_prompt) == current.version:
+            return None
+        cassette.record_schema(db_settings, db_definitions_prompt)
+        return schema_registry.publish(db_settings, db_definitions_prompt)
+
+
+def pin_schema_version(callback_context: CallbackContext) -> None:
+    """
+    Moves the session to the current schema version at the start of each
+    invocation and keeps it fixed for the rest of that invocation.
+
+    Specialists called through AgentTool run in a new session seeded with the
+    caller's state and get their own invocation id. Their state already holds
+    the version pinned by an invocation that is not part of their session, so
+    they keep it rather than moving to a newer version mid-turn.
+    """
+    state = callback_context.state
+    pinned_by = state.get(SCHEMA_INVOCATION_STATE_KEY)
+    if pinned_by == callback_context.invocation_id:
+        return
+    if pinned_by is not None and not any(
+        event.invocation_id == pinned_by for event in reversed(callback_context.session.events)
+    ):
+        return
+    state[SCHEMA_VERSION_STATE_KEY] = init_database_settings()["schema_version"]
+    state[SCHEMA_INVOCATION_STATE_KEY] = callback_context.invocation_id
+
+
+def table_row_count(full_table_id: str) -> Optional[int]:
+    """Row count of an inspected table from its metadata, or None if it is unknown."""
+    return _table_rows.get(full_table_id.lower())
 
-        return {
-            "database_settings": db_settings,
-            "database_definitions_prompt": db_definitions_prompt,
-        }
 
-    except (ValueError, FileNotFoundError, json.JSONDecodeError, ValidationError) as e:
-        logger.critical(f"Configuration failed. Application cannot start. Reason: {e}...")
-        raise
-    except Exception as e:
-        logger.critical(f"An unexpected error occurred during initialization. Reason: {e}...")
-        raise
+def get_database_settings(state: Mapping[str, Any]) -> Mapping[str, Any]:
+    """Resolves the read-only database settings referenced by a session state."""
+    init_database_settings()
+    return schema_registry.resolve(state.get(SCHEMA_VERSION_STATE_KEY)).database_settings
@@ -0,0 +1,213 @@
+"""
+Retrieval of verified question -> SQL examples for the SQL generation prompt.
+
+Every generated query that BigQuery executes successfully is recorded with its
+question. Questions are embedded offline by hashing word unigrams, word
+bigrams and character trigrams into a fixed-size TF-IDF vector. The most
+similar recorded examples are found by brute-force cosine search and replace
+the static examples in `TOOL_PROMPT`. The index is bounded: once
+`FEW_SHOT_MAX_EXAMPLES` is reached, the oldest example is evicted. It can be
+persisted to a JSONL file so workers start warm. Examples are appended to the
+file, which is rewritten with its last `FEW_SHOT_MAX_EXAMPLES` lines once it
+grows past twice that; workers only read that many lines from its end.
+"""
+import json
+import logging
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .answer_cache import normalize_question
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+N_FEATURES = 2 ** 11
+
+
+def _hashed_features(text: str) -> np.ndarray:
+    """Sublinear term-frequency vector of hashed word and character n-grams."""
+    words = normalize_question(text).split()
+    grams = list(words)
+    grams += [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"#{word}#"
+        grams += [f"~{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+
+    counts = np.zeros(N_FEATURES, dtype=np.float32)
+    for gram in grams:
+        counts[zlib.crc32(gram.encode("utf-8")) % N_FEATURES] += 1
+    np.log1p(counts, out=counts)
+    return counts
+
+
+def _normalize_sql(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+def _tail_lines(path: Path, count: int, block_size: int = 1 << 16) -> Tuple[List[str], bool]:
+    """The last `count` lines of a file, read backwards in blocks, and whether the file has more."""
+    with open(path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        data = b""
+        # One newline more than `count`, so that the first line kept is complete.
+        while position > 0 and data.count(b"\n") <= count:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    lines = data.decode("utf-8", errors="replace").splitlines()
+    return lines[-count:] if count > 0 else [], position > 0 or len(lines) > count
+
+
+class ExampleIndex:
+    """A bounded, thread-safe nearest-neighbour index of verified question -> SQL pairs."""
+
+    def __init__(self, max_entries: int, path: Optional[Path] = None):
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.path = path
+        # Serializes appends to and rewrites of the file
+        self._file_lock = threading.Lock()
+        # Lines in the file, counting only this worker's appends since it was last read or rewritten
+        self._persisted = 0
+        self._slots: "OrderedDict[str, int]" = OrderedDict()
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._examples: List[Optional[Dict[str, str]]] = [None] * max_entries
+        self._tf = np.zeros((max_entries, N_FEATURES), dtype=np.float32)
+        self._df = np.zeros(N_FEATURES, dtype=np.float32)
+        self.stats = {
+            "recorded": 0, "evicted": 0, "searches": 0, "retrievals": 0,
+            "generations": 0, "prompt_tokens": 0,
+            "executions": 0, "first_shot_successes": 0,
+        }
+        if path is not None and path.is_file():
+            self._load(path)
+
+    def _load(self, path: Path) -> None:
+        try:
+            lines, truncated = _tail_lines(path, self.max_entries)
+        except OSError as e:
+            logger.warning(f"Could not read few-shot examples from {path}: {e}")
+            return
+        for line in lines:
+            try:
+                example = json.loads(line)
+                self._insert(example["question"], example["sql_query"])
+            except (json.JSONDecodeError, KeyError) as e:
+                logger.warning(f"Skipping malformed few-shot example in {path}: {e}")
+        self._persisted = len(lines)
+        if truncated:
+            self._compact(lines)
+        logger.info(f"Loaded {len(self._slots)} few-shot examples from {path}...")
+
+    def _compact(self, lines: List[str]) -> None:
+        """Replaces the file with `lines` through a temporary file, so readers never see it partly written."""
+        # Per process, since workers sharing the file may compact it at the same time.
+        tmp = self.path.with_suffix(f"{self.path.suffix}.{os.getpid()}.tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.writelines(line + "\n" for line in lines)
+            tmp.replace(self.path)
+            self._persisted = len(lines)
+        except OSError as e:
+            logger.warning(f"Could not compact the few-shot examples in {self.path}: {e}")
+
+    def _insert(self, question: str, sql_query: str) -> None:
+        key = normalize_question(question)
+        if key in self._slots:
+            slot = self._slots.pop(key)
+        else:
+            if not self._free:
+                _, evicted = self._slots.popitem(last=False)
+                self._df -= self._tf[evicted] > 0
+                self._free.append(evicted)
+                self.stats["evicted"] += 1
+            slot = self._free.pop()
+            self._tf[slot] = _hashed_features(question)
+            self._df += self._tf[slot] > 0
+        self._slots[key] = slot
+        self._examples[slot] = {"question": question, "sql_query": sql_query}
+
+    def add(self, question: str, sql_query: str) -> None:
+        """Records a verified example, replacing an earlier one for the same question."""
+        with self._lock:
+            self._insert(question, sql_query)
+            self.stats["recorded"] += 1
+        if self.path is None:
+            return
+        with self._file_lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"question": question, "sql_query": sql_query}) + "\n")
+                self._persisted += 1
+                if self._persisted > 2 * self.max_entries:
+                    # Re-read rather than written from memory, to keep the examples other workers appended.
+                    self._compact(_tail_lines(self.path, self.max_entries)[0])
+            except OSError as e:
+                logger.warning(f"Could not persist few-shot example to {self.path}: {e}")
+
+    def search(self, question: str, k: int, min_similarity: float = 0.0) -> List[Dict[str, Any]]:
+        """Returns up to `k` examples most similar to `question`, most similar first."""
+        with self._lock:
+            self.stats["searches"] += 1
+            if not self._slots or k <= 0:
+                return []
+            slots = np.fromiter(self._slots.values(), dtype=np.int64)
+            idf = np.log((1 + len(slots)) / (1 + self._df)) + 1
+            documents = self._tf[slots] * idf
+            documents /= np.maximum(np.linalg.norm(documents, axis=1, keepdims=True), 1e-12)
+            query = _hashed_features(question) * idf
+            query /= max(float(np.linalg.norm(query)), 1e-12)
+
+            scores = documents @ query
+            best = np.argsort(-scores)[:k]
+            results = [
+                {**self._examples[slots[i]], "similarity": float(scores[i])}
+                for i in best if scores[i] >= min_similarity
+            ]
+            if results:
+                self.stats["retrievals"] += 1
+            return results
+
+    def record_generation(self, prompt_tokens: Optional[int]) -> None:
+        """Counts one SQL generation call and its prompt size."""
+        with self._lock:
+            self.stats["generations"] += 1
+            self.stats["prompt_tokens"] += prompt_tokens or 0
+
+    def record_execution(self, succeeded: bool) -> None:
+        """Counts the first execution of a generated query."""
+        with self._lock:
+            self.stats["executions"] += 1
+            self.stats["first_shot_successes"] += int(succeeded)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns counters, first-shot success rate and average prompt tokens."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["examples"] = len(self._slots)
+        stats["first_shot_success_rate"] = (
+            stats["first_shot_successes"] / stats["executions"] if stats["executions"] else None
+        )
+        stats["avg_prompt_tokens"] = (
+            stats["prompt_tokens"] / stats["generations"] if stats["generations"] else None
+        )
+        return stats
+
+
+def is_same_query(a: str, b: str) -> bool:
+    """True if two SQL strings differ at most in whitespace."""
+    return _normalize_sql(a) == _normalize_sql(b)
+
+
+# Process-wide index shared by all sessions of this worker
+example_index = ExampleIndex(
+    max_entries=settings.FEW_SHOT_MAX_EXAMPLES,
+    path=Path(settings.FEW_SHOT_INDEX_FILE) if settings.FEW_SHOT_INDEX_FILE else None,
+)
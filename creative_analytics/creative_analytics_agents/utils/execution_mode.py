@@ -0,0 +1,49 @@
+"""
+Interactive and non-interactive execution of a session.
+
+In the default `interactive` mode, the orchestrator presents its plan and
+delegates once the user confirms it. In `auto` mode, meant for scripts and
+dashboards, the plan is logged and the orchestrator delegates in the same
+turn. The mode is read from the session state (`execution_mode`), which
+callers set when creating a session or per message (see `server.py`).
+
+Whatever the mode, the specialists store the structured result of their last
+analysis or prediction in the session state (`structured_result`), so machine
+clients can read the numbers next to the prose answer.
+"""
+import logging
+from typing import Any, Dict, Mapping, Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmResponse
+
+logger = logging.getLogger(__name__)
+
+EXECUTION_MODE_STATE_KEY = "execution_mode"
+STRUCTURED_RESULT_STATE_KEY = "structured_result"
+INTERACTIVE, AUTO = "interactive", "auto"
+EXECUTION_MODES = (INTERACTIVE, AUTO)
+
+
+def is_auto(state: Mapping[str, Any]) -> bool:
+    return state.get(EXECUTION_MODE_STATE_KEY) == AUTO
+
+
+def store_structured_result(state: Any, result_type: str, **data: Any) -> None:
+    """Stores the structured result of a specialist, replacing the previous one."""
+    state[STRUCTURED_RESULT_STATE_KEY] = {"type": result_type, **data}
+
+
+def structured_result(state: Mapping[str, Any]) -> Optional[Dict[str, Any]]:
+    return state.get(STRUCTURED_RESULT_STATE_KEY)
+
+
+def log_plan_in_auto_mode(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+    """after_model_callback: logs the plan the orchestrator executes without confirmation."""
+    content = llm_response.content
+    if llm_response.partial or content is None or not content.parts or not is_auto(callback_context.state):
+        return None
+    plan = "".join(part.text for part in content.parts if part.text and not part.thought).strip()
+    if plan:
+        logger.info(f"Executing plan without confirmation for session {callback_context.session.id}: {plan}")
+    return None
@@ -0,0 +1,161 @@
+"""
+Concurrent execution of the independent parts of a compound request.
+
+The orchestrator splits a request such as "compare logo vs. cta lift, and
+predict how these two images will do" into subtasks, e.g. one analysis and
+one prediction per image, and hands them to `run_subtasks_in_parallel`. Each
+subtask runs in an isolated session of a specialist, like an agent tool, and
+starts with a copy of the caller's session state. At most
+`FANOUT_MAX_CONCURRENCY` subtasks run at once per worker, so the wall-clock
+time of a request approaches that of its slowest subtask instead of the sum.
+The answers and structured results are returned to the orchestrator, which
+merges them into one response.
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from typing import Any, Dict, List, Literal, Mapping
+
+from google.adk.agents import BaseAgent
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.adk.tools import ToolContext
+from google.genai import types
+from pydantic import BaseModel, Field
+
+from .execution_mode import STRUCTURED_RESULT_STATE_KEY, store_structured_result, structured_result
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Subtask(BaseModel):
+    """One independent part of a compound request."""
+
+    specialist: Literal["analysis", "prediction"] = Field(
+        ..., description="`analysis` for historical performance questions, `prediction` for a new creative"
+    )
+    request: str = Field(..., description="The self-contained request for the specialist")
+    attachments: List[int] = Field(
+        default_factory=list,
+        description="0-based positions of the creatives the subtask needs, in the order they were uploaded in this conversation",
+    )
+
+
+def session_media(tool_context: ToolContext) -> List[types.Part]:
+    """The image and video parts the user uploaded in this session, in upload order."""
+    return [
+        part
+        for event in tool_context.session.events if event.author == "user" and event.content
+        for part in event.content.parts or []
+        if (part.inline_data or part.file_data)
+        and ((part.inline_data or part.file_data).mime_type or "").split("/")[0] in ("image", "video")
+    ]
+
+
+class FanOutScheduler:
+    """Runs subtasks on specialist agents under a per-worker concurrency cap."""
+
+    def __init__(self, max_concurrency: int, max_subtasks: int):
+        self._lock = threading.Lock()
+        self.max_concurrency = max_concurrency
+        self.max_subtasks = max_subtasks
+        # One semaphore per event loop: a worker may serve from several loops over its life,
+        # and a semaphore bound to a closed loop would fail every later subtask.
+        self._slots = weakref.WeakKeyDictionary()
+        self.stats = {"batches": 0, "subtasks": 0, "failed": 0, "wall_seconds": 0.0, "subtask_seconds": 0.0}
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._slots:
+                self._slots[loop] = asyncio.Semaphore(self.max_concurrency)
+            return self._slots[loop]
+
+    async def _run_one(
+        self, agent: BaseAgent, subtask: Subtask, media: List[types.Part], tool_context: ToolContext
+    ) -> Dict[str, Any]:
+        parts = [types.Part(text=subtask.request)]
+        for index in subtask.attachments:
+            if not 0 <= index < len(media):
+                return {"status": "error", "error_message": f"No uploaded creative at position {index}."}
+            parts.append(media[index])
+
+        async with self._semaphore():
+            start = time.perf_counter()
+            runner = Runner(
+                app_name=tool_context._invocation_context.app_name,
+                agent=agent,
+                session_service=InMemorySessionService(),
+            )
+            try:
+                session = await runner.session_service.create_session(
+                    app_name=runner.app_name,
+                    user_id=tool_context.user_id,
+                    state={
+                        **{k: v for k, v in tool_context.state.to_dict().items() if not k.startswith("_adk")},
+                        STRUCTURED_RESULT_STATE_KEY: None,
+                    },
+                )
+                answer = ""
+                async for event in runner.run_async(
+                    user_id=session.user_id, session_id=session.id,
+                    new_message=types.Content(role="user", parts=parts),
+                ):
+                    if event.content and event.content.parts and not event.partial:
+                        answer = "\n".join(part.text for part in event.content.parts if part.text) or answer
+                session = await runner.session_service.get_session(
+                    app_name=runner.app_name, user_id=session.user_id, session_id=session.id
+                )
+            finally:
+                await runner.close()
+            seconds = time.perf_counter() - start
+        return {"status": "success", "answer": answer, "result": structured_result(session.state), "seconds": round(seconds, 2)}
+
+    async def run(
+        self, agents: Mapping[str, BaseAgent], subtasks: List[Subtask], tool_context: ToolContext
+    ) -> Dict[str, Any]:
+        """Runs `subtasks` concurrently and returns their answers in order."""
+        if len(subtasks) > self.max_subtasks:
+            return {"status": "error", "error_message": f"At most {self.max_subtasks} subtasks can run per request."}
+        media = session_media(tool_context)
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(
+            *(self._run_one(agents[subtask.specialist], subtask, media, tool_context) for subtask in subtasks),
+            return_exceptions=True,
+        )
+        wall_seconds = time.perf_counter() - start
+
+        results = []
+        for subtask, outcome in zip(subtasks, outcomes):
+            if isinstance(outcome, Exception):
+                logger.warning(f"Subtask failed: {subtask.request}: {outcome}")
+                outcome = {"status": "error", "error_message": f"The subtask failed: {outcome}"}
+            results.append({"specialist": subtask.specialist, "request": subtask.request, **outcome})
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["subtasks"] += len(results)
+            self.stats["failed"] += sum(result["status"] != "success" for result in results)
+            self.stats["wall_seconds"] += wall_seconds
+            self.stats["subtask_seconds"] += sum(result.get("seconds", 0.0) for result in results)
+        logger.info(f"Ran {len(results)} subtasks in {wall_seconds:.2f}s...")
+
+        store_structured_result(tool_context.state, "subtasks", results=[
+            {key: result.get(key) for key in ("specialist", "request", "status", "result")} for result in results
+        ])
+        return {"status": "success", "results": results, "wall_seconds": round(wall_seconds, 2)}
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters, with the speedup of concurrent over serial execution of the same subtasks."""
+        with self._lock:
+            return {
+                **{key: round(value, 2) if isinstance(value, float) else value for key, value in self.stats.items()},
+                "speedup": round(self.stats["subtask_seconds"] / self.stats["wall_seconds"], 2)
+                if self.stats["wall_seconds"] else None,
+            }
+
+
+# Process-wide scheduler shared by all sessions of this worker
+fanout_scheduler = FanOutScheduler(settings.FANOUT_MAX_CONCURRENCY, settings.FANOUT_MAX_SUBTASKS)
@@ -0,0 +1,92 @@
+"""
+Content-addressed cache of extracted creative features.
+
+Entries are keyed on the SHA-256 of the media bytes, the extractor model and
+the tag taxonomy, so the same creative uploaded in chat or scored in a batch run is analyzed
+once. The cache is bounded (least recently used entries are evicted) and can
+be persisted to a JSONL file (`FEATURE_CACHE_FILE`) shared by chat workers
+and `scripts/score_creatives.py`.
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+from .settings import settings
+from .tag_registry import tag_registry
+
+logger = logging.getLogger(__name__)
+
+
+class FeatureCache:
+    """A thread-safe LRU cache of feature dictionaries with optional JSONL persistence."""
+
+    def __init__(self, max_entries: int, path: Optional[Path] = None):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, bool]]" = OrderedDict()
+        self.max_entries = max_entries
+        self.path = path
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        if path is not None and path.is_file():
+            self._load(path)
+
+    @staticmethod
+    def make_key(media: Iterable[bytes], model: str) -> str:
+        """Builds the cache key for the media parts of one creative, the extractor model and the tag taxonomy."""
+        digest = hashlib.sha256(model.encode("utf-8"))
+        digest.update(tag_registry.fingerprint.encode("utf-8"))
+        for data in media:
+            digest.update(hashlib.sha256(data).digest())
+        return digest.hexdigest()
+
+    def _load(self, path: Path) -> None:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    self._insert(entry["key"], entry["features"])
+                except (json.JSONDecodeError, KeyError) as e:
+                    logger.warning(f"Skipping malformed feature cache entry in {path}: {e}")
+        logger.info(f"Loaded {len(self._entries)} cached feature sets from {path}...")
+
+    def _insert(self, key: str, features: Dict[str, bool]) -> None:
+        self._entries[key] = features
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get(self, key: str) -> Optional[Dict[str, bool]]:
+        with self._lock:
+            features = self._entries.get(key)
+            if features is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return dict(features)
+
+    def put(self, key: str, features: Dict[str, bool]) -> None:
+        with self._lock:
+            is_new = key not in self._entries
+            self._insert(key, dict(features))
+        if is_new and self.path is not None:
+            try:
+                with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"key": key, "features": features}) + "\n")
+            except OSError as e:
+                logger.warning(f"Could not persist features to {self.path}: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries)}
+
+
+# Process-wide cache shared by all sessions of this worker
+feature_cache = FeatureCache(
+    max_entries=settings.FEATURE_CACHE_MAX_ENTRIES,
+    path=Path(settings.FEATURE_CACHE_FILE) if settings.FEATURE_CACHE_FILE else None,
+)
@@ -0,0 +1,246 @@
+"""
+Bounded conversation history for long sessions.
+
+Every model request carries the session's history, so without a bound its
+prompt tokens and latency grow with every turn. Before each model call of the
+orchestrator and the specialists, the history is compacted:
+- The last `HISTORY_WINDOW_TURNS` turns are kept verbatim, except that the tool
+  outputs of earlier turns above `HISTORY_TOOL_RESULT_MAX_TOKENS` and their
+  images and videos are replaced with short references. The current turn is
+  never changed, and the latest attached creative is kept until a prediction
+  has run on it, so a prediction confirmed in a later turn still sees it.
+- Older turns are folded into a summary. Each folded turn adds one digest line
+  to the summary: the question, the tools it ran and the start of the answer.
+  Digests are kept in the session state per agent, so every turn is
+  summarized once. The oldest digests are dropped beyond
+  `HISTORY_SUMMARY_MAX_TOKENS`.
+- If the result still exceeds `HISTORY_MAX_TOKENS`, more turns are folded.
+
+Token counts are estimated from the serialized size, about four characters
+per token.
+"""
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+# Gemini bills an image as 258 tokens; videos are larger, so this is a lower bound.
+MEDIA_TOKENS = 258
+QUESTION_DIGEST_CHARS = 300
+ANSWER_DIGEST_CHARS = 400
+# How ADK presents the messages of other agents to a model
+OTHER_AGENT_PREFIX = "For context:"
+SUMMARY_STATE_PREFIX = "history_summary_"
+# The tool whose result means an attached creative has been scored
+PREDICTION_TOOL = "SQLPredictionAgent"
+
+
+def estimate_tokens(contents: List[types.Content]) -> int:
+    chars, media = 0, 0
+    for content in contents:
+        for part in content.parts or []:
+            if part.text:
+                chars += len(part.text)
+            elif part.function_call:
+                chars += len(json.dumps(part.function_call.args or {}, default=str)) + len(part.function_call.name or "")
+            elif part.function_response:
+                chars += len(json.dumps(part.function_response.response or {}, default=str))
+            elif part.inline_data or part.file_data:
+                media += 1
+    return chars // CHARS_PER_TOKEN + media * MEDIA_TOKENS
+
+
+def _is_user_message(content: types.Content) -> bool:
+    """True for a message the user typed, as opposed to tool responses and other agents' messages."""
+    if content.role != "user" or not content.parts:
+        return False
+    if any(part.function_response for part in content.parts):
+        return False
+    return content.parts[0].text != OTHER_AGENT_PREFIX
+
+
+def _has_media(content: types.Content) -> bool:
+    return any(part.inline_data or part.file_data for part in content.parts or [])
+
+
+def _ran_prediction(contents: List[types.Content]) -> bool:
+    """True if the contents hold a prediction result, as a tool response or as another agent's message."""
+    rendered = f"`{PREDICTION_TOOL}` tool returned result: "
+    return any(
+        (part.function_response and part.function_response.name == PREDICTION_TOOL)
+        or (part.text and rendered in part.text)
+        for content in contents for part in content.parts or []
+    )
+
+
+def pending_media_turn(turns: List[List[types.Content]]) -> Optional[int]:
+    """The index of the latest turn whose user message carries media, if no prediction has run on it since."""
+    for index in range(len(turns) - 1, -1, -1):
+        if _is_user_message(turns[index][0]) and _has_media(turns[index][0]):
+            later = [content for turn in turns[index:] for content in turn]
+            return None if _ran_prediction(later) else index
+    return None
+
+
+def split_turns(contents: List[types.Content]) -> List[List[types.Content]]:
+    """Groups contents into turns, each starting with a user message."""
+    turns: List[List[types.Content]] = []
+    for content in contents:
+        if not turns or _is_user_message(content):
+            turns.append([])
+        turns[-1].append(content)
+    return turns
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars] + "..."
+
+
+def digest_turn(turn: List[types.Content]) -> str:
+    """One line that summarizes a turn: the question, the tools it ran and the start of the answer."""
+    question = " ".join(part.text for part in turn[0].parts or [] if part.text)
+    attachments = sum(1 for part in turn[0].parts or [] if part.inline_data or part.file_data)
+    tools, answer = [], ""
+    for content in turn[1:]:
+        for part in content.parts or []:
+            if part.function_call:
+                tools.append(part.function_call.name)
+            elif part.text and content.role == "model" and not part.thought:
+                answer = part.text
+            elif part.text and " said: " in part.text and " tool returned result: " not in part.text:
+                answer = part.text.split(" said: ", 1)[1]
+    line = f"User: {_truncate(question, QUESTION_DIGEST_CHARS)}"
+    if attachments:
+        line += f" [{attachments} attachment(s)]"
+    if tools:
+        line += f" | Tools: {', '.join(dict.fromkeys(tools))}"
+    if answer:
+        line += f" | Answer: {_truncate(answer, ANSWER_DIGEST_CHARS)}"
+    return line
+
+
+def _reference(response: types.FunctionResponse) -> types.FunctionResponse:
+    """A small stand-in for a bulky tool output."""
+    payload = response.response or {}
+    tokens = len(json.dumps(payload, default=str)) // CHARS_PER_TOKEN
+    reference: Dict[str, Any] = {"omitted": f"{tokens} tokens of output from an earlier turn"}
+    if "status" in payload:
+        reference["status"] = payload["status"]
+    for key in ("rows", "results"):
+        if isinstance(payload.get(key), list):
+            reference[f"{key}_count"] = len(payload[key])
+    return types.FunctionResponse(id=response.id, name=response.name, response=reference)
+
+
+def slim_turn(turn: List[types.Content], max_tool_tokens: int, keep_media: bool = False) -> List[types.Content]:
+    """A turn with bulky tool outputs and, unless `keep_media` is set, media replaced with references."""
+    max_chars = max_tool_tokens * CHARS_PER_TOKEN
+    slimmed = []
+    for content in turn:
+        parts = []
+        for part in content.parts or []:
+            if part.function_response and estimate_tokens([types.Content(parts=[part])]) > max_tool_tokens:
+                part = types.Part(function_response=_reference(part.function_response))
+            elif (part.inline_data or part.file_data) and not keep_media:
+                mime_type = (part.inline_data or part.file_data).mime_type
+                part = types.Part(text=f"[{mime_type} attachment from an earlier turn omitted]")
+            elif part.text and len(part.text) > max_chars and content.role == "user" and not _is_user_message(content):
+                # Another agent's tool output, rendered as text
+                part = types.Part(text=f"{part.text[:max_chars]}... [{len(part.text) // CHARS_PER_TOKEN} tokens omitted]")
+            parts.append(part)
+        slimmed.append(types.Content(role=content.role, parts=parts))
+    return slimmed
+
+
+def compact_contents(
+    contents: List[types.Content], summary: Optional[Mapping[str, Any]]
+) -> Tuple[List[types.Content], Dict[str, Any]]:
+    """
+    Returns the compacted contents and the updated summary state
+    (`{"folded": <turns folded>, "digests": [...]}`).
+    """
+    turns = split_turns(contents)
+    folded = summary.get("folded", 0) if summary else 0
+    digests = list(summary.get("digests", [])) if summary else []
+    if folded > len(turns):
+        # The history is shorter than what was folded, e.g. after a rewind.
+        folded, digests = 0, []
+
+    fold_until = max(folded, len(turns) - max(settings.HISTORY_WINDOW_TURNS, 1))
+    media_turn = pending_media_turn(turns)
+    slimmed = {}
+    while True:
+        for turn in turns[folded:fold_until]:
+            digests.append(digest_turn(turn))
+        folded = max(folded, fold_until)
+        while len(digests) > 1 and estimate_tokens([types.Content(parts=[types.Part(text="\n".join(digests))])]) \
+                > settings.HISTORY_SUMMARY_MAX_TOKENS:
+            digests.pop(0)
+
+        window = []
+        for index in range(folded, len(turns)):
+            if index == len(turns) - 1:
+                window.extend(turns[index])
+            else:
+                if index not in slimmed:
+                    slimmed[index] = slim_turn(
+                        turns[index], settings.HISTORY_TOOL_RESULT_MAX_TOKENS, keep_media=index == media_turn
+                    )
+                window.extend(slimmed[index])
+        compacted = window
+        if folded:
+            omitted = "(Earlier turns are omitted.)\n" if len(digests) < folded else ""
+            compacted = [types.Content(role="user", parts=[types.Part(
+                text=f"<CONVERSATION_SUMMARY>\nEarlier turns of this conversation, oldest first:\n{omitted}"
+                     + "\n".join(f"- {digest}" for digest in digests) + "\n</CONVERSATION_SUMMARY>"
+            )])] + window
+        if estimate_tokens(compacted) <= settings.HISTORY_MAX_TOKENS or folded >= len(turns) - 1:
+            return compacted, {"folded": folded, "digests": digests}
+        fold_until = folded + 1
+
+
+class HistoryCompactor:
+    """Counts compacted model requests and the estimated tokens they saved."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "compacted": 0, "tokens_before": 0, "tokens_after": 0}
+
+    def record(self, tokens_before: int, tokens_after: int) -> None:
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["compacted"] += tokens_after < tokens_before
+            self.stats["tokens_before"] += tokens_before
+            self.stats["tokens_after"] += tokens_after
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats)
+
+
+# Process-wide compactor shared by all sessions of this worker
+history_compactor = HistoryCompactor()
+
+
+def compact_history(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+    """before_model_callback: replaces the request's history with its compacted form."""
+    if not settings.HISTORY_COMPACTION or not llm_request.contents:
+        return None
+    state_key = SUMMARY_STATE_PREFIX + callback_context.agent_name
+    tokens_before = estimate_tokens(llm_request.contents)
+    contents, summary = compact_contents(llm_request.contents, callback_context.state.get(state_key))
+    if summary != callback_context.state.get(state_key) and summary["folded"]:
+        callback_context.state[state_key] = summary
+    llm_request.contents = contents
+    history_compactor.record(tokens_before, estimate_tokens(contents))
+    return None
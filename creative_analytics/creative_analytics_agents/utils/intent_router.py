@@ -0,0 +1,272 @@
+"""
+Local routing of unambiguous requests past the orchestrator's model turn.
+
+Before each orchestrator model call on a new user message, the message is
+classified locally:
+- A message with one image or video attachment is a prediction request and is
+  transferred to the performance predictor, unless it also asks for an
+  analysis of a known tag. Several creatives, or a prediction combined with an
+  analysis, are left to the orchestrator, which runs the parts concurrently.
+- A message is transferred to the statistical analyst when three signals agree.
+  An offline text model (the nearest TF-IDF centroid of the labeled examples in
+  `config/intent_examples.json`, with hashed n-gram features) classifies it as
+  a historical analysis by a margin of at least `INTENT_ROUTER_MIN_MARGIN`.
+  It contains an analysis cue from the orchestrator prompt ("impact of",
+  "compare", ...). And it names a creative tag of the session's schema, and
+  so does every tag slot: both sides of a comparison ("X vs Y", "X or Y"),
+  "ads with X" and "the X tag".
+
+Everything else goes to the orchestrator model, including confirmations,
+out-of-scope questions, questions about unknown tags and predictions without
+an asset. A routed message is answered with a `transfer_to_agent` call
+instead of a model response, so the orchestrator's long prompt is never sent.
+"""
+import json
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+
+from .answer_cache import normalize_question
+from .example_index import _hashed_features
+from .metering import meter
+from .schema_registry import SCHEMA_VERSION_STATE_KEY, schema_registry
+from .settings import settings
+from .tag_registry import tag_registry
+
+logger = logging.getLogger(__name__)
+
+EXAMPLES_FILE = Path(__file__).parent.parent / "config" / "intent_examples.json"
+ANALYSIS, PREDICTION, OTHER = "analysis", "prediction", "other"
+ANALYST_AGENT = "StatisticalAnalystAgent"
+PREDICTOR_AGENT = "PerformancePredictorCoordinator"
+ORCHESTRATOR_AGENT = "AdInsightsOrchestrator"
+
+# Keywords of the analyst's question types in the orchestrator prompt
+ANALYSIS_CUES = re.compile(
+    r"\b(impact of|boost|lift|how did|perform(ed|ance)?|compare|vs|versus|which is better|worked better|"
+    r"performed best|across metrics|every metric|median|typical|p90|outliers?|viral|average|"
+    r"views|clicks|impressions|conversions?|spend|ctr|cpc|cost per click|click through rate|significant)\b"
+)
+PREDICTION_CUES = re.compile(
+    r"\b(predict|prediction|forecast|will (this|it|my|the)|new (ad|creative|video|image)|"
+    r"probability of success|this (image|video|creative|asset|banner)|attached|upload(ed|ing)?)\b"
+)
+COMPARISON_WORDS = {"vs", "versus", "or"}
+# Words that may stand for the other side of a comparison instead of a tag
+REST_WORDS = {"without", "rest", "others", "other", "none", "no", "not", "neither"}
+# Words skipped when reading a slot, and words that end a comparison operand
+SLOT_FILLERS = {"a", "an", "the", "any", "ads", "ad", "ones", "one", "creatives", "videos", "with", "having"}
+OPERAND_BOUNDARIES = {
+    "on", "in", "for", "across", "by", "when", "and", "than", "to", "compare", "between", "of", "from",
+    "better", "best", "worse", "performed", "perform", "which", "is", "was", "did", "do",
+}
+TAG_WORDS = {"tag", "tags"}
+# Words that "with X" and "without X" describe, making X a tag slot
+SLOT_SUBJECTS = {"ads", "ad", "creatives", "videos", "ones", "one", "those"}
+
+
+@dataclass
+class IntentDecision:
+    """The agent a message is routed to, or None to let the orchestrator model decide."""
+
+    agent: Optional[str]
+    intent: str
+    margin: float
+    reason: str
+
+
+def message_text(content: Optional[types.Content]) -> str:
+    if content is None or not content.parts:
+        return ""
+    return " ".join(part.text for part in content.parts if part.text)
+
+
+def media_count(content: Optional[types.Content]) -> int:
+    """The number of images and videos in a message, inline or by URI."""
+    count = 0
+    for part in (content.parts or []) if content else []:
+        blob = part.inline_data or part.file_data
+        if blob is not None and (blob.mime_type or "").split("/")[0] in ("image", "video"):
+            count += 1
+    return count
+
+
+def schema_tags(database_settings: Mapping) -> List[str]:
+    """The creative tags of a schema: the tags stored in its raw (non-rollup) tables."""
+    tags = set()
+    for dataset in database_settings.values():
+        for table in dataset.get("tables", {}).values():
+            if table.get("rollup"):
+                continue
+            tags.update(name.lower() for name in tag_registry.schema_tags(table.get("schema_list") or ()))
+    return sorted(tags)
+
+
+def mentioned_tags(text: str, tags: Iterable[str]) -> List[str]:
+    """The tags a message names, by tag name, plural or registered alias."""
+    return tag_registry.mentioned(text, tags)
+
+
+def _names_tag(words: Iterable[str], tags: Iterable[str]) -> bool:
+    names = set(tags)
+    return any(
+        word in names or (word.endswith("s") and word[:-1] in names) or (word.endswith("es") and word[:-2] in names)
+        for word in words
+    )
+
+
+def unresolved_tag_slots(text: str, tags: Iterable[str]) -> List[str]:
+    """
+    The tag slots of a message that name no tag of `tags`: either side of a
+    comparison ("logo vs dog"), "ads with X" (or "ones"/"those with X") and
+    "the X tag".
+    """
+    tags = list(tags)
+    unresolved = []
+    # Clauses end at punctuation, so the operands of "animal, human or logo" are read per clause.
+    for clause in re.split(r"[,;:?!()\-]|\.(?!\w)", re.sub(r"\bvs\.", "vs", text.lower())):
+        words = tag_registry.normalize(clause)
+        for i, word in enumerate(words):
+            if word in COMPARISON_WORDS:
+                left, right = [], []
+                for before in reversed(words[:i]):
+                    if before in OPERAND_BOUNDARIES or len(left) == 2:
+                        break
+                    if before not in SLOT_FILLERS:
+                        left.insert(0, before)
+                for after in words[i + 1:]:
+                    if after in OPERAND_BOUNDARIES or len(right) == 2:
+                        break
+                    if after not in SLOT_FILLERS:
+                        right.append(after)
+                for operand in (left, right):
+                    if operand and not REST_WORDS.intersection(operand) and not _names_tag(operand, tags):
+                        unresolved.append(" ".join(operand))
+            elif word in ("with", "without") and i > 0 and words[i - 1] in SLOT_SUBJECTS:
+                slot = next((after for after in words[i + 1:] if after not in SLOT_FILLERS), None)
+                if slot is not None and not _names_tag([slot], tags):
+                    unresolved.append(slot)
+            elif word in TAG_WORDS and i > 1 and words[i - 2] == "the" and not _names_tag([words[i - 1]], tags):
+                unresolved.append(words[i - 1])
+    return unresolved
+
+
+class IntentModel:
+    """Nearest-centroid classifier over the hashed TF-IDF features of labeled example questions."""
+
+    def __init__(self, examples: Mapping[str, List[str]]):
+        self.labels = sorted(examples)
+        features = {label: np.stack([_hashed_features(q) for q in examples[label]]) for label in self.labels}
+        all_features = np.concatenate(list(features.values()))
+        self.idf = np.log((1 + len(all_features)) / (1 + (all_features > 0).sum(axis=0))) + 1
+        centroids = []
+        for label in self.labels:
+            weighted = features[label] * self.idf
+            weighted /= np.maximum(np.linalg.norm(weighted, axis=1, keepdims=True), 1e-12)
+            centroid = weighted.mean(axis=0)
+            centroids.append(centroid / max(float(np.linalg.norm(centroid)), 1e-12))
+        self.centroids = np.stack(centroids)
+
+    @classmethod
+    def from_file(cls, path: Path) -> "IntentModel":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """The closest label and its cosine similarity margin over the runner-up."""
+        query = _hashed_features(text) * self.idf
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        scores = self.centroids @ query
+        order = np.argsort(scores)[::-1]
+        return self.labels[order[0]], float(scores[order[0]] - scores[order[1]])
+
+
+class IntentRouter:
+    """Thread-safe local classifier with routing counters."""
+
+    def __init__(self, model: IntentModel, min_margin: float):
+        self._lock = threading.Lock()
+        self.model = model
+        self.min_margin = min_margin
+        self.stats = {"routed": {ANALYST_AGENT: 0, PREDICTOR_AGENT: 0}, "fallbacks": 0, "classifier_seconds": 0.0}
+
+    def classify(self, text: str, media: int, tags: Iterable[str]) -> IntentDecision:
+        """Routes a message with `media` attachments, or returns a decision without an agent when any signal is uncertain."""
+        normalized = normalize_question(text)
+        if media > 1:
+            return IntentDecision(None, PREDICTION, 1.0, "several creatives")
+        if media:
+            if ANALYSIS_CUES.search(normalized) and mentioned_tags(text, tags):
+                return IntentDecision(None, PREDICTION, 1.0, "prediction combined with an analysis")
+            return IntentDecision(PREDICTOR_AGENT, PREDICTION, 1.0, "media attachment")
+        intent, margin = self.model.predict(text)
+        if intent != ANALYSIS:
+            return IntentDecision(None, intent, margin, f"classified as {intent}")
+        if margin < self.min_margin:
+            return IntentDecision(None, intent, margin, "low margin")
+        if PREDICTION_CUES.search(normalized) or not ANALYSIS_CUES.search(normalized):
+            return IntentDecision(None, intent, margin, "no unambiguous analysis cue")
+        if not mentioned_tags(text, tags):
+            return IntentDecision(None, intent, margin, "no known tag named")
+        unresolved = unresolved_tag_slots(text, tags)
+        if unresolved:
+            return IntentDecision(None, intent, margin, f"unknown tag {unresolved[0]!r}")
+        return IntentDecision(ANALYST_AGENT, intent, margin, "analysis cue and known tag")
+
+    def record(self, decision: IntentDecision, seconds: float) -> None:
+        with self._lock:
+            self.stats["classifier_seconds"] += seconds
+            if decision.agent:
+                self.stats["routed"][decision.agent] += 1
+            else:
+                self.stats["fallbacks"] += 1
+
+    def snapshot(self) -> Dict:
+        """Routing counters, with the orchestrator time saved estimated from its metered mean latency."""
+        orchestrator = meter.snapshot()["by_agent"].get(ORCHESTRATOR_AGENT, {})
+        mean_seconds = orchestrator["latency_seconds"] / orchestrator["calls"] if orchestrator.get("calls") else None
+        with self._lock:
+            routed = sum(self.stats["routed"].values())
+            return {
+                "routed": dict(self.stats["routed"]),
+                "fallbacks": self.stats["fallbacks"],
+                "classifier_seconds": round(self.stats["classifier_seconds"], 4),
+                "estimated_seconds_saved": round(routed * mean_seconds, 2) if mean_seconds is not None else None,
+            }
+
+
+# Process-wide router shared by all sessions of this worker
+intent_router = IntentRouter(IntentModel.from_file(EXAMPLES_FILE), settings.INTENT_ROUTER_MIN_MARGIN)
+
+
+def route_intent(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+    """
+    before_model_callback: transfers a new user message to its specialist when
+    the local classifier is confident, skipping the orchestrator model call.
+    """
+    if not settings.INTENT_ROUTING or not llm_request.contents:
+        return None
+    content = llm_request.contents[-1]
+    # Only the orchestrator's first model call on a user message is routed.
+    if content.role != "user" or any(part.function_response for part in content.parts or []):
+        return None
+
+    start = time.perf_counter()
+    snapshot = schema_registry.resolve(callback_context.state.get(SCHEMA_VERSION_STATE_KEY))
+    decision = intent_router.classify(message_text(content), media_count(content), schema_tags(snapshot.database_settings))
+    intent_router.record(decision, time.perf_counter() - start)
+    if decision.agent is None:
+        return None
+    logger.info(f"Routing to {decision.agent} locally ({decision.reason}, margin {decision.margin:.2f})...")
+    return LlmResponse(content=types.Content(role="model", parts=[
+        types.Part(function_call=types.FunctionCall(name="transfer_to_agent", args={"agent_name": decision.agent}))
+    ]))
@@ -0,0 +1,225 @@
+"""
+Token and cost accounting for every model call.
+
+Agent model calls are metered with before/after model callbacks; a call that
+fails is dropped by the model error callback. The SQL
+generation call inside `generate_sql_for_analysis` is metered directly.
+Usage is aggregated per agent, per session and per brand and day, and every
+call can be appended to a JSONL metrics file (`METERING_FILE`).
+
+`SESSION_TOKEN_BUDGET` and `BRAND_DAILY_TOKEN_BUDGET` do not block requests.
+Once exceeded, the analyst switches to cheaper paths: it serves cached
+answers regardless of age and reports query results without a synthesis
+call.
+"""
+import datetime
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Mapping, Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+
+from .answer_cache import BRAND_STATE_KEY, DEFAULT_BRAND
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Session that usage is charged to; copied into the isolated sessions of agent tools
+METERED_SESSION_STATE_KEY = "metered_session_id"
+MAX_TRACKED_SESSIONS = 10000
+# Start times older than this belong to calls that were cancelled without a callback.
+STALE_CALL_SECONDS = 600.0
+USAGE_FIELDS = ("calls", "prompt_tokens", "response_tokens", "cached_tokens", "thoughts_tokens",
+                "total_tokens", "latency_seconds", "cost_usd")
+
+
+def _empty_usage() -> Dict[str, float]:
+    return {field: 0 for field in USAGE_FIELDS}
+
+
+def brand_of(state: Mapping[str, Any]) -> str:
+    """The brand scope of a session."""
+    return str(state.get(BRAND_STATE_KEY) or DEFAULT_BRAND)
+
+
+def metered_session_id(callback_context: CallbackContext) -> str:
+    """The session usage is charged to, which for agent tools is the calling session."""
+    return callback_context.state.get(METERED_SESSION_STATE_KEY) or callback_context.session.id
+
+
+class Meter:
+    """Thread-safe usage aggregates with optional JSONL export."""
+
+    def __init__(self, metrics_file: Optional[str] = None):
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self.metrics_file = metrics_file
+        self._by_agent: Dict[str, Dict[str, float]] = defaultdict(_empty_usage)
+        self._by_session: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+        self._by_brand_day: Dict[str, Dict[str, float]] = defaultdict(_empty_usage)
+        self._started: Dict[str, float] = {}
+        self.degraded = {"stale_cache_answers": 0, "skipped_synthesis": 0}
+
+    @staticmethod
+    def _brand_day_key(brand: str) -> str:
+        return f"{brand}|{datetime.datetime.now(datetime.timezone.utc).date().isoformat()}"
+
+    def start(self, call_key: str) -> None:
+        """Marks the start of a model call for latency measurement."""
+        now = time.perf_counter()
+        with self._lock:
+            stale = [key for key, started in self._started.items() if now - started > STALE_CALL_SECONDS]
+            for key in stale:
+                del self._started[key]
+            self._started[call_key] = now
+
+    def cancel(self, call_key: str) -> None:
+        """Forgets the start of a model call that will not be recorded."""
+        with self._lock:
+            self._started.pop(call_key, None)
+
+    def record(
+        self,
+        agent: str,
+        session_id: str,
+        brand: str,
+        model: str,
+        usage_metadata: Any,
+        call_key: Optional[str] = None,
+        latency_seconds: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """Adds one model call to the aggregates and the metrics file."""
+        with self._lock:
+            if call_key is not None and call_key in self._started:
+                latency_seconds = time.perf_counter() - self._started.pop(call_key)
+
+        prompt = getattr(usage_metadata, "prompt_token_count", None) or 0
+        response = getattr(usage_metadata, "candidates_token_count", None) or 0
+        thoughts = getattr(usage_metadata, "thoughts_token_count", None) or 0
+        usage = {
+            "calls": 1,
+            "prompt_tokens": prompt,
+            "response_tokens": response,
+            "cached_tokens": getattr(usage_metadata, "cached_content_token_count", None) or 0,
+            "thoughts_tokens": thoughts,
+            "total_tokens": getattr(usage_metadata, "total_token_count", None) or prompt + response + thoughts,
+            "latency_seconds": latency_seconds or 0.0,
+            "cost_usd": (
+                prompt * settings.TOKEN_PRICE_INPUT_PER_MILLION
+                + (response + thoughts) * settings.TOKEN_PRICE_OUTPUT_PER_MILLION
+            ) / 1_000_000,
+        }
+
+        with self._lock:
+            brand_day = self._brand_day_key(brand)
+            if brand_day not in self._by_brand_day:
+                # Daily budgets only need today's totals.
+                today = brand_day.split("|")[1]
+                for key in [key for key in self._by_brand_day if not key.endswith(f"|{today}")]:
+                    del self._by_brand_day[key]
+            session_usage = self._by_session.pop(session_id, None) or _empty_usage()
+            self._by_session[session_id] = session_usage
+            while len(self._by_session) > MAX_TRACKED_SESSIONS:
+                self._by_session.popitem(last=False)
+            for aggregate in (self._by_agent[agent], session_usage, self._by_brand_day[brand_day]):
+                for field, value in usage.items():
+                    aggregate[field] += value
+
+        record = {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "agent": agent, "session_id": session_id, "brand": brand, "model": model, **usage,
+        }
+        self._export(record)
+        return record
+
+    def _export(self, record: Dict[str, Any]) -> None:
+        if not self.metrics_file:
+            return
+        try:
+            with self._file_lock, open(self.metrics_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            logger.warning(f"Could not write metering record to {self.metrics_file}: {e}")
+
+    def session_usage(self, session_id: str) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._by_session.get(session_id) or _empty_usage())
+
+    def brand_usage_today(self, brand: str) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._by_brand_day.get(self._brand_day_key(brand)) or _empty_usage())
+
+    def budget_exceeded(self, session_id: Optional[str], state: Mapping[str, Any]) -> Optional[str]:
+        """Returns why the session or its brand is over budget, or None."""
+        if settings.SESSION_TOKEN_BUDGET and session_id:
+            used = self.session_usage(session_id)["total_tokens"]
+            if used >= settings.SESSION_TOKEN_BUDGET:
+                return f"session token budget was reached ({used:.0f}/{settings.SESSION_TOKEN_BUDGET})"
+        if settings.BRAND_DAILY_TOKEN_BUDGET:
+            brand = brand_of(state)
+            used = self.brand_usage_today(brand)["total_tokens"]
+            if used >= settings.BRAND_DAILY_TOKEN_BUDGET:
+                return f"daily token budget of brand '{brand}' was reached ({used:.0f}/{settings.BRAND_DAILY_TOKEN_BUDGET})"
+        return None
+
+    def record_degradation(self, kind: str) -> None:
+        with self._lock:
+            self.degraded[kind] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns usage per agent and per brand for today, and degraded-path counts."""
+        today = datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+        with self._lock:
+            return {
+                "by_agent": {agent: dict(usage) for agent, usage in self._by_agent.items()},
+                "by_brand_today": {
+                    key.split("|")[0]: dict(usage)
+                    for key, usage in self._by_brand_day.items() if key.endswith(f"|{today}")
+                },
+                "tracked_sessions": len(self._by_session),
+                "degraded": dict(self.degraded),
+            }
+
+
+# Process-wide meter shared by all sessions of this worker
+meter = Meter(metrics_file=settings.METERING_FILE)
+
+
+def _call_key(callback_context: CallbackContext) -> str:
+    return f"{callback_context.invocation_id}|{callback_context.agent_name}"
+
+
+def start_model_call(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+    """before_model_callback: starts the latency clock of a model call."""
+    meter.start(_call_key(callback_context))
+    return None
+
+
+def fail_model_call(
+    callback_context: CallbackContext, llm_request: LlmRequest, error: Exception
+) -> Optional[LlmResponse]:
+    """on_model_error_callback: forgets a failed call, whose after-model callbacks never run."""
+    meter.cancel(_call_key(callback_context))
+    return None
+
+
+def record_model_call(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+    """after_model_callback: records the usage of a completed model call."""
+    if llm_response.partial:
+        return None
+    if llm_response.usage_metadata is None:
+        meter.cancel(_call_key(callback_context))
+        return None
+    meter.record(
+        agent=callback_context.agent_name,
+        session_id=metered_session_id(callback_context),
+        brand=brand_of(callback_context.state),
+        model=llm_response.model_version or "",
+        usage_metadata=llm_response.usage_metadata,
+        call_key=_call_key(callback_context),
+    )
+    return None
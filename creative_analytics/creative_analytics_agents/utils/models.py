@@ -0,0 +1,75 @@
+"""
+Model construction for all agents.
+
+`MODEL_BACKEND=gemini` (the default) builds Gemini models. `MODEL_BACKEND=fake`
+builds `FakeLlm`, a deterministic, network-free model with a configurable
+latency. It is used to benchmark the serving stack without model calls.
+Either model is wrapped in `CassetteLlm` when `CASSETTE_MODE` records or
+replays model calls.
+"""
+import asyncio
+import json
+import logging
+from typing import AsyncGenerator, Optional, Type
+
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.adk.models.google_llm import Gemini
+from google.genai import types
+from google.genai.types import HttpRetryOptions
+from pydantic import BaseModel
+
+from .cassette import CassetteLlm
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+FAKE_STREAM_CHUNKS = 4
+
+
+def _fake_structured_answer(schema: Type[BaseModel]) -> str:
+    """A JSON object with a zero value for every field of `schema`."""
+    zero_values = {bool: False, int: 0, float: 0.0, str: ""}
+    return json.dumps({
+        name: zero_values.get(field.annotation)
+        for name, field in schema.model_fields.items()
+    })
+
+
+class FakeLlm(BaseLlm):
+    """
+    Answers every request with a short canned text after a fixed delay, or
+    with a zero-valued JSON object when a response schema is requested.
+    """
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        await asyncio.sleep(settings.FAKE_MODEL_LATENCY_SECONDS)
+
+        question = ""
+        if llm_request.contents and llm_request.contents[-1].parts:
+            question = " ".join(part.text for part in llm_request.contents[-1].parts if part.text)
+        answer = f"[{self.model}] Received {len(llm_request.contents)} message(s); last: {question[:200]}"
+        response_schema = llm_request.config.response_schema if llm_request.config else None
+        if isinstance(response_schema, type) and issubclass(response_schema, BaseModel):
+            answer = _fake_structured_answer(response_schema)
+
+        if stream:
+            step = max(1, len(answer) // FAKE_STREAM_CHUNKS)
+            for start in range(0, len(answer), step):
+                yield LlmResponse(
+                    content=types.Content(role="model", parts=[types.Part(text=answer[start:start + step])]),
+                    partial=True,
+                )
+        yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=answer)]))
+
+
+def create_model(model_name: str, retry_options: Optional[HttpRetryOptions] = None) -> BaseLlm:
+    """Returns the model for `model_name` on the configured backend."""
+    if settings.MODEL_BACKEND == "fake":
+        model: BaseLlm = FakeLlm(model=f"fake-{model_name}")
+    else:
+        model = Gemini(model=model_name, retry_options=retry_options)
+    if settings.CASSETTE_MODE != "off":
+        return CassetteLlm(model=model.model, inner=model)
+    return model
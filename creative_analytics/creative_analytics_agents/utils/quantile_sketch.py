@@ -0,0 +1,322 @@
+"""
+Mergeable quantile sketches for robust (median and p90) lift.
+
+View counts are heavy-tailed, so average lift is dominated by a few viral
+ads. Quantile lift compares, for example, the median of ads with a tag to the
+median of all ads. `KllSketch` is a KLL sketch (Karnin, Lang and Liberty,
+2016): a stack of compactors where level h holds items of weight 2^h. Its
+rank error is about 1.7 / k with high probability, independent of the number
+of rows, and two sketches merge into a sketch of the union with the same
+guarantee.
+
+`QuantileSketchStore` keeps one sketch per partition, tag combination and
+metric, and pre-merges them into one sketch per tag (the union of the tag
+combinations that contain it) and one over all ads as partitions are added.
+Robust lift is answered from those pre-merged sketches and never rescans the
+table; a replaced partition triggers a re-merge from the per-partition
+sketches.
+Stores are built by `scripts/build_quantile_sketches.py` and persisted as JSON
+(`QUANTILE_SKETCH_FILE`).
+"""
+import json
+import logging
+import math
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_K = settings.QUANTILE_SKETCH_K
+CAPACITY_DECAY = 2.0 / 3.0
+DEFAULT_QUANTILES = (0.5, 0.9)
+
+Stratum = Tuple[bool, ...]
+
+
+class KllSketch:
+    """A mergeable KLL quantile sketch over floats."""
+
+    def __init__(self, k: int = DEFAULT_K, seed: Optional[int] = None):
+        self.k = k
+        self.n = 0
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(int(math.ceil(self.k * CAPACITY_DECAY ** depth)), 2)
+
+    def _size(self) -> int:
+        return sum(len(items) for items in self.levels)
+
+    def _max_size(self) -> int:
+        return sum(self._capacity(level) for level in range(len(self.levels)))
+
+    def _compress(self) -> None:
+        while self._size() > self._max_size():
+            for level, items in enumerate(self.levels):
+                if len(items) < self._capacity(level):
+                    continue
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # An odd item out stays behind so total weight is preserved.
+                keep = items[-1:] if len(items) % 2 else items[:0]
+                pairs = items[:len(items) - len(keep)]
+                promoted = pairs[self._rng.integers(2)::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                break
+
+    def update(self, values: Iterable[float]) -> "KllSketch":
+        """Adds values; NaNs are ignored."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self.n += len(values)
+            self._compress()
+        return self
+
+    def merge(self, other: "KllSketch") -> "KllSketch":
+        """Adds every item of `other` to this sketch."""
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def copy(self) -> "KllSketch":
+        clone = KllSketch(self.k)
+        clone.n = self.n
+        clone.levels = [items.copy() for items in self.levels]
+        return clone
+
+    def quantiles(self, qs: Sequence[float]) -> List[Optional[float]]:
+        """Approximate quantiles for the fractions `qs`, or None for an empty sketch."""
+        if self.n == 0:
+            return [None for _ in qs]
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_items), 2.0 ** level) for level, level_items in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        cumulative = np.cumsum(weights[order])
+        positions = np.searchsorted(cumulative, np.asarray(qs) * cumulative[-1], side="left")
+        return [float(items[order][min(p, len(items) - 1)]) for p in positions]
+
+    def rank_error_bound(self) -> float:
+        """Typical normalized rank error of this sketch's size."""
+        return 1.7 / self.k
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"k": self.k, "n": self.n, "levels": [items.tolist() for items in self.levels]}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "KllSketch":
+        sketch = cls(data["k"])
+        sketch.n = data["n"]
+        sketch.levels = [np.asarray(items, dtype=np.float64) for items in data["levels"]] or [np.empty(0)]
+        return sketch
+
+
+def _lift(segment: Optional[float], overall: Optional[float]) -> Optional[float]:
+    if segment is None or not overall:
+        return None
+    return (segment / overall - 1.0) * 100.0
+
+
+class QuantileSketchStore:
+    """Sketches per partition, tag combination and metric, with pre-merged views."""
+
+    def __init__(
+        self,
+        tags: Sequence[str],
+        metrics: Sequence[str],
+        k: int = DEFAULT_K,
+        table: str = "",
+        source_modified: Optional[str] = None,
+    ):
+        self._lock = threading.Lock()
+        self.table = table
+        # Modification time (ISO 8601) of `table` when it was last sketched, to tell when the table changed since
+        self.source_modified = source_modified
+        self.tags = list(tags)
+        self.metrics = list(metrics)
+        self.k = k
+        self.partitions: Dict[str, Dict[Stratum, Dict[str, KllSketch]]] = {}
+        # Merged across partitions and tag combinations, per metric
+        self._overall: Dict[str, KllSketch] = {}
+        self._by_tag: Dict[str, Dict[str, KllSketch]] = {tag: {} for tag in self.tags}
+
+    def add_partition(
+        self,
+        partition: str,
+        tag_matrix: np.ndarray,
+        metric_values: Dict[str, np.ndarray],
+        seed: Optional[int] = None,
+    ) -> None:
+        """
+        Sketches one partition's rows, replacing any earlier sketches of it.
+
+        Args:
+            partition: Partition identifier, e.g. a load date.
+            tag_matrix: Boolean array of shape (n, T) in the order of `self.tags`.
+            metric_values: Mapping of metric name to an array of shape (n,).
+            seed: Seed for the compaction coin flips.
+        """
+        tag_matrix = np.asarray(tag_matrix, dtype=bool).reshape(-1, len(self.tags))
+        combinations, inverse = np.unique(tag_matrix, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        sketches: Dict[Stratum, Dict[str, KllSketch]] = {}
+        for index, combination in enumerate(combinations):
+            rows = inverse == index
+            sketches[tuple(bool(v) for v in combination)] = {
+                metric: KllSketch(self.k, seed=seed).update(np.asarray(metric_values[metric], dtype=np.float64)[rows])
+                for metric in self.metrics
+            }
+        with self._lock:
+            replaced = partition in self.partitions
+            self.partitions[partition] = sketches
+            if replaced:
+                self._rebuild_merged()
+            else:
+                self._merge_into_views(sketches)
+
+    def _merge_into_views(self, sketches: Dict[Stratum, Dict[str, KllSketch]]) -> None:
+        for stratum, by_metric in sketches.items():
+            targets = [self._overall] + [self._by_tag[tag] for tag, has_tag in zip(self.tags, stratum) if has_tag]
+            for target in targets:
+                for metric, sketch in by_metric.items():
+                    if metric in target:
+                        target[metric].merge(sketch)
+                    else:
+                        target[metric] = sketch.copy()
+
+    def _rebuild_merged(self) -> None:
+        self._overall = {}
+        self._by_tag = {tag: {} for tag in self.tags}
+        for sketches in self.partitions.values():
+            self._merge_into_views(sketches)
+
+    def segment_sketch(self, metric: str, tag: Optional[str] = None) -> KllSketch:
+        """The pre-merged sketch of `metric` over ads with `tag`, or over all ads."""
+        with self._lock:
+            view = self._overall if tag is None else self._by_tag[tag]
+            sketch = view.get(metric)
+            return sketch.copy() if sketch is not None else KllSketch(self.k)
+
+    def robust_lift(
+        self,
+        tags: Sequence[str],
+        metric: str,
+        quantiles: Sequence[float] = DEFAULT_QUANTILES,
+    ) -> Dict[str, Any]:
+        """
+        Quantile lift of every tag: each quantile of the segment relative to the
+        same quantile of all ads, in percent.
+
+        Raises:
+            ValueError: If a tag or the metric is not in the store.
+        """
+        unknown = [tag for tag in tags if tag not in self.tags]
+        if unknown:
+            raise ValueError(f"No sketches for tags {unknown}. Sketched tags: {self.tags}")
+        if metric not in self.metrics:
+            raise ValueError(f"No sketches for metric '{metric}'. Sketched metrics: {self.metrics}")
+
+        names = [f"p{round(q * 100):g}" for q in quantiles]
+        overall = dict(zip(names, self.segment_sketch(metric).quantiles(quantiles)))
+        results = []
+        for tag in tags:
+            sketch = self.segment_sketch(metric, tag)
+            segment = dict(zip(names, sketch.quantiles(quantiles)))
+            results.append({
+                "tag": tag,
+                "segment_size": sketch.n,
+                "segment_quantiles": segment,
+                "percentage_lift": {name: _lift(segment[name], overall[name]) for name in names},
+            })
+        return {
+            "metric": metric,
+            "overall_quantiles": overall,
+            "results": results,
+            "partitions": len(self.partitions),
+            "rank_error_bound": 1.7 / self.k,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "table": self.table,
+                "source_modified": self.source_modified,
+                "tags": self.tags,
+                "metrics": self.metrics,
+                "k": self.k,
+                "partitions": {
+                    partition: [
+                        {"tags": list(stratum), "sketches": {m: s.to_dict() for m, s in by_metric.items()}}
+                        for stratum, by_metric in sketches.items()
+                    ]
+                    for partition, sketches in self.partitions.items()
+                },
+            }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "QuantileSketchStore":
+        store = cls(
+            data["tags"], data["metrics"], k=data.get("k", DEFAULT_K),
+            table=data.get("table", ""), source_modified=data.get("source_modified"),
+        )
+        store.partitions = {
+            partition: {
+                tuple(entry["tags"]): {m: KllSketch.from_dict(s) for m, s in entry["sketches"].items()}
+                for entry in strata
+            }
+            for partition, strata in data["partitions"].items()
+        }
+        store._rebuild_merged()
+        return store
+
+    def save(self, path: Path) -> None:
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "QuantileSketchStore":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+_store_lock = threading.Lock()
+_store: Optional[QuantileSketchStore] = None
+_store_mtime: Optional[float] = None
+
+
+def get_sketch_store() -> Optional[QuantileSketchStore]:
+    """The store at `QUANTILE_SKETCH_FILE`, reloaded when the file changes; None if unavailable."""
+    global _store, _store_mtime
+    if not settings.QUANTILE_SKETCH_FILE:
+        return None
+    path = Path(settings.QUANTILE_SKETCH_FILE)
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return None
+    with _store_lock:
+        if _store is None or mtime != _store_mtime:
+            try:
+                _store = QuantileSketchStore.load(path)
+                _store_mtime = mtime
+                logger.info(f"Loaded quantile sketches for {len(_store.partitions)} partitions from {path}...")
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Could not load quantile sketches from {path}: {e}")
+                return _store
+        return _store
@@ -0,0 +1,83 @@
+"""
+Background refresh of the shared database settings.
+
+A daemon thread polls the metadata of the configured tables every
+`SCHEMA_REFRESH_SECONDS`. Metadata reads are free and fast; only tables whose
+etag changed are inspected further, and a new schema version is published
+only when a table's schema prompt actually changed. Agents and the SQL
+generation tool pick up the new version on their next invocation, without a
+restart and without blocking requests in flight.
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from .database_context import refresh_database_settings
+from .schema_registry import schema_registry
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaRefresher:
+    """Polls table metadata in a background thread and hot-swaps changed schemas."""
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_swap_at: Optional[float] = None
+        self.stats = {"polls": 0, "swaps": 0, "errors": 0}
+
+    def refresh_once(self) -> bool:
+        """Runs one poll; returns True if a new schema version was published."""
+        try:
+            snapshot = refresh_database_settings()
+        except Exception as e:
+            with self._lock:
+                self.stats["errors"] += 1
+            logger.warning(f"Schema refresh failed, keeping the current version. Error: {e}")
+            return False
+        with self._lock:
+            self.stats["polls"] += 1
+            if snapshot is not None:
+                self.stats["swaps"] += 1
+                self.last_swap_at = time.time()
+        if snapshot is not None:
+            logger.info(f"Schema changed; sessions use version {snapshot.version} from their next turn...")
+        return snapshot is not None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            self.refresh_once()
+
+    def start(self) -> None:
+        """Starts polling, unless disabled or already running."""
+        with self._lock:
+            if self.interval_seconds <= 0 or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="schema-refresher", daemon=True)
+            self._thread.start()
+        logger.info(f"Checking table metadata for schema changes every {self.interval_seconds:g}s...")
+
+    def stop(self) -> None:
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def snapshot(self) -> Dict[str, Any]:
+        current = schema_registry.current()
+        with self._lock:
+            return {
+                **self.stats,
+                "schema_version": current.version if current else None,
+                "last_swap_at": self.last_swap_at,
+            }
+
+
+# Process-wide refresher shared by all sessions of this worker
+schema_refresher = SchemaRefresher(settings.SCHEMA_REFRESH_SECONDS)
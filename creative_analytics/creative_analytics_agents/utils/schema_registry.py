@@ -0,0 +1,110 @@
+"""
+Process-level registry of immutable database schema snapshots.
+
+Sessions store only the short version key of the snapshot they were started
+with (under `SCHEMA_VERSION_STATE_KEY`), instead of a copy of the full
+`database_settings` dictionary. Tools resolve the schema through the registry,
+so the per-table `schema_prompt` text is held once per process rather than
+serialized into every persisted session.
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Any, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION_STATE_KEY = "schema_version"
+MAX_RETAINED_VERSIONS = 8
+
+
+def _freeze(value: Any) -> Any:
+    """Recursively converts dictionaries and lists into read-only equivalents."""
+    if isinstance(value, Mapping):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Inverse of `_freeze`: a mutable copy of snapshot content, e.g. to build the next version from."""
+    if isinstance(value, Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+class SchemaSnapshot:
+    """An immutable, versioned view of the database settings and their prompt."""
+
+    __slots__ = ("version", "database_settings", "database_definitions_prompt")
+
+    def __init__(self, version: str, database_settings: Mapping[str, Any], database_definitions_prompt: str):
+        self.version = version
+        self.database_settings = database_settings
+        self.database_definitions_prompt = database_definitions_prompt
+
+
+class SchemaRegistry:
+    """Thread-safe store of schema snapshots keyed by a content-derived version."""
+
+    def __init__(self, max_versions: int = MAX_RETAINED_VERSIONS):
+        self._lock = threading.Lock()
+        self._snapshots: "OrderedDict[str, SchemaSnapshot]" = OrderedDict()
+        self._current: Optional[SchemaSnapshot] = None
+        self._max_versions = max_versions
+
+    @staticmethod
+    def compute_version(database_settings: Mapping[str, Any], database_definitions_prompt: str) -> str:
+        """Derives a stable version key from the snapshot content."""
+        payload = json.dumps(
+            {"settings": thaw(database_settings), "prompt": database_definitions_prompt},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    def publish(self, database_settings: Mapping[str, Any], database_definitions_prompt: str) -> SchemaSnapshot:
+        """Freezes and registers a snapshot, making it the current version."""
+        version = self.compute_version(database_settings, database_definitions_prompt)
+        with self._lock:
+            snapshot = self._snapshots.get(version)
+            if snapshot is None:
+                snapshot = SchemaSnapshot(version, _freeze(database_settings), database_definitions_prompt)
+                self._snapshots[version] = snapshot
+                while len(self._snapshots) > self._max_versions:
+                    self._snapshots.popitem(last=False)
+                logger.info(f"Published schema snapshot version {version}...")
+            self._snapshots.move_to_end(version)
+            self._current = snapshot
+        return snapshot
+
+    def current(self) -> Optional[SchemaSnapshot]:
+        """Returns the most recently published snapshot, if any."""
+        return self._current
+
+    def resolve(self, version: Optional[str]) -> SchemaSnapshot:
+        """
+        Returns the snapshot for `version`, falling back to the current one when
+        the version is unknown to this process (e.g. a session started on
+        another worker or before a restart).
+        """
+        with self._lock:
+            snapshot = self._snapshots.get(version) if version else None
+            current = self._current
+        if snapshot is not None:
+            return snapshot
+        if current is None:
+            raise LookupError("No schema snapshot has been published yet.")
+        if version:
+            logger.warning(f"Schema version {version} is unknown; using current version {current.version}...")
+        return current
+
+
+# Process-wide registry shared by every agent and tool
+schema_registry = SchemaRegistry()
@@ -1,3 +1,5 @@
+from typing import Literal, Optional
+
 from pydantic import Field
 from pydantic_settings import BaseSettings
 from pathlib import Path
@@ -21,6 +23,9 @@ class AppSettings(BaseSettings):
     # ---- Dataset Config JSON File ----
     DATASET_CONFIG_FILE: str = Field(..., description="Path to dataset config JSON file")
 
+    # ---- Schema refresh ----
+    SCHEMA_REFRESH_SECONDS: float = Field(300, description="Seconds between checks of table metadata for schema changes; 0 disables")
+
     # ---- Vertex AI flag ----
     GOOGLE_GENAI_USE_VERTEXAI: int = Field(..., description="Enable vertex ai")
 
@@ -29,6 +34,88 @@ class AppSettings(BaseSettings):
     STATS_AGENT_MODEL: str = Field(..., description="Model for the stat agent")
     PREDICTOR_AGENT_MODEL: str = Field(..., description="Model for predictor agent")
 
+    # ---- Model backend ----
+    MODEL_BACKEND: Literal["gemini", "fake"] = Field("gemini", description="'fake' replaces every model with a local canned-response model")
+    FAKE_MODEL_LATENCY_SECONDS: float = Field(0.05, description="Simulated latency of each fake model call")
+
+    # ---- Record and replay ----
+    CASSETTE_MODE: Literal["off", "record", "replay"] = Field("off", description="Record model and BigQuery exchanges to the cassette, or replay them from it")
+    CASSETTE_FILE: str = Field("cassette.jsonl.gz", description="Gzip-compressed JSONL cassette file")
+    CASSETTE_REPLAY_LATENCY: Literal["recorded", "zero"] = Field("zero", description="Replay each exchange after its recorded latency, or immediately")
+
+    # ---- Conversation history ----
+    HISTORY_COMPACTION: bool = Field(True, description="Summarize older turns and drop bulky tool outputs from model requests")
+    HISTORY_WINDOW_TURNS: int = Field(4, description="Most recent turns sent to the models verbatim")
+    HISTORY_MAX_TOKENS: int = Field(16000, description="Estimated token cap of the history sent with a model request")
+    HISTORY_SUMMARY_MAX_TOKENS: int = Field(2000, description="Estimated token cap of the summary of older turns")
+    HISTORY_TOOL_RESULT_MAX_TOKENS: int = Field(500, description="Tool outputs of earlier turns above this size are replaced with references")
+
+    # ---- Tool execution ----
+    USE_ASYNC_TOOLS: bool = Field(False, description="Use non-blocking async SQL generation and execution tools")
+    BQ_POLL_INITIAL_DELAY: float = Field(0.1, description="First delay in seconds between BigQuery job status polls")
+    BQ_POLL_MAX_DELAY: float = Field(1.0, description="Maximum delay in seconds between BigQuery job status polls")
+    BQ_MAX_RESULT_ROWS: int = Field(50, description="Maximum number of rows returned by execute_sql")
+
+    # ---- SQL validation ----
+    SQL_GENERATION_ATTEMPTS: int = Field(2, description="SQL generations per question when a generated query fails local validation")
+
+    # ---- Aggregate routing ----
+    AGGREGATE_ROUTING: bool = Field(True, description="Route queries to the smallest declared rollup table that answers them exactly")
+
+    # ---- Intent routing ----
+    INTENT_ROUTING: bool = Field(True, description="Route unambiguous requests to a specialist without the orchestrator model call")
+    INTENT_ROUTER_MIN_MARGIN: float = Field(0.1, description="Minimum similarity margin of the local intent model to route a request")
+
+    # ---- Parallel subtasks ----
+    FANOUT_MAX_CONCURRENCY: int = Field(4, description="Subtasks of compound requests running at once per worker")
+    FANOUT_MAX_SUBTASKS: int = Field(8, description="Maximum number of subtasks per request")
+
+    # ---- Few-shot retrieval ----
+    FEW_SHOT_RETRIEVAL: bool = Field(False, description="Use the most similar verified question/SQL pairs as prompt examples")
+    FEW_SHOT_TOP_K: int = Field(2, description="Number of retrieved examples per SQL generation prompt")
+    FEW_SHOT_MIN_SIMILARITY: float = Field(0.3, description="Minimum cosine similarity of a retrieved example")
+    FEW_SHOT_MAX_EXAMPLES: int = Field(500, description="Maximum number of verified examples kept per worker")
+    FEW_SHOT_INDEX_FILE: Optional[str] = Field(None, description="JSONL file to persist verified examples across restarts")
+
+    # ---- Speculative execution ----
+    SPECULATIVE_EXECUTION: bool = Field(False, description="Run planned analyses while awaiting confirmation (requires USE_ASYNC_TOOLS)")
+    SPECULATION_TTL_SECONDS: int = Field(600, description="Discard unclaimed speculative analyses after this many seconds")
+
+    # ---- Answer cache ----
+    ANSWER_CACHE_ENABLED: bool = Field(False, description="Serve repeated analytical questions from a cross-user answer cache")
+    ANSWER_CACHE_MAX_ENTRIES: int = Field(1024, description="Maximum number of cached answers per worker")
+    ANSWER_CACHE_MAX_BYTES: int = Field(64 * 1024 * 1024, description="Maximum serialized size of the answer cache per worker")
+    ANSWER_CACHE_MAX_STALENESS_SECONDS: float = Field(3600, description="Ignore cached answers older than this many seconds")
+    ANSWER_CACHE_VERSION_CHECK_SECONDS: float = Field(60, description="How often to re-read table and model versions")
+
+    # ---- Approximate queries ----
+    APPROXIMATE_MODE: bool = Field(False, description="Allow sampled lift matrices with confidence bounds for exploratory questions")
+    APPROX_TARGET_BYTES: int = Field(10 * 1024 ** 3, description="Bytes an approximate query may scan")
+    APPROX_TARGET_SECONDS: float = Field(0, description="Latency target of an approximate query, using the observed scan throughput; 0 disables")
+    APPROX_MIN_SAMPLE_ROWS: int = Field(100_000, description="Smallest expected number of sampled rows")
+    APPROX_MAX_STRATIFIED_TAGS: int = Field(12, description="Most tags to stratify by; larger requests are computed exactly")
+
+    # ---- Quantile sketches ----
+    QUANTILE_SKETCH_FILE: Optional[str] = Field(None, description="JSON file of pre-merged quantile sketches for median and p90 lift")
+    QUANTILE_SKETCH_K: int = Field(200, description="KLL sketch size; rank error is about 1.7 / k")
+
+    # ---- Feature cache ----
+    FEATURE_CACHE_MAX_ENTRIES: int = Field(100_000, description="Maximum number of cached feature sets per process")
+    FEATURE_CACHE_FILE: Optional[str] = Field(None, description="JSONL file to persist extracted features across runs and workers")
+
+    # ---- Metering and budgets ----
+    METERING_FILE: Optional[str] = Field(None, description="JSONL file receiving one usage record per model call")
+    TOKEN_PRICE_INPUT_PER_MILLION: float = Field(0.30, description="USD per million prompt tokens, for cost estimates")
+    TOKEN_PRICE_OUTPUT_PER_MILLION: float = Field(2.50, description="USD per million response and thinking tokens, for cost estimates")
+    SESSION_TOKEN_BUDGET: int = Field(0, description="Tokens per session before cheaper degraded paths are used; 0 disables")
+    BRAND_DAILY_TOKEN_BUDGET: int = Field(0, description="Tokens per brand and UTC day before cheaper degraded paths are used; 0 disables")
+
+    # ---- HTTP server ----
+    SERVER_MAX_CONCURRENT_RUNS: int = Field(32, description="Agent runs executing at once per server worker")
+    SERVER_MAX_QUEUED_REQUESTS: int = Field(64, description="Requests allowed to wait for a run slot before rejecting with 503")
+    SERVER_QUEUE_TIMEOUT_SECONDS: float = Field(10.0, description="Longest a request waits for a run slot before rejecting with 503")
+    SERVER_SESSION_DB_URL: Optional[str] = Field(None, description="Database URL for sessions shared by all workers; in-memory per worker if unset")
+
     class Config:
         env_file = Path(__file__).parent.parent / ".env"
         env_file_encoding = "utf-8"
@@ -0,0 +1,466 @@
+"""
+Local validation and rewriting of generated SQL.
+
+Generated queries are parsed with sqlglot before they reach BigQuery. A query is
+rejected when it does not parse, is not a single read-only SELECT, or
+references a table or column that is not in the cached schema. A syntax error
+or a hallucinated column is caught locally rather than after a BigQuery job
+round trip.
+
+Lift queries in the one-branch-per-tag `UNION ALL` form, or the
+`CROSS JOIN UNNEST([...tags])` form, scan the table once per tag or multiply
+every row by the number of tags. These are rewritten into a single scan with
+conditional aggregation, keeping the output columns and the lift expression
+of the original query.
+"""
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError, TokenError
+
+logger = logging.getLogger(__name__)
+
+DIALECT = "bigquery"
+BOOLEAN_TYPES = ("BOOLEAN", "BOOL")
+
+# Table catalog: lower-cased "project.dataset.table" -> {lower-cased column: type}
+Catalog = Dict[str, Dict[str, str]]
+
+
+def build_catalog(database_settings: Mapping[str, Any]) -> Catalog:
+    """Builds the table catalog from the cached database settings."""
+    catalog: Catalog = {}
+    for dataset in database_settings.values():
+        for table_name, table_info in dataset.get("tables", {}).items():
+            table_id = f"{dataset['project_id']}.{dataset['dataset_id']}.{table_name}".lower()
+            catalog[table_id] = {name.lower(): dtype for name, dtype in table_info.get("schema_list", [])}
+    return catalog
+
+
+def _table_id(table: exp.Table, default_project: str) -> str:
+    """Fully qualified, lower-cased id of a table reference."""
+    parts = [table.catalog or default_project, table.db, table.name]
+    return ".".join(part for part in parts if part).lower()
+
+
+def _cte_names(tree: exp.Expression) -> set:
+    return {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+
+
+def validate_sql(sql: str, catalog: Catalog, default_project: str) -> exp.Expression:
+    """
+    Parses `sql` and checks it against `catalog`.
+
+    Returns the parsed query. Raises ValueError describing the first problem
+    found: a syntax error, more than one statement, a statement other than
+    SELECT, or an unknown table or column.
+    """
+    try:
+        statements = [s for s in sqlglot.parse(sql, read=DIALECT) if s is not None]
+    except ParseError as e:
+        error = e.errors[0] if e.errors else {}
+        raise ValueError(
+            f"Syntax error at line {error.get('line')}, column {error.get('col')}: "
+            f"{error.get('description', str(e))}"
+        ) from e
+    except TokenError as e:
+        raise ValueError(f"Syntax error: {e}") from e
+
+    if len(statements) != 1:
+        raise ValueError(f"Expected exactly one SQL statement, found {len(statements)}.")
+    tree = statements[0]
+    if not isinstance(tree, exp.Query):
+        raise ValueError("Only read-only SELECT queries are allowed.")
+
+    ctes = _cte_names(tree)
+    alias_columns: Dict[str, Dict[str, str]] = {}
+    for table in tree.find_all(exp.Table):
+        if not table.db and table.name.lower() in ctes:
+            continue
+        table_id = _table_id(table, default_project)
+        if table_id not in catalog:
+            raise ValueError(f"Unknown table `{table_id}`. Available tables: {sorted(catalog)}")
+        alias_columns[table.alias_or_name.lower()] = catalog[table_id]
+
+    # Names the query defines itself: select aliases, table and CTE aliases, UNNEST columns.
+    defined = set(ctes)
+    for alias in tree.find_all(exp.Alias):
+        defined.add(alias.alias.lower())
+    for table_alias in tree.find_all(exp.TableAlias):
+        defined.add(table_alias.name.lower())
+        defined.update(column.name.lower() for column in table_alias.columns)
+    all_columns = {name for columns in alias_columns.values() for name in columns}
+
+    unknown = []
+    for column in tree.find_all(exp.Column):
+        name = column.name.lower()
+        qualifier = column.table.lower()
+        if qualifier in alias_columns:
+            known = name in alias_columns[qualifier]
+        else:
+            known = name in all_columns or name in defined or qualifier in defined
+        if not known and column.sql(dialect=DIALECT) not in unknown:
+            unknown.append(column.sql(dialect=DIALECT))
+    if unknown:
+        raise ValueError(f"Unknown column(s): {', '.join(unknown)}. Available columns: {sorted(all_columns)}")
+    return tree
+
+
+def count_table_scans(tree: exp.Expression, catalog: Catalog, default_project: str) -> int:
+    """Counts base table scans, expanding each CTE reference into the scans of its body."""
+    cte_bodies = {cte.alias_or_name.lower(): cte.this for cte in tree.find_all(exp.CTE)}
+    memo: Dict[str, int] = {}
+
+    def scans(node: exp.Expression) -> int:
+        total = 0
+        for table in node.find_all(exp.Table):
+            name = table.name.lower()
+            if not table.db and name in cte_bodies:
+                if name not in memo:
+                    memo[name] = 0  # guards against self-referencing CTEs
+                    memo[name] = scans(cte_bodies[name])
+                total += memo[name]
+            elif _table_id(table, default_project) in catalog:
+                total += 1
+        return total
+
+    main = tree.copy()
+    main.set("with_", None)
+    return scans(main)
+
+
+@dataclass
+class _LiftPattern:
+    """A recognized per-tag lift query."""
+    table: exp.Table
+    metric: str
+    overall_alias: str
+    tags: List[Tuple[str, str]]
+    label_alias: str
+    lift_alias: str
+    lift_expression: exp.Expression
+    segment_alias: str
+    overall_table_alias: str
+
+
+def _overall_cte(tree: exp.Expression) -> Optional[Tuple[str, exp.Table, str, str]]:
+    """Matches `WITH X AS (SELECT AVG(metric) AS alias FROM base)`; returns (name, base, metric, alias)."""
+    with_ = tree.args.get("with_")
+    if with_ is None or len(with_.expressions) != 1:
+        return None
+    cte = with_.expressions[0]
+    body = cte.this
+    if not isinstance(body, exp.Select) or len(body.expressions) != 1:
+        return None
+    if any(body.args.get(key) for key in ("joins", "where", "group", "having", "order", "limit", "distinct")):
+        return None
+    projection = body.expressions[0]
+    source = body.args.get("from_")
+    if not (
+        isinstance(projection, exp.Alias)
+        and isinstance(projection.this, exp.Avg)
+        and isinstance(projection.this.this, exp.Column)
+        and source is not None
+        and isinstance(source.this, exp.Table)
+    ):
+        return None
+    return cte.alias_or_name, source.this, projection.this.this.name, projection.alias
+
+
+def _tag_column(condition: exp.Expression, segment_alias: str, catalog_columns: Dict[str, str]) -> Optional[str]:
+    """Matches `t.tag = TRUE`, `t.tag IS TRUE` or `t.tag` on a boolean column; returns the column name."""
+    if isinstance(condition, exp.Paren):
+        condition = condition.this
+    if isinstance(condition, (exp.EQ, exp.Is)) and isinstance(condition.expression, exp.Boolean) \
+            and condition.expression.this is True:
+        condition = condition.this
+    if not isinstance(condition, exp.Column) or condition.table.lower() not in ("", segment_alias.lower()):
+        return None
+    if catalog_columns.get(condition.name.lower()) not in BOOLEAN_TYPES:
+        return None
+    return condition.name
+
+
+def _sources(select: exp.Select, cte_name: str) -> Optional[Tuple[str, str, List[exp.Expression]]]:
+    """Matches `FROM base t, cte o [, ...]`; returns the two aliases and the remaining join targets."""
+    source = select.args.get("from_")
+    if source is None or not isinstance(source.this, exp.Table):
+        return None
+    segment_alias = source.this.alias_or_name
+    overall_alias = None
+    others = []
+    for join in select.args.get("joins") or []:
+        if join.args.get("on") or join.args.get("using") or join.side:
+            return None
+        target = join.this
+        if isinstance(target, exp.Table) and not target.db and target.name.lower() == cte_name.lower():
+            overall_alias = target.alias_or_name
+        else:
+            others.append(target)
+    if overall_alias is None:
+        return None
+    return segment_alias, overall_alias, others
+
+
+def _is_lift_expression(expression: exp.Expression, segment_alias: str, overall_alias: str,
+                        metric: str, overall_column: str) -> bool:
+    """True if `expression` only combines AVG(t.metric), o.overall_column and literals."""
+    averages = list(expression.find_all(exp.Avg))
+    if len(averages) != 1 or any(isinstance(node, exp.AggFunc) and not isinstance(node, exp.Avg)
+                                 for node in expression.find_all(exp.AggFunc)):
+        return False
+    average = averages[0].this
+    if not (isinstance(average, exp.Column) and average.name.lower() == metric.lower()
+            and average.table.lower() in ("", segment_alias.lower())):
+        return False
+    for column in expression.find_all(exp.Column):
+        if column is average:
+            continue
+        if not (column.table.lower() == overall_alias.lower() and column.name.lower() == overall_column.lower()):
+            return False
+    return not any(isinstance(node, (exp.Subquery, exp.Window)) for node in expression.walk())
+
+
+def _flatten_union(tree: exp.Expression) -> Optional[List[exp.Select]]:
+    if isinstance(tree, exp.Select):
+        return [tree]
+    if isinstance(tree, exp.Union) and not tree.args.get("distinct"):
+        left, right = _flatten_union(tree.this), _flatten_union(tree.expression)
+        if left is not None and right is not None:
+            return left + right
+    return None
+
+
+def _match_union(tree: exp.Expression, catalog: Catalog, default_project: str) -> Optional[_LiftPattern]:
+    """Matches one `SELECT 'tag' AS label, <lift> ... WHERE t.tag = TRUE` branch per tag under UNION ALL."""
+    if not isinstance(tree, exp.Union):
+        return None
+    overall = _overall_cte(tree)
+    branches = _flatten_union(tree)
+    if overall is None or branches is None:
+        return None
+    cte_name, base, metric, overall_column = overall
+    columns = catalog.get(_table_id(base, default_project), {})
+
+    pattern, reference = None, None
+    for branch in branches:
+        if any(branch.args.get(key) for key in ("with_", "having", "order", "limit", "distinct")):
+            return None
+        sources = _sources(branch, cte_name)
+        if sources is None or sources[2]:
+            return None
+        segment_alias, overall_alias, _ = sources
+        if _table_id(branch.args["from_"].this, default_project) != _table_id(base, default_project):
+            return None
+        tag = _tag_column(branch.args["where"].this, segment_alias, columns) if branch.args.get("where") else None
+        group = branch.args.get("group")
+        if tag is None or group is None or len(group.expressions) != 1 \
+                or group.expressions[0].name.lower() != overall_column.lower():
+            return None
+        if len(branch.expressions) != 2 or not all(isinstance(e, exp.Alias) for e in branch.expressions):
+            return None
+        label, lift = branch.expressions
+        if not (isinstance(label.this, exp.Literal) and label.this.is_string):
+            return None
+        if not _is_lift_expression(lift.this, segment_alias, overall_alias, metric, overall_column):
+            return None
+
+        normalized = _normalize_lift(lift.this, segment_alias, overall_alias).sql(dialect=DIALECT)
+        if pattern is None:
+            pattern = _LiftPattern(
+                table=base, metric=metric, overall_alias=overall_column, tags=[],
+                label_alias=label.alias, lift_alias=lift.alias,
+                lift_expression=lift.this, segment_alias=segment_alias, overall_table_alias=overall_alias,
+            )
+            reference = normalized
+        elif (label.alias, lift.alias, normalized) != (pattern.label_alias, pattern.lift_alias, reference):
+            return None
+        pattern.tags.append((label.this.this, tag))
+    return pattern
+
+
+def _match_unnest(tree: exp.Expression, catalog: Catalog, default_project: str) -> Optional[_LiftPattern]:
+    """Matches `CROSS JOIN UNNEST([...]) AS tag_name WHERE (tag_name = 'x' AND t.x = TRUE) OR ...`."""
+    if not isinstance(tree, exp.Select):
+        return None
+    overall = _overall_cte(tree)
+    if overall is None or any(tree.args.get(key) for key in ("having", "distinct")):
+        return None
+    cte_name, base, metric, overall_column = overall
+    columns = catalog.get(_table_id(base, default_project), {})
+
+    sources = _sources(tree, cte_name)
+    if sources is None or len(sources[2]) != 1 or not isinstance(sources[2][0], exp.Unnest):
+        return None
+    segment_alias, overall_alias, (unnest,) = sources
+    if _table_id(tree.args["from_"].this, default_project) != _table_id(base, default_project):
+        return None
+    unnest_alias = unnest.args.get("alias")
+    if unnest_alias is None or len(unnest_alias.columns) != 1 or len(unnest.expressions) != 1 \
+            or not isinstance(unnest.expressions[0], exp.Array):
+        return None
+    tag_variable = unnest_alias.columns[0].name.lower()
+    labels = [item.this for item in unnest.expressions[0].expressions
+              if isinstance(item, exp.Literal) and item.is_string]
+
+    # Each OR term pairs a label with the boolean column it selects.
+    label_columns: Dict[str, str] = {}
+    where = tree.args.get("where")
+    terms = list(where.this.flatten()) if where is not None and isinstance(where.this, exp.Or) else \
+        ([where.this] if where is not None else [])
+    for term in terms:
+        term = term.this if isinstance(term, exp.Paren) else term
+        if not isinstance(term, exp.And):
+            return None
+        label, tag = None, None
+        for side in (term.this, term.expression):
+            if isinstance(side, exp.EQ) and isinstance(side.this, exp.Column) \
+                    and side.this.name.lower() == tag_variable and isinstance(side.expression, exp.Literal):
+                label = side.expression.this
+            else:
+                tag = _tag_column(side, segment_alias, columns)
+        if label is None or tag is None:
+            return None
+        label_columns[label] = tag
+
+    group = tree.args.get("group")
+    grouped = {e.name.lower() for e in group.expressions} if group else set()
+    if group is None or len(group.expressions) != 2 or grouped != {tag_variable, overall_column.lower()}:
+        return None
+    if len(tree.expressions) != 2:
+        return None
+    label, lift = tree.expressions
+    label_column = label.this if isinstance(label, exp.Alias) else label
+    if not (isinstance(label_column, exp.Column) and label_column.name.lower() == tag_variable) \
+            or not isinstance(lift, exp.Alias):
+        return None
+    if not _is_lift_expression(lift.this, segment_alias, overall_alias, metric, overall_column):
+        return None
+
+    return _LiftPattern(
+        table=base, metric=metric, overall_alias=overall_column,
+        tags=[(label, label_columns[label]) for label in labels if label in label_columns],
+        label_alias=label.alias_or_name, lift_alias=lift.alias,
+        lift_expression=lift.this, segment_alias=segment_alias, overall_table_alias=overall_alias,
+    )
+
+
+def _normalize_lift(expression: exp.Expression, segment_alias: str, overall_alias: str) -> exp.Expression:
+    """Replaces AVG(t.metric) with s.segment_avg and o.column with a.column in a copy of the lift expression."""
+    def transform(node: exp.Expression) -> exp.Expression:
+        if isinstance(node, exp.Avg):
+            return exp.column("segment_avg", table="s")
+        if isinstance(node, exp.Column) and node.table.lower() == overall_alias.lower():
+            return exp.column(node.name, table="a")
+        return node
+    return expression.copy().transform(transform)
+
+
+def _order_and_limit(tree: exp.Expression, output_aliases: set) -> Optional[str]:
+    """Returns the ORDER BY / LIMIT clause of `tree` if it only uses output columns; None if it cannot be kept."""
+    clauses = []
+    order = tree.args.get("order")
+    if order is not None:
+        if any(column.table or column.name.lower() not in output_aliases for column in order.find_all(exp.Column)):
+            return None
+        clauses.append(order.sql(dialect=DIALECT))
+    limit = tree.args.get("limit")
+    if limit is not None:
+        clauses.append(limit.sql(dialect=DIALECT))
+    return " ".join(clauses)
+
+
+def _build_conditional_aggregation(pattern: _LiftPattern, tail: str) -> str:
+    """Single-scan form of a per-tag lift query."""
+    table = pattern.table.copy()
+    table.set("alias", None)
+    metric = exp.to_identifier(pattern.metric).sql(dialect=DIALECT)
+    aggregates = [f"AVG({metric}) AS {exp.to_identifier(pattern.overall_alias).sql(dialect=DIALECT)}"]
+    structs = []
+    for i, (label, column) in enumerate(pattern.tags):
+        column_sql = exp.to_identifier(column).sql(dialect=DIALECT)
+        aggregates.append(f"AVG(IF({column_sql}, {metric}, NULL)) AS segment_avg_{i}")
+        aggregates.append(f"COUNTIF({column_sql}) AS segment_size_{i}")
+        label_sql = exp.Literal.string(label).sql(dialect=DIALECT)
+        structs.append(f"STRUCT({label_sql} AS tag, a.segment_avg_{i} AS segment_avg, a.segment_size_{i} AS segment_size)")
+
+    lift = _normalize_lift(pattern.lift_expression, pattern.segment_alias, pattern.overall_table_alias)
+    return (
+        f"WITH TagAverages AS (SELECT {', '.join(aggregates)} FROM {table.sql(dialect=DIALECT)}) "
+        f"SELECT s.tag AS {exp.to_identifier(pattern.label_alias).sql(dialect=DIALECT)}, "
+        f"{lift.sql(dialect=DIALECT)} AS {exp.to_identifier(pattern.lift_alias).sql(dialect=DIALECT)} "
+        f"FROM TagAverages AS a CROSS JOIN UNNEST([{', '.join(structs)}]) AS s "
+        f"WHERE s.segment_size > 0 {tail}"
+    ).strip()
+
+
+def rewrite_tag_lift_query(tree: exp.Expression, catalog: Catalog, default_project: str) -> Optional[str]:
+    """Returns the single-scan rewrite of a per-tag lift query, or None if `tree` is not one."""
+    pattern = _match_union(tree, catalog, default_project) or _match_unnest(tree, catalog, default_project)
+    if pattern is None or not pattern.tags:
+        return None
+    tail = _order_and_limit(tree, {pattern.label_alias.lower(), pattern.lift_alias.lower()})
+    if tail is None:
+        return None
+    return _build_conditional_aggregation(pattern, tail)
+
+
+class SqlGuard:
+    """Validates and optimizes generated SQL, keeping counts of rejections and rewrites."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {"validated": 0, "rejected": 0, "rewritten": 0, "table_scans_saved": 0}
+
+    def _count(self, **increments: int) -> None:
+        with self._lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def check(self, sql: str, database_settings: Mapping[str, Any], default_project: str) -> exp.Expression:
+        """Validates `sql`; raises ValueError and records the rejection if it is invalid."""
+        try:
+            tree = validate_sql(sql, build_catalog(database_settings), default_project)
+        except ValueError as e:
+            self._count(rejected=1)
+            logger.warning(f"Rejected generated SQL before execution: {e}")
+            raise
+        self._count(validated=1)
+        return tree
+
+    def prepare(self, sql: str, database_settings: Mapping[str, Any], default_project: str) -> Dict[str, Any]:
+        """
+        Validates `sql` and rewrites per-tag lift queries into a single scan.
+
+        Returns `{"sql_query": ...}`, plus `"optimization"` with the table scans
+        before and after when the query was rewritten. Raises ValueError if the
+        query is invalid.
+        """
+        tree = self.check(sql, database_settings, default_project)
+        catalog = build_catalog(database_settings)
+        rewritten = rewrite_tag_lift_query(tree, catalog, default_project)
+        if rewritten is None:
+            return {"sql_query": sql}
+
+        before = count_table_scans(tree, catalog, default_project)
+        after = count_table_scans(sqlglot.parse_one(rewritten, read=DIALECT), catalog, default_project)
+        if after >= before:
+            return {"sql_query": sql}
+        self._count(rewritten=1, table_scans_saved=before - after)
+        logger.info(f"Rewrote per-tag lift query into conditional aggregation: {before} -> {after} table scans...")
+        return {
+            "sql_query": rewritten,
+            "optimization": {"rewritten": True, "table_scans_before": before, "table_scans_after": after},
+        }
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats)
+
+
+# Process-wide guard shared by all sessions of this worker
+sql_guard = SqlGuard()
@@ -0,0 +1,744 @@
+"""
+Vectorized significance engine for creative tag lift.
+
+Lift for a tag is `(AVG(metric | tag) - AVG(metric)) / AVG(metric) * 100`, the
+same definition used by the SQL generation prompt. This module attaches a
+bootstrap confidence interval and a Welch t-test (tag vs. no tag) to every lift.
+
+The bootstrap runs on bucketed sufficient statistics: rows are hashed into a
+fixed number of buckets, per-bucket sums are computed once, and each resample
+is a row of a multinomial weight matrix. All replicates for all tags are then a
+single pair of matrix products, so cost is independent of the row count once
+the bucket statistics exist. Bucket statistics can be computed locally from
+NumPy arrays or directly in BigQuery (see `build_bucket_statistics_sql`).
+
+Every metric is a ratio of sums (`Metric`): per-ad averages such as
+`video_views` divide by the ad count, rates such as `ctr` divide by another
+column. The lift of every tag on every metric is computed from one set of
+sums, either in a single BigQuery scan (`build_lift_matrix_sql`) or in one
+matrix product over local arrays (`compute_lift_matrix`).
+"""
+import math
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_BUCKETS = 256
+DEFAULT_RESAMPLES = 2000
+DEFAULT_CONFIDENCE = 0.95
+
+
+@dataclass(frozen=True)
+class Metric:
+    """A performance metric defined as SUM(numerator) / SUM(denominator), or AVG(numerator) without one."""
+    name: str
+    numerator: str
+    denominator: Optional[str] = None
+    description: str = ""
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        return (self.numerator,) if self.denominator is None else (self.numerator, self.denominator)
+
+    @property
+    def sql(self) -> str:
+        """The metric over a group of ads, in GoogleSQL."""
+        if self.denominator is None:
+            return f"AVG({self.numerator})"
+        return f"SAFE_DIVIDE(SUM({self.numerator}), SUM({self.denominator}))"
+
+
+METRICS = {
+    metric.name: metric
+    for metric in [
+        Metric("video_views", "video_views", description="average video views per ad"),
+        Metric("impressions", "impressions", description="average impressions per ad"),
+        Metric("clicks", "clicks", description="average clicks per ad"),
+        Metric("conversions", "conversions", description="average conversions per ad"),
+        Metric("spend", "spend", description="average spend per ad"),
+        Metric("ctr", "clicks", "impressions", description="click-through rate, clicks per impression"),
+        Metric("cvr", "conversions", "clicks", description="conversion rate, conversions per click"),
+        Metric("cpc", "spend", "clicks", description="cost per click"),
+        Metric("cpa", "spend", "conversions", description="cost per conversion"),
+    ]
+}
+
+
+def available_metrics(columns: Iterable[str]) -> List[Metric]:
+    """The metrics whose columns all exist among `columns`."""
+    columns = set(columns)
+    return [metric for metric in METRICS.values() if set(metric.columns) <= columns]
+
+
+def _regularized_incomplete_beta(x: float, a: float, b: float) -> float:
+    """Regularized incomplete beta I_x(a, b) via Lentz's continued fraction."""
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+
+    log_front = (
+        math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+        + a * math.log(x) + b * math.log1p(-x)
+    )
+    # The continued fraction converges fastest for x < (a + 1) / (a + b + 2).
+    if x > (a + 1.0) / (a + b + 2.0):
+        return 1.0 - _regularized_incomplete_beta(1.0 - x, b, a)
+
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1.0)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    fraction = d
+    for m in range(1, 300):
+        m2 = 2 * m
+        numerator = m * (b - m) * x / ((a + m2 - 1.0) * (a + m2))
+        d = 1.0 + numerator * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + numerator / c
+        c = c if abs(c) > tiny else tiny
+        fraction *= d * c
+
+        numerator = -(a + m) * (a + b + m) * x / ((a + m2) * (a + m2 + 1.0))
+        d = 1.0 + numerator * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + numerator / c
+        c = c if abs(c) > tiny else tiny
+        delta = d * c
+        fraction *= delta
+        if abs(delta - 1.0) < 1e-12:
+            break
+
+    return math.exp(log_front) * fraction / a
+
+
+def _student_t_two_sided_p(t_stat: float, df: float) -> float:
+    """Two-sided p-value of a Student t statistic."""
+    if not math.isfinite(t_stat) or not math.isfinite(df) or df <= 0:
+        return float("nan")
+    return _regularized_incomplete_beta(df / (df + t_stat * t_stat), df / 2.0, 0.5)
+
+
+def _welch_test(
+    n1: float, sum1: float, sq1: float,
+    n0: float, sum0: float, sq0: float
+) -> Dict[str, Optional[float]]:
+    """Welch's unequal-variance t-test from count, sum and sum of squares."""
+    if n1 < 2 or n0 < 2:
+        return {"t_statistic": None, "degrees_of_freedom": None, "p_value": None}
+
+    mean1, mean0 = sum1 / n1, sum0 / n0
+    var1 = max(sq1 - n1 * mean1 * mean1, 0.0) / (n1 - 1)
+    var0 = max(sq0 - n0 * mean0 * mean0, 0.0) / (n0 - 1)
+    se1, se0 = var1 / n1, var0 / n0
+    if se1 + se0 == 0:
+        return {"t_statistic": None, "degrees_of_freedom": None, "p_value": None}
+
+    t_stat = (mean1 - mean0) / math.sqrt(se1 + se0)
+    denominator = (se1 * se1) / (n1 - 1) + (se0 * se0) / (n0 - 1)
+    if denominator > 0:
+        df = (se1 + se0) ** 2 / denominator
+        p_value = _student_t_two_sided_p(t_stat, df)
+    else:
+        # One group has zero variance in every observation: use the normal limit.
+        df = float("inf")
+        p_value = math.erfc(abs(t_stat) / math.sqrt(2.0))
+    return {"t_statistic": t_stat, "degrees_of_freedom": df, "p_value": p_value}
+
+
+def summarize_buckets(
+    metric: np.ndarray,
+    tag_matrix: np.ndarray,
+    n_buckets: int = DEFAULT_BUCKETS,
+    seed: Optional[int] = 0,
+) -> Dict[str, np.ndarray]:
+    """
+    Reduces row-level data to per-bucket sufficient statistics.
+
+    Args:
+        metric: Float array of shape (n,) with the performance metric.
+        tag_matrix: Boolean array of shape (n, T), one column per tag.
+        n_buckets: Number of random buckets rows are assigned to.
+        seed: Seed for the bucket assignment.
+
+    Returns:
+        A dictionary with `all_count`, `all_sum`, `all_sumsq` of shape (K,) and
+        `tag_count`, `tag_sum`, `tag_sumsq` of shape (K, T).
+    """
+    metric = np.asarray(metric, dtype=np.float64)
+    tag_matrix = np.asarray(tag_matrix, dtype=bool)
+    if tag_matrix.ndim == 1:
+        tag_matrix = tag_matrix[:, None]
+    n_rows, n_tags = tag_matrix.shape
+
+    rng = np.random.default_rng(seed)
+    buckets = rng.integers(0, n_buckets, size=n_rows)
+    squared = metric * metric
+
+    rows, cols = np.nonzero(tag_matrix)
+    flat = buckets[rows] * n_tags + cols
+    size = n_buckets * n_tags
+
+    return {
+        "all_count": np.bincount(buckets, minlength=n_buckets).astype(np.float64),
+        "all_sum": np.bincount(buckets, weights=metric, minlength=n_buckets),
+        "all_sumsq": np.bincount(buckets, weights=squared, minlength=n_buckets),
+        "tag_count": np.bincount(flat, minlength=size).astype(np.float64).reshape(n_buckets, n_tags),
+        "tag_sum": np.bincount(flat, weights=metric[rows], minlength=size).reshape(n_buckets, n_tags),
+        "tag_sumsq": np.bincount(flat, weights=squared[rows], minlength=size).reshape(n_buckets, n_tags),
+    }
+
+
+def _tag_condition(tag: str, tag_sql: Optional[Mapping[str, str]]) -> str:
+    return tag_sql.get(tag, tag) if tag_sql else tag
+
+
+def build_bucket_statistics_sql(
+    full_table_id: str,
+    tags: Sequence[str],
+    metric: str = "video_views",
+    key_column: str = "media_id",
+    n_buckets: int = DEFAULT_BUCKETS,
+    tag_sql: Optional[Mapping[str, str]] = None,
+) -> str:
+    """
+    Builds a single-scan BigQuery query producing the same bucket statistics as
+    `summarize_buckets`, so only `n_buckets` rows leave the warehouse.
+
+    `tag_sql` maps a tag to the SQL condition that tests it; a tag without one
+    is a boolean column.
+    """
+    # Squares are taken in FLOAT64 so large INT64 counts cannot overflow.
+    value = f"CAST({metric} AS FLOAT64)"
+    tag_columns = []
+    for tag in tags:
+        condition = _tag_condition(tag, tag_sql)
+        tag_columns.append(
+            f"COUNTIF({condition}) AS n_{tag}, "
+            f"SUM(IF({condition}, {value}, 0)) AS sum_{tag}, "
+            f"SUM(IF({condition}, {value} * {value}, 0)) AS sq_{tag}"
+        )
+    select_tags = ",\n      ".join(tag_columns)
+
+    return f"""
+    SELECT
+      MOD(ABS(FARM_FINGERPRINT(CAST({key_column} AS STRING))), {n_buckets}) AS bucket,
+      COUNT(*) AS n_all,
+      SUM({value}) AS sum_all,
+      SUM({value} * {value}) AS sq_all,
+      {select_tags}
+    FROM {full_table_id}
+    WHERE {metric} IS NOT NULL
+    GROUP BY bucket
+    """
+
+
+def buckets_from_rows(rows: Iterable[Mapping[str, Any]], tags: Sequence[str]) -> Dict[str, np.ndarray]:
+    """Converts rows returned by `build_bucket_statistics_sql` into bucket statistics."""
+    rows = list(rows)
+    n_tags = len(tags)
+    stats = {
+        "all_count": np.zeros(len(rows)),
+        "all_sum": np.zeros(len(rows)),
+        "all_sumsq": np.zeros(len(rows)),
+        "tag_count": np.zeros((len(rows), n_tags)),
+        "tag_sum": np.zeros((len(rows), n_tags)),
+        "tag_sumsq": np.zeros((len(rows), n_tags)),
+    }
+    for i, row in enumerate(rows):
+        stats["all_count"][i] = row["n_all"] or 0
+        stats["all_sum"][i] = row["sum_all"] or 0
+        stats["all_sumsq"][i] = row["sq_all"] or 0
+        for j, tag in enumerate(tags):
+            stats["tag_count"][i, j] = row[f"n_{tag}"] or 0
+            stats["tag_sum"][i, j] = row[f"sum_{tag}"] or 0
+            stats["tag_sumsq"][i, j] = row[f"sq_{tag}"] or 0
+    return stats
+
+
+def lift_significance_from_buckets(
+    stats: Mapping[str, np.ndarray],
+    tags: Sequence[str],
+    n_resamples: int = DEFAULT_RESAMPLES,
+    confidence: float = DEFAULT_CONFIDENCE,
+    seed: Optional[int] = 0,
+) -> List[Dict[str, Any]]:
+    """
+    Computes lift, bootstrap confidence interval and Welch test for every tag.
+
+    Args:
+        stats: Bucket statistics from `summarize_buckets` or `buckets_from_rows`.
+        tags: Tag names, in the column order of the `tag_*` arrays.
+        n_resamples: Number of bootstrap replicates.
+        confidence: Two-sided confidence level of the interval.
+        seed: Seed for the resampling weights.
+
+    Returns:
+        One dictionary per tag with `tag`, `segment_size`, `percentage_lift`,
+        `ci_lower`, `ci_upper`, `t_statistic`, `degrees_of_freedom` and `p_value`.
+    """
+    all_count = np.asarray(stats["all_count"], dtype=np.float64)
+    all_sum = np.asarray(stats["all_sum"], dtype=np.float64)
+    all_sumsq = np.asarray(stats["all_sumsq"], dtype=np.float64)
+    tag_count = np.asarray(stats["tag_count"], dtype=np.float64)
+    tag_sum = np.asarray(stats["tag_sum"], dtype=np.float64)
+    tag_sumsq = np.asarray(stats["tag_sumsq"], dtype=np.float64)
+    n_buckets = all_count.shape[0]
+
+    # Every replicate draws n_buckets buckets with replacement; one matrix
+    # product then yields the resampled totals for the table and every tag.
+    rng = np.random.default_rng(seed)
+    weights = rng.multinomial(n_buckets, np.full(n_buckets, 1.0 / n_buckets), size=n_resamples)
+    weights = weights.astype(np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        overall_mean = (weights @ all_sum) / (weights @ all_count)
+        segment_mean = (weights @ tag_sum) / (weights @ tag_count)
+        replicate_lift = (segment_mean / overall_mean[:, None] - 1.0) * 100.0
+
+    alpha = (1.0 - confidence) / 2.0
+    lower, upper = np.nanquantile(replicate_lift, [alpha, 1.0 - alpha], axis=0)
+
+    total_n, total_sum, total_sq = float(all_count.sum()), float(all_sum.sum()), float(all_sumsq.sum())
+    results = []
+    for j, tag in enumerate(tags):
+        n1 = float(tag_count[:, j].sum())
+        sum1 = float(tag_sum[:, j].sum())
+        sq1 = float(tag_sumsq[:, j].sum())
+        lift = None
+        if n1 > 0 and total_sum != 0:
+            lift = ((sum1 / n1) / (total_sum / total_n) - 1.0) * 100.0
+
+        result = {
+            "tag": tag,
+            "segment_size": int(n1),
+            "percentage_lift": lift,
+            "ci_lower": float(lower[j]) if np.isfinite(lower[j]) else None,
+            "ci_upper": float(upper[j]) if np.isfinite(upper[j]) else None,
+        }
+        result.update(
+            _welch_test(n1, sum1, sq1, total_n - n1, total_sum - sum1, total_sq - sq1)
+        )
+        results.append(result)
+
+    return results
+
+
+def _lift_significance_chunk(
+    metric: np.ndarray,
+    tag_matrix: np.ndarray,
+    tags: Sequence[str],
+    n_buckets: int,
+    n_resamples: int,
+    confidence: float,
+    seed: Optional[int],
+) -> List[Dict[str, Any]]:
+    """Worker entry point: summarizes and bootstraps one chunk of tags."""
+    stats = summarize_buckets(metric, tag_matrix, n_buckets=n_buckets, seed=seed)
+    return lift_significance_from_buckets(
+        stats, tags, n_resamples=n_resamples, confidence=confidence, seed=seed
+    )
+
+
+def compute_lift_significance(
+    metric: np.ndarray,
+    tags: Mapping[str, np.ndarray],
+    n_buckets: int = DEFAULT_BUCKETS,
+    n_resamples: int = DEFAULT_RESAMPLES,
+    confidence: float = DEFAULT_CONFIDENCE,
+    seed: Optional[int] = 0,
+    max_workers: int = 1,
+) -> List[Dict[str, Any]]:
+    """
+    Computes lift with confidence intervals and Welch tests from row-level arrays.
+
+    Args:
+        metric: Array of shape (n,) with the performance metric.
+        tags: Mapping of tag name to a boolean array of shape (n,).
+        n_buckets: Number of bootstrap buckets.
+        n_resamples: Number of bootstrap replicates.
+        confidence: Two-sided confidence level of the interval.
+        seed: Seed shared by every chunk, so results do not depend on
+            `max_workers`.
+        max_workers: When greater than 1, tags are split into chunks that are
+            processed in parallel in a process pool.
+
+    Returns:
+        One result dictionary per tag, see `lift_significance_from_buckets`.
+    """
+    names = list(tags)
+    if not names:
+        return []
+    metric = np.asarray(metric, dtype=np.float64)
+    tag_matrix = np.column_stack([np.asarray(tags[name], dtype=bool) for name in names])
+
+    n_workers = min(max_workers, len(names))
+    if n_workers <= 1:
+        return _lift_significance_chunk(
+            metric, tag_matrix, names, n_buckets, n_resamples, confidence, seed
+        )
+
+    chunks = np.array_split(np.arange(len(names)), n_workers)
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [
+            executor.submit(
+                _lift_significance_chunk,
+                metric,
+                tag_matrix[:, chunk],
+                [names[i] for i in chunk],
+                n_buckets,
+                n_resamples,
+                confidence,
+                seed,
+            )
+            for chunk in chunks
+        ]
+        return [result for future in futures for result in future.result()]
+
+
+def build_lift_matrix_sql(
+    full_table_id: str,
+    tags: Sequence[str],
+    metrics: Sequence[Metric],
+    tag_sql: Optional[Mapping[str, str]] = None,
+) -> str:
+    """
+    Builds a single-scan query returning one row with the sums behind the lift
+    of every tag on every metric (see `lift_matrix_from_row`).
+
+    Columns are numbered rather than named after tags and metrics, so any
+    column names are safe to combine. `tag_sql` is as in `build_bucket_statistics_sql`.
+    """
+    def sums(prefix: str, condition: Optional[str]) -> List[str]:
+        columns = []
+        for k, metric in enumerate(metrics):
+            numerator = f"CAST({metric.numerator} AS FLOAT64)"
+            # An average divides by the ads that have the metric, like AVG().
+            denominator = (
+                f"IF({metric.numerator} IS NULL, 0, 1)" if metric.denominator is None
+                else f"IF({metric.numerator} IS NULL, 0, CAST({metric.denominator} AS FLOAT64))"
+            )
+            if condition is not None:
+                numerator = f"IF({condition}, {numerator}, 0)"
+                denominator = f"IF({condition}, {denominator}, 0)"
+            columns.append(f"SUM({numerator}) AS num_{prefix}_m{k}, SUM({denominator}) AS den_{prefix}_m{k}")
+        return columns
+
+    select = ["COUNT(*) AS n_all", *sums("all", None)]
+    for j, tag in enumerate(tags):
+        condition = _tag_condition(tag, tag_sql)
+        select.append(f"COUNTIF({condition}) AS n_t{j}")
+        select.extend(sums(f"t{j}", condition))
+    select_columns = ",\n      ".join(select)
+
+    return f"""
+    SELECT
+      {select_columns}
+    FROM {full_table_id}
+    """
+
+
+def lift_matrix_from_row(
+    row: Mapping[str, Any],
+    tags: Sequence[str],
+    metrics: Sequence[Metric]
+) -> Dict[str, Any]:
+    """Computes the lift matrix from the row returned by `build_lift_matrix_sql`."""
+    n_metrics = len(metrics)
+    tag_num = np.zeros((len(tags), n_metrics))
+    tag_den = np.zeros((len(tags), n_metrics))
+    for j in range(len(tags)):
+        for k in range(n_metrics):
+            tag_num[j, k] = row[f"num_t{j}_m{k}"] or 0
+            tag_den[j, k] = row[f"den_t{j}_m{k}"] or 0
+    return lift_matrix_from_sums(
+        all_num=np.array([row[f"num_all_m{k}"] or 0 for k in range(n_metrics)], dtype=np.float64),
+        all_den=np.array([row[f"den_all_m{k}"] or 0 for k in range(n_metrics)], dtype=np.float64),
+        tag_num=tag_num,
+        tag_den=tag_den,
+        tag_count=np.array([row[f"n_t{j}"] or 0 for j in range(len(tags))], dtype=np.float64),
+        tags=tags,
+        metrics=metrics,
+    )
+
+
+def lift_matrix_from_sums(
+    all_num: np.ndarray,
+    all_den: np.ndarray,
+    tag_num: np.ndarray,
+    tag_den: np.ndarray,
+    tag_count: np.ndarray,
+    tags: Sequence[str],
+    metrics: Sequence[Metric],
+) -> Dict[str, Any]:
+    """
+    Computes the percentage lift of every tag on every metric.
+
+    Args:
+        all_num, all_den: Arrays of shape (M,) with the table-wide sums per metric.
+        tag_num, tag_den: Arrays of shape (T, M) with the sums over ads with each tag.
+        tag_count: Array of shape (T,) with the number of ads with each tag.
+        tags: Tag names, in row order of the `tag_*` arrays.
+        metrics: Metrics, in column order.
+
+    Returns:
+        `{"metrics": [...], "overall": {metric: value}, "results": [...]}` with one
+        result per tag holding `tag`, `segment_size` and `percentage_lift`, a
+        mapping of metric name to lift (None where undefined).
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        overall = all_num / all_den
+        segment = tag_num / tag_den
+        lift = (segment / overall[None, :] - 1.0) * 100.0
+
+    def value(x: float) -> Optional[float]:
+        return float(x) if np.isfinite(x) else None
+
+    names = [metric.name for metric in metrics]
+    return {
+        "metrics": names,
+        "overall": {name: value(overall[k]) for k, name in enumerate(names)},
+        "results": [
+            {
+                "tag": tag,
+                "segment_size": int(tag_count[j]),
+                "percentage_lift": {name: value(lift[j, k]) for k, name in enumerate(names)},
+            }
+            for j, tag in enumerate(tags)
+        ],
+    }
+
+
+def compute_lift_matrix(
+    columns: Mapping[str, np.ndarray],
+    tags: Mapping[str, np.ndarray],
+    metrics: Sequence[Metric],
+) -> Dict[str, Any]:
+    """
+    Computes the lift of every tag on every metric from row-level arrays in one pass.
+
+    Args:
+        columns: Mapping of column name to a numeric array of shape (n,); NaN marks a missing value.
+        tags: Mapping of tag name to a boolean array of shape (n,).
+        metrics: Metrics whose columns are in `columns`.
+
+    Returns:
+        See `lift_matrix_from_sums`.
+    """
+    names = list(tags)
+    tag_matrix = np.column_stack([np.asarray(tags[name], dtype=np.float64) for name in names])
+    numerators, denominators = [], []
+    for metric in metrics:
+        numerator = np.asarray(columns[metric.numerator], dtype=np.float64)
+        present = ~np.isnan(numerator)
+        denominator = (
+            present.astype(np.float64) if metric.denominator is None
+            else np.nan_to_num(np.where(present, np.asarray(columns[metric.denominator], dtype=np.float64), 0.0))
+        )
+        numerators.append(np.where(present, numerator, 0.0))
+        denominators.append(denominator)
+    sums = np.column_stack(numerators + denominators)
+
+    # One product yields the per-tag sums of every numerator and denominator.
+    tag_sums = tag_matrix.T @ sums
+    n_metrics = len(metrics)
+    return lift_matrix_from_sums(
+        all_num=sums[:, :n_metrics].sum(axis=0),
+        all_den=sums[:, n_metrics:].sum(axis=0),
+        tag_num=tag_sums[:, :n_metrics],
+        tag_den=tag_sums[:, n_metrics:],
+        tag_count=tag_matrix.sum(axis=0),
+        tags=names,
+        metrics=metrics,
+    )
+
+
+def _z_score(confidence: float) -> float:
+    """Two-sided standard normal quantile, by bisection on erfc."""
+    alpha = 1.0 - confidence
+    low, high = 0.0, 10.0
+    for _ in range(100):
+        mid = (low + high) / 2.0
+        if math.erfc(mid / math.sqrt(2.0)) > alpha:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2.0
+
+
+def build_stratum_counts_sql(full_table_id: str, tags: Sequence[str], tag_sql: Optional[Mapping[str, str]] = None) -> str:
+    """Counts rows per tag combination; reads only the tag columns."""
+    columns = ", ".join(f"IFNULL({_tag_condition(tag, tag_sql)}, FALSE) AS t{j}" for j, tag in enumerate(tags))
+    group_by = ", ".join(f"t{j}" for j in range(len(tags)))
+    return f"""
+    SELECT {columns}, COUNT(*) AS n
+    FROM {full_table_id}
+    GROUP BY {group_by}
+    """
+
+
+def build_stratified_sample_sql(
+    full_table_id: str,
+    tags: Sequence[str],
+    metrics: Sequence[Metric],
+    sample_percent: float,
+    quantiles: int = 10,
+    tag_sql: Optional[Mapping[str, str]] = None,
+) -> str:
+    """
+    Builds per-stratum sufficient statistics over a block sample of the table.
+
+    Each metric contributes the count, sums, sums of squares and cross products
+    of its numerator `y` and denominator `x` (1 for averages), which is all the
+    stratified ratio estimator and its variance need. Per-ad averages also get
+    `APPROX_QUANTILES` deciles per stratum for distribution summaries.
+    """
+    columns = [f"IFNULL({_tag_condition(tag, tag_sql)}, FALSE) AS t{j}" for j, tag in enumerate(tags)]
+    columns.append("COUNT(*) AS n")
+    for k, metric in enumerate(metrics):
+        y = f"CAST({metric.numerator} AS FLOAT64)"
+        x = "1.0" if metric.denominator is None else f"CAST({metric.denominator} AS FLOAT64)"
+        # Rows without the metric count as zero in both numerator and denominator.
+        x = f"IF({metric.numerator} IS NULL, 0, {x})"
+        y = f"IFNULL({y}, 0)"
+        columns.append(
+            f"SUM({y}) AS y_m{k}, SUM({x}) AS x_m{k}, SUM({y} * {y}) AS yy_m{k}, "
+            f"SUM({x} * {x}) AS xx_m{k}, SUM({y} * {x}) AS xy_m{k}"
+        )
+        if metric.denominator is None:
+            columns.append(f"APPROX_QUANTILES({metric.numerator}, {quantiles}) AS q_m{k}")
+    select_columns = ",\n      ".join(columns)
+    group_by = ", ".join(f"t{j}" for j in range(len(tags)))
+    return f"""
+    SELECT
+      {select_columns}
+    FROM {full_table_id} TABLESAMPLE SYSTEM ({sample_percent:.6g} PERCENT)
+    GROUP BY {group_by}
+    """
+
+
+def approximate_lift_matrix(
+    stratum_rows: Iterable[Mapping[str, Any]],
+    sample_rows: Iterable[Mapping[str, Any]],
+    tags: Sequence[str],
+    metrics: Sequence[Metric],
+    confidence: float = DEFAULT_CONFIDENCE,
+) -> Dict[str, Any]:
+    """
+    Estimates the lift matrix from a stratified sample, with confidence bounds.
+
+    Strata are tag combinations with exact sizes `N_s` (`build_stratum_counts_sql`)
+    and sampled statistics (`build_stratified_sample_sql`). Totals are expanded
+    per stratum (`N_s / n_s`), so every tag's segment is estimated from the strata
+    that contain it. Bounds use the linearized (delta method) variance of each
+    ratio of ratios under stratified sampling without replacement. Strata
+    without sampled rows are left out and reported as uncovered.
+
+    Returns:
+        The `lift_matrix_from_sums` result, plus per-tag `ci_lower` and `ci_upper`
+        mappings, `overall_quantiles` for per-ad averages and the coverage of
+        the sample.
+    """
+    n_tags, n_metrics = len(tags), len(metrics)
+
+    def combination(row: Mapping[str, Any]) -> Tuple[bool, ...]:
+        return tuple(bool(row[f"t{j}"]) for j in range(n_tags))
+
+    population = {combination(row): float(row["n"]) for row in stratum_rows}
+    sampled = {combination(row): row for row in sample_rows}
+    strata = [s for s in population if s in sampled and sampled[s]["n"]]
+
+    n_strata = len(strata)
+    big_n = np.array([population[s] for s in strata])
+    small_n = np.array([float(sampled[s]["n"]) for s in strata])
+    membership = np.array(strata, dtype=np.float64).reshape(n_strata, n_tags)
+
+    def stat(name: str) -> np.ndarray:
+        return np.array([
+            [float(sampled[s][f"{name}_m{k}"] or 0) for k in range(n_metrics)] for s in strata
+        ]).reshape(n_strata, n_metrics)
+
+    y, x, yy, xx, xy = stat("y"), stat("x"), stat("yy"), stat("xx"), stat("xy")
+    expansion = (big_n / small_n)[:, None]
+
+    # Expanded totals: table-wide (M,) and per tag (T, M).
+    y_all, x_all = (expansion * y).sum(axis=0), (expansion * x).sum(axis=0)
+    y_tag, x_tag = membership.T @ (expansion * y), membership.T @ (expansion * x)
+
+    result = lift_matrix_from_sums(
+        all_num=y_all,
+        all_den=x_all,
+        tag_num=y_tag,
+        tag_den=x_tag,
+        tag_count=np.array([
+            sum(size for s, size in population.items() if s[j]) for j in range(n_tags)
+        ], dtype=np.float64),
+        tags=tags,
+        metrics=metrics,
+    )
+
+    # Per-stratum sample (co)variances of y and x, shape (S, M).
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dof = np.maximum(small_n - 1.0, 1.0)[:, None]
+        mean_y, mean_x = y / small_n[:, None], x / small_n[:, None]
+        var_y = np.maximum(yy - small_n[:, None] * mean_y ** 2, 0.0) / dof
+        var_x = np.maximum(xx - small_n[:, None] * mean_x ** 2, 0.0) / dof
+        cov_xy = (xy - small_n[:, None] * mean_y * mean_x) / dof
+        # Strata sampled once carry no variance estimate; finite population correction otherwise.
+        weight = np.where(small_n > 1, big_n ** 2 * (1.0 - small_n / big_n) / small_n, 0.0)[:, None]
+
+        r_all = y_all / x_all
+        r_tag = y_tag / x_tag
+        lift_ratio = r_tag / r_all[None, :]
+        # Linearization of L = r_tag / r_all: z = a * y + b * x within each stratum.
+        in_tag = membership[:, :, None]
+        a = in_tag / (x_tag * r_all[None, :])[None, :, :] - (lift_ratio / (r_all * x_all)[None, :])[None, :, :]
+        b = (-in_tag * (r_tag / (x_tag * r_all[None, :]))[None, :, :]
+             + (lift_ratio / x_all[None, :])[None, :, :])
+        var_z = a ** 2 * var_y[:, None, :] + b ** 2 * var_x[:, None, :] + 2 * a * b * cov_xy[:, None, :]
+        variance = (weight[:, None, :] * var_z).sum(axis=0)
+        margin = _z_score(confidence) * np.sqrt(variance) * 100.0
+
+    lift = (lift_ratio - 1.0) * 100.0
+    names = [metric.name for metric in metrics]
+    for j, row in enumerate(result["results"]):
+        row["ci_lower"] = {
+            name: float(lift[j, k] - margin[j, k]) if np.isfinite(margin[j, k]) and np.isfinite(lift[j, k]) else None
+            for k, name in enumerate(names)
+        }
+        row["ci_upper"] = {
+            name: float(lift[j, k] + margin[j, k]) if np.isfinite(margin[j, k]) and np.isfinite(lift[j, k]) else None
+            for k, name in enumerate(names)
+        }
+
+    # Deciles of per-ad averages, pooled across strata with their expansion weights.
+    quantiles = {}
+    for k, metric in enumerate(metrics):
+        if metric.denominator is not None:
+            continue
+        values, weights = [], []
+        for i, s in enumerate(strata):
+            sketch = sampled[s].get(f"q_m{k}") or []
+            points = [v for v in sketch if v is not None]
+            values.extend(points)
+            weights.extend([big_n[i] / max(len(points), 1)] * len(points))
+        if values:
+            order = np.argsort(values)
+            cumulative = np.cumsum(np.asarray(weights)[order]) / np.sum(weights)
+            sorted_values = np.asarray(values, dtype=np.float64)[order]
+            quantiles[metric.name] = {
+                f"p{p}": float(sorted_values[min(np.searchsorted(cumulative, p / 100.0), len(values) - 1)])
+                for p in (10, 50, 90)
+            }
+
+    total_rows = sum(population.values())
+    result.update({
+        "approximate": True,
+        "confidence": confidence,
+        "overall_quantiles": quantiles,
+        "sampled_rows": int(small_n.sum()),
+        "coverage": float(big_n.sum() / total_rows) if total_rows else None,
+        "uncovered_strata": len(population) - n_strata,
+    })
+    return result
@@ -0,0 +1,285 @@
+"""
+Registry of the creative tag taxonomy.
+
+`config/tag_registry.json` lists every tag once, with the description the
+feature extractor is given. Extraction, the table schema, model training and
+query generation all read the tag list from here. A tag's bit is its position
+in the list, so tags are only ever appended; a tag that is no longer extracted
+is marked `"retired"` and keeps its bit.
+
+Tags are stored in one of two layouts:
+- `"columns"`: one BOOLEAN column per tag, for small taxonomies.
+- `"packed"`: the tags of an ad form a multi-hot bitmask in INT64 columns
+  `tag_bits_0`, `tag_bits_1`, ..., 64 tags per column, so 500 tags take 8
+  columns instead of 500. The extractor lists the tags present instead of a
+  boolean per tag, and the model is trained on sparse features: an
+  `ARRAY<STRUCT<tag STRING, value FLOAT64>>` of the tags an ad has.
+
+Queries test a tag with the SQL predicate from `predicate`, which is the
+column itself or a bit test, so SQL builders work unchanged in both layouts.
+"""
+import hashlib
+import json
+import logging
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Literal, Mapping, Optional, Sequence, Tuple, Type
+
+from pydantic import BaseModel, ConfigDict, Field, create_model
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_FILE = Path(__file__).parent.parent / "config" / "tag_registry.json"
+COLUMNS, PACKED = "columns", "packed"
+WORD_BITS = 64
+WORD_COLUMN_PREFIX = "tag_bits_"
+SPARSE_FEATURES_COLUMN = "tag_features"
+BOOLEAN_TYPES = ("BOOLEAN", "BOOL")
+TAG_NAME = re.compile(r"^[a-z][a-z0-9_]*$")
+
+
+@dataclass(frozen=True)
+class Tag:
+    """A creative tag and its bit in the packed layout."""
+
+    name: str
+    bit: int
+    description: str = ""
+    aliases: Tuple[str, ...] = ()
+    retired: bool = False
+
+
+class TagRegistry:
+    """The tag taxonomy and its storage layout."""
+
+    def __init__(self, tags: Sequence[Tag], storage: str = COLUMNS):
+        if storage not in (COLUMNS, PACKED):
+            raise ValueError(f"Unknown tag storage '{storage}', expected '{COLUMNS}' or '{PACKED}'.")
+        names = [tag.name for tag in tags]
+        invalid = [name for name in names if not TAG_NAME.match(name)]
+        if invalid:
+            raise ValueError(f"Tag names must be lowercase identifiers: {invalid}")
+        if len(set(names)) != len(names):
+            raise ValueError("Tag names must be unique.")
+        self.storage = storage
+        self.tags = list(tags)
+        self.by_name = {tag.name: tag for tag in self.tags}
+        self.names = [tag.name for tag in self.tags if not tag.retired]
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "TagRegistry":
+        tags = [
+            Tag(
+                name=entry["name"],
+                bit=bit,
+                description=entry.get("description", ""),
+                aliases=tuple(entry.get("aliases", ())),
+                retired=entry.get("retired", False),
+            )
+            for bit, entry in enumerate(data["tags"])
+        ]
+        return cls(tags, data.get("storage", COLUMNS))
+
+    @classmethod
+    def from_file(cls, path: Path) -> "TagRegistry":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    @property
+    def packed(self) -> bool:
+        return self.storage == PACKED
+
+    @property
+    def fingerprint(self) -> str:
+        """Identifies the layout and the extracted tags, which extracted features depend on."""
+        return hashlib.sha256(json.dumps([self.storage, self.names]).encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def word_columns(self) -> List[str]:
+        """The bitmask columns of the packed layout."""
+        return [f"{WORD_COLUMN_PREFIX}{word}" for word in range((len(self.tags) + WORD_BITS - 1) // WORD_BITS)]
+
+    def table_columns(self) -> List[Tuple[str, str]]:
+        """Names and BigQuery types of the tag columns of the performance table."""
+        if self.packed:
+            return [(column, "INTEGER") for column in self.word_columns]
+        return [(name, "BOOLEAN") for name in self.names]
+
+    # ---- Queries ----
+
+    def schema_tags(self, schema_list: Iterable[Tuple[str, str]]) -> List[str]:
+        """
+        The tags a table has: the registry's tags stored in it, then any other
+        BOOLEAN columns, which are tags added to the table but not yet registered.
+        """
+        columns = {name: field_type for name, field_type in schema_list}
+        if self.packed:
+            registered = [name for name in self.names if self._word_column(name) in columns]
+        else:
+            registered = [name for name in self.names if columns.get(name) in BOOLEAN_TYPES]
+        return registered + [
+            name for name, field_type in columns.items()
+            if field_type in BOOLEAN_TYPES and name not in self.by_name
+        ]
+
+    def _word_column(self, name: str) -> str:
+        return f"{WORD_COLUMN_PREFIX}{self.by_name[name].bit // WORD_BITS}"
+
+    def predicate(self, name: str) -> str:
+        """The SQL expression that is true for ads with the tag."""
+        if not self.packed or name not in self.by_name:
+            return name
+        # `>>` fills with zeros in BigQuery, so the sign bit tests like any other.
+        return f"(({self._word_column(name)} >> {self.by_name[name].bit % WORD_BITS}) & 1) = 1"
+
+    def predicates(self, names: Iterable[str]) -> Dict[str, str]:
+        return {name: self.predicate(name) for name in names}
+
+    def normalize(self, text: str) -> List[str]:
+        """The lowercase words of `text`, with every alias replaced by its tag name."""
+        # Quotes are dropped, so "'logo'" names the logo tag.
+        normalized = f" {' '.join(re.findall(r'[a-z0-9_]+', text.lower()))} "
+        for tag in self.tags:
+            for alias in (*tag.aliases, tag.name.replace("_", " ")):
+                normalized = normalized.replace(f" {alias} ", f" {tag.name} ")
+        return normalized.split()
+
+    def mentioned(self, text: str, names: Iterable[str]) -> List[str]:
+        """The tags a message names, by tag name, plural or alias."""
+        words = set(self.normalize(text))
+        return [name for name in names if name in words or f"{name}s" in words or f"{name}es" in words]
+
+    def schema_prompt(self, schema_list: Iterable[Tuple[str, str]]) -> str:
+        """
+        The active tags packed into a table's bitmask columns, with their tag
+        numbers and descriptions, for its schema prompt; empty unless packed.
+        """
+        columns = {name for name, _ in schema_list}
+        stored = [name for name in self.names if self._word_column(name) in columns] if self.packed else []
+        if not stored:
+            return ""
+        listed = "\n".join(
+            f"      - {name} (tag {self.by_name[name].bit}): {self.by_name[name].description}" for name in stored
+        )
+        packed_into = ", ".join(column for column in self.word_columns if column in columns)
+        return f"  - Creative Tags (packed into {packed_into}):\n{listed}"
+
+    def unpack_rows(self, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> Tuple[List[str], List[List[Any]]]:
+        """Rows with their bitmask columns replaced by a `tags` column listing the tags they encode."""
+        positions = {column: index for index, column in enumerate(columns)}
+        kept = [index for index, column in enumerate(columns) if column not in self.word_columns]
+        unpacked = [
+            [row[index] for index in kept]
+            + [",".join(self.unpack([row[positions[c]] if c in positions else None for c in self.word_columns]))]
+            for row in rows
+        ]
+        return [columns[index] for index in kept] + ["tags"], unpacked
+
+    def sql_guidelines(self, question: str, names: Sequence[str]) -> str:
+        """
+        How to test tags in generated SQL: empty for the columns layout, else
+        the predicates of the tags the question names, or the bit of every tag.
+        """
+        if not self.packed:
+            return ""
+        packed = [name for name in names if name in self.by_name]
+        lines = [
+            "    -   **Creative Tags:** Tags are packed into the bitmask columns "
+            f"{', '.join(f'`{column}`' for column in self.word_columns)}. "
+            f"Tag number `b` is set when `(({WORD_COLUMN_PREFIX}<b DIV {WORD_BITS}> >> <b MOD {WORD_BITS}>) & 1) = 1`. "
+            "Use these predicates wherever a tag is a condition, e.g. `AVG(IF(<predicate>, video_views, NULL))`, "
+            "and never compare or aggregate the bitmask columns directly."
+        ]
+        mentioned = self.mentioned(question, packed)
+        if mentioned:
+            lines.extend(f"        -   `{name}`: `{self.predicate(name)}`" for name in mentioned)
+        else:
+            lines.append("        -   Tag numbers: " + ", ".join(f"{name}={self.by_name[name].bit}" for name in packed))
+        return "\n".join(lines)
+
+    # ---- Packing ----
+
+    def pack(self, names: Iterable[str]) -> List[int]:
+        """The bitmask words of a set of tags, as signed INT64 values."""
+        words = [0] * len(self.word_columns)
+        for name in names:
+            bit = self.by_name[name].bit
+            words[bit // WORD_BITS] |= 1 << (bit % WORD_BITS)
+        return [word - (1 << WORD_BITS) if word >= 1 << (WORD_BITS - 1) else word for word in words]
+
+    def unpack(self, words: Sequence[Optional[int]]) -> List[str]:
+        """The active tags set in bitmask words."""
+        return [
+            name for name in self.names
+            if (words[self.by_name[name].bit // WORD_BITS] or 0) >> (self.by_name[name].bit % WORD_BITS) & 1
+        ]
+
+    # ---- Extraction ----
+
+    def features_model(self) -> Type[BaseModel]:
+        """
+        The feature extractor's response schema, validated strictly: a boolean
+        per tag in the columns layout, or the list of tags present when packed.
+        """
+        config = ConfigDict(extra="forbid", strict=True)
+        if self.packed:
+            return create_model(
+                "CreativeFeatures",
+                __config__=config,
+                tags=(List[Literal[tuple(self.names)]], Field(description="The tags that appear anywhere in the creative.")),
+            )
+        return create_model(
+            "CreativeFeatures",
+            __config__=config,
+            **{name: (bool, Field(description=self.by_name[name].description)) for name in self.names},
+        )
+
+    def present_tags(self, features: Mapping[str, Any]) -> List[str]:
+        """The tags set in validated features, in registry order."""
+        present = set(features.get("tags") or ()) if self.packed else {name for name, value in features.items() if value}
+        return [name for name in self.names if name in present]
+
+    def extraction_instructions(self) -> str:
+        """The extractor's task and output format."""
+        if self.packed:
+            listed = "\n".join(f"        - \"{name}\": {self.by_name[name].description}" for name in self.names)
+            return f"""1. First, analyze the provided image or video. For each of the following visual feature tags, detect whether the element appears **anywhere** in the creative:
+{listed}
+
+    2. Respond with a JSON object whose only key, "tags", lists the tags that appear, and nothing else.
+        Example: {{"tags": [{", ".join(f'"{name}"' for name in self.names[:2])}]}}"""
+
+        quoted = ", ".join(f'"{name}"' for name in self.names)
+        example = ", ".join(f'"{name}": {"true" if i % 2 else "false"}' for i, name in enumerate(self.names))
+        return f"""1. First, analyze the provided image or video. For each of the following visual feature tags — {quoted} — detect whether the element appears **anywhere** in the creative.
+        - If the element is present in any part of the image or video: set its value to true.
+        - If the element does not appear anywhere: set its value to false.
+
+    2. Respond with a JSON object containing exactly these {len(self.names)} boolean keys and nothing else.
+        Example: {{{example}}}"""
+
+    # ---- Training and prediction ----
+
+    def model_input_sql(self) -> str:
+        """The tag features of the training query, read from the performance table's tag columns."""
+        if not self.packed:
+            return ",\n      ".join(self.names)
+        names = ", ".join(f"'{tag.name}'" for tag in self.tags)
+        words = ", ".join(self.word_columns)
+        return f"""ARRAY(
+        SELECT AS STRUCT tag, 1.0 AS value
+        FROM UNNEST([{names}]) AS tag WITH OFFSET AS bit
+        WHERE ([{words}][OFFSET(DIV(bit, {WORD_BITS}))] >> MOD(bit, {WORD_BITS})) & 1 = 1
+      ) AS {SPARSE_FEATURES_COLUMN}"""
+
+    def prediction_input_sql(self, present: Iterable[str]) -> str:
+        """The model input for one ad with the `present` tags, as a SELECT list."""
+        present = set(present)
+        if not self.packed:
+            return ", ".join(f"{str(name in present).lower()} AS {name}" for name in self.names)
+        structs = ", ".join(f"STRUCT('{name}' AS tag, 1.0 AS value)" for name in self.names if name in present)
+        return f"ARRAY<STRUCT<tag STRING, value FLOAT64>>[{structs}] AS {SPARSE_FEATURES_COLUMN}"
+
+
+tag_registry = TagRegistry.from_file(REGISTRY_FILE)
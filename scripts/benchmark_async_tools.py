@@ -0,0 +1,95 @@
+import argparse
+import asyncio
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "creative_analytics"))
+
+from creative_analytics_agents.utils.database_context import init_database_settings  # noqa: E402
+from creative_analytics_agents.utils.settings import settings  # noqa: E402
+from creative_analytics_agents.sub_agents.statistical_analysis import async_tools, tools  # noqa: E402
+
+# --- CONFIGURATION ---
+QUESTIONS = [
+    "How did ads with a logo perform?",
+    "Compare the performance lift from ads with animals vs. ads with humans.",
+    "What creative elements are working best overall?",
+    "Did ads with a call to action get more views?",
+]
+CONCURRENCY_LEVELS = [1, 2, 4, 8, 16, 32]
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+async def run_session_async(index: int, tool_context) -> float:
+    """One analyst session: generate SQL, then execute it, using the async tools."""
+    start = time.perf_counter()
+    generated = await async_tools.generate_sql_for_analysis(QUESTIONS[index % len(QUESTIONS)], tool_context)
+    if generated["status"] == "success":
+        await async_tools.execute_sql(settings.GOOGLE_CLOUD_PROJECT_ID, generated["sql_query"])
+    return time.perf_counter() - start
+
+
+async def run_session_sync(index: int, tool_context) -> float:
+    """The same session using the blocking tools, called from the event loop as ADK does."""
+    start = time.perf_counter()
+    generated = tools.generate_sql_for_analysis(QUESTIONS[index % len(QUESTIONS)], tool_context)
+    if generated["status"] == "success":
+        tools.get_bigquery_client().query(generated["sql_query"]).result()
+    return time.perf_counter() - start
+
+
+async def measure(session_fn, concurrency: int, tool_context) -> dict:
+    """Runs `concurrency` sessions at once and reports throughput."""
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(session_fn(i, tool_context) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "wall_seconds": elapsed,
+        "sessions_per_second": concurrency / elapsed,
+        "median_latency": statistics.median(latencies),
+    }
+
+
+async def run_benchmark(levels, include_sync: bool) -> None:
+    """Measures session throughput per worker for each concurrency level."""
+    shared_context = init_database_settings()
+    tool_context = SimpleNamespace(state={"schema_version": shared_context["schema_version"]})
+
+    modes = [("async", run_session_async)]
+    if include_sync:
+        modes.append(("sync", run_session_sync))
+
+    for mode, session_fn in modes:
+        baseline = None
+        for concurrency in levels:
+            result = await measure(session_fn, concurrency, tool_context)
+            baseline = baseline or result["sessions_per_second"]
+            logging.info(
+                f"[{mode}] concurrency={concurrency:3d} "
+                f"throughput={result['sessions_per_second']:6.2f} sessions/s "
+                f"scaling={result['sessions_per_second'] / baseline:5.2f}x "
+                f"median_latency={result['median_latency']:.2f}s"
+            )
+
+
+def main():
+    """Main function to run the concurrency benchmark against live services."""
+    parser = argparse.ArgumentParser(description="Benchmark async vs. blocking analysis tools.")
+    parser.add_argument("--levels", type=int, nargs="+", default=CONCURRENCY_LEVELS)
+    parser.add_argument("--include-sync", action="store_true", help="Also measure the blocking tools")
+    args = parser.parse_args()
+
+    asyncio.run(run_benchmark(args.levels, args.include_sync))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import json
+import logging
+import mimetypes
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "creative_analytics"))
+
+from google.adk.agents import LlmAgent  # noqa: E402
+from google.adk.runners import InMemoryRunner  # noqa: E402
+from google.genai import types  # noqa: E402
+
+from creative_analytics_agents.sub_agents.performance_predictor.agent import features_extraction_agent  # noqa: E402
+from creative_analytics_agents.sub_agents.performance_predictor.tools import parse_features  # noqa: E402
+from creative_analytics_agents.utils.models import create_model  # noqa: E402
+from creative_analytics_agents.utils.settings import settings  # noqa: E402
+
+# --- CONFIGURATION ---
+APP_NAME = "feature_extraction_benchmark"
+USER_ID = "benchmark_user"
+
+# The extractor as it was before structured output: emit JSON, validate it
+# with a tool call, then echo the tool result.
+TOOL_VALIDATED_INSTRUCTION = """
+Analyze the provided image or video. For each of the visual feature tags "animal", "human", "logo", "product", "cta",
+set the value to true if the element appears anywhere in the creative and false otherwise.
+Output a raw JSON string containing exactly these five boolean keys, then call the `validate_features_json` tool with it.
+Your final output MUST be ONLY the dictionary of features that you receive from the `validate_features_json` tool.
+"""
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+def validate_features_json(json_string: str) -> Dict[str, Any]:
+    """Parses a JSON string of visual features."""
+    try:
+        return {"status": "success", "features": json.loads(json_string)}
+    except json.JSONDecodeError as e:
+        return {"status": "error", "error_message": str(e)}
+
+
+def build_tool_validated_agent() -> LlmAgent:
+    return LlmAgent(
+        name="ToolValidatedFeaturesExtractionAgent",
+        model=create_model(settings.PREDICTOR_AGENT_MODEL),
+        instruction=TOOL_VALIDATED_INSTRUCTION,
+        tools=[validate_features_json],
+        output_key="features",
+    )
+
+
+async def extract_once(agent: LlmAgent, media: types.Part) -> Dict[str, Any]:
+    """Runs one extraction in a fresh session and measures it."""
+    runner = InMemoryRunner(agent=agent, app_name=APP_NAME)
+    session = await runner.session_service.create_session(app_name=APP_NAME, user_id=USER_ID)
+    message = types.Content(role="user", parts=[types.Part(text="Extract the features of this creative."), media])
+
+    model_turns = prompt_tokens = 0
+    start = time.perf_counter()
+    async for event in runner.run_async(user_id=USER_ID, session_id=session.id, new_message=message):
+        if event.author != agent.name or event.partial or not event.content or not event.content.parts:
+            continue
+        if not any(part.function_response for part in event.content.parts):
+            model_turns += 1
+            if event.usage_metadata is not None:
+                prompt_tokens += event.usage_metadata.prompt_token_count or 0
+    latency = time.perf_counter() - start
+
+    session = await runner.session_service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=session.id)
+    features = session.state.get("features")
+    try:
+        parse_features(json.dumps(features))
+        valid = True
+    except ValueError:
+        valid = False
+    return {"latency": latency, "model_turns": model_turns, "prompt_tokens": prompt_tokens, "valid": valid}
+
+
+async def run_benchmark(media_path: Path, runs: int) -> None:
+    mime_type = mimetypes.guess_type(media_path.name)[0] or "application/octet-stream"
+    media = types.Part.from_bytes(data=media_path.read_bytes(), mime_type=mime_type)
+
+    medians = {}
+    for mode, agent in [("tool_validated", build_tool_validated_agent()), ("structured", features_extraction_agent)]:
+        results = [await extract_once(agent, media) for _ in range(runs)]
+        medians[mode] = statistics.median(r["latency"] for r in results)
+        logging.info(
+            f"[{mode:>14}] runs={runs} "
+            f"p50={medians[mode]:.2f}s "
+            f"model_turns={statistics.mean(r['model_turns'] for r in results):.1f} "
+            f"prompt_tokens={statistics.mean(r['prompt_tokens'] for r in results):.0f} "
+            f"strictly_valid={sum(r['valid'] for r in results)}/{runs}"
+        )
+    saved = medians["tool_validated"] - medians["structured"]
+    logging.info(f"Latency saved per prediction: {saved:.2f}s ({saved / medians['tool_validated']:.0%} of extraction)")
+
+
+def main():
+    """Compares tool-validated and structured-output feature extraction on one creative."""
+    parser = argparse.ArgumentParser(description="Latency of feature extraction with and without the validation tool turn.")
+    parser.add_argument("media", type=Path, help="Image or video file of a creative")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    asyncio.run(run_benchmark(args.media, args.runs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import json
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "creative_analytics"))
+
+from google.genai import types  # noqa: E402
+
+from creative_analytics_agents.utils.history import compact_contents, estimate_tokens  # noqa: E402
+
+# --- CONFIGURATION ---
+CORPUS_FILE = Path(__file__).parent.parent / "data" / "load_test_corpus.json"
+ROWS_PER_QUERY = 40
+IMAGE_EVERY_TURNS = 5
+IMAGE_BYTES = 200_000
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+def load_questions() -> List[str]:
+    with open(CORPUS_FILE, "r", encoding="utf-8") as f:
+        conversations = json.load(f)["conversations"]
+    return [conversation["turns"][0] for conversation in conversations]
+
+
+def synthetic_turn(index: int, questions: List[str]) -> List[types.Content]:
+    """One analyst turn: question, SQL generation, execution with result rows and an answer; some turns upload an image."""
+    question = questions[index % len(questions)]
+    user_parts = [types.Part(text=f"{question} (turn {index})")]
+    if index % IMAGE_EVERY_TURNS == IMAGE_EVERY_TURNS - 1:
+        user_parts.append(types.Part(inline_data=types.Blob(mime_type="image/png", data=b"\0" * IMAGE_BYTES)))
+    sql = "SELECT logo, AVG(video_views) AS avg_views, AVG(clicks) AS avg_clicks FROM t GROUP BY logo"
+    rows = [
+        {"segment": f"segment_{i}", "ads": 100 + i, "avg_views": 1234.5 + i, "avg_clicks": 56.7 + i,
+         "avg_spend": 12.34 + i, "ctr": 0.0123, "lift": 12.3 + i}
+        for i in range(ROWS_PER_QUERY)
+    ]
+    return [
+        types.Content(role="user", parts=user_parts),
+        types.Content(role="model", parts=[types.Part(
+            function_call=types.FunctionCall(id=f"g{index}", name="generate_sql_for_analysis", args={"question": question}))]),
+        types.Content(role="user", parts=[types.Part(function_response=types.FunctionResponse(
+            id=f"g{index}", name="generate_sql_for_analysis", response={"status": "success", "sql_query": sql}))]),
+        types.Content(role="model", parts=[types.Part(
+            function_call=types.FunctionCall(id=f"e{index}", name="execute_sql", args={"query": sql}))]),
+        types.Content(role="user", parts=[types.Part(function_response=types.FunctionResponse(
+            id=f"e{index}", name="execute_sql", response={"status": "SUCCESS", "rows": rows}))]),
+        types.Content(role="model", parts=[types.Part(
+            text="Ads with a logo averaged 12.3% more video views than ads without one. " * 8)]),
+    ]
+
+
+def model_latency(client, model: str, contents: List[types.Content], repeats: int) -> float:
+    """Median latency of a short generation over `contents`."""
+    tool_names = sorted({
+        part.function_call.name for content in contents for part in content.parts or [] if part.function_call
+    })
+    config = types.GenerateContentConfig(
+        max_output_tokens=64,
+        tools=[types.Tool(function_declarations=[
+            types.FunctionDeclaration(name=name, description=name) for name in tool_names
+        ])] if tool_names else None,
+    )
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        client.models.generate_content(model=model, contents=contents, config=config)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    """Compares the history sent per turn with and without compaction as sessions grow."""
+    parser = argparse.ArgumentParser(description="Benchmark per-turn prompt size and latency versus session length.")
+    parser.add_argument("--turns", type=int, nargs="+", default=[5, 10, 20, 40, 80], help="Session lengths to report")
+    parser.add_argument("--model", help="Also measure the median model latency per turn, e.g. gemini-2.5-flash")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    questions = load_questions()
+    client = None
+    if args.model:
+        from google import genai
+        client = genai.Client(vertexai=True)
+
+    # Turns are compacted one after the other, as in a session, so the summary grows incrementally.
+    history: List[types.Content] = []
+    summary: Optional[Dict] = None
+    compaction_ms: List[float] = []
+    checkpoints = set(args.turns)
+    logging.info(f"{'turns':>6} {'raw tokens':>11} {'sent tokens':>12} {'compaction':>11}"
+                 + (f" {'raw latency':>12} {'sent latency':>13}" if client else ""))
+    for index in range(max(args.turns)):
+        turn = synthetic_turn(index, questions)
+        request = history + turn[:1]
+        start = time.perf_counter()
+        compacted, summary = compact_contents(request, summary)
+        compaction_ms.append((time.perf_counter() - start) * 1000)
+        history += turn
+
+        if index + 1 in checkpoints:
+            line = (f"{index + 1:>6} {estimate_tokens(request):>11} {estimate_tokens(compacted):>12} "
+                    f"{compaction_ms[-1]:>9.2f}ms")
+            if client:
+                line += (f" {model_latency(client, args.model, request, args.repeats):>11.2f}s"
+                         f" {model_latency(client, args.model, compacted, args.repeats):>12.2f}s")
+            logging.info(line)
+    logging.info(f"Median compaction time per turn: {statistics.median(compaction_ms):.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import argparse
+import logging
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# --- CONFIGURATION ---
+PACKAGE_DIR = Path(__file__).parent.parent / "creative_analytics"
+OWN_PACKAGE = "creative_analytics_agents"
+ENTRY_MODULE = f"{OWN_PACKAGE}.agent"
+DEFAULT_BUDGET_SECONDS = 3.5
+# Must finish importing for the measurement to be complete
+REQUIRED_MODULES = (f"{OWN_PACKAGE}.sub_agents", f"{OWN_PACKAGE}.utils.schema_refresher")
+# Never imported on the serving path
+FORBIDDEN_MODULES = ("vertexai", "google.cloud.aiplatform")
+# Never imported by the package's own modules (a dependency may still pull them in)
+AVOIDED_OWN_IMPORTS = ("pandas",)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+@dataclass
+class ImportEntry:
+    name: str
+    depth: int
+    self_us: int
+    cumulative_us: int
+    parent: Optional[str] = None
+
+
+def measure_imports() -> List[ImportEntry]:
+    """
+    Imports the root agent in a fresh interpreter with `-X importtime` and
+    returns one entry per module, in the order the interpreter reported them.
+    """
+    env = {**os.environ, "SCHEMA_REFRESH_SECONDS": "0", "PYTHONPATH": str(PACKAGE_DIR)}
+    # The import may fail afterwards, e.g. without credentials for the schema
+    # crawl; every module imported before that is still reported.
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {ENTRY_MODULE}"],
+        cwd=PACKAGE_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        logging.warning(f"Importing {ENTRY_MODULE} failed: {result.stderr.strip().splitlines()[-1]}")
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        stripped = name.lstrip()
+        entries.append(ImportEntry(stripped.strip(), (len(name) - len(stripped)) // 2, int(self_us), int(cumulative_us)))
+
+    # Modules are reported after their imports, so a module's importer is the
+    # next entry with a smaller depth.
+    for i, entry in enumerate(entries):
+        for later in entries[i + 1:]:
+            if later.depth < entry.depth:
+                entry.parent = later.name
+                break
+    return entries
+
+
+def package_group(name: str) -> str:
+    """Groups modules by distribution, e.g. `google.cloud.bigquery.client` -> `google.cloud.bigquery`."""
+    parts = name.split(".")
+    if parts[0] == "google":
+        return ".".join(parts[:3] if len(parts) > 2 and parts[1] == "cloud" else parts[:2])
+    return parts[0]
+
+
+def import_chain(entries: List[ImportEntry], name: str) -> List[str]:
+    by_name = {entry.name: entry for entry in entries}
+    chain, current = [], by_name.get(name)
+    while current is not None:
+        chain.append(current.name)
+        current = by_name.get(current.parent) if current.parent else None
+    return chain
+
+
+def main():
+    """Reports the import time of the serving path per package and fails when it exceeds the budget."""
+    parser = argparse.ArgumentParser(description="Import-time breakdown of the agent package with an enforced budget.")
+    parser.add_argument("--budget-seconds", type=float, default=DEFAULT_BUDGET_SECONDS)
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters to measure; the fastest run is reported")
+    parser.add_argument("--top", type=int, default=15, help="Package groups to list")
+    args = parser.parse_args()
+
+    runs = [measure_imports() for _ in range(args.runs)]
+    # The entry module's own time includes the schema crawl, which is not import cost.
+    totals = [sum(e.self_us for e in entries if e.name != ENTRY_MODULE) for entries in runs]
+    entries = runs[totals.index(min(totals))]
+    total_seconds = min(totals) / 1e6
+    missing = [module for module in REQUIRED_MODULES if module not in {entry.name for entry in entries}]
+    if missing:
+        logging.error(f"Import stopped before {missing} finished importing, so the measurement is incomplete...")
+        exit(1)
+
+    groups: Dict[str, int] = defaultdict(int)
+    for entry in entries:
+        if entry.name != ENTRY_MODULE:
+            groups[package_group(entry.name)] += entry.self_us
+    logging.info(f"Imported {len(entries)} modules in {total_seconds:.2f}s (best of {args.runs}). Slowest packages:")
+    for group, self_us in sorted(groups.items(), key=lambda item: -item[1])[:args.top]:
+        logging.info(f"  {group:<40} {self_us / 1e3:8.1f}ms")
+    logging.info("Package modules (self time):")
+    for entry in sorted((e for e in entries if e.name.startswith(OWN_PACKAGE) and e.name != ENTRY_MODULE),
+                        key=lambda e: -e.self_us):
+        logging.info(f"  {entry.name:<70} {entry.self_us / 1e3:8.1f}ms")
+
+    failures = []
+    names = {entry.name for entry in entries}
+    for module in FORBIDDEN_MODULES:
+        if module in names:
+            failures.append(f"{module} is imported: {' <- '.join(import_chain(entries, module))}")
+    for module in AVOIDED_OWN_IMPORTS:
+        if module in names:
+            chain = import_chain(entries, module)
+            importer = chain[1] if len(chain) > 1 else ""
+            if importer.startswith(OWN_PACKAGE):
+                failures.append(f"{module} is imported by {importer}")
+            else:
+                logging.info(f"{module} is imported by a dependency: {' <- '.join(chain[:4])}")
+    if total_seconds > args.budget_seconds:
+        failures.append(f"Import time {total_seconds:.2f}s exceeds the {args.budget_seconds:.2f}s budget")
+
+    for failure in failures:
+        logging.error(failure)
+    if failures:
+        exit(1)
+    logging.info(f"Within the {args.budget_seconds:.2f}s import budget.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+# --- CONFIGURATION ---
+PROJECT_DIR = Path(__file__).parent.parent / "creative_analytics"
+HOST = "127.0.0.1"
+STARTUP_TIMEOUT_SECONDS = 120
+QUESTIONS = [
+    "How did ads with a logo perform?",
+    "Which ads performed better - one with animal or human?",
+    "What creative elements are working best overall?",
+]
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+def start_server(port: int, workers: int, fake_latency: float) -> subprocess.Popen:
+    """Starts the HTTP server with the fake model backend in a child process."""
+    env = {
+        **os.environ,
+        "MODEL_BACKEND": "fake",
+        "FAKE_MODEL_LATENCY_SECONDS": str(fake_latency),
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "creative_analytics_agents.server", "--host", HOST,
+         "--port", str(port), "--workers", str(workers)],
+        cwd=PROJECT_DIR,
+        env=env,
+    )
+
+
+async def wait_until_ready(client: httpx.AsyncClient, server: subprocess.Popen) -> None:
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited during startup with code {server.returncode}")
+        try:
+            if (await client.get("/healthz")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError("Server did not become ready in time")
+
+
+async def one_request(client: httpx.AsyncClient, index: int) -> dict:
+    """Sends one message and reads its event stream to the end."""
+    start = time.perf_counter()
+    first_event = None
+    payload = {"user_id": f"bench_user_{index}", "message": QUESTIONS[index % len(QUESTIONS)]}
+    async with client.stream("POST", "/run_sse", json=payload) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return {"status": response.status_code, "latency": time.perf_counter() - start, "first_event": None}
+        async for line in response.aiter_lines():
+            if line.startswith("data:") and first_event is None:
+                first_event = time.perf_counter() - start
+    return {"status": 200, "latency": time.perf_counter() - start, "first_event": first_event}
+
+
+async def measure(client: httpx.AsyncClient, requests: int, concurrency: int) -> dict:
+    """Issues `requests` requests with at most `concurrency` in flight."""
+    limiter = asyncio.Semaphore(concurrency)
+
+    async def bounded(index: int) -> dict:
+        async with limiter:
+            return await one_request(client, index)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(bounded(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r["status"] == 200]
+    latencies = sorted(r["latency"] for r in ok)
+    first_events = [r["first_event"] for r in ok if r["first_event"] is not None]
+    return {
+        "concurrency": concurrency,
+        "requests_per_second": len(ok) / elapsed,
+        "p50_latency": statistics.median(latencies) if latencies else float("nan"),
+        "p95_latency": latencies[int(0.95 * (len(latencies) - 1))] if latencies else float("nan"),
+        "p50_first_event": statistics.median(first_events) if first_events else float("nan"),
+        "rejected": sum(r["status"] == 503 for r in results),
+        "failed": sum(r["status"] not in (200, 503) for r in results),
+    }
+
+
+async def run_benchmark(args) -> None:
+    server = start_server(args.port, args.workers, args.fake_latency)
+    try:
+        timeout = httpx.Timeout(60.0, connect=5.0)
+        limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+        async with httpx.AsyncClient(base_url=f"http://{HOST}:{args.port}", timeout=timeout, limits=limits) as client:
+            await wait_until_ready(client, server)
+            await measure(client, requests=args.workers * 4, concurrency=args.workers * 4)  # warm-up
+            for concurrency in args.concurrency:
+                result = await measure(client, args.requests, concurrency)
+                logging.info(
+                    f"concurrency={result['concurrency']:>4}  "
+                    f"{result['requests_per_second']:8.1f} req/s  "
+                    f"p50={result['p50_latency'] * 1000:7.1f} ms  "
+                    f"p95={result['p95_latency'] * 1000:7.1f} ms  "
+                    f"first event p50={result['p50_first_event'] * 1000:7.1f} ms  "
+                    f"rejected={result['rejected']}  failed={result['failed']}"
+                )
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    """Measures server throughput with the fake model backend, isolating serving overhead."""
+    parser = argparse.ArgumentParser(description="Throughput benchmark for the HTTP server with the fake model backend.")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64, 128])
+    parser.add_argument("--fake-latency", type=float, default=0.05, help="Seconds per fake model call")
+    args = parser.parse_args()
+
+    asyncio.run(run_benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
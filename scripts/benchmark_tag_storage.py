@@ -0,0 +1,246 @@
+import argparse
+import json
+import logging
+import sqlite3
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "creative_analytics"))
+
+from creative_analytics_agents.utils import stats_engine  # noqa: E402
+from creative_analytics_agents.utils.tag_registry import COLUMNS, PACKED, WORD_BITS, Tag, TagRegistry  # noqa: E402
+
+# --- CONFIGURATION ---
+MEASURES = ("video_views", "impressions", "clicks", "conversions", "spend")
+# Bytes per value that BigQuery bills for a column read
+BOOL_BYTES, INT64_BYTES = 1, 8
+CHARS_PER_TOKEN = 4
+# Tags a "few tags" question names
+FEW_TAGS = 3
+SAMPLE_ROWS = 3
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+def synthetic_registry(num_tags: int, storage: str) -> TagRegistry:
+    return TagRegistry(
+        [Tag(name=f"tag_{bit:03d}", bit=bit, description=f"Visual element number {bit} appears in the creative.")
+         for bit in range(num_tags)],
+        storage,
+    )
+
+
+def generate_data(num_rows: int, num_tags: int, tags_per_ad: float, seed: int = 7):
+    """A tag matrix with skewed tag prevalences and log-normal views, boosted by the first tags."""
+    rng = np.random.default_rng(seed)
+    prevalence = rng.dirichlet(np.full(num_tags, 0.5)) * tags_per_ad
+    present = rng.random((num_rows, num_tags)) < np.clip(prevalence, 0, 1)
+    views = 100 + rng.lognormal(mean=8, sigma=2.0, size=num_rows)
+    views *= 1 + 0.2 * present[:, :10].sum(axis=1)
+    impressions = views * rng.uniform(2.0, 6.0, size=num_rows)
+    clicks = rng.binomial(impressions.astype(np.int64), 0.02)
+    measures = {
+        "video_views": views.astype(np.int64),
+        "impressions": impressions.astype(np.int64),
+        "clicks": clicks,
+        "conversions": rng.binomial(clicks, 0.05),
+        "spend": np.round(impressions / 1000 * 8.0, 2),
+    }
+    return present, measures
+
+
+def table_rows(registry: TagRegistry, present: np.ndarray, measures: Dict[str, np.ndarray]) -> List[tuple]:
+    rows = []
+    for i in range(len(present)):
+        if registry.packed:
+            tags = registry.pack(registry.names[j] for j in np.flatnonzero(present[i]))
+        else:
+            tags = [int(value) for value in present[i]]
+        rows.append((f"ad_{i}", *tags, *(measures[m][i].item() for m in MEASURES)))
+    return rows
+
+
+def load_sqlite(registry: TagRegistry, rows: List[tuple]) -> sqlite3.Connection:
+    db = sqlite3.connect(":memory:")
+    columns = ["media_id", *(name for name, _ in registry.table_columns()), *MEASURES]
+    db.execute(f"CREATE TABLE performance ({', '.join(columns)})")
+    db.executemany(f"INSERT INTO performance VALUES ({', '.join('?' * len(columns))})", rows)
+    return db
+
+
+def sqlite_lift_sql(registry: TagRegistry, tags: Sequence[str]) -> str:
+    """The single-scan lift sums of `build_lift_matrix_sql` for video views, in sqlite's dialect."""
+    select = ["COUNT(*) AS n_all", "SUM(video_views) AS s_all"]
+    for j, (tag, condition) in enumerate(registry.predicates(tags).items()):
+        select.append(f"SUM(IIF({condition}, 1, 0)) AS n_t{j}")
+        select.append(f"SUM(IIF({condition}, video_views, 0)) AS s_t{j}")
+    return f"SELECT {', '.join(select)} FROM performance"
+
+
+def median_seconds(run, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def scanned_bytes_per_row(registry: TagRegistry, tags: Sequence[str]) -> int:
+    """The bytes per row BigQuery reads for the lift of `tags` on video views: the tag columns plus one INT64."""
+    if registry.packed:
+        return len({registry.by_name[tag].bit // WORD_BITS for tag in tags}) * INT64_BYTES + INT64_BYTES
+    return len(tags) * BOOL_BYTES + INT64_BYTES
+
+
+def schema_prompt_tokens(registry: TagRegistry, rows: List[tuple]) -> int:
+    """The size of the table's schema block in the analyst prompt, formatted as in database_context.py."""
+    schema = [("media_id", "STRING"), *registry.table_columns(), *((m, "INTEGER") for m in MEASURES)]
+    columns = [name for name, _ in schema]
+    samples = "\n".join("  ".join(str(value) for value in row) for row in [columns, *rows[:SAMPLE_ROWS]])
+    prompt = ", ".join(f"{name} ({field_type})" for name, field_type in schema) + samples
+    prompt += registry.sql_guidelines("Which elements work best?", registry.names)
+    return len(prompt) // CHARS_PER_TOKEN
+
+
+def extraction_prompt_tokens(registry: TagRegistry) -> int:
+    """The extractor's instructions plus its response schema, which carries the tag descriptions of the columns layout."""
+    schema = json.dumps(registry.features_model().model_json_schema())
+    return (len(registry.extraction_instructions()) + len(schema)) // CHARS_PER_TOKEN
+
+
+def extractor_output(registry: TagRegistry, present_row: np.ndarray) -> str:
+    present = [registry.names[j] for j in np.flatnonzero(present_row)]
+    if registry.packed:
+        return json.dumps({"tags": present})
+    return json.dumps({name: name in present for name in registry.names})
+
+
+def prediction_seconds(registry: TagRegistry, outputs: List[str]) -> float:
+    """Mean time to validate an extractor output and render its ML.PREDICT input."""
+    model = registry.features_model()
+    start = time.perf_counter()
+    for output in outputs:
+        features = model.model_validate_json(output).model_dump()
+        registry.prediction_input_sql(registry.present_tags(features))
+    return (time.perf_counter() - start) / len(outputs)
+
+
+def local_benchmark(args, present: np.ndarray, measures: Dict[str, np.ndarray]) -> None:
+    logging.info(f"{'layout':>8} {'tag cols':>9} {'load':>8} {'few tags':>9} {'all tags':>9} "
+                 f"{'B/row few':>10} {'B/row all':>10} {'schema tok':>11} {'extract tok':>12} "
+                 f"{'output tok':>11} {'predict prep':>13}")
+    for storage in (COLUMNS, PACKED):
+        registry = synthetic_registry(args.tags, storage)
+        rows = table_rows(registry, present, measures)
+        start = time.perf_counter()
+        db = load_sqlite(registry, rows)
+        load_seconds = time.perf_counter() - start
+
+        few = registry.names[:FEW_TAGS]
+        few_sql, all_sql = sqlite_lift_sql(registry, few), sqlite_lift_sql(registry, registry.names)
+        all_result = db.execute(all_sql).fetchone()
+        if storage == COLUMNS:
+            expected = all_result
+        elif all_result != expected:
+            raise AssertionError("The packed layout returned different lift sums than the columns layout.")
+        few_seconds = median_seconds(lambda: db.execute(few_sql).fetchone(), args.repeats)
+        all_seconds = median_seconds(lambda: db.execute(all_sql).fetchone(), args.repeats)
+
+        outputs = [extractor_output(registry, present[i]) for i in range(min(args.predictions, len(present)))]
+        output_tokens = statistics.mean(len(output) for output in outputs) / CHARS_PER_TOKEN
+        logging.info(
+            f"{storage:>8} {len(registry.table_columns()):>9} {load_seconds:>7.2f}s "
+            f"{few_seconds * 1000:>7.1f}ms {all_seconds * 1000:>7.1f}ms "
+            f"{scanned_bytes_per_row(registry, few):>10} {scanned_bytes_per_row(registry, registry.names):>10} "
+            f"{schema_prompt_tokens(registry, rows):>11} "
+            f"{extraction_prompt_tokens(registry):>12} {output_tokens:>11.0f} "
+            f"{prediction_seconds(registry, outputs) * 1000:>11.2f}ms"
+        )
+        db.close()
+    logging.info("Both layouts returned identical lift sums.")
+
+
+def bigquery_benchmark(args, present: np.ndarray, measures: Dict[str, np.ndarray]) -> None:
+    """Loads both layouts into BQ_DATASET_NAME, trains a model on each and times lift queries and ML.PREDICT."""
+    from google.cloud import bigquery
+    from creative_analytics_agents.utils.settings import settings
+
+    client = bigquery.Client(project=settings.GOOGLE_CLOUD_PROJECT_ID)
+    no_cache = bigquery.QueryJobConfig(use_query_cache=False)
+    label_threshold = float(np.median(measures["video_views"]))
+    logging.info(f"{'layout':>8} {'few tags':>9} {'few bytes':>12} {'all tags':>9} {'all bytes':>12} {'ML.PREDICT':>11}")
+    for storage in (COLUMNS, PACKED):
+        registry = synthetic_registry(args.tags, storage)
+        table_id = f"{settings.GOOGLE_CLOUD_PROJECT_ID}.{settings.BQ_DATASET_NAME}.tag_storage_bench_{storage}"
+        model_id = f"{settings.BQ_DATASET_NAME}.tag_storage_bench_{storage}_model"
+        columns = ["media_id", *(name for name, _ in registry.table_columns()), *MEASURES]
+        schema = [
+            bigquery.SchemaField("media_id", "STRING"),
+            *(bigquery.SchemaField(name, field_type) for name, field_type in registry.table_columns()),
+            *(bigquery.SchemaField(m, "FLOAT" if m == "spend" else "INTEGER") for m in MEASURES),
+        ]
+        rows = [
+            {column: bool(value) if field.field_type == "BOOLEAN" else value
+             for column, field, value in zip(columns, schema, row)}
+            for row in table_rows(registry, present, measures)
+        ]
+        client.load_table_from_json(rows, table_id, job_config=bigquery.LoadJobConfig(
+            schema=schema, write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        )).result()
+        client.query(f"""
+        CREATE OR REPLACE MODEL `{model_id}`
+        OPTIONS(model_type='LOGISTIC_REG', input_label_cols=['is_high_performing']) AS
+        SELECT
+          {registry.model_input_sql()},
+          IF(video_views > {label_threshold}, 1, 0) AS is_high_performing
+        FROM `{table_id}`
+        """).result()
+
+        timings = {}
+        metrics = stats_engine.available_metrics(["video_views"])
+        for label, tags in (("few", registry.names[:FEW_TAGS]), ("all", registry.names)):
+            sql = stats_engine.build_lift_matrix_sql(f"`{table_id}`", tags, metrics, tag_sql=registry.predicates(tags))
+            start = time.perf_counter()
+            job = client.query(sql, job_config=no_cache)
+            job.result()
+            timings[label] = (time.perf_counter() - start, job.total_bytes_processed or 0)
+
+        present_tags = [registry.names[j] for j in np.flatnonzero(present[0])]
+        predict_sql = f"SELECT * FROM ML.PREDICT(MODEL `{model_id}`, (SELECT {registry.prediction_input_sql(present_tags)}))"
+        predict_seconds = median_seconds(lambda: client.query(predict_sql, job_config=no_cache).result(), args.repeats)
+        logging.info(
+            f"{storage:>8} {timings['few'][0]:>8.2f}s {timings['few'][1]:>12} "
+            f"{timings['all'][0]:>8.2f}s {timings['all'][1]:>12} {predict_seconds:>10.2f}s"
+        )
+
+
+def main():
+    """Compares one BOOLEAN column per tag with packed bitmask words for a large tag taxonomy."""
+    parser = argparse.ArgumentParser(description="Benchmark tag storage layouts for hundreds of tags.")
+    parser.add_argument("--tags", type=int, default=500, help="Size of the synthetic taxonomy")
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--tags-per-ad", type=float, default=20.0, help="Average number of tags an ad has")
+    parser.add_argument("--predictions", type=int, default=500, help="Extractor outputs to validate and render")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--bigquery", action="store_true",
+                        help="Also load both layouts into BQ_DATASET_NAME and time the queries and ML.PREDICT there")
+    args = parser.parse_args()
+
+    present, measures = generate_data(args.rows, args.tags, args.tags_per_ad)
+    logging.info(f"Generated {args.rows} ads over {args.tags} tags, {present.sum(axis=1).mean():.1f} tags per ad...")
+    local_benchmark(args, present, measures)
+    if args.bigquery:
+        bigquery_benchmark(args, present, measures)
+
+
+if __name__ == "__main__":
+    main()
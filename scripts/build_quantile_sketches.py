@@ -0,0 +1,139 @@
+import argparse
+import logging
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "creative_analytics"))
+
+from google.cloud import bigquery  # noqa: E402
+
+from creative_analytics_agents.utils import stats_engine  # noqa: E402
+from creative_analytics_agents.utils.quantile_sketch import QuantileSketchStore  # noqa: E402
+from creative_analytics_agents.utils.settings import settings  # noqa: E402
+from creative_analytics_agents.utils.tag_registry import tag_registry  # noqa: E402
+
+# --- CONFIGURATION ---
+DEFAULT_OUTPUT_FILE = "quantile_sketches.json"
+ALL_ROWS_PARTITION = "all"
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+def per_ad_metrics(columns: List[str]) -> List[str]:
+    """The metrics that are a value per ad (not a ratio of sums), which are the ones sketched."""
+    return [metric.name for metric in stats_engine.available_metrics(columns) if metric.denominator is None]
+
+
+def load_store(path: Path, table: str, tags: List[str], metrics: List[str], k: int, rebuild: bool) -> QuantileSketchStore:
+    """The existing store at `path` if it was built for the same table, tags, metrics and k; else a new one."""
+    if path.is_file() and not rebuild:
+        store = QuantileSketchStore.load(path)
+        if (store.table, store.tags, store.metrics, store.k) == (table, tags, metrics, k):
+            return store
+        logging.info(f"Existing sketches in {path} were built for other tags, metrics or k; rebuilding...")
+    return QuantileSketchStore(tags, metrics, k=k, table=table)
+
+
+def partitions_to_sketch(available: List[str], store: QuantileSketchStore) -> List[str]:
+    """
+    New partitions, plus the most recent sketched one, which may have been
+    incomplete when it was sketched.
+    """
+    done = sorted(store.partitions)
+    return [p for p in sorted(available) if p not in store.partitions or (done and p == done[-1])]
+
+
+def add_frame(store: QuantileSketchStore, partition: str, frame: pd.DataFrame) -> None:
+    tag_matrix = frame[store.tags].fillna(False).astype(bool).to_numpy()
+    values = {metric: frame[metric].astype(float).to_numpy() for metric in store.metrics}
+    store.add_partition(partition, tag_matrix, values)
+    logging.info(f"Sketched partition {partition} ({len(frame)} rows)...")
+
+
+def build_from_csv(args, output: Path) -> QuantileSketchStore:
+    frame = pd.read_csv(args.csv)
+    metrics = args.metrics or per_ad_metrics(list(frame.columns))
+    excluded = set(metrics) | {args.partition_column}
+    tags = args.tags or [
+        column for column in frame.columns
+        if column not in excluded and frame[column].dropna().isin([0, 1, True, False]).all()
+    ]
+    store = load_store(output, "", tags, metrics, args.k, args.rebuild)
+
+    if args.partition_column:
+        groups: Dict[str, pd.DataFrame] = {str(p): g for p, g in frame.groupby(args.partition_column)}
+    else:
+        groups = {ALL_ROWS_PARTITION: frame}
+    for partition in partitions_to_sketch(list(groups), store):
+        add_frame(store, partition, groups[partition])
+    return store
+
+
+def build_from_bigquery(args, output: Path) -> QuantileSketchStore:
+    client = bigquery.Client(project=settings.GOOGLE_CLOUD_PROJECT_ID)
+    table_id = f"{settings.GOOGLE_CLOUD_PROJECT_ID}.{settings.BQ_DATASET_NAME}.{settings.BQ_TABLE_NAME}"
+    # Read before any partition so that rows written during the build leave the sketches stale, not current.
+    table = client.get_table(table_id)
+    schema = table.schema
+    metrics = args.metrics or per_ad_metrics([field.name for field in schema])
+    tags = args.tags or tag_registry.schema_tags([(field.name, field.field_type) for field in schema])
+    store = load_store(output, table_id, tags, metrics, args.k, args.rebuild)
+
+    # Packed tags are unpacked into one boolean column per tag.
+    selected = [tag if predicate == tag else f"{predicate} AS {tag}" for tag, predicate in tag_registry.predicates(tags).items()]
+    columns = ", ".join(selected + metrics)
+    partition_sql: Optional[str] = args.partition_column
+    if partition_sql:
+        available = [
+            row["partition"] for row in client.query(
+                f"SELECT DISTINCT CAST({partition_sql} AS STRING) AS partition FROM `{table_id}`"
+            ).result()
+        ]
+    else:
+        available = [ALL_ROWS_PARTITION]
+
+    for partition in partitions_to_sketch(available, store):
+        if partition_sql:
+            job_config = bigquery.QueryJobConfig(
+                query_parameters=[bigquery.ScalarQueryParameter("partition", "STRING", partition)]
+            )
+            query = f"SELECT {columns} FROM `{table_id}` WHERE CAST({partition_sql} AS STRING) = @partition"
+        else:
+            job_config, query = None, f"SELECT {columns} FROM `{table_id}`"
+        frame = client.query(query, job_config=job_config).to_dataframe()
+        add_frame(store, partition, frame)
+        # Saving after every partition lets an interrupted build resume.
+        store.save(output)
+    store.source_modified = table.modified.isoformat()
+    return store
+
+
+def main():
+    """Builds or incrementally updates the quantile sketches used for median and p90 lift."""
+    parser = argparse.ArgumentParser(description="Sketch per-ad metrics per partition and tag combination.")
+    parser.add_argument("--csv", type=Path, help="Sketch a local CSV export instead of the BigQuery table")
+    parser.add_argument("--partition-column", help="Column (or SQL expression) that partitions the rows, e.g. a load date")
+    parser.add_argument("--tags", nargs="+", help="Tags to sketch by; all tags of the table by default")
+    parser.add_argument("--metrics", nargs="+", help="Per-ad metrics to sketch; all available by default")
+    parser.add_argument("--k", type=int, default=settings.QUANTILE_SKETCH_K, help="Sketch size; rank error is about 1.7 / k")
+    parser.add_argument("--output", type=Path, default=Path(settings.QUANTILE_SKETCH_FILE or DEFAULT_OUTPUT_FILE))
+    parser.add_argument("--rebuild", action="store_true", help="Re-sketch every partition")
+    args = parser.parse_args()
+
+    store = build_from_csv(args, args.output) if args.csv else build_from_bigquery(args, args.output)
+    store.save(args.output)
+    combinations = {stratum for sketches in store.partitions.values() for stratum in sketches}
+    logging.info(
+        f"Saved sketches of {len(store.metrics)} metrics over {len(store.partitions)} partitions "
+        f"and {len(combinations)} tag combinations to {args.output} ({args.output.stat().st_size / 1024:.0f} KiB)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "creative_analytics"))
+
+from benchmark_stats_engine import generate_data  # noqa: E402
+from creative_analytics_agents.utils.quantile_sketch import QuantileSketchStore  # noqa: E402
+
+# --- CONFIGURATION ---
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9, 0.99)
+# The 1.7 / k bound holds with high probability per query; allow some slack
+# because many quantiles are checked at once.
+RANK_ERROR_SLACK = 1.5
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+def rank_error(sorted_values: np.ndarray, estimate: float, q: float) -> float:
+    """How far, in normalized rank, `estimate` is from the exact q-quantile."""
+    low = np.searchsorted(sorted_values, estimate, side="left") / len(sorted_values)
+    high = np.searchsorted(sorted_values, estimate, side="right") / len(sorted_values)
+    return 0.0 if low <= q <= high else min(abs(low - q), abs(high - q))
+
+
+def main():
+    """Checks merged sketch quantiles and quantile lift against exact values on generated data."""
+    parser = argparse.ArgumentParser(description="Accuracy of partitioned, merged quantile sketches.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--partitions", type=int, default=30)
+    parser.add_argument("--k", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    views, tags = generate_data(args.rows, seed=args.seed)
+    names = list(tags)
+    tag_matrix = np.column_stack([tags[name] for name in names])
+
+    store = QuantileSketchStore(names, ["video_views"], k=args.k)
+    start = time.perf_counter()
+    for partition, rows in enumerate(np.array_split(np.arange(args.rows), args.partitions)):
+        store.add_partition(f"{partition:03d}", tag_matrix[rows], {"video_views": views[rows]}, seed=partition)
+    logging.info(f"Sketched {args.rows} rows in {args.partitions} partitions in {time.perf_counter() - start:.2f}s...")
+
+    bound = 1.7 / args.k
+    worst = 0.0
+    segments = [("all", np.ones(args.rows, dtype=bool))] + [(name, tags[name]) for name in names]
+    for segment, mask in segments:
+        exact = np.sort(views[mask].astype(float))
+        estimates = store.segment_sketch("video_views", None if segment == "all" else segment).quantiles(QUANTILES)
+        errors = [rank_error(exact, estimate, q) for estimate, q in zip(estimates, QUANTILES)]
+        worst = max(worst, *errors)
+        logging.info(
+            f"{segment:>8}: n={len(exact):>8} max rank error={max(errors):.4f} "
+            + " ".join(f"p{q * 100:g}={e:.0f}/{np.quantile(exact, q):.0f}" for e, q in zip(estimates, QUANTILES))
+        )
+
+    start = time.perf_counter()
+    lift = store.robust_lift(names, "video_views")
+    elapsed = time.perf_counter() - start
+    overall = {q: np.quantile(views, q) for q in (0.5, 0.9)}
+    for result in lift["results"]:
+        segment_views = views[tags[result["tag"]]]
+        exact_lift = {f"p{q * 100:g}": (np.quantile(segment_views, q) / overall[q] - 1) * 100 for q in overall}
+        logging.info(
+            f"{result['tag']:>8}: "
+            + " ".join(f"{name} lift={result['percentage_lift'][name]:6.1f}% (exact {exact_lift[name]:6.1f}%)" for name in exact_lift)
+        )
+
+    logging.info(f"Computed robust lift of {len(names)} tags from merged sketches in {elapsed * 1000:.1f}ms without rescanning")
+    logging.info(f"Worst rank error {worst:.4f} (nominal bound {bound:.4f})")
+    if worst > RANK_ERROR_SLACK * bound:
+        logging.error(f"Rank error exceeds {RANK_ERROR_SLACK} x the nominal bound...")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
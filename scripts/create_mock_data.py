@@ -1,13 +1,26 @@
+import argparse
 import pandas as pd
 import numpy as np
+import sys
 import uuid
 from pathlib import Path
 import logging
+from typing import Dict
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "creative_analytics"))
+
+from creative_analytics_agents.utils.tag_registry import tag_registry  # noqa: E402
 
 # --- CONFIGURATION ---
 NUM_ROWS = 500
+# Share of ads with each tag; tags not listed here appear in DEFAULT_TAG_PREVALENCE of ads.
+TAG_PREVALENCE = {"animal": 0.35, "human": 0.60, "logo": 0.80, "product": 0.55, "cta": 0.70}
+DEFAULT_TAG_PREVALENCE = 0.10
 OUTPUT_DIR = Path(__file__).parent.parent / "data"
 OUTPUT_FILENAME = "creative_tags_performance_data.csv"
+METRIC_COLUMNS = ["impressions", "clicks", "conversions", "spend"]
+# Seed used when extending existing rows, so the appended metrics are reproducible
+EXTEND_SEED = 38
 
 # Configure logging
 logging.basicConfig(
@@ -15,22 +28,46 @@ logging.basicConfig(
 )
 
 
+def add_metric_columns(df: pd.DataFrame, tags: Dict[str, np.ndarray], rng=np.random) -> None:
+    """
+    Adds delivery and engagement metrics derived from `video_views`, each with its own tag effects.
+    """
+    num_rows = len(df)
+    absent = np.zeros(num_rows, dtype=bool)
+    human, product, cta = (tags.get(name, absent) for name in ("human", "product", "cta"))
+
+    df["impressions"] = (df["video_views"] * rng.uniform(2.0, 6.0, size=num_rows)).astype(int)
+
+    ctr = rng.beta(2, 80, size=num_rows)
+    ctr[cta] *= 1.6
+    ctr[human] *= 1.15
+    df["clicks"] = rng.binomial(df["impressions"], np.clip(ctr, 0, 1))
+
+    cvr = rng.beta(2, 30, size=num_rows)
+    cvr[product] *= 1.4
+    df["conversions"] = rng.binomial(df["clicks"], np.clip(cvr, 0, 1))
+
+    cpm = rng.lognormal(mean=np.log(8.0), sigma=0.3, size=num_rows)
+    cpm[human] *= 1.2
+    df["spend"] = (df["impressions"] / 1000 * cpm).round(2)
+
+
 def generate_mock_data() -> pd.DataFrame:
     """
     Generates a DataFrame with realistic, skewed, and correlated mock data.
     """
     logging.info(f"Generating {NUM_ROWS} rows of mock data...")
 
-    boolean_cols = ["animal", "human", "logo", "product", "cta"]
-    data = {
-        "media_id": [str(uuid.uuid4()) for _ in range(NUM_ROWS)],
-        "animal": np.random.choice([True, False], size=NUM_ROWS, p=[0.35, 0.65]),
-        "human": np.random.choice([True, False], size=NUM_ROWS, p=[0.60, 0.40]),
-        "logo": np.random.choice([True, False], size=NUM_ROWS, p=[0.80, 0.20]),
-        "product": np.random.choice([True, False], size=NUM_ROWS, p=[0.55, 0.45]),
-        "cta": np.random.choice([True, False], size=NUM_ROWS, p=[0.70, 0.30]),
+    tags = {
+        name: np.random.random(size=NUM_ROWS) < TAG_PREVALENCE.get(name, DEFAULT_TAG_PREVALENCE)
+        for name in tag_registry.names
     }
-    df = pd.DataFrame(data)
+    # The view effects below apply to the tags the registry has.
+    absent = np.zeros(NUM_ROWS, dtype=bool)
+    animal, cta = (tags.get(name, absent) for name in ("animal", "cta"))
+    logo = tags.get("logo", ~absent)
+
+    df = pd.DataFrame({"media_id": [str(uuid.uuid4()) for _ in range(NUM_ROWS)]})
 
     # Generate skewed video_views using a log-normal distribution
     base_views = np.random.lognormal(mean=8, sigma=2.0, size=NUM_ROWS)
@@ -38,36 +75,68 @@ def generate_mock_data() -> pd.DataFrame:
 
     # Introduce correlations by adjusting views based on tags
     animal_boost_multiplier = 1.8
-    df.loc[df["animal"], "video_views"] = (df.loc[df["animal"], "video_views"] * animal_boost_multiplier).astype(int)
+    df.loc[animal, "video_views"] = (df.loc[animal, "video_views"] * animal_boost_multiplier).astype(int)
 
     cta_boost_multiplier = 1.3
-    df.loc[df["cta"], "video_views"] = (df.loc[df["cta"], "video_views"] * cta_boost_multiplier).astype(int)
+    df.loc[cta, "video_views"] = (df.loc[cta, "video_views"] * cta_boost_multiplier).astype(int)
 
     no_logo_penalty_multiplier = 0.8
-    df.loc[~df["logo"], "video_views"] = (df.loc[~df["logo"], "video_views"] * no_logo_penalty_multiplier).astype(int)
+    df.loc[~logo, "video_views"] = (df.loc[~logo, "video_views"] * no_logo_penalty_multiplier).astype(int)
+
+    add_metric_columns(df, tags)
 
-    # Convert boolean columns to 1s and 0s for the CSV output ***
-    for col in boolean_cols:
-        df[col] = df[col].astype(int)
+    # Tag columns as 1s and 0s for the CSV output, or the packed bitmask words
+    if tag_registry.packed:
+        words = [tag_registry.pack(name for name in tags if tags[name][i]) for i in range(NUM_ROWS)]
+        tag_df = pd.DataFrame(words, columns=tag_registry.word_columns)
+    else:
+        tag_df = pd.DataFrame({name: present.astype(int) for name, present in tags.items()})
 
     # Ensure the column order matches the desired BigQuery schema
-    schema_order = [
-        "media_id", "animal", "human", "logo",
-        "product", "cta", "video_views"
-    ]
-    df = df[schema_order]
+    df = pd.concat([df[["media_id"]], tag_df, df.drop(columns="media_id")], axis=1)
     logging.info("Mock data generation completed...")
 
     return df
 
 
+def extend_mock_data(path: Path) -> pd.DataFrame:
+    """
+    Appends the metric columns an existing mock data file lacks, keeping its
+    rows (media_id, tags and video_views) unchanged.
+    """
+    df = pd.read_csv(path)
+    missing = [column for column in METRIC_COLUMNS if column not in df.columns]
+    if not missing:
+        logging.info(f"{path} already has every metric column...")
+        return df
+    logging.info(f"Adding {', '.join(missing)} to {len(df)} existing rows...")
+
+    if tag_registry.packed:
+        names = [tag_registry.unpack(words) for words in df[tag_registry.word_columns].itertuples(index=False)]
+        tags = {name: np.array([name in row for row in names]) for name in tag_registry.names}
+    else:
+        tags = {name: df[name].astype(bool).to_numpy() for name in tag_registry.names if name in df.columns}
+    metrics = df[["video_views"]].copy()
+    add_metric_columns(metrics, tags, rng=np.random.RandomState(EXTEND_SEED))
+    return pd.concat([df, metrics[missing]], axis=1)
+
+
 def main():
     """Main function to generate data and save it to a CSV file."""
+    parser = argparse.ArgumentParser(description="Generate the mock creative performance data.")
+    parser.add_argument(
+        "--extend", action="store_true",
+        help="Add missing metric columns to the existing file instead of regenerating every row",
+    )
+    args = parser.parse_args()
 
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     output_path = OUTPUT_DIR / OUTPUT_FILENAME
 
-    mock_data_df = generate_mock_data()
+    if args.extend and output_path.exists():
+        mock_data_df = extend_mock_data(output_path)
+    else:
+        mock_data_df = generate_mock_data()
 
     mock_data_df.to_csv(output_path, index=False)
     logging.info(f"Successfully saved mock data to: {output_path}")
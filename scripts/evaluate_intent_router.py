@@ -0,0 +1,126 @@
+import argparse
+import json
+import logging
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "creative_analytics"))
+
+from google.genai import types  # noqa: E402
+
+from creative_analytics_agents.utils.intent_router import (  # noqa: E402
+    ANALYST_AGENT, EXAMPLES_FILE, ORCHESTRATOR_AGENT, PREDICTOR_AGENT, intent_router, media_count, message_text,
+)
+
+# --- CONFIGURATION ---
+DEFAULT_QUESTIONS_FILE = Path(__file__).parent.parent / "data" / "intent_eval_questions.json"
+# Tag columns of the performance table created by setup_script.py
+DEFAULT_TAGS = ["animal", "human", "logo", "product", "cta"]
+AGENT_OF_INTENT = {"analysis": ANALYST_AGENT, "prediction": PREDICTOR_AGENT}
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+def orchestrator_turn_cost(metering_file: Path) -> Optional[Dict[str, float]]:
+    """Mean latency and prompt tokens of the orchestrator's model calls in a METERING_FILE."""
+    calls = []
+    with open(metering_file, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("agent") == ORCHESTRATOR_AGENT:
+                calls.append(record)
+    if not calls:
+        return None
+    return {
+        "seconds": statistics.mean(call["latency_seconds"] for call in calls),
+        "prompt_tokens": statistics.mean(call["prompt_tokens"] for call in calls),
+    }
+
+
+def training_overlap(questions: List[Dict], examples_file: Path) -> List[str]:
+    """The evaluation questions that are also examples the classifier was built from, ignoring case and spacing."""
+    with open(examples_file, "r", encoding="utf-8") as f:
+        examples = {" ".join(example.lower().split()) for labeled in json.load(f).values() for example in labeled}
+    return [question["question"] for question in questions if " ".join(question["question"].lower().split()) in examples]
+
+
+def to_content(question: Dict) -> types.Content:
+    parts = [types.Part(text=question["question"])]
+    for mime_type in question.get("attachments", []):
+        parts.append(types.Part(inline_data=types.Blob(mime_type=mime_type, data=b"")))
+    return types.Content(role="user", parts=parts)
+
+
+def main():
+    """Reports the intent router's precision, coverage and classifier latency on a labeled question set."""
+    parser = argparse.ArgumentParser(description="Evaluate the local intent router on labeled questions.")
+    parser.add_argument("--questions", type=Path, default=DEFAULT_QUESTIONS_FILE)
+    parser.add_argument("--tags", nargs="+", default=DEFAULT_TAGS, help="Tag columns of the schema")
+    parser.add_argument("--metering-file", type=Path, help="METERING_FILE of a run, to price the skipped orchestrator turns")
+    parser.add_argument("--min-precision", type=float, default=0.98, help="Fail below this share of correct routes")
+    args = parser.parse_args()
+
+    with open(args.questions, "r", encoding="utf-8") as f:
+        questions: List[Dict] = json.load(f)["questions"]
+    # Questions the classifier was built from would overstate its precision.
+    overlap = training_overlap(questions, EXAMPLES_FILE)
+    if overlap:
+        logging.error(f"{len(overlap)} questions are also intent examples in {EXAMPLES_FILE.name}: {overlap}")
+        exit(1)
+
+    routed: Dict[str, Counter] = defaultdict(Counter)
+    model_correct, model_total, latencies, misroutes = 0, 0, [], []
+    for question in questions:
+        content = to_content(question)
+        start = time.perf_counter()
+        decision = intent_router.classify(message_text(content), media_count(content), args.tags)
+        latencies.append(time.perf_counter() - start)
+        # "agent" overrides the intent's agent, e.g. the orchestrator for a question naming an unknown tag.
+        expected = question.get("agent") or AGENT_OF_INTENT.get(question["intent"])
+        routed[question["intent"]][decision.agent or ORCHESTRATOR_AGENT] += 1
+        # Compound requests have no label of their own; they must only be left to the orchestrator.
+        if question["intent"] in intent_router.model.labels:
+            model_total += 1
+            model_correct += decision.intent == question["intent"]
+        if decision.agent and decision.agent != expected:
+            misroutes.append(f"{question['question']!r} ({question['intent']}) -> {decision.agent}: {decision.reason}")
+
+    total_routed = sum(count for counts in routed.values() for agent, count in counts.items() if agent != ORCHESTRATOR_AGENT)
+    correct = total_routed - len(misroutes)
+    precision = correct / total_routed if total_routed else 1.0
+    logging.info(f"{len(questions)} questions, {total_routed} routed locally, {len(questions) - total_routed} left to the orchestrator")
+    logging.info(f"Routing precision: {precision:.1%} ({correct}/{total_routed})")
+    for intent, counts in sorted(routed.items()):
+        agent = AGENT_OF_INTENT.get(intent)
+        coverage = f", coverage {counts[agent] / sum(counts.values()):.0%}" if agent else ""
+        logging.info(f"  {intent:<11} {dict(counts)}{coverage}")
+    logging.info(f"Intent accuracy: {model_correct / model_total:.1%} ({model_correct}/{model_total})")
+    latencies.sort()
+    logging.info(f"Classifier latency: median {statistics.median(latencies) * 1e3:.2f}ms, "
+                 f"max {latencies[-1] * 1e3:.2f}ms")
+
+    cost = orchestrator_turn_cost(args.metering_file) if args.metering_file else None
+    if cost:
+        logging.info(f"Saved per {len(questions)} questions: {correct} orchestrator turns, "
+                     f"{correct * cost['seconds']:.1f}s and {correct * cost['prompt_tokens']:.0f} prompt tokens "
+                     f"(mean orchestrator turn {cost['seconds']:.2f}s, {cost['prompt_tokens']:.0f} prompt tokens)")
+    else:
+        logging.info(f"Saved per {len(questions)} questions: {correct} orchestrator turns "
+                     "(pass --metering-file to convert them to seconds and tokens)")
+
+    for misroute in misroutes:
+        logging.error(f"Misrouted {misroute}")
+    if precision < args.min_precision:
+        logging.error(f"Routing precision {precision:.1%} is below {args.min_precision:.1%}")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
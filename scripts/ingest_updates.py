@@ -0,0 +1,662 @@
+import argparse
+import csv
+import logging
+import math
+import random
+import sqlite3
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "creative_analytics"))
+
+from google.cloud import bigquery  # noqa: E402
+
+from creative_analytics_agents.utils.aggregate_router import AggregateRouter, stamp_rollup  # noqa: E402
+from creative_analytics_agents.utils.settings import settings  # noqa: E402
+from creative_analytics_agents.utils.tag_registry import tag_registry  # noqa: E402
+
+# --- CONFIGURATION ---
+DATA_FILEPATH = Path(__file__).parent.parent / "data" / "creative_tags_performance_data.csv"
+KEY_COLUMN = "media_id"
+LABEL_SOURCE_COLUMN = "video_views"
+# Derived tables, named as in setup_script.py
+TRAINING_SUFFIX = "_training"
+ROLLUP_SUFFIX = "_by_tags"
+# Tables of the incremental path
+STAGING_SUFFIX = "_staging"
+CHANGES_SUFFIX = "_changes"
+WATERMARKS_SUFFIX = "_ingestion_watermarks"
+# Column of the watermarks holding the training label threshold, on log views
+THRESHOLD_COLUMN = "label_threshold"
+# setup_script.py builds no rollup when tags are packed.
+CONSUMERS = ("training",) if tag_registry.packed else ("training", "rollup")
+# Column types of the performance table, as in TABLE_SCHEMA of setup_script.py
+LOCAL_SCHEMA = [
+    (KEY_COLUMN, "STRING"),
+    *tag_registry.table_columns(),
+    *((measure, "INTEGER") for measure in ("video_views", "impressions", "clicks", "conversions")),
+    ("spend", "FLOAT"),
+]
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+def read_batch(path: Path) -> List[Dict[str, str]]:
+    """Reads an update batch; when a media_id appears more than once, its last row wins."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    latest = last_write_wins(rows)
+    if len(latest) < len(rows):
+        logging.info(f"Collapsed {len(rows) - len(latest)} repeated media_id rows in {path.name}...")
+    return latest
+
+
+def last_write_wins(rows: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """One row per media_id: the last one in batch order."""
+    return list({row[KEY_COLUMN]: row for row in rows}.values())
+
+
+def split_columns(schema: Sequence[Tuple[str, str]]) -> Tuple[List[str], List[str]]:
+    """The tag (BOOLEAN or packed bitmask) and measure (INTEGER/FLOAT) columns of the performance table."""
+    words = set(tag_registry.word_columns) if tag_registry.packed else set()
+    tags = [name for name, field_type in schema if field_type in ("BOOLEAN", "BOOL") or name in words]
+    measures = [
+        name for name, field_type in schema
+        if field_type in ("INTEGER", "INT64", "FLOAT", "FLOAT64") and name not in words
+    ]
+    return tags, measures
+
+
+class BigQueryIngestion:
+    """
+    Incremental ingestion into the BigQuery performance table.
+
+    A batch is staged, compared with the table and only its new or changed rows
+    are appended to a change log under the next batch id, then merged into the
+    table on media_id in the same transaction. The training table and the tag
+    rollup each keep a watermark (the last batch id they consumed) and catch up
+    from the change log, so the work of both is proportional to the changed
+    rows. The training table labels rows with the threshold stored next to its
+    watermark, the median log views at the last setup, until retraining
+    recomputes it. A refreshed rollup is labeled with the table's modification time, so the
+    agent stops routing to it while it lags the table.
+    `bytes_processed` totals the bytes scanned by every query.
+    """
+
+    def __init__(self, client: bigquery.Client, dataset: str, table: str):
+        self.client = client
+        self.prefix = f"{client.project}.{dataset}."
+        self.table = table
+        self.schema = client.get_table(self._id(table)).schema
+        self.columns = [field.name for field in self.schema]
+        self.tags, self.measures = split_columns([(field.name, field.field_type) for field in self.schema])
+        self.bytes_processed = 0
+        # The table's metadata as of the last `watermarks` call
+        self.source: bigquery.Table = None
+
+    def _id(self, table: str) -> str:
+        return f"{self.prefix}{table}"
+
+    def _ref(self, suffix: str = "") -> str:
+        return f"`{self._id(self.table + suffix)}`"
+
+    @staticmethod
+    def _job_config(params: Dict[str, float]) -> bigquery.QueryJobConfig:
+        return bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter(name, "FLOAT64" if isinstance(value, float) else "INT64", value)
+            for name, value in params.items()
+        ])
+
+    def _run(self, sql: str, **params) -> int:
+        """Runs a query or script and returns the rows its DML statements changed."""
+        job = self.client.query(sql, job_config=self._job_config(params))
+        job.result()
+        # For scripts, the parent job reports the bytes of all its statements.
+        self.bytes_processed += job.total_bytes_processed or 0
+        if job.num_child_jobs:
+            return sum(child.num_dml_affected_rows or 0 for child in self.client.list_jobs(parent_job=job))
+        return job.num_dml_affected_rows or 0
+
+    def _row(self, sql: str, **params) -> bigquery.Row:
+        job = self.client.query(sql, job_config=self._job_config(params))
+        row = next(iter(job.result()))
+        self.bytes_processed += job.total_bytes_processed or 0
+        return row
+
+    def ensure_tables(self) -> None:
+        """Creates the change log and the watermarks; new consumers start at the latest batch."""
+        old_columns = ", ".join(f"{name} AS old_{name}" for name in self.columns if name != KEY_COLUMN)
+        self._run(f"""
+        CREATE TABLE IF NOT EXISTS {self._ref(CHANGES_SUFFIX)} CLUSTER BY batch_id AS
+        SELECT 0 AS batch_id, FALSE AS is_new, *, {old_columns} FROM {self._ref()} WHERE FALSE;
+        CREATE TABLE IF NOT EXISTS {self._ref(WATERMARKS_SUFFIX)} (consumer STRING NOT NULL, watermark INT64 NOT NULL);
+        ALTER TABLE {self._ref(WATERMARKS_SUFFIX)} ADD COLUMN IF NOT EXISTS {THRESHOLD_COLUMN} FLOAT64;
+        INSERT INTO {self._ref(WATERMARKS_SUFFIX)} (consumer, watermark)
+        SELECT consumer, (SELECT IFNULL(MAX(batch_id), 0) FROM {self._ref(CHANGES_SUFFIX)})
+        FROM UNNEST({list(CONSUMERS)}) AS consumer
+        WHERE consumer NOT IN (SELECT consumer FROM {self._ref(WATERMARKS_SUFFIX)});
+        """)
+
+    def stage(self, rows: List[Dict[str, str]]) -> None:
+        converters = {"BOOLEAN": lambda v: v.strip().lower() in ("1", "true"), "INTEGER": int, "FLOAT": float}
+        records = [
+            {field.name: (converters.get(field.field_type, str)(row[field.name]) if row.get(field.name) not in (None, "") else None)
+             for field in self.schema}
+            for row in rows
+        ]
+        job_config = bigquery.LoadJobConfig(
+            schema=self.schema, write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        )
+        self.client.load_table_from_json(records, self._id(self.table + STAGING_SUFFIX), job_config=job_config).result()
+
+    def merge_batch(self) -> Dict[str, int]:
+        """Logs the staged rows that are new or differ from the table and merges them, in one transaction."""
+        batch_id = self._row(f"SELECT IFNULL(MAX(batch_id), 0) + 1 FROM {self._ref(CHANGES_SUFFIX)}")[0]
+        values = [name for name in self.columns if name != KEY_COLUMN]
+        unchanged = " AND ".join(f"s.{name} IS NOT DISTINCT FROM t.{name}" for name in values)
+        self._run(f"""
+        BEGIN TRANSACTION;
+        INSERT INTO {self._ref(CHANGES_SUFFIX)} (batch_id, is_new, {", ".join(self.columns)}, {", ".join(f"old_{name}" for name in values)})
+        SELECT @batch_id, t.{KEY_COLUMN} IS NULL, {", ".join(f"s.{name}" for name in self.columns)}, {", ".join(f"t.{name}" for name in values)}
+        FROM {self._ref(STAGING_SUFFIX)} AS s
+        LEFT JOIN {self._ref()} AS t ON t.{KEY_COLUMN} = s.{KEY_COLUMN}
+        WHERE t.{KEY_COLUMN} IS NULL OR NOT ({unchanged});
+
+        MERGE {self._ref()} AS t
+        USING (SELECT * FROM {self._ref(CHANGES_SUFFIX)} WHERE batch_id = @batch_id) AS s
+        ON t.{KEY_COLUMN} = s.{KEY_COLUMN}
+        WHEN MATCHED THEN UPDATE SET {", ".join(f"{name} = s.{name}" for name in values)}
+        WHEN NOT MATCHED THEN INSERT ({", ".join(self.columns)}) VALUES ({", ".join(f"s.{name}" for name in self.columns)});
+        COMMIT TRANSACTION;
+        """, batch_id=batch_id)
+        inserted, updated = self._row(
+            f"SELECT COUNTIF(is_new), COUNTIF(NOT is_new) FROM {self._ref(CHANGES_SUFFIX)} WHERE batch_id = @batch_id",
+            batch_id=batch_id,
+        ).values()
+        return {"batch_id": batch_id, "inserted": inserted, "updated": updated}
+
+    def watermarks(self) -> Tuple[Dict[str, int], int]:
+        """The last batch id each consumer applied, and the latest batch id."""
+        # Read first: a merge committed after it makes the refreshed rollup look stale rather than current.
+        self.source = self.client.get_table(self._id(self.table))
+        rows = self.client.query(f"SELECT consumer, watermark FROM {self._ref(WATERMARKS_SUFFIX)}").result()
+        latest = self._row(f"SELECT IFNULL(MAX(batch_id), 0) FROM {self._ref(CHANGES_SUFFIX)}")[0]
+        return {row["consumer"]: row["watermark"] for row in rows}, latest
+
+    def refresh_rollup(self, watermark: int, latest: int) -> int:
+        """
+        Applies the changes after the watermark to the rollup as per-combination
+        deltas and labels it as built from the table read by `watermarks`.
+        """
+        tags = ", ".join(self.tags)
+        new_side = ", ".join([*self.tags, "1 AS sign", *self.measures])
+        old_side = ", ".join([*(f"old_{tag} AS {tag}" for tag in self.tags), "-1 AS sign",
+                              *(f"old_{measure} AS {measure}" for measure in self.measures)])
+        sums = ", ".join(f"SUM(sign * {measure}) AS sum_{measure}" for measure in self.measures)
+        rollup_columns = ["ad_count", *(f"sum_{measure}" for measure in self.measures)]
+        changed = self._run(f"""
+        BEGIN TRANSACTION;
+        MERGE {self._ref(ROLLUP_SUFFIX)} AS r
+        USING (
+          SELECT {tags}, SUM(sign) AS ad_count, {sums}
+          FROM (
+            SELECT {new_side} FROM {self._ref(CHANGES_SUFFIX)} WHERE batch_id > @watermark AND batch_id <= @latest
+            UNION ALL
+            SELECT {old_side} FROM {self._ref(CHANGES_SUFFIX)} WHERE batch_id > @watermark AND batch_id <= @latest AND NOT is_new
+          )
+          GROUP BY {tags}
+        ) AS d
+        ON {" AND ".join(f"r.{tag} IS NOT DISTINCT FROM d.{tag}" for tag in self.tags)}
+        WHEN MATCHED AND r.ad_count + d.ad_count = 0 THEN DELETE
+        WHEN MATCHED THEN UPDATE SET {", ".join(f"{c} = IFNULL(r.{c}, 0) + IFNULL(d.{c}, 0)" for c in rollup_columns)}
+        WHEN NOT MATCHED AND d.ad_count > 0 THEN INSERT ({tags}, {", ".join(rollup_columns)})
+          VALUES ({", ".join(f"d.{c}" for c in [*self.tags, *rollup_columns])});
+        UPDATE {self._ref(WATERMARKS_SUFFIX)} SET watermark = @latest WHERE consumer = 'rollup';
+        COMMIT TRANSACTION;
+        """, watermark=watermark, latest=latest)
+        stamp_rollup(self.client, self._id(self.table + ROLLUP_SUFFIX), self.source)
+        return changed
+
+    def label_threshold(self) -> Tuple[float, int]:
+        """
+        The training label threshold stored next to the watermark, and the rows
+        read to find it. Watermarks from before it was stored get the threshold
+        the current labels were made with.
+        """
+        threshold = self._row(f"SELECT {THRESHOLD_COLUMN} FROM {self._ref(WATERMARKS_SUFFIX)} WHERE consumer = 'training'")[0]
+        if threshold is not None:
+            return threshold, 0
+        threshold = self._row(
+            f"SELECT IFNULL(MAX(log_video_views), 0) FROM {self._ref(TRAINING_SUFFIX)} WHERE is_high_performing = 0"
+        )[0]
+        self._run(
+            f"UPDATE {self._ref(WATERMARKS_SUFFIX)} SET {THRESHOLD_COLUMN} = @threshold WHERE consumer = 'training'",
+            threshold=float(threshold),
+        )
+        return threshold, self.client.get_table(self._id(self.table + TRAINING_SUFFIX)).num_rows
+
+    def refresh_training(self, watermark: int, latest: int) -> int:
+        """
+        Upserts the latest version of each changed row, labeled with the stored
+        threshold. Returns the rows changed, plus the rows read to find the
+        threshold when it was not stored yet.
+        """
+        threshold, read = self.label_threshold()
+        values = [name for name in self.columns if name != KEY_COLUMN]
+        log_views = f"LOG(SAFE_CAST(s.{LABEL_SOURCE_COLUMN} AS FLOAT64) + 1)"
+        label = f"IF({log_views} > @threshold, 1, 0)"
+        changed = self._run(f"""
+        BEGIN TRANSACTION;
+        MERGE {self._ref(TRAINING_SUFFIX)} AS t
+        USING (
+          SELECT * FROM {self._ref(CHANGES_SUFFIX)}
+          WHERE batch_id > @watermark AND batch_id <= @latest
+          QUALIFY ROW_NUMBER() OVER (PARTITION BY {KEY_COLUMN} ORDER BY batch_id DESC) = 1
+        ) AS s
+        ON t.{KEY_COLUMN} = s.{KEY_COLUMN}
+        WHEN MATCHED THEN UPDATE SET {", ".join(f"{name} = s.{name}" for name in values)},
+          log_video_views = {log_views}, is_high_performing = {label}
+        WHEN NOT MATCHED THEN INSERT ({", ".join(self.columns)}, log_video_views, is_high_performing)
+          VALUES ({", ".join(f"s.{name}" for name in self.columns)}, {log_views}, {label});
+        UPDATE {self._ref(WATERMARKS_SUFFIX)} SET watermark = @latest WHERE consumer = 'training';
+        COMMIT TRANSACTION;
+        """, watermark=watermark, latest=latest, threshold=float(threshold))
+        return changed + read
+
+    def changes_between(self, watermark: int, latest: int) -> int:
+        return self._row(
+            f"SELECT COUNT(*) FROM {self._ref(CHANGES_SUFFIX)} WHERE batch_id > @watermark AND batch_id <= @latest",
+            watermark=watermark, latest=latest,
+        )[0]
+
+    def table_rows(self) -> int:
+        return self.client.get_table(self._id(self.table)).num_rows
+
+
+class LocalIngestion:
+    """
+    The same incremental path on sqlite, as a local stand-in for BigQuery.
+
+    sqlite has no MERGE, so merges are upserts and the rollup deltas are
+    applied with an update, an insert and a delete. `rebuild` creates the
+    training table and rollup from scratch, as setup_script.py does. The
+    rollup's watermark stands in for its modification time label.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, schema: Sequence[Tuple[str, str]], table: str = "performance"):
+        self.db = connection
+        self.db.create_function("LN", 1, lambda v: math.log(v) if v is not None and v > 0 else None, deterministic=True)
+        self.table = table
+        self.schema = list(schema)
+        self.columns = [name for name, _ in self.schema]
+        self.tags, self.measures = split_columns(self.schema)
+        values = [name for name in self.columns if name != KEY_COLUMN]
+        self.db.executescript(f"""
+        CREATE TABLE IF NOT EXISTS {table} ({KEY_COLUMN} TEXT PRIMARY KEY, {", ".join(values)});
+        CREATE TABLE IF NOT EXISTS {table}{STAGING_SUFFIX} ({", ".join(self.columns)});
+        CREATE TABLE IF NOT EXISTS {table}{CHANGES_SUFFIX} (batch_id INTEGER, is_new INTEGER, {", ".join(self.columns)},
+          {", ".join(f"old_{name}" for name in values)});
+        CREATE INDEX IF NOT EXISTS {table}{CHANGES_SUFFIX}_batch ON {table}{CHANGES_SUFFIX} (batch_id);
+        CREATE TABLE IF NOT EXISTS {table}{WATERMARKS_SUFFIX} (consumer TEXT PRIMARY KEY, watermark INTEGER, {THRESHOLD_COLUMN} REAL);
+        """)
+        self.db.executemany(
+            f"INSERT OR IGNORE INTO {table}{WATERMARKS_SUFFIX} (consumer, watermark) "
+            f"VALUES (?, (SELECT IFNULL(MAX(batch_id), 0) FROM {table}{CHANGES_SUFFIX}))",
+            [(consumer,) for consumer in CONSUMERS],
+        )
+
+    def _convert(self, row: Dict[str, str]) -> Tuple:
+        converters = {"BOOLEAN": lambda v: int(v.strip().lower() in ("1", "true")), "INTEGER": int, "FLOAT": float}
+        return tuple(
+            converters.get(field_type, str)(row[name]) if row.get(name) not in (None, "") else None
+            for name, field_type in self.schema
+        )
+
+    def full_reload(self, rows: List[Dict[str, str]]) -> int:
+        """
+        Replaces the table, rebuilds everything derived from it and stores the
+        new median as the label threshold, as a setup with retraining does;
+        returns the rows processed.
+        """
+        with self.db:
+            self.db.execute(f"DELETE FROM {self.table}")
+            self.db.executemany(
+                f"INSERT INTO {self.table} VALUES ({', '.join('?' * len(self.columns))})", map(self._convert, rows)
+            )
+        processed = len(rows) + self.rebuild(self.table + TRAINING_SUFFIX, self.table + ROLLUP_SUFFIX)
+        with self.db:
+            self.db.execute(f"""
+            UPDATE {self.table}{WATERMARKS_SUFFIX} SET {THRESHOLD_COLUMN} = (
+              SELECT IFNULL(MAX(log_video_views), 0) FROM {self.table}{TRAINING_SUFFIX} WHERE is_high_performing = 0
+            ) WHERE consumer = 'training'
+            """)
+        return processed
+
+    def rebuild(self, training: str, rollup: str, threshold: Optional[float] = None) -> int:
+        """
+        Creates the training table, labeled on the median or on `threshold`,
+        and the rollup from the whole table; returns the rows processed.
+        """
+        tags = ", ".join(self.tags)
+        sums = ", ".join(f"SUM({measure}) AS sum_{measure}" for measure in self.measures)
+        with self.db:
+            self.db.execute(f"DROP TABLE IF EXISTS {training}")
+            self.db.execute(f"""
+            CREATE TABLE {training} AS
+            WITH source AS (SELECT *, LN(CAST({LABEL_SOURCE_COLUMN} AS REAL) + 1) AS log_video_views FROM {self.table}),
+                 threshold AS (
+                   SELECT IFNULL(?, (
+                     SELECT log_video_views FROM source ORDER BY log_video_views
+                     LIMIT 1 OFFSET (SELECT (COUNT(*) - 1) / 2 FROM source)
+                   )) AS median_log_views
+                 )
+            SELECT source.*, IIF(source.log_video_views > threshold.median_log_views, 1, 0) AS is_high_performing
+            FROM source, threshold
+            """, (threshold,))
+            self.db.executescript(f"""
+            CREATE UNIQUE INDEX {training}_key ON {training} ({KEY_COLUMN});
+            DROP TABLE IF EXISTS {rollup};
+            CREATE TABLE {rollup} AS SELECT {tags}, COUNT(*) AS ad_count, {sums} FROM {self.table} GROUP BY {tags};
+            """)
+        return 2 * self.table_rows()
+
+    def stage(self, rows: List[Dict[str, str]]) -> None:
+        with self.db:
+            self.db.execute(f"DELETE FROM {self.table}{STAGING_SUFFIX}")
+            self.db.executemany(
+                f"INSERT INTO {self.table}{STAGING_SUFFIX} VALUES ({', '.join('?' * len(self.columns))})",
+                map(self._convert, rows),
+            )
+
+    def merge_batch(self) -> Dict[str, int]:
+        changes = f"{self.table}{CHANGES_SUFFIX}"
+        values = [name for name in self.columns if name != KEY_COLUMN]
+        unchanged = " AND ".join(f"s.{name} IS t.{name}" for name in values)
+        with self.db:
+            batch_id = self.db.execute(f"SELECT IFNULL(MAX(batch_id), 0) + 1 FROM {changes}").fetchone()[0]
+            self.db.execute(f"""
+            INSERT INTO {changes} (batch_id, is_new, {", ".join(self.columns)}, {", ".join(f"old_{name}" for name in values)})
+            SELECT ?, t.{KEY_COLUMN} IS NULL, {", ".join(f"s.{name}" for name in self.columns)}, {", ".join(f"t.{name}" for name in values)}
+            FROM {self.table}{STAGING_SUFFIX} AS s
+            LEFT JOIN {self.table} AS t ON t.{KEY_COLUMN} = s.{KEY_COLUMN}
+            WHERE t.{KEY_COLUMN} IS NULL OR NOT ({unchanged})
+            """, (batch_id,))
+            self.db.execute(f"""
+            INSERT INTO {self.table} ({", ".join(self.columns)})
+            SELECT {", ".join(self.columns)} FROM {changes} WHERE batch_id = ?
+            ON CONFLICT ({KEY_COLUMN}) DO UPDATE SET {", ".join(f"{name} = excluded.{name}" for name in values)}
+            """, (batch_id,))
+            inserted, updated = self.db.execute(
+                f"SELECT IFNULL(SUM(is_new), 0), IFNULL(SUM(1 - is_new), 0) FROM {changes} WHERE batch_id = ?", (batch_id,)
+            ).fetchone()
+        return {"batch_id": batch_id, "inserted": inserted, "updated": updated}
+
+    def watermarks(self) -> Tuple[Dict[str, int], int]:
+        watermarks = dict(self.db.execute(f"SELECT consumer, watermark FROM {self.table}{WATERMARKS_SUFFIX}"))
+        latest = self.db.execute(f"SELECT IFNULL(MAX(batch_id), 0) FROM {self.table}{CHANGES_SUFFIX}").fetchone()[0]
+        return watermarks, latest
+
+    def refresh_rollup(self, watermark: int, latest: int) -> int:
+        changes, rollup = f"{self.table}{CHANGES_SUFFIX}", f"{self.table}{ROLLUP_SUFFIX}"
+        tags = ", ".join(self.tags)
+        sums = ", ".join(f"SUM(sign * {measure}) AS sum_{measure}" for measure in self.measures)
+        old_side = ", ".join([*(f"old_{tag} AS {tag}" for tag in self.tags), "-1 AS sign",
+                              *(f"old_{measure} AS {measure}" for measure in self.measures)])
+        rollup_columns = ["ad_count", *(f"sum_{measure}" for measure in self.measures)]
+        same_combination = " AND ".join(f"r.{tag} IS d.{tag}" for tag in self.tags)
+        with self.db:
+            self.db.execute("DROP TABLE IF EXISTS temp.rollup_delta")
+            self.db.execute(f"""
+            CREATE TEMP TABLE rollup_delta AS
+            SELECT {tags}, SUM(sign) AS ad_count, {sums}
+            FROM (
+              SELECT {", ".join([*self.tags, "1 AS sign", *self.measures])} FROM {changes} WHERE batch_id > ?1 AND batch_id <= ?2
+              UNION ALL
+              SELECT {old_side} FROM {changes} WHERE batch_id > ?1 AND batch_id <= ?2 AND NOT is_new
+            )
+            GROUP BY {tags}
+            """, (watermark, latest))
+            processed = self.db.execute(f"""
+            UPDATE {rollup} AS r SET {", ".join(f"{c} = IFNULL(r.{c}, 0) + IFNULL(d.{c}, 0)" for c in rollup_columns)}
+            FROM temp.rollup_delta AS d WHERE {same_combination}
+            """).rowcount
+            processed += self.db.execute(f"""
+            INSERT INTO {rollup} ({tags}, {", ".join(rollup_columns)})
+            SELECT {tags}, {", ".join(rollup_columns)} FROM temp.rollup_delta AS d
+            WHERE d.ad_count > 0 AND NOT EXISTS (SELECT 1 FROM {rollup} AS r WHERE {same_combination})
+            """).rowcount
+            processed += self.db.execute(f"DELETE FROM {rollup} WHERE ad_count = 0").rowcount
+            self.db.execute(f"UPDATE {self.table}{WATERMARKS_SUFFIX} SET watermark = ? WHERE consumer = 'rollup'", (latest,))
+        return processed
+
+    def label_threshold(self) -> float:
+        return self.db.execute(
+            f"SELECT {THRESHOLD_COLUMN} FROM {self.table}{WATERMARKS_SUFFIX} WHERE consumer = 'training'"
+        ).fetchone()[0]
+
+    def refresh_training(self, watermark: int, latest: int) -> int:
+        changes, training = f"{self.table}{CHANGES_SUFFIX}", f"{self.table}{TRAINING_SUFFIX}"
+        values = [name for name in self.columns if name != KEY_COLUMN]
+        log_views = f"LN(CAST({LABEL_SOURCE_COLUMN} AS REAL) + 1)"
+        with self.db:
+            processed = self.db.execute(f"""
+            INSERT INTO {training} ({", ".join(self.columns)}, log_video_views, is_high_performing)
+            SELECT {", ".join(self.columns)}, {log_views}, IIF({log_views} > ?3, 1, 0)
+            FROM (
+              SELECT *, ROW_NUMBER() OVER (PARTITION BY {KEY_COLUMN} ORDER BY batch_id DESC) AS position
+              FROM {changes} WHERE batch_id > ?1 AND batch_id <= ?2
+            ) WHERE position = 1
+            ON CONFLICT ({KEY_COLUMN}) DO UPDATE SET {", ".join(f"{name} = excluded.{name}" for name in values)},
+              log_video_views = excluded.log_video_views, is_high_performing = excluded.is_high_performing
+            """, (watermark, latest, self.label_threshold())).rowcount
+            self.db.execute(f"UPDATE {self.table}{WATERMARKS_SUFFIX} SET watermark = ? WHERE consumer = 'training'", (latest,))
+        return processed
+
+    def changes_between(self, watermark: int, latest: int) -> int:
+        return self.db.execute(
+            f"SELECT COUNT(*) FROM {self.table}{CHANGES_SUFFIX} WHERE batch_id > ? AND batch_id <= ?", (watermark, latest)
+        ).fetchone()[0]
+
+    def table_rows(self) -> int:
+        return self.db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def rollup_is_current(self) -> bool:
+        """True if the rollup applied every logged batch; the stand-in for the rollup's modification time label."""
+        watermarks, latest = self.watermarks()
+        return watermarks.get("rollup") == latest
+
+    def rollup_settings(self) -> Dict[str, Dict]:
+        """Database settings declaring the rollup over the table, as the agent reads them from the dataset config."""
+        rollup = {
+            "base_table": self.table,
+            "grain": self.tags,
+            "count_column": "ad_count",
+            "measures": {measure: {"sum": f"sum_{measure}"} for measure in self.measures},
+        }
+        columns = [*self.tags, rollup["count_column"], *(f"sum_{measure}" for measure in self.measures)]
+        return {"local": {"project_id": "local", "dataset_id": "local", "tables": {
+            self.table + ROLLUP_SUFFIX: {"error": None, "rollup": rollup, "schema_list": [(c, "") for c in columns]},
+        }}}
+
+    def matches_rebuild(self) -> bool:
+        """
+        True if the incrementally maintained training table and rollup equal a
+        rebuild from scratch with the stored label threshold.
+        """
+        self.rebuild("expected_training", "expected_rollup", self.label_threshold())
+        training, rollup = f"{self.table}{TRAINING_SUFFIX}", f"{self.table}{ROLLUP_SUFFIX}"
+        columns = ", ".join([*self.columns, "ROUND(log_video_views, 9)", "is_high_performing"])
+        rollup_columns = ", ".join([*self.tags, "ad_count", *(f"ROUND(sum_{m}, 6)" for m in self.measures)])
+        differences = 0
+        compared = [(training, "expected_training", columns), (rollup, "expected_rollup", rollup_columns)]
+        for actual, expected, selected in compared[:len(CONSUMERS)]:
+            differences += self.db.execute(f"""
+            SELECT COUNT(*) FROM (
+              SELECT {selected} FROM {actual} EXCEPT SELECT {selected} FROM {expected}
+              UNION ALL
+              SELECT {selected} FROM {expected} EXCEPT SELECT {selected} FROM {actual}
+            )""").fetchone()[0]
+        return differences == 0
+
+
+def apply_batch(ingestion, rows: List[Dict[str, str]]) -> Dict[str, int]:
+    """Stages and merges a batch, then brings every consumer up to date; returns the rows read or written per step."""
+    ingestion.stage(rows)
+    merged = ingestion.merge_batch()
+    stats = {"staged": len(rows), **merged}
+    watermarks, latest = ingestion.watermarks()
+    stats["merged"] = merged["inserted"] + merged["updated"]
+    for consumer in CONSUMERS:
+        watermark = watermarks.get(consumer, latest)
+        if watermark >= latest:
+            stats[consumer] = 0
+            continue
+        read = ingestion.changes_between(watermark, latest)
+        refresh = ingestion.refresh_rollup if consumer == "rollup" else ingestion.refresh_training
+        stats[consumer] = read + refresh(watermark, latest)
+    stats["processed"] = stats["staged"] + stats["merged"] + sum(stats[consumer] for consumer in CONSUMERS)
+    return stats
+
+
+def synthetic_batch(base: List[Dict[str, str]], new_rows: int, updated_rows: int, repeats: int) -> List[Dict[str, str]]:
+    """
+    A daily update: growing metrics for `updated_rows` existing ads, `new_rows`
+    new ads, and `repeats` ads reported twice with the later row winning.
+    """
+    batch = []
+    for row in random.sample(base, min(updated_rows, len(base))):
+        growth = random.uniform(1.0, 1.3)
+        updated = dict(row)
+        for column in ("video_views", "impressions", "clicks", "conversions"):
+            updated[column] = str(int(int(row[column]) * growth))
+        updated["spend"] = f"{float(row['spend']) * growth:.2f}"
+        batch.append(updated)
+    for row in random.sample(base, min(new_rows, len(base))):
+        batch.append({**row, KEY_COLUMN: str(uuid.uuid4())})
+    for row in random.sample(batch, min(repeats, len(batch))):
+        batch.append({**row, "video_views": str(int(row["video_views"]) + 1)})
+    return batch
+
+
+def check_stale_rollup(ingestion: LocalIngestion, batch: List[Dict[str, str]]) -> bool:
+    """
+    Merges `batch` without refreshing the rollup and checks that an aggregate
+    query stays on the raw table until the rollup catches up.
+    """
+    router = AggregateRouter()
+    database_settings = ingestion.rollup_settings()
+    sql = f"SELECT {ingestion.tags[0]}, AVG({LABEL_SOURCE_COLUMN}) FROM `local.local.{ingestion.table}` GROUP BY 1"
+
+    def routed() -> bool:
+        return router.route(sql, database_settings, "local", lambda rollup: ingestion.rollup_is_current()) is not None
+
+    before = routed()
+    ingestion.stage(batch)
+    ingestion.merge_batch()
+    stale = routed()
+    watermarks, latest = ingestion.watermarks()
+    ingestion.refresh_rollup(watermarks["rollup"], latest)
+    after = routed()
+    logging.info(f"Rollup routing: current {before}, after a merge without refresh {stale}, after the refresh {after}")
+    return before and not stale and after
+
+
+def local_benchmark(args) -> bool:
+    """Simulates daily updates on the sqlite stand-in and compares them with full reloads."""
+    random.seed(args.seed)
+    with open(DATA_FILEPATH, "r", encoding="utf-8", newline="") as f:
+        seed_rows = list(csv.DictReader(f))
+    # Rows beyond the sample data are copies of its rows under new media ids.
+    base = seed_rows + [
+        {**seed_rows[index % len(seed_rows)], KEY_COLUMN: str(uuid.uuid4())}
+        for index in range(args.base_rows - len(seed_rows))
+    ]
+    ingestion = LocalIngestion(sqlite3.connect(":memory:"), LOCAL_SCHEMA)
+    reload_rows = ingestion.full_reload(base)
+    logging.info(f"Initial full load of {len(base)} rows processed {reload_rows} rows...")
+
+    current = {row[KEY_COLUMN]: row for row in base}
+    consistent = True
+    logging.info(f"{'day':>4} {'staged':>7} {'inserted':>9} {'updated':>8} {'incremental':>12} {'full reload':>12} "
+                 f"{'ratio':>7} {'incr. time':>11} {'reload time':>12}")
+    for day in range(1, args.days + 1):
+        batch = synthetic_batch(list(current.values()), args.new_per_day, args.updates_per_day, args.repeats_per_day)
+        start = time.perf_counter()
+        stats = apply_batch(ingestion, last_write_wins(batch))
+        incremental_seconds = time.perf_counter() - start
+        current.update({row[KEY_COLUMN]: row for row in batch})
+
+        reference = LocalIngestion(sqlite3.connect(":memory:"), LOCAL_SCHEMA)
+        start = time.perf_counter()
+        full_rows = reference.full_reload(list(current.values()))
+        reload_seconds = time.perf_counter() - start
+        logging.info(f"{day:>4} {stats['staged']:>7} {stats['inserted']:>9} {stats['updated']:>8} {stats['processed']:>12} "
+                     f"{full_rows:>12} {stats['processed'] / full_rows:>7.1%} {incremental_seconds * 1e3:>9.1f}ms "
+                     f"{reload_seconds * 1e3:>10.1f}ms")
+        if args.verify and not ingestion.matches_rebuild():
+            logging.error(f"Day {day}: the incremental training table or rollup differs from a full rebuild")
+            consistent = False
+    if args.verify and "rollup" in CONSUMERS:
+        batch = synthetic_batch(list(current.values()), args.new_per_day, args.updates_per_day, 0)
+        if not check_stale_rollup(ingestion, batch):
+            logging.error("A query was routed to the rollup while it lagged the table")
+            consistent = False
+    return consistent
+
+
+def main():
+    """Merges a performance update into BigQuery, or benchmarks the incremental path on a local stand-in."""
+    parser = argparse.ArgumentParser(description="Incrementally ingest performance updates, merging on media_id.")
+    parser.add_argument("batches", nargs="*", type=Path, help="CSV update batches to merge into BigQuery, in order")
+    parser.add_argument("--local", action="store_true", help="Simulate daily updates on a local sqlite stand-in instead")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--base-rows", type=int, default=100_000, help="Rows of the simulated table")
+    parser.add_argument("--new-per-day", type=int, default=500)
+    parser.add_argument("--updates-per-day", type=int, default=2_000)
+    parser.add_argument("--repeats-per-day", type=int, default=50, help="Ads reported twice in a batch")
+    parser.add_argument("--verify", action="store_true", help="Compare the derived tables with a full rebuild after every day")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.local:
+        if not local_benchmark(args):
+            exit(1)
+        return
+    if not args.batches:
+        parser.error("pass update batches, or --local to run the local benchmark")
+
+    try:
+        client = bigquery.Client(project=settings.GOOGLE_CLOUD_PROJECT_ID)
+        ingestion = BigQueryIngestion(client, settings.BQ_DATASET_NAME, settings.BQ_TABLE_NAME)
+        ingestion.ensure_tables()
+        merged = 0
+        for path in args.batches:
+            table_rows = ingestion.table_rows()
+            bytes_before = ingestion.bytes_processed
+            stats = apply_batch(ingestion, read_batch(path))
+            merged += stats["merged"]
+            logging.info(
+                f"{path.name}: batch {stats['batch_id']}, {stats['staged']} staged, {stats['inserted']} inserted, "
+                f"{stats['updated']} updated, {stats['processed']} rows processed "
+                f"(a full reload processes about {3 * (table_rows + stats['inserted'])}), "
+                f"{(ingestion.bytes_processed - bytes_before) / 1e6:.1f} MB scanned"
+            )
+        if merged and settings.QUANTILE_SKETCH_FILE:
+            # Sketches cannot drop the values a merge replaced, so they are not maintained incrementally here.
+            logging.warning(
+                f"{merged} rows changed; the quantile sketches in {settings.QUANTILE_SKETCH_FILE} are stale until "
+                f"they are rebuilt with `python scripts/build_quantile_sketches.py --rebuild`"
+            )
+    except Exception as e:
+        logging.error(f"An error occurred during ingestion: {e}", exc_info=True)
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import math
+import mimetypes
+import os
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+# --- PATHS ---
+ROOT_DIR = Path(__file__).parent.parent
+PROJECT_DIR = ROOT_DIR / "creative_analytics"
+ENV_FILE = PROJECT_DIR / "creative_analytics_agents" / ".env"
+DEPLOYED_JSON = ROOT_DIR / "deployed_agent.json"
+DEFAULT_CORPUS = ROOT_DIR / "data" / "load_test_corpus.json"
+
+# --- CONFIGURATION ---
+APP_NAME = "creative_analytics_agents"
+HISTOGRAM_BUCKETS_MS = [100, 250, 500, 1000, 2000, 5000, 10000, 20000, 30000, 60000, 120000]
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+load_dotenv(dotenv_path=ENV_FILE)
+
+
+def load_corpus(path: Path) -> List[Dict[str, Any]]:
+    """Loads conversations and inlines their attachments once, up front."""
+    with open(path, "r", encoding="utf-8") as f:
+        conversations = json.load(f)["conversations"]
+
+    for conversation in conversations:
+        attachments = []
+        for attachment in conversation.get("attachments", []):
+            file_path = ROOT_DIR / attachment
+            mime_type = mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+            attachments.append({"mime_type": mime_type, "data": file_path.read_bytes()})
+        conversation["attachments"] = attachments
+    return conversations
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def render_histogram(values_ms: List[float]) -> str:
+    """Renders a fixed-bucket latency histogram as text."""
+    counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+    for value in values_ms:
+        index = next((i for i, bound in enumerate(HISTOGRAM_BUCKETS_MS) if value <= bound), len(HISTOGRAM_BUCKETS_MS))
+        counts[index] += 1
+
+    peak = max(counts) or 1
+    lines = []
+    for i, count in enumerate(counts):
+        label = f"<= {HISTOGRAM_BUCKETS_MS[i]:>6d} ms" if i < len(HISTOGRAM_BUCKETS_MS) else f" > {HISTOGRAM_BUCKETS_MS[-1]:>6d} ms"
+        lines.append(f"  {label} | {'#' * round(40 * count / peak):<40} {count}")
+    return "\n".join(lines)
+
+
+class Metrics:
+    """Collects per-turn measurements."""
+
+    def __init__(self):
+        self.turns: List[Dict[str, Any]] = []
+
+    def record(self, latency: float, first_event: Optional[float], error: Optional[str]) -> None:
+        """Adds one turn; `error` is None for successful turns."""
+        self.turns.append({"latency": latency, "first_event": first_event, "error": error})
+
+    def summary(self, wall_seconds: float) -> Dict[str, Any]:
+        """Aggregates latency percentiles, time to first event and error rate."""
+        ok = [t for t in self.turns if t["error"] is None]
+        latencies = [t["latency"] * 1000 for t in ok]
+        first_events = [t["first_event"] * 1000 for t in ok if t["first_event"] is not None]
+        return {
+            "turns": len(self.turns),
+            "errors": len(self.turns) - len(ok),
+            "error_rate": (len(self.turns) - len(ok)) / len(self.turns) if self.turns else 0.0,
+            "throughput_turns_per_second": len(self.turns) / wall_seconds if wall_seconds else 0.0,
+            "latency_ms": {f"p{int(p * 100)}": percentile(latencies, p) for p in (0.5, 0.9, 0.95, 0.99)},
+            "time_to_first_event_ms": {f"p{int(p * 100)}": percentile(first_events, p) for p in (0.5, 0.9, 0.99)},
+            "error_samples": sorted({t["error"] for t in self.turns if t["error"]})[:5],
+        }
+
+
+class RemoteTarget:
+    """Drives a deployed Agent Engine, reusing one agent handle and session service."""
+
+    def __init__(self):
+        import vertexai
+        from vertexai import agent_engines
+        from google.adk.sessions import VertexAiSessionService
+
+        project_id = os.environ["GOOGLE_CLOUD_PROJECT_ID"]
+        location = os.environ["GOOGLE_CLOUD_LOCATION"]
+        with open(DEPLOYED_JSON, "r", encoding="utf-8") as f:
+            self.resource_id = json.load(f)["resource_id"]
+
+        vertexai.init(project=project_id, location=location)
+        self.agent = agent_engines.get(self.resource_id)
+        self.session_service = VertexAiSessionService(project_id, location)
+
+    async def create_session(self, user_id: str) -> str:
+        session = await self.session_service.create_session(app_name=self.resource_id, user_id=user_id)
+        return session.id
+
+    async def send(self, user_id: str, session_id: str, text: str, attachments: List[Dict[str, Any]]):
+        parts = [{"text": text}] + [
+            {"inline_data": {"mime_type": a["mime_type"], "data": base64.b64encode(a["data"]).decode("ascii")}}
+            for a in attachments
+        ]
+        message = {"role": "user", "parts": parts} if attachments else text
+        async for event in self.agent.async_stream_query(message=message, user_id=user_id, session_id=session_id):
+            yield event
+
+
+class LocalTarget:
+    """
+    Drives `root_agent` in-process through an in-memory runner; no deployment
+    needed. It is imported on first use, after `use_cassette` has selected the
+    cassette mode.
+    """
+
+    def __init__(self):
+        from google.adk.runners import InMemoryRunner
+        from google.genai import types
+
+        sys.path.insert(0, str(PROJECT_DIR))
+        from creative_analytics_agents.agent import root_agent
+        from creative_analytics_agents.utils.cassette import cassette
+
+        self.types = types
+        self.cassette = cassette
+        self.runner = InMemoryRunner(agent=root_agent, app_name=APP_NAME)
+
+    async def create_session(self, user_id: str) -> str:
+        session = await self.runner.session_service.create_session(app_name=APP_NAME, user_id=user_id)
+        return session.id
+
+    async def send(self, user_id: str, session_id: str, text: str, attachments: List[Dict[str, Any]]):
+        parts = [self.types.Part(text=text)] + [
+            self.types.Part(inline_data=self.types.Blob(mime_type=a["mime_type"], data=a["data"]))
+            for a in attachments
+        ]
+        message = self.types.Content(role="user", parts=parts)
+        async for event in self.runner.run_async(user_id=user_id, session_id=session_id, new_message=message):
+            yield event
+
+
+def use_cassette(mode: str, path: Path) -> None:
+    """
+    Records the local target's model and BigQuery exchanges to a cassette, or
+    replays them from it so that no call leaves the process.
+    """
+    os.environ.update({
+        "CASSETTE_MODE": mode,
+        "CASSETTE_FILE": str(path),
+        # The schema snapshot comes from the cassette; polling BigQuery for changes would not.
+        "SCHEMA_REFRESH_SECONDS": "0",
+    })
+
+
+async def run_turn(target, metrics: Metrics, user_id: str, session_id: str, text: str, attachments) -> None:
+    """Sends one message and records latency, time to first event and errors."""
+    start = time.perf_counter()
+    first_event = None
+    error = None
+    try:
+        async for event in target.send(user_id, session_id, text, attachments):
+            if first_event is None:
+                first_event = time.perf_counter() - start
+            error_message = event.get("error_message") if isinstance(event, dict) else getattr(event, "error_message", None)
+            if error_message:
+                error = error_message
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    metrics.record(time.perf_counter() - start, first_event, error)
+
+
+async def virtual_user(index: int, target, queue: asyncio.Queue, metrics: Metrics, reuse_sessions: bool) -> None:
+    """Consumes conversations from the queue, reusing its session across them when asked."""
+    user_id = f"load_test_user_{index}"
+    session_id = None
+    while True:
+        conversation = await queue.get()
+        try:
+            if conversation is None:
+                return
+            if session_id is None or not reuse_sessions:
+                session_id = await target.create_session(user_id)
+            for turn_index, text in enumerate(conversation["turns"]):
+                attachments = conversation["attachments"] if turn_index == 0 else []
+                await run_turn(target, metrics, user_id, session_id, text, attachments)
+        except Exception as e:
+            metrics.record(0.0, None, f"{type(e).__name__}: {e}")
+        finally:
+            queue.task_done()
+
+
+async def run_load_test(args) -> Dict[str, Any]:
+    """Issues conversations at the configured rate to a pool of virtual users."""
+    corpus = load_corpus(args.corpus)
+    target = LocalTarget() if args.target == "local" else RemoteTarget()
+    metrics = Metrics()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency * 2)
+    rng = random.Random(args.seed)
+
+    users = [
+        asyncio.create_task(virtual_user(i, target, queue, metrics, not args.new_session_per_conversation))
+        for i in range(args.concurrency)
+    ]
+
+    # A recording plays every conversation once, so that an offline run can replay any of them.
+    schedule = list(corpus) if args.record else [rng.choice(corpus) for _ in range(args.conversations)]
+    start = time.perf_counter()
+    interval = 1.0 / args.qps if args.qps > 0 else 0.0
+    for i, conversation in enumerate(schedule):
+        await queue.put(conversation)
+        if interval:
+            # Pace against the schedule, not the previous put, so slow consumers do not lower the rate.
+            await asyncio.sleep(max(0.0, start + (i + 1) * interval - time.perf_counter()))
+    for _ in users:
+        await queue.put(None)
+    await asyncio.gather(*users)
+    wall_seconds = time.perf_counter() - start
+
+    summary = metrics.summary(wall_seconds)
+    summary.update(
+        target=args.target,
+        qps=args.qps,
+        concurrency=args.concurrency,
+        conversations=len(schedule),
+        wall_seconds=wall_seconds,
+        run_id=uuid.uuid4().hex,
+    )
+    if args.target == "local" and target.cassette.mode != "off":
+        summary["cassette"] = target.cassette.snapshot()
+    logging.info("Turn latency histogram:\n" + render_histogram([t["latency"] * 1000 for t in metrics.turns if not t["error"]]))
+    return summary
+
+
+def main():
+    """Main function to replay the question corpus against the agent under load."""
+    parser = argparse.ArgumentParser(description="Concurrent load test for the creative analytics agent.")
+    parser.add_argument("--target", choices=["remote", "local"], default="remote")
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10, help="Number of concurrent virtual users")
+    parser.add_argument("--qps", type=float, default=2.0, help="Conversation start rate; 0 for as fast as possible")
+    parser.add_argument("--new-session-per-conversation", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Write the JSON summary to this file")
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument("--record", type=Path, metavar="CASSETTE",
+                          help="Local target: play every corpus conversation once, recording its model and BigQuery exchanges to this cassette")
+    cassette.add_argument("--offline", type=Path, metavar="CASSETTE",
+                          help="Local target: replay a cassette recorded with --record, with no network access")
+    args = parser.parse_args()
+
+    if args.record or args.offline:
+        if args.target != "local":
+            parser.error("--record and --offline need --target local")
+        if args.offline and not args.offline.is_file():
+            parser.error(f"cassette not found at: {args.offline}")
+        # Conversations sharing a session would send requests that depend on which ones ran before.
+        args.new_session_per_conversation = True
+        use_cassette("record" if args.record else "replay", args.record or args.offline)
+
+    summary = asyncio.run(run_load_test(args))
+    logging.info(json.dumps(summary, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from pathlib import Path
+from typing import Any, Dict, Mapping
+
+from google.adk.events import Event, EventActions
+from google.adk.sessions import InMemorySessionService
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "creative_analytics"))
+
+from creative_analytics_agents.utils.database_context import init_database_settings  # noqa: E402
+from creative_analytics_agents.utils.schema_registry import SCHEMA_VERSION_STATE_KEY  # noqa: E402
+
+# --- CONFIGURATION ---
+APP_NAME = "creative_analytics_agents"
+AGENT_NAMES = ["AdInsightsOrchestrator", "StatisticalAnalystAgent", "PerformancePredictorCoordinator"]
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+def to_plain(value: Any) -> Any:
+    """Converts read-only snapshot mappings and tuples back into JSON-friendly types."""
+    if isinstance(value, Mapping):
+        return {key: to_plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_plain(item) for item in value]
+    return value
+
+
+def widen_tables(database_settings: Dict[str, Any], num_tables: int) -> Dict[str, Any]:
+    """Replicates the configured tables to model a dataset config with more tables."""
+    widened = {}
+    for dataset_name, dataset_info in database_settings.items():
+        tables = list(dataset_info["tables"].items())
+        widened_tables = {}
+        for i in range(num_tables):
+            table_name, table_info = tables[i % len(tables)]
+            widened_tables[f"{table_name}_{i}" if i >= len(tables) else table_name] = table_info
+        widened[dataset_name] = {**dataset_info, "tables": widened_tables}
+    return widened
+
+
+async def simulate_sessions(state_delta: Dict[str, Any], num_sessions: int) -> Dict[str, int]:
+    """
+    Replays the first turn of `num_sessions` sessions: each of the three agent
+    callbacks checks the state and only the first one writes `state_delta`.
+    """
+    service = InMemorySessionService()
+    write_bytes = 0
+    state_bytes = 0
+
+    for i in range(num_sessions):
+        session = await service.create_session(app_name=APP_NAME, user_id=f"user_{i}")
+        for agent_name in AGENT_NAMES:
+            missing = {key: value for key, value in state_delta.items() if key not in session.state}
+            if not missing:
+                continue
+            event = Event(
+                author=agent_name,
+                invocation_id=f"invocation_{i}",
+                actions=EventActions(state_delta=missing),
+            )
+            await service.append_event(session, event)
+            write_bytes += len(event.model_dump_json(exclude_none=True).encode("utf-8"))
+        state_bytes += len(json.dumps(session.state, default=str).encode("utf-8"))
+
+    return {"state_bytes_per_session": state_bytes // num_sessions, "total_write_bytes": write_bytes}
+
+
+async def run(num_sessions: int, num_tables: int) -> None:
+    """Compares copying `database_settings` into state against storing a version key."""
+    shared_context = init_database_settings()
+    database_settings = to_plain(shared_context["database_settings"])
+    if num_tables:
+        database_settings = widen_tables(database_settings, num_tables)
+
+    scenarios = {
+        "copy database_settings": {"database_settings": database_settings},
+        "schema registry version": {SCHEMA_VERSION_STATE_KEY: shared_context["schema_version"]},
+    }
+
+    results = {}
+    for name, state_delta in scenarios.items():
+        results[name] = await simulate_sessions(state_delta, num_sessions)
+        logging.info(
+            f"{name:>24}: {results[name]['state_bytes_per_session']:>9,d} state bytes/session, "
+            f"{results[name]['total_write_bytes']:>12,d} bytes written for {num_sessions} sessions"
+        )
+
+    before = results["copy database_settings"]["total_write_bytes"]
+    after = results["schema registry version"]["total_write_bytes"]
+    logging.info(f"Session-service write volume reduced {before / max(after, 1):.1f}x...")
+
+
+def main():
+    """Main function to measure per-session state size before and after the registry."""
+    parser = argparse.ArgumentParser(description="Measure session state bytes and write volume.")
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--tables", type=int, default=0, help="Replicate tables to model a wider config")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.sessions, args.tables))
+
+
+if __name__ == "__main__":
+    main()
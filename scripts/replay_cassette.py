@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "creative_analytics"))
+
+# --- CONFIGURATION ---
+APP_NAME = "cassette_replay"
+DEFAULT_CASSETTE_FILE = "cassette.jsonl.gz"
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+def recorded_sessions(cassette) -> "OrderedDict[str, List[Dict[str, Any]]]":
+    """The recorded user messages grouped by session, in recording order."""
+    sessions: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+    for entry in cassette.entries("session"):
+        sessions.setdefault(entry["response"]["session_id"], []).append(entry["response"])
+    return sessions
+
+
+async def replay_session(runner, types, turns: List[Dict[str, Any]], latencies: List[float], errors: List[str]) -> None:
+    """Replays the turns of one recorded session in a fresh session."""
+    user_id = turns[0]["user_id"]
+    session = await runner.session_service.create_session(app_name=APP_NAME, user_id=user_id)
+    for turn in turns:
+        message = types.Content.model_validate(turn["message"])
+        start = time.perf_counter()
+        try:
+            async for event in runner.run_async(user_id=user_id, session_id=session.id, new_message=message):
+                if event.error_message:
+                    errors.append(f"{turn['session_id']}: {event.error_message}")
+        except Exception as e:
+            errors.append(f"{turn['session_id']}: {type(e).__name__}: {e}")
+        latencies.append(time.perf_counter() - start)
+
+
+async def replay(args) -> int:
+    # Imported after the environment selects replay mode.
+    from google.adk.runners import InMemoryRunner
+    from google.genai import types
+
+    from creative_analytics_agents.agent import root_agent
+    from creative_analytics_agents.utils.cassette import cassette
+
+    sessions = recorded_sessions(cassette)
+    if not sessions:
+        logging.error(f"No recorded sessions in {args.cassette}...")
+        return 1
+    runner = InMemoryRunner(agent=root_agent, app_name=APP_NAME)
+    latencies: List[float] = []
+    errors: List[str] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def bounded(turns):
+        async with semaphore:
+            await replay_session(runner, types, turns, latencies, errors)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(bounded(turns) for turns in sessions.values()))
+    elapsed = time.perf_counter() - start
+
+    logging.info(
+        f"Replayed {len(latencies)} turns of {len(sessions)} sessions in {elapsed:.2f}s "
+        f"(median turn {statistics.median(latencies) * 1000:.1f}ms, max {max(latencies) * 1000:.1f}ms)"
+    )
+    logging.info(f"Cassette: {cassette.snapshot()}")
+    for error in errors:
+        logging.error(error)
+    return 1 if errors or cassette.snapshot()["misses"] else 0
+
+
+def main():
+    """Replays the sessions recorded with CASSETTE_MODE=record offline, for profiling and regression tests."""
+    parser = argparse.ArgumentParser(description="Replay recorded sessions from a cassette without model or BigQuery calls.")
+    parser.add_argument("--cassette", default=os.environ.get("CASSETTE_FILE", DEFAULT_CASSETTE_FILE))
+    parser.add_argument("--latency", choices=["zero", "recorded"], default="zero",
+                        help="Serve each exchange immediately or after its recorded latency")
+    parser.add_argument("--concurrency", type=int, default=1, help="Sessions replayed at once")
+    args = parser.parse_args()
+
+    os.environ.update({
+        "CASSETTE_MODE": "replay",
+        "CASSETTE_FILE": args.cassette,
+        "CASSETTE_REPLAY_LATENCY": args.latency,
+        "SCHEMA_REFRESH_SECONDS": "0",
+    })
+    if not Path(args.cassette).is_file():
+        logging.error(f"Cassette not found at: {args.cassette}")
+        exit(1)
+    exit(asyncio.run(replay(args)))
+
+
+if __name__ == "__main__":
+    main()
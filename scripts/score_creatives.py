@@ -0,0 +1,242 @@
+import argparse
+import asyncio
+import json
+import logging
+import mimetypes
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "creative_analytics"))
+
+from google.adk.models import LlmRequest  # noqa: E402
+from google.genai import types  # noqa: E402
+
+from creative_analytics_agents.sub_agents.performance_predictor.agent import features_extraction_agent  # noqa: E402
+from creative_analytics_agents.sub_agents.performance_predictor.tools import (  # noqa: E402
+    CreativeFeatures,
+    build_batch_prediction_query,
+    parse_features,
+)
+from creative_analytics_agents.sub_agents.statistical_analysis.async_tools import run_query_async  # noqa: E402
+from creative_analytics_agents.utils.feature_cache import feature_cache  # noqa: E402
+from creative_analytics_agents.utils.settings import settings  # noqa: E402
+
+# --- CONFIGURATION ---
+MEDIA_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".mp4", ".mov", ".webm"}
+MAX_INLINE_BYTES = 20 * 1024 * 1024
+CHECKPOINT_FILE = "checkpoint.jsonl"
+RESULTS_FILE = "scores.parquet"
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+@dataclass
+class Asset:
+    asset_id: str
+    mime_type: str
+    size_bytes: int
+    read: Callable[[], bytes]
+
+
+def _mime_type(name: str) -> str:
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def list_assets(source: str) -> List[Asset]:
+    """Lists the images and videos under a local directory or a `gs://bucket/prefix` URI."""
+    if source.startswith("gs://"):
+        from google.cloud import storage
+
+        bucket_name, _, prefix = source[len("gs://"):].partition("/")
+        bucket = storage.Client(project=settings.GOOGLE_CLOUD_PROJECT_ID).bucket(bucket_name)
+        return [
+            Asset(f"gs://{bucket_name}/{blob.name}", _mime_type(blob.name), blob.size or 0, blob.download_as_bytes)
+            for blob in bucket.list_blobs(prefix=prefix)
+            if Path(blob.name).suffix.lower() in MEDIA_SUFFIXES
+        ]
+
+    root = Path(source)
+    return [
+        Asset(str(path.relative_to(root)), _mime_type(path.name), path.stat().st_size, path.read_bytes)
+        for path in sorted(root.rglob("*"))
+        if path.is_file() and path.suffix.lower() in MEDIA_SUFFIXES
+    ]
+
+
+def load_checkpoint(path: Path) -> Dict[str, Dict[str, Any]]:
+    """Returns the latest checkpointed record of every asset."""
+    records = {}
+    if path.is_file():
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    records[record["asset_id"]] = record
+                except (json.JSONDecodeError, KeyError):
+                    logging.warning(f"Skipping malformed checkpoint line in {path}")
+    return records
+
+
+async def extract_features(asset: Asset) -> Dict[str, Any]:
+    """Extracts the features of one asset, from the feature cache when possible."""
+    record = {"asset_id": asset.asset_id, "mime_type": asset.mime_type, "size_bytes": asset.size_bytes}
+    start = time.perf_counter()
+    try:
+        if asset.size_bytes > MAX_INLINE_BYTES:
+            raise ValueError(f"Asset exceeds the {MAX_INLINE_BYTES} byte inline upload limit")
+        data = await asyncio.to_thread(asset.read)
+        key = feature_cache.make_key([data], settings.PREDICTOR_AGENT_MODEL)
+        features = feature_cache.get(key)
+        record["from_cache"] = features is not None
+        if features is None:
+            model = features_extraction_agent.canonical_model
+            request = LlmRequest(
+                model=model.model,
+                contents=[types.Content(role="user", parts=[
+                    types.Part(text="Extract the features of this creative."),
+                    types.Part.from_bytes(data=data, mime_type=asset.mime_type),
+                ])],
+                config=types.GenerateContentConfig(system_instruction=features_extraction_agent.instruction),
+            )
+            request.set_output_schema(CreativeFeatures)
+            response = None
+            async for response in model.generate_content_async(request):
+                pass
+            text = "".join(part.text for part in response.content.parts if part.text and not part.thought)
+            features = parse_features(text).model_dump()
+            feature_cache.put(key, features)
+        record.update(features)
+        record["status"] = "success"
+    except Exception as e:
+        logging.warning(f"Feature extraction failed for {asset.asset_id}: {e}")
+        record.update({"status": "error", "error_message": str(e)})
+    record["extract_seconds"] = time.perf_counter() - start
+    return record
+
+
+async def score_batch(records: List[Dict[str, Any]]) -> None:
+    """Scores the extracted records with one ML.PREDICT query and updates them in place."""
+    scorable = [r for r in records if r["status"] == "success"]
+    if not scorable:
+        return
+    features = [{name: r[name] for name in CreativeFeatures.model_fields} for r in scorable]
+    start = time.perf_counter()
+    try:
+        rows = await run_query_async(build_batch_prediction_query(features))
+    except Exception as e:
+        logging.error(f"Batch scoring failed for {len(scorable)} assets: {e}", exc_info=True)
+        for record in scorable:
+            record.update({"status": "error", "error_message": f"Scoring failed: {e}"})
+        return
+    score_seconds = (time.perf_counter() - start) / len(scorable)
+    for row in rows:
+        scorable[row["row_index"]].update({
+            "predicted_class": row["predicted_class"],
+            "confidence_score": row["confidence_score"],
+            "score_seconds": score_seconds,
+        })
+
+
+def write_parquet(records: List[Dict[str, Any]], path: Path) -> None:
+    columns = ["asset_id", "mime_type", "size_bytes", "status", "error_message", "from_cache",
+               *CreativeFeatures.model_fields, "predicted_class", "confidence_score",
+               "extract_seconds", "score_seconds"]
+    table = pa.Table.from_pylist([{column: record.get(column) for column in columns} for record in records])
+    pq.write_table(table, path)
+
+
+async def run_scoring(
+    assets: List[Asset],
+    checkpoint_path: Path,
+    concurrency: int,
+    batch_size: int,
+    on_batch: Optional[Callable[[List[Dict[str, Any]]], Awaitable[None]]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Extracts features with at most `concurrency` model calls in flight and
+    scores them in batches of `batch_size`, appending every scored batch to
+    the checkpoint. Extraction continues while a batch is being scored.
+    """
+    limiter = asyncio.Semaphore(concurrency)
+
+    async def bounded(asset: Asset) -> Dict[str, Any]:
+        async with limiter:
+            return await extract_features(asset)
+
+    scored, pending = [], []
+
+    async def flush() -> None:
+        await score_batch(pending)
+        with open(checkpoint_path, "a", encoding="utf-8") as f:
+            for record in pending:
+                f.write(json.dumps(record) + "\n")
+        scored.extend(pending)
+        if on_batch is not None:
+            await on_batch(pending)
+        pending.clear()
+
+    for task in asyncio.as_completed([bounded(asset) for asset in assets]):
+        pending.append(await task)
+        if len(pending) >= batch_size:
+            await flush()
+    if pending:
+        await flush()
+    return scored
+
+
+async def main_async(args) -> None:
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    checkpoint_path = output_dir / CHECKPOINT_FILE
+
+    assets = list_assets(args.source)
+    done = {asset_id for asset_id, record in load_checkpoint(checkpoint_path).items() if record["status"] == "success"}
+    todo = [asset for asset in assets if asset.asset_id not in done]
+    logging.info(f"Found {len(assets)} assets; {len(done)} already scored, {len(todo)} to go...")
+
+    start = time.perf_counter()
+    progress = {"scored": 0}
+
+    async def report(batch: List[Dict[str, Any]]) -> None:
+        progress["scored"] += len(batch)
+        elapsed = time.perf_counter() - start
+        logging.info(f"{progress['scored']}/{len(todo)} assets ({progress['scored'] / elapsed:.2f} assets/s)")
+
+    scored = await run_scoring(todo, checkpoint_path, args.concurrency, args.batch_size, on_batch=report)
+    elapsed = time.perf_counter() - start
+
+    records = list(load_checkpoint(checkpoint_path).values())
+    write_parquet(records, output_dir / RESULTS_FILE)
+
+    succeeded = sum(r["status"] == "success" for r in scored)
+    cached = sum(bool(r.get("from_cache")) for r in scored)
+    logging.info(
+        f"Scored {succeeded}/{len(scored)} assets in {elapsed:.1f}s "
+        f"({len(scored) / elapsed if elapsed else 0:.2f} assets/s end to end, {cached} from the feature cache). "
+        f"Results: {output_dir / RESULTS_FILE}"
+    )
+
+
+def main():
+    """Scores every creative under a directory or bucket prefix without a chat turn per asset."""
+    parser = argparse.ArgumentParser(description="Bulk feature extraction and performance scoring of creatives.")
+    parser.add_argument("source", help="Local directory or gs://bucket/prefix of images and videos")
+    parser.add_argument("--output-dir", default="scoring_output", help="Directory for the checkpoint and Parquet results")
+    parser.add_argument("--concurrency", type=int, default=8, help="Feature extractions in flight")
+    parser.add_argument("--batch-size", type=int, default=200, help="Assets per ML.PREDICT query")
+    args = parser.parse_args()
+
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
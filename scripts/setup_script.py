@@ -1,4 +1,5 @@
 import os
+import sys
 import logging
 from pathlib import Path
 
@@ -6,6 +7,11 @@ from dotenv import load_dotenv, find_dotenv
 from google.cloud import bigquery
 from google.api_core.exceptions import NotFound, GoogleAPICallError
 
+sys.path.insert(0, str(Path(__file__).parent.parent / "creative_analytics"))
+
+from creative_analytics_agents.utils.aggregate_router import stamp_rollup  # noqa: E402
+from creative_analytics_agents.utils.tag_registry import tag_registry  # noqa: E402
+
 # --- CONFIGURE LOGGING ---
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -29,6 +35,13 @@ try:
     # Derived BQ table name for training data
     BQ_TRAINING_TABLE_NAME = f"{BQ_TABLE_NAME}_training"
 
+    # Derived BQ rollup table name, declared in config/dataset_config.json
+    BQ_ROLLUP_TABLE_NAME = f"{BQ_TABLE_NAME}_by_tags"
+
+    # Watermarks of the incremental ingestion path (scripts/ingest_updates.py)
+    BQ_CHANGES_TABLE_NAME = f"{BQ_TABLE_NAME}_changes"
+    BQ_WATERMARKS_TABLE_NAME = f"{BQ_TABLE_NAME}_ingestion_watermarks"
+
     # Source data file settings
     DATA_DIR = Path(__file__).parent.parent / "data"
     CSV_FILENAME = "creative_tags_performance_data.csv"
@@ -39,14 +52,15 @@ except KeyError as e:
     exit(1)
 
 # -- BIGQUERY TABLE SCHEMA ---
+# Tag columns follow config/tag_registry.json: a BOOLEAN per tag, or the INT64 bitmask words when packed.
 TABLE_SCHEMA = [
     bigquery.SchemaField("media_id", "STRING", mode="REQUIRED"),
-    bigquery.SchemaField("animal", "BOOLEAN"),
-    bigquery.SchemaField("human", "BOOLEAN"),
-    bigquery.SchemaField("logo", "BOOLEAN"),
-    bigquery.SchemaField("product", "BOOLEAN"),
-    bigquery.SchemaField("cta", "BOOLEAN"),
+    *(bigquery.SchemaField(name, field_type) for name, field_type in tag_registry.table_columns()),
     bigquery.SchemaField("video_views", "INTEGER"),
+    bigquery.SchemaField("impressions", "INTEGER"),
+    bigquery.SchemaField("clicks", "INTEGER"),
+    bigquery.SchemaField("conversions", "INTEGER"),
+    bigquery.SchemaField("spend", "FLOAT"),
 ]
 
 
@@ -94,6 +108,8 @@ def load_data_to_bq(client: bigquery.Client) -> None:
         source_format=bigquery.SourceFormat.CSV,
         skip_leading_rows=1, schema=TABLE_SCHEMA,
         write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        # Incremental updates merge on media_id; clustering lets them skip unaffected blocks.
+        clustering_fields=["media_id"],
     )
 
     with open(DATA_FILEPATH, "rb") as source_file:
@@ -102,12 +118,41 @@ def load_data_to_bq(client: bigquery.Client) -> None:
     logging.info(f"Loaded {load_job.output_rows} rows into table...")
 
 
+def create_rollup_table(client: bigquery.Client) -> None:
+    """Creates the per-tag-combination rollup that exact aggregate queries are routed to."""
+    if tag_registry.packed:
+        # With hundreds of tags nearly every ad is its own combination, so a rollup saves nothing.
+        logging.info("Tags are packed — skipping the tag combination rollup...")
+        return
+    logging.info("Creating the tag combination rollup in BigQuery...")
+
+    # Read before the rollup so that a write to the table while it is built leaves the rollup unrouted.
+    source = client.get_table(f"{PROJECT_ID}.{BQ_DATASET_NAME}.{BQ_TABLE_NAME}")
+    tags = tag_registry.names
+    measures = [field.name for field in TABLE_SCHEMA if field.field_type in ("INTEGER", "FLOAT")]
+    query = f"""
+    CREATE OR REPLACE TABLE `{BQ_DATASET_NAME}.{BQ_ROLLUP_TABLE_NAME}` AS
+    SELECT
+      {", ".join(tags)},
+      COUNT(*) AS ad_count,
+      {", ".join(f"SUM({measure}) AS sum_{measure}" for measure in measures)}
+    FROM `{BQ_DATASET_NAME}.{BQ_TABLE_NAME}`
+    GROUP BY {", ".join(tags)};
+    """
+
+    execute_bq_query(client, query)
+    stamp_rollup(client, f"{PROJECT_ID}.{BQ_DATASET_NAME}.{BQ_ROLLUP_TABLE_NAME}", source)
+    logging.info("Rollup table created successfully in BigQuery...")
+
+
 def create_training_table(client: bigquery.Client) -> None:
     """Creates a new table with a binary label based on the median of log-transformed views."""
     logging.info("Creating the training dataset in BigQuery...")
 
     query = f"""
-    CREATE OR REPLACE TABLE `{BQ_DATASET_NAME}.{BQ_TRAINING_TABLE_NAME}` AS
+    CREATE OR REPLACE TABLE `{BQ_DATASET_NAME}.{BQ_TRAINING_TABLE_NAME}`
+    -- Incremental updates merge on media_id, as into the performance table
+    CLUSTER BY media_id AS
     WITH
       SourceData AS (
         SELECT *, LOG(SAFE_CAST(video_views AS FLOAT64) + 1) AS log_video_views
@@ -127,6 +172,35 @@ def create_training_table(client: bigquery.Client) -> None:
     logging.info("Training dataset created successfully in BigQuery...")
 
 
+def reset_ingestion_watermarks(client: bigquery.Client) -> None:
+    """
+    Marks every logged change as applied, since the derived tables were just
+    rebuilt from the full table, and stores the new median as the label
+    threshold that incremental updates use until the next retraining.
+    """
+    dataset_id = f"{PROJECT_ID}.{BQ_DATASET_NAME}"
+    try:
+        client.get_table(f"{dataset_id}.{BQ_WATERMARKS_TABLE_NAME}")
+    except NotFound:
+        return
+
+    query = f"""
+    ALTER TABLE `{BQ_DATASET_NAME}.{BQ_WATERMARKS_TABLE_NAME}` ADD COLUMN IF NOT EXISTS label_threshold FLOAT64;
+    UPDATE `{BQ_DATASET_NAME}.{BQ_WATERMARKS_TABLE_NAME}`
+    SET
+      watermark = (SELECT IFNULL(MAX(batch_id), 0) FROM `{BQ_DATASET_NAME}.{BQ_CHANGES_TABLE_NAME}`),
+      label_threshold = IF(
+        consumer = 'training',
+        (SELECT IFNULL(MAX(log_video_views), 0) FROM `{BQ_DATASET_NAME}.{BQ_TRAINING_TABLE_NAME}` WHERE is_high_performing = 0),
+        NULL
+      )
+    WHERE TRUE;
+    """
+
+    execute_bq_query(client, query)
+    logging.info("Incremental ingestion watermarks reset...")
+
+
 def train_model(client: bigquery.Client) -> None:
     """Trains a BigQuery model to predict the 'is_high_performing' label."""
     logging.info("Training BigQueryML Logistic Regression model...")
@@ -135,11 +209,7 @@ def train_model(client: bigquery.Client) -> None:
     CREATE OR REPLACE MODEL `{BQ_DATASET_NAME}.{BQ_MODEL_NAME}`
     OPTIONS(model_type='LOGISTIC_REG', input_label_cols=['is_high_performing']) AS
     SELECT
-      animal,
-      human,
-      logo,
-      product,
-      cta,
+      {tag_registry.model_input_sql()},
       is_high_performing
     FROM
       `{BQ_DATASET_NAME}.{BQ_TRAINING_TABLE_NAME}`;
@@ -162,7 +232,13 @@ def main():
         # Step 2: Create the training table in BQ
         create_training_table(bq_client)
 
-        # Step 3: Train the BigQuery logistic regression model
+        # Step 3: Create the rollup table that aggregate queries are routed to
+        create_rollup_table(bq_client)
+
+        # Step 4: Incremental updates resume from the rebuilt tables
+        reset_ingestion_watermarks(bq_client)
+
+        # Step 5: Train the BigQuery logistic regression model
         train_model(bq_client)
 
         logging.info("Quickstart setup completed successfully!")